@@ -4,20 +4,30 @@ Medical Diagnosis Agents - New Architecture
 
 from .initial_assessment_agent import get_initial_assessment_agent, InitialQuery, StructuredAssessment
 from .information_gathering_agent import get_information_gathering_agent
+from .local_query_generator import get_local_query_generator
 from .hypothesis_generation_agent import get_hypothesis_generation_agent
 from .clarifying_question_agent import get_clarifying_question_agent
 from .hypothesis_refinement_agent import get_hypothesis_refinement_agent
+from .local_refinement import get_local_refinement_engine
+from .refinement_narrative_agent import get_refinement_narrative_agent
 from .final_diagnosis_agent import get_final_diagnosis_agent
 from .treatment_plan_agent import get_treatment_plan_agent
+from .assessment_query_agent import get_assessment_query_agent
+from .diagnosis_treatment_agent import get_diagnosis_treatment_agent
 
 __all__ = [
     "get_initial_assessment_agent",
     "get_information_gathering_agent",
+    "get_local_query_generator",
     "get_hypothesis_generation_agent", 
     "get_clarifying_question_agent",
     "get_hypothesis_refinement_agent",
+    "get_local_refinement_engine",
+    "get_refinement_narrative_agent",
     "get_final_diagnosis_agent",
     "get_treatment_plan_agent",
+    "get_assessment_query_agent",
+    "get_diagnosis_treatment_agent",
     "InitialQuery",
     "StructuredAssessment"
 ]
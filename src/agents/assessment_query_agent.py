@@ -0,0 +1,76 @@
+"""
+Agent: Assessment and Query Generation (fast path)
+Description: Structures the user's query and formulates knowledge base search
+            queries in a single LLM call, replacing the initial assessment and
+            information gathering agents in the fast workflow.
+"""
+from langchain_core.prompts import ChatPromptTemplate
+from pydantic import BaseModel, Field
+from typing import List
+
+from llm.llm_config import DEFAULT_MAX_TOKENS
+from llm.model_router import get_llm_for
+from llm.response_cache import with_response_cache
+from .initial_assessment_agent import StructuredAssessment
+from .information_gathering_agent import SearchQuery
+
+# --- Pydantic Models for Output ---
+
+class AssessmentWithQueries(BaseModel):
+    """A structured assessment together with search queries derived from it."""
+    assessment: StructuredAssessment = Field(description="The structured representation of the patient's initial complaint.")
+    queries: List[SearchQuery] = Field(description="A list of 3-5 targeted search queries to find relevant medical information.")
+
+# --- Prompt Template ---
+
+ASSESSMENT_QUERY_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        (
+            "system",
+            """You are an expert medical assistant AI. You have two tasks: structure the user's medical query, then formulate search queries for a medical knowledge base.
+
+            Task 1 - Assessment. Extract key information accurately without making assumptions or providing medical advice.
+            - Identify and list the main symptoms.
+            - Identify and list any secondary symptoms.
+            - Extract the duration of symptoms, patient age, and sex if provided.
+            - Note any other information that seems relevant.
+            - Create a very brief, one-sentence summary of the core issue.
+            If a piece of information (like age or duration) is not mentioned, leave it as null.
+
+            Task 2 - Search queries. Based on your assessment, generate 3-5 distinct search queries optimized for a medical vector database, covering potential causes, related symptoms, and diagnostic criteria.
+            Make queries specific and combine symptoms where it makes sense, e.g. "causes of headache behind the eyes with nausea" rather than "headache".""",
+        ),
+        (
+            "human",
+            "Here is the user's query:\n\n---\n{text}\n---",
+        ),
+    ]
+)
+
+# --- Agent Definition ---
+
+def get_assessment_query_agent():
+    """
+    Creates and returns the combined assessment and query generation agent.
+
+    This agent takes an unstructured user query and returns both the
+    structured assessment and the knowledge base search queries.
+    """
+    # Room for two agents' worth of output
+    llm = get_llm_for("assessment_query", max_tokens=2 * DEFAULT_MAX_TOKENS)
+    structured_llm = llm.with_structured_output(AssessmentWithQueries)
+    agent = with_response_cache("assessment_query", ASSESSMENT_QUERY_PROMPT, structured_llm, AssessmentWithQueries, llm)
+    return agent
+
+# --- Example Usage (for testing) ---
+
+if __name__ == '__main__':
+    assessment_query_agent = get_assessment_query_agent()
+    response = assessment_query_agent.invoke({
+        "text": "I'm a 45-year-old male with a throbbing headache on one side for 3 days, and light hurts my eyes."
+    })
+    print(f"Summary: {response.assessment.initial_summary}")
+    print(f"Main Symptoms: {response.assessment.main_symptoms}")
+    print("Search Queries:")
+    for q in response.queries:
+        print(f"- {q.query}")
@@ -7,7 +7,8 @@ from langchain_core.prompts import ChatPromptTemplate
 from pydantic import BaseModel, Field
 from typing import List
 
-from llm.llm_config import get_llm
+from llm.model_router import get_llm_for
+from llm.response_cache import with_response_cache
 from agents.hypothesis_generation_agent import DifferentialDiagnosis
 
 # --- Pydantic Models ---
@@ -61,9 +62,9 @@ def get_clarifying_question_agent():
     This agent takes a differential diagnosis and generates targeted questions
     to ask the user.
     """
-    llm = get_llm()
+    llm = get_llm_for("clarifying_questions")
     structured_llm = llm.with_structured_output(ClarifyingQuestions)
-    agent = QUESTION_PROMPT | structured_llm
+    agent = with_response_cache("clarifying_questions", QUESTION_PROMPT, structured_llm, ClarifyingQuestions, llm)
     return agent
 
 # --- Example Usage (for testing) ---
@@ -0,0 +1,91 @@
+"""
+Agent: Final Diagnosis and Treatment Plan (fast path)
+Description: Synthesizes the refined differential into a final diagnosis and
+            writes general treatment suggestions for it in a single LLM call,
+            replacing the final diagnosis and treatment plan agents in the fast
+            workflow.
+"""
+from langchain_core.prompts import ChatPromptTemplate
+from pydantic import BaseModel, Field
+
+from llm.llm_config import DEFAULT_MAX_TOKENS
+from llm.model_router import get_llm_for
+from llm.response_cache import with_response_cache
+from .final_diagnosis_agent import FinalDiagnosis
+from .treatment_plan_agent import TreatmentPlan
+
+# --- Pydantic Models for Output ---
+
+class DiagnosisWithTreatment(BaseModel):
+    """A final diagnosis together with a general treatment plan for it."""
+    final_diagnosis: FinalDiagnosis = Field(description="The final, user-facing diagnosis.")
+    treatment_plan: TreatmentPlan = Field(description="General, non-prescriptive suggestions for the primary diagnosis.")
+
+# --- Prompt Template ---
+
+DIAGNOSIS_TREATMENT_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        (
+            "system",
+            """You are a senior medical diagnostician AI. You have two tasks: give a clear, responsible final assessment, then general advice for the diagnosed condition.
+
+            Task 1 - Final diagnosis, from the refined differential diagnosis:
+            1.  Identify the single most likely condition. This will be your primary diagnosis.
+            2.  State your final confidence as a score from 0.0 to 1.0, based on the highest probability from the refined list.
+            3.  Write a final summary that walks the user through the reasoning: the initial symptoms, how the clarifying questions helped, and why the final diagnosis is the most probable one.
+            4.  Provide a list of safe, responsible next steps. This should ALWAYS include a recommendation to consult a human doctor.
+            5.  ALWAYS include a clear disclaimer that you are an AI and this is not a real medical diagnosis.
+
+            Task 2 - Treatment plan for your primary diagnosis, using the medical knowledge provided for the candidate conditions:
+            1.  Provide a list of general suggestions, each with a category (e.g., 'Lifestyle', 'Home Care', 'Monitoring', 'When to See a Doctor').
+            2.  Formulate an important note that stresses these are not personal medical instructions and a doctor must be consulted.
+            IMPORTANT: You must NOT prescribe medication or give definitive medical directives. Suggestions should be safe, widely accepted, and general in nature.
+
+            Your tone should be empathetic, clear, and highly responsible.""",
+        ),
+        (
+            "human",
+            "Here is the refined differential diagnosis and the relevant medical knowledge:\n\n"
+            "--- Refined Differential Diagnosis ---\n"
+            "{refined_diagnosis}\n\n"
+            "--- Medical Knowledge for Candidate Conditions ---\n"
+            "{treatment_knowledge}\n"
+            "---",
+        ),
+    ]
+)
+
+# --- Agent Definition ---
+
+def get_diagnosis_treatment_agent():
+    """
+    Creates and returns the combined final diagnosis and treatment plan agent.
+
+    This agent takes the refined diagnosis and treatment knowledge for the
+    candidate conditions, and returns the final diagnosis with its plan.
+    """
+    # Room for two agents' worth of output
+    llm = get_llm_for("diagnosis_treatment", max_tokens=2 * DEFAULT_MAX_TOKENS)
+    # JSON mode streams the answer as text, so the workflow can show it as it is written
+    structured_llm = llm.with_structured_output(DiagnosisWithTreatment, method="json_mode")
+    agent = with_response_cache("diagnosis_treatment", DIAGNOSIS_TREATMENT_PROMPT, structured_llm, DiagnosisWithTreatment, llm)
+    return agent
+
+# --- Example Usage (for testing) ---
+
+if __name__ == '__main__':
+    diagnosis_treatment_agent = get_diagnosis_treatment_agent()
+    response = diagnosis_treatment_agent.invoke({
+        "refined_diagnosis": {
+            "hypotheses": [
+                {"condition": "Migraine", "probability": 0.85, "reasoning": "Unilateral throbbing headache with photophobia."},
+                {"condition": "Tension Headache", "probability": 0.15, "reasoning": "Less likely given the throbbing quality."}
+            ],
+            "refinement_summary": "Sensitivity to light strongly favours migraine."
+        },
+        "treatment_knowledge": "### Migraine\nRest in a quiet, dark room; keep a headache diary."
+    })
+    print(f"Primary Diagnosis: {response.final_diagnosis.primary_diagnosis}")
+    print(f"Confidence Score: {response.final_diagnosis.confidence_score:.2f}")
+    for s in response.treatment_plan.suggestions:
+        print(f"- [{s.category}] {s.suggestion}")
@@ -7,7 +7,8 @@ from langchain_core.prompts import ChatPromptTemplate
 from pydantic import BaseModel, Field
 from typing import List
 
-from llm.llm_config import get_llm
+from llm.model_router import get_llm_for
+from llm.response_cache import with_response_cache
 from agents.hypothesis_refinement_agent import RefinedDifferentialDiagnosis
 
 # --- Pydantic Models ---
@@ -57,9 +58,10 @@ def get_final_diagnosis_agent():
     This agent takes the refined diagnosis and produces the final,
     user-facing output.
     """
-    llm = get_llm()
-    structured_llm = llm.with_structured_output(FinalDiagnosis)
-    agent = FINAL_DIAGNOSIS_PROMPT | structured_llm
+    llm = get_llm_for("final_diagnosis")
+    # JSON mode streams the answer as text, so the workflow can show it as it is written
+    structured_llm = llm.with_structured_output(FinalDiagnosis, method="json_mode")
+    agent = with_response_cache("final_diagnosis", FINAL_DIAGNOSIS_PROMPT, structured_llm, FinalDiagnosis, llm)
     return agent
 
 # --- Example Usage (for testing) ---
@@ -7,7 +7,8 @@ from langchain_core.prompts import ChatPromptTemplate
 from pydantic import BaseModel, Field
 from typing import List
 
-from llm.llm_config import get_llm
+from llm.model_router import get_llm_for
+from llm.response_cache import with_response_cache
 from agents.initial_assessment_agent import StructuredAssessment
 
 # --- Pydantic Models ---
@@ -63,9 +64,9 @@ def get_hypothesis_generation_agent():
     This agent takes the patient's assessment and retrieved knowledge
     and generates a differential diagnosis.
     """
-    llm = get_llm()
+    llm = get_llm_for("hypothesis_generation")
     structured_llm = llm.with_structured_output(DifferentialDiagnosis)
-    agent = HYPOTHESIS_PROMPT | structured_llm
+    agent = with_response_cache("hypothesis_generation", HYPOTHESIS_PROMPT, structured_llm, DifferentialDiagnosis, llm)
     return agent
 
 # --- Example Usage (for testing) ---
@@ -6,7 +6,8 @@ Description: Updates the differential diagnosis based on the user's answers to
 from langchain_core.prompts import ChatPromptTemplate
 from pydantic import BaseModel, Field
 
-from llm.llm_config import get_llm
+from llm.model_router import get_llm_for
+from llm.response_cache import with_response_cache
 from agents.hypothesis_generation_agent import DifferentialDiagnosis
 
 # --- Pydantic Models ---
@@ -58,9 +59,9 @@ def get_hypothesis_refinement_agent():
     This agent takes the current diagnosis and the user's answers and
     returns an updated, more accurate differential diagnosis.
     """
-    llm = get_llm()
+    llm = get_llm_for("hypothesis_refinement")
     structured_llm = llm.with_structured_output(RefinedDifferentialDiagnosis)
-    agent = REFINEMENT_PROMPT | structured_llm
+    agent = with_response_cache("hypothesis_refinement", REFINEMENT_PROMPT, structured_llm, RefinedDifferentialDiagnosis, llm)
     return agent
 
 # --- Example Usage (for testing) ---
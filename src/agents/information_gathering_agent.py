@@ -7,7 +7,8 @@ from langchain_core.prompts import ChatPromptTemplate
 from pydantic import BaseModel, Field
 from typing import List
 
-from llm.llm_config import get_llm
+from llm.model_router import get_llm_for
+from llm.response_cache import with_response_cache
 from agents.initial_assessment_agent import StructuredAssessment
 
 # --- Pydantic Models ---
@@ -59,9 +60,9 @@ def get_information_gathering_agent():
     This agent takes a structured assessment and generates a list of
     optimized search queries for the knowledge base.
     """
-    llm = get_llm()
+    llm = get_llm_for("information_gathering")
     structured_llm = llm.with_structured_output(SearchQueries)
-    agent = INFORMATION_GATHERING_PROMPT | structured_llm
+    agent = with_response_cache("information_gathering", INFORMATION_GATHERING_PROMPT, structured_llm, SearchQueries, llm)
     return agent
 
 # --- Example Usage (for testing) ---
@@ -7,7 +7,8 @@ from langchain_core.prompts import ChatPromptTemplate
 from pydantic import BaseModel, Field
 from typing import List, Optional
 
-from llm.llm_config import get_llm
+from llm.model_router import get_llm_for
+from llm.response_cache import with_response_cache
 
 # --- Pydantic Models for Input and Output ---
 
@@ -60,9 +61,9 @@ def get_initial_assessment_agent():
     This agent is a chain that takes an unstructured user query and returns a
     structured assessment of their condition.
     """
-    llm = get_llm()
+    llm = get_llm_for("initial_assessment")
     structured_llm = llm.with_structured_output(StructuredAssessment)
-    agent = ASSESSMENT_PROMPT | structured_llm
+    agent = with_response_cache("initial_assessment", ASSESSMENT_PROMPT, structured_llm, StructuredAssessment, llm)
     return agent
 
 # --- Example Usage (for testing) ---
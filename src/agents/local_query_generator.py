@@ -0,0 +1,153 @@
+"""
+Agent: Local Query Generator
+Description: Builds the information gathering search queries in-process from a
+             structured assessment, with no LLM call. Symptoms are combined with
+             duration, age and sex, and expanded with the corpus's own terms for
+             them (see knowledge/symptom_synonyms.py).
+
+A drop-in replacement for the information gathering agent: same input, same
+SearchQueries output.
+"""
+from typing import List, Optional
+
+from langchain_core.runnables import RunnableLambda
+
+from agents.information_gathering_agent import SearchQueries, SearchQuery
+from knowledge.entity_index import normalize_name, tokenize
+from knowledge.symptom_synonyms import SymptomSynonyms, get_symptom_synonyms
+
+MAX_QUERIES = 5
+
+_DURATION_NUMBERS = {"a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6,
+                     "several": 3, "few": 3, "couple": 2}
+_UNIT_DAYS = {"hour": 1 / 24, "day": 1, "week": 7, "month": 30, "year": 365}
+
+
+def duration_course(duration: Optional[str]) -> Optional[str]:
+    """'2 days' -> 'acute', 'several weeks' -> 'subacute', 'for months' -> 'chronic'"""
+    if not duration:
+        return None
+    text = duration.lower()
+    if any(word in text for word in ("yesterday", "today", "tonight", "this morning", "sudden")):
+        return "acute"
+    tokens = tokenize(text)
+    for i, token in enumerate(tokens):
+        unit = token[:-1] if token.endswith("s") and token[:-1] in _UNIT_DAYS else token
+        if unit not in _UNIT_DAYS:
+            continue
+        # 'two days', 'a few weeks'; a bare 'months' means several
+        count = 3 if unit != token else 1
+        for word in reversed(tokens[max(0, i - 2):i]):
+            if word.isdigit() or word in _DURATION_NUMBERS:
+                count = int(word) if word.isdigit() else _DURATION_NUMBERS[word]
+                break
+        days = count * _UNIT_DAYS[unit]
+        if days < 21:
+            return "acute"
+        if days < 90:
+            return "subacute"
+        return "chronic"
+    return None
+
+
+def patient_description(age: Optional[int], sex: Optional[str]) -> Optional[str]:
+    """(52, 'female') -> 'middle-aged woman'"""
+    sex = (sex or "").lower()
+    female = sex.startswith("f") or sex.startswith("w")
+    male = not female and sex.startswith("m")
+    if age is None:
+        return "woman" if female else "man" if male else None
+    if age < 2:
+        return "infant"
+    if age < 13:
+        return "girl" if female else "boy" if male else "child"
+    if age < 18:
+        return "adolescent girl" if female else "adolescent boy" if male else "adolescent"
+    group = "young adult" if age < 40 else "middle-aged" if age < 65 else "elderly"
+    if group == "young adult":
+        return "young woman" if female else "young man" if male else "young adult"
+    return f"{group} {'woman' if female else 'man' if male else 'patient'}"
+
+
+def _join(terms: List[str]) -> str:
+    if len(terms) <= 1:
+        return "".join(terms)
+    return ", ".join(terms[:-1]) + " and " + terms[-1]
+
+
+def _unique(terms: List[str]) -> List[str]:
+    seen, unique = set(), []
+    for term in terms:
+        key = normalize_name(term)
+        if key and key not in seen:
+            seen.add(key)
+            unique.append(term)
+    return unique
+
+
+def generate_queries(assessment: dict, synonyms: Optional[SymptomSynonyms] = None) -> SearchQueries:
+    """Build 3-5 search queries from a structured assessment."""
+    synonyms = synonyms or get_symptom_synonyms()
+    main = _unique(assessment.get("main_symptoms") or [])
+    secondary = _unique(assessment.get("secondary_symptoms") or [])
+    main_terms = _unique([synonyms.clinical_term(symptom) for symptom in main])
+    secondary_terms = _unique([synonyms.clinical_term(symptom) for symptom in secondary])
+    course = duration_course(assessment.get("duration_of_symptoms"))
+    patient = patient_description(assessment.get("patient_age"), assessment.get("patient_sex"))
+
+    queries = []
+    if main:
+        # The patient's own wording, as the LLM queries mostly are
+        queries.append(_join(main[:3]) + (f" with {_join(secondary[:2])}" if secondary else ""))
+        # The same presentation in the textbooks' terms
+        queries.append(f"causes of {_join(main_terms[:2])}" + (f" with {_join(secondary_terms[:2])}" if secondary_terms else ""))
+        if course or patient:
+            queries.append(" ".join(filter(None, [course, _join(main_terms[:2]), f"in a {patient}" if patient else None])))
+        queries.append(f"differential diagnosis of {_join(main_terms[:3])}")
+    lead = main_terms[0] if main_terms else None
+    associated = [term for term in secondary_terms if term != lead]
+    if lead and associated:
+        queries.append(f"{lead} associated with {_join(associated[:3])}")
+    # Other terms the books use for the main symptoms
+    expansions = _unique([
+        term for symptom in main for term in synonyms.expand(symptom) if term not in main_terms
+    ])
+    if expansions:
+        queries.append(f"{_join(expansions[:3])} diagnosis and workup")
+    if not queries and assessment.get("initial_summary"):
+        queries.append(assessment["initial_summary"])
+
+    queries = _unique([query.strip() for query in queries if query.strip()])[:MAX_QUERIES]
+    return SearchQueries(queries=[SearchQuery(query=query) for query in queries])
+
+
+def get_local_query_generator():
+    """
+    Creates and returns the local query generator.
+
+    Takes the same structured assessment as the information gathering agent
+    and returns SearchQueries, built in-process in well under a millisecond.
+    """
+    synonyms = get_symptom_synonyms()
+
+    def _generate(assessment) -> SearchQueries:
+        if hasattr(assessment, "model_dump"):
+            assessment = assessment.model_dump()
+        return generate_queries(assessment, synonyms)
+
+    return RunnableLambda(_generate, name="local_query_generator")
+
+
+# --- Example Usage (for testing) ---
+
+if __name__ == '__main__':
+    generator = get_local_query_generator()
+    test_assessment = {
+        "main_symptoms": ["throbbing headache on the left side", "nausea"],
+        "secondary_symptoms": ["bright lights make it worse"],
+        "duration_of_symptoms": "2 days",
+        "patient_age": 34,
+        "patient_sex": "female",
+    }
+    for q in generator.invoke(test_assessment).queries:
+        print(f"- {q.query}")
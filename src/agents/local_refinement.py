@@ -0,0 +1,158 @@
+"""
+Agent: Local Hypothesis Refinement
+Description: Updates the differential diagnosis from the patient's answers with
+             a Bayesian update over the likelihood table built at ingestion
+             (knowledge/likelihood_table.py), with no LLM call.
+
+A drop-in replacement for the hypothesis refinement agent: same inputs, same
+RefinedDifferentialDiagnosis output. The same differential and answers always
+give the same probabilities, and refinement_summary lists every finding taken
+from the answers and the likelihood ratio it applied to each hypothesis.
+"""
+import re
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from langchain_core.runnables import RunnableLambda
+from pydantic import Field
+
+from agents.hypothesis_generation_agent import DiagnosisHypothesis
+from agents.hypothesis_refinement_agent import RefinedDifferentialDiagnosis
+from knowledge.entity_index import tokenize
+from knowledge.likelihood_table import LikelihoodTable
+from knowledge.symptom_synonyms import SymptomSynonyms, get_symptom_synonyms
+
+# Answer words that deny, or confirm, the symptom a question asks about
+NEGATIONS = {"no", "not", "never", "none", "nope", "without", "denies", "deny",
+             "don", "doesn", "didn", "haven", "hasn", "isn", "wasn", "aren"}
+AFFIRMATIONS = {"yes", "yeah", "yep", "definitely", "sometimes", "often", "always", "usually", "occasionally"}
+# A negation only reaches the symptoms after it in its own clause: "no fever but a bad cough"
+CLAUSE_BREAK = re.compile(r"[,.;:!?]|\b(?:but|however|although|though|yet|except|whereas)\b", re.IGNORECASE)
+
+# Floor for prior probabilities, so a hypothesis the generator gave 0 can still move
+MIN_PRIOR = 1e-4
+
+
+class LocalRefinedDifferentialDiagnosis(RefinedDifferentialDiagnosis):
+    """A refined differential that records the priors the update started from."""
+    prior_probabilities: Dict[str, float] = Field(description="Each hypothesis' probability before the update.")
+
+
+def _mentioned_symptoms(tokens: List[str], synonyms: SymptomSynonyms) -> Set[str]:
+    return {synonyms.aliases[alias] for _, alias in synonyms.alias_mentions(tokens)}
+
+
+def _clause_findings(clause: List[str], synonyms: SymptomSynonyms) -> Dict[str, bool]:
+    """The symptoms a clause names, each absent when a negation comes before it in the clause"""
+    findings: Dict[str, bool] = {}
+    for position, alias in synonyms.alias_mentions(clause):
+        findings[synonyms.aliases[alias]] = not NEGATIONS.intersection(clause[:position])
+    return findings
+
+
+def answer_findings(user_answers: Dict[str, str], synonyms: Optional[SymptomSynonyms] = None) -> List[Tuple[str, bool]]:
+    """
+    (symptom, present) findings from question -> answer pairs
+
+    Symptoms the answer names are present unless a negation comes before
+    them in the same clause; symptoms only the question names take the
+    yes or no of the answer's first clause that names no symptom, and are
+    skipped when there is none. Later answers override earlier ones.
+    """
+    synonyms = synonyms or get_symptom_synonyms()
+    findings: Dict[str, bool] = {}
+    for question, answer in user_answers.items():
+        named: Dict[str, bool] = {}
+        reply = None
+        for clause in map(tokenize, CLAUSE_BREAK.split(answer or "")):
+            clause_findings = _clause_findings(clause, synonyms)
+            named.update(clause_findings)
+            if reply is None and not clause_findings:
+                if NEGATIONS.intersection(clause):
+                    reply = False
+                elif AFFIRMATIONS.intersection(clause):
+                    reply = True
+        for symptom in sorted(named):
+            findings[symptom] = named[symptom]
+        if reply is not None:
+            for symptom in sorted(_mentioned_symptoms(tokenize(question), synonyms) - set(named)):
+                findings[symptom] = reply
+    return list(findings.items())
+
+
+def refine_differential(
+    differential: dict,
+    user_answers: Dict[str, str],
+    table: Optional[LikelihoodTable],
+    synonyms: Optional[SymptomSynonyms] = None,
+) -> LocalRefinedDifferentialDiagnosis:
+    """
+    Posterior probabilities for the differential's hypotheses given the answers
+
+    A differential this engine already refined (a follow-up re-entering at
+    refinement) is updated from its recorded priors, since all the answers
+    are applied again.
+    """
+    hypotheses = [DiagnosisHypothesis(**hypothesis) for hypothesis in differential.get("hypotheses", [])]
+    recorded = differential.get("prior_probabilities") or {}
+    hypotheses = [hypothesis.model_copy(update={"probability": recorded.get(hypothesis.condition, hypothesis.probability)})
+                  for hypothesis in hypotheses]
+    unchanged = {hypothesis.condition: hypothesis.probability for hypothesis in hypotheses}
+    if table is None:
+        return LocalRefinedDifferentialDiagnosis(
+            hypotheses=hypotheses, prior_probabilities=unchanged,
+            refinement_summary="No likelihood table is available; probabilities unchanged."
+        )
+    findings = [(symptom, present) for symptom, present in answer_findings(user_answers, synonyms)
+                if table.symptom_column(symptom) is not None]
+    if not hypotheses or not findings:
+        return LocalRefinedDifferentialDiagnosis(
+            hypotheses=hypotheses, prior_probabilities=unchanged,
+            refinement_summary="The answers did not mention any symptom in the likelihood table; probabilities unchanged."
+        )
+
+    rows = [table.condition_row(hypothesis.condition) for hypothesis in hypotheses]
+    ratios = table.likelihood_ratios(rows, [table.symptom_column(symptom) for symptom, _ in findings],
+                                     [present for _, present in findings])
+    known = [row is not None for row in rows]
+    if any(known) and not all(known):
+        # The table has nothing on these conditions: the findings neither favour nor count against them
+        ratios[~np.asarray(known)] = np.exp(np.log(ratios[known]).mean(axis=0))
+    priors = np.maximum([hypothesis.probability for hypothesis in hypotheses], MIN_PRIOR)
+    log_posterior = np.log(priors) + np.log(ratios).sum(axis=1)
+    posterior = np.exp(log_posterior - log_posterior.max())
+    # Keep the mass the generator left for conditions outside the differential
+    posterior *= min(1.0, float(priors.sum())) / posterior.sum()
+
+    order = np.argsort(-posterior, kind="stable")
+    refined = [hypotheses[i].model_copy(update={"probability": round(float(posterior[i]), 4)}) for i in order]
+    evidence = ", ".join(f"{symptom} {'present' if present else 'absent'}" for symptom, present in findings)
+    changes = ", ".join(
+        f"{hypotheses[i].condition} {priors[i]:.0%} → {posterior[i]:.0%} "
+        + (f"(likelihood ratio {ratios[i].prod():.2f})" if rows[i] is not None
+           else f"(not in the likelihood table; average ratio {ratios[i].prod():.2f})")
+        for i in order
+    )
+    return LocalRefinedDifferentialDiagnosis(
+        hypotheses=refined, prior_probabilities=unchanged,
+        refinement_summary=f"Bayesian update from {len(findings)} finding(s) ({evidence}): {changes}."
+    )
+
+
+def get_local_refinement_engine(knowledge_base):
+    """
+    Creates and returns the local hypothesis refinement engine.
+
+    Takes the same {"differential_diagnosis", "user_answers"} inputs as the
+    hypothesis refinement agent. The knowledge base's likelihood table is
+    read on first use.
+    """
+    synonyms = get_symptom_synonyms()
+
+    def _refine(inputs: dict) -> LocalRefinedDifferentialDiagnosis:
+        return refine_differential(
+            inputs["differential_diagnosis"], inputs.get("user_answers") or {},
+            knowledge_base.get_likelihood_table(), synonyms
+        )
+
+    return RunnableLambda(_refine, name="local_refinement")
@@ -0,0 +1,56 @@
+"""
+Agent: Refinement Narrative
+Description: Explains, in plain language, how the patient's answers changed the
+             differential diagnosis. Used with the local refinement engine,
+             which computes the probabilities itself; this agent only writes
+             the refinement_summary, off the critical path.
+"""
+from langchain_core.prompts import ChatPromptTemplate
+from pydantic import BaseModel, Field
+
+from llm.model_router import get_llm_for
+from llm.response_cache import with_response_cache
+
+# --- Pydantic Models ---
+
+class RefinementNarrative(BaseModel):
+    """A narrative summary of a refinement whose probabilities are already decided."""
+    refinement_summary: str = Field(description="A brief summary explaining how the user's answers changed the likelihood of the diagnoses.")
+
+# --- Prompt Template ---
+
+REFINEMENT_NARRATIVE_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        (
+            "system",
+            """You are an expert diagnostician AI. A differential diagnosis has already been refined with the patient's answers; the updated probabilities and the findings behind them are final.
+
+            Write a concise summary explaining *why* the probabilities changed, in terms a patient can follow. For example, "The patient's report of sensitivity to light significantly increases the likelihood of a migraine."
+
+            Do not change, invent or contradict any probability. Generate ONLY the summary.""",
+        ),
+        (
+            "human",
+            "--- Refined Differential Diagnosis ---\n"
+            "{differential_diagnosis}\n\n"
+            "--- Patient's Answers to Clarifying Questions ---\n"
+            "{user_answers}\n"
+            "---",
+        ),
+    ]
+)
+
+# --- Agent Definition ---
+
+def get_refinement_narrative_agent():
+    """
+    Creates and returns the refinement narrative agent.
+
+    This agent takes the refined differential diagnosis (with the local
+    engine's finding-by-finding summary) and the user's answers, and
+    returns a narrative refinement_summary.
+    """
+    llm = get_llm_for("refinement_narrative")
+    structured_llm = llm.with_structured_output(RefinementNarrative)
+    agent = with_response_cache("refinement_narrative", REFINEMENT_NARRATIVE_PROMPT, structured_llm, RefinementNarrative, llm)
+    return agent
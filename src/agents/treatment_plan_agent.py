@@ -8,7 +8,8 @@ from langchain_core.prompts import ChatPromptTemplate
 from pydantic import BaseModel, Field
 from typing import List
 
-from llm.llm_config import get_llm
+from llm.model_router import get_llm_for
+from llm.response_cache import with_response_cache
 from agents.final_diagnosis_agent import FinalDiagnosis
 
 # --- Pydantic Models ---
@@ -69,9 +70,10 @@ def get_treatment_plan_agent():
     This agent takes a final diagnosis and retrieved knowledge and suggests
     general, non-prescriptive next steps.
     """
-    llm = get_llm()
-    structured_llm = llm.with_structured_output(TreatmentPlan)
-    agent = TREATMENT_PROMPT | structured_llm
+    llm = get_llm_for("treatment_plan")
+    # JSON mode streams the answer as text, so the workflow can show it as it is written
+    structured_llm = llm.with_structured_output(TreatmentPlan, method="json_mode")
+    agent = with_response_cache("treatment_plan", TREATMENT_PROMPT, structured_llm, TreatmentPlan, llm)
     return agent
 
 # --- Example Usage (for testing) ---
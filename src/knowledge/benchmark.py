@@ -0,0 +1,267 @@
+"""
+Retrieval-quality and latency benchmark for the medical knowledge base.
+
+Runs a fixed set of medical queries with expected source books against
+MedicalKnowledgeBase and reports recall@k, MRR, search latency percentiles,
+index build time, index size and process memory. Results are written as
+JSON with sorted keys so two runs can be compared with `--compare` or any
+text diff tool.
+
+    python src/knowledge/benchmark.py --output bench/baseline.json
+    python src/knowledge/benchmark.py --output bench/new.json --compare bench/baseline.json
+"""
+
+import argparse
+import hashlib
+import json
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Sequence
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from knowledge.knowledge_base import MedicalKnowledgeBase
+from knowledge.index_store import KnowledgeIndex, QUANTIZATION_TYPES
+
+DEFAULT_QUERIES = Path(__file__).resolve().parent / "benchmark_queries.json"
+DEFAULT_K_VALUES = (1, 3, 5, 10)
+
+# Metrics where a lower value is better; everything else is higher-is-better
+LOWER_IS_BETTER = ("latency", "seconds", "memory_bytes", "index_bytes", "rss")
+
+
+def load_queries(path: str = DEFAULT_QUERIES) -> List[Dict[str, Any]]:
+    """Load query/expected-source pairs from a JSON file."""
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def is_relevant(source_book: str, expected_sources: Sequence[str]) -> bool:
+    """A hit is relevant if its book name contains any expected source fragment."""
+    name = (source_book or "").lower()
+    return any(fragment.lower() in name for fragment in expected_sources)
+
+
+def current_rss_bytes() -> int:
+    """Resident set size of this process, falling back to the peak on non-Linux systems."""
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return peak_rss_bytes()
+
+
+def peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    return peak if platform.system() == "Darwin" else peak * 1024
+
+
+def percentiles_ms(samples: Sequence[float]) -> Dict[str, float]:
+    """p50, p95, p99 and mean of latency samples in seconds, as milliseconds"""
+    values = np.asarray(samples, dtype="float64") * 1000.0
+    return {
+        "p50": round(float(np.percentile(values, 50)), 3),
+        "p95": round(float(np.percentile(values, 95)), 3),
+        "p99": round(float(np.percentile(values, 99)), 3),
+        "mean": round(float(values.mean()), 3),
+    }
+
+
+def run_benchmark(
+    knowledge_base: MedicalKnowledgeBase,
+    queries: List[Dict[str, Any]],
+    k_values: Sequence[int] = DEFAULT_K_VALUES,
+    repeat: int = 3,
+    rebuild: bool = False,
+    quantization: str = None,
+    use_subjects: bool = False,
+) -> Dict[str, Any]:
+    """
+    Run every query against the knowledge base and collect quality and cost metrics.
+
+    Each query is searched `repeat` times for latency; relevance is taken from the
+    first run, since retrieval is deterministic. `quantization` re-packs the loaded
+    index in memory (from its full-precision vectors) so storage options can be
+    compared without re-embedding the corpus. `use_subjects` restricts each
+    query to the subject categories listed in its "subjects" field.
+    """
+    k_values = sorted(set(k_values))
+    max_k = k_values[-1]
+    scratch_dir = None
+
+    ingest_seconds = None
+    if rebuild:
+        start = time.perf_counter()
+        knowledge_base.process_medical_textbooks()
+        ingest_seconds = time.perf_counter() - start
+        # Measure a cold load of what was just written
+        knowledge_base.vector_store = None
+
+    load_start = time.perf_counter()
+    if not knowledge_base.vector_store and not knowledge_base.load_vector_store():
+        raise RuntimeError("Knowledge base index is not available; run with --rebuild")
+    load_seconds = time.perf_counter() - load_start
+    if quantization and quantization != knowledge_base.vector_store.header.get("quantization", "none"):
+        # Round-trip through disk so full-precision vectors are memory-mapped as in production
+        scratch_dir = tempfile.mkdtemp(prefix="kb_benchmark_")
+        knowledge_base.vector_store.requantize(quantization).save(scratch_dir)
+        knowledge_base.vector_store = KnowledgeIndex.load(scratch_dir, verify_checksums=False)
+        knowledge_base.vector_store.rescore_factor = knowledge_base.rescore_factor
+    header = knowledge_base.vector_store.header
+
+    # Warm up the embedding model so the first query doesn't skew latency
+    knowledge_base.search_medical_knowledge(queries[0]["query"], k=max_k)
+
+    latencies = []
+    per_query = []
+    hits_at_k = {k: 0 for k in k_values}
+    reciprocal_ranks = []
+    for item in queries:
+        docs = []
+        subjects = item.get("subjects") if use_subjects else None
+        for _ in range(max(1, repeat)):
+            start = time.perf_counter()
+            docs = knowledge_base.search_medical_knowledge(item["query"], k=max_k, subjects=subjects)
+            latencies.append(time.perf_counter() - start)
+
+        sources = [doc.metadata.get("source_book", "Unknown") for doc in docs]
+        first_relevant = next(
+            (rank for rank, source in enumerate(sources, start=1) if is_relevant(source, item["expected_sources"])),
+            None
+        )
+        for k in k_values:
+            if first_relevant is not None and first_relevant <= k:
+                hits_at_k[k] += 1
+        reciprocal_ranks.append(1.0 / first_relevant if first_relevant else 0.0)
+        per_query.append({
+            "id": item["id"],
+            "first_relevant_rank": first_relevant,
+            "top_sources": sources[:3],
+        })
+
+    query_set = json.dumps(queries, sort_keys=True).encode("utf-8")
+    metrics = {
+        f"recall_at_{k}": round(hits_at_k[k] / len(queries), 4) for k in k_values
+    }
+    metrics["mrr"] = round(float(np.mean(reciprocal_ranks)), 4)
+    metrics.update({f"search_latency_ms_{name}": value for name, value in percentiles_ms(latencies).items()})
+    metrics["index_bytes"] = sum(entry["bytes"] for entry in header.get("files", {}).values())
+    metrics.update(knowledge_base.vector_store.memory_usage())
+    metrics["index_load_seconds"] = round(load_seconds, 4)
+    metrics["index_build_seconds"] = header.get("build_seconds", 0.0)
+    if ingest_seconds is not None:
+        metrics["ingest_seconds"] = round(ingest_seconds, 3)
+    metrics["rss_bytes"] = current_rss_bytes()
+    metrics["peak_rss_bytes"] = peak_rss_bytes()
+    if scratch_dir:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    return {
+        "config": {
+            "embedding_model": header.get("embedding_model"),
+            "dimension": header.get("dimension"),
+            "quantization": header.get("quantization", "none"),
+            "rescore_factor": knowledge_base.vector_store.rescore_factor if knowledge_base.vector_store.quantized else None,
+            "chunk_size": header.get("chunk_size"),
+            "chunk_overlap": header.get("chunk_overlap"),
+            "num_chunks": header.get("num_chunks"),
+            "k_values": k_values,
+            "subject_filter": use_subjects,
+            "repeat": repeat,
+            "num_queries": len(queries),
+            "query_set_sha256": hashlib.sha256(query_set).hexdigest(),
+        },
+        "metrics": metrics,
+        "queries": per_query,
+        "run": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+    }
+
+
+def compare_results(
+    baseline: Dict[str, Any],
+    current: Dict[str, Any],
+    lower_is_better: Sequence[str] = LOWER_IS_BETTER,
+) -> List[Dict[str, Any]]:
+    """Per-metric deltas between two benchmark results, flagged as better or worse."""
+    rows = []
+    for name in sorted(set(baseline["metrics"]) | set(current["metrics"])):
+        old = baseline["metrics"].get(name)
+        new = current["metrics"].get(name)
+        row = {"metric": name, "baseline": old, "current": new, "delta": None, "change": "n/a"}
+        if isinstance(old, (int, float)) and isinstance(new, (int, float)):
+            row["delta"] = round(new - old, 4)
+            if new == old:
+                row["change"] = "same"
+            else:
+                lower_better = any(token in name for token in lower_is_better)
+                row["change"] = "better" if (new < old) == lower_better else "worse"
+        rows.append(row)
+    return rows
+
+
+def print_comparison(rows: List[Dict[str, Any]]) -> None:
+    print(f"{'metric':<28}{'baseline':>16}{'current':>16}{'delta':>14}  change")
+    for row in rows:
+        print(f"{row['metric']:<28}{str(row['baseline']):>16}{str(row['current']):>16}{str(row['delta']):>14}  {row['change']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark knowledge base retrieval quality and latency")
+    parser.add_argument("--queries", default=str(DEFAULT_QUERIES), help="JSON file of query/expected-source pairs")
+    parser.add_argument("--knowledge-dir", default=None, help="Directory of textbook TXT files")
+    parser.add_argument("--k", type=int, nargs="+", default=list(DEFAULT_K_VALUES), help="Cut-offs for recall@k")
+    parser.add_argument("--repeat", type=int, default=3, help="Searches per query for latency percentiles")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild the index and time it")
+    parser.add_argument("--quantization", choices=QUANTIZATION_TYPES,
+                        help="Vector storage to benchmark (re-packs the loaded index in memory)")
+    parser.add_argument("--subjects", action="store_true",
+                        help="Restrict each query to the subject categories listed in the query set")
+    parser.add_argument("--output", "-o", help="Write results JSON to this file")
+    parser.add_argument("--compare", help="Baseline results JSON to compare against")
+    args = parser.parse_args()
+
+    knowledge_base = MedicalKnowledgeBase(args.knowledge_dir, quantization=args.quantization)
+    results = run_benchmark(
+        knowledge_base,
+        load_queries(args.queries),
+        k_values=args.k,
+        repeat=args.repeat,
+        rebuild=args.rebuild,
+        quantization=args.quantization,
+        use_subjects=args.subjects,
+    )
+
+    serialized = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(serialized + "\n")
+        print(f"💾 Results written to {args.output}")
+    else:
+        print(serialized)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline["config"].get("query_set_sha256") != results["config"]["query_set_sha256"]:
+            print("⚠️  Baseline was run with a different query set; quality metrics are not comparable")
+        print_comparison(compare_results(baseline, results))
+
+
+if __name__ == "__main__":
+    main()
@@ -16,7 +16,9 @@ class SentenceTransformerEmbeddings(Embeddings):
     def __init__(self, model_name: str = "all-MiniLM-L6-v2"):
         try:
             from sentence_transformers import SentenceTransformer
+            self.model_name = model_name
             self.model = SentenceTransformer(model_name)
+            self.dimension = self.model.get_sentence_embedding_dimension()
             print(f"✅ SentenceTransformer model '{model_name}' loaded")
         except ImportError:
             raise ImportError("sentence-transformers package is required")
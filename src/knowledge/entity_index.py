@@ -0,0 +1,194 @@
+"""
+Condition and drug entity index for the medical knowledge base.
+
+Built once at ingestion: every chunk is scanned for the disease and drug names
+(and their synonyms) in medical_entities.json, and each canonical entity maps
+to the chunks that mention it, ranked by mention count. Looking up a condition
+is then a dictionary hit and an array slice, with no embedding search.
+
+Stored next to the FAISS index as:
+
+    entities.json        canonical names, entity types and the alias table
+    entity_offsets.npy   int64 offsets into the two arrays below (num_entities + 1)
+    entity_chunk_ids.npy int64 chunk ids, most mentions first within each entity
+    entity_counts.npy    int32 mention count for each (entity, chunk) pair
+"""
+
+import json
+import re
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+ENTITY_TABLE = Path(__file__).resolve().parent / "medical_entities.json"
+
+ENTITIES_FILE = "entities.json"
+ENTITY_OFFSETS_FILE = "entity_offsets.npy"
+ENTITY_CHUNK_IDS_FILE = "entity_chunk_ids.npy"
+ENTITY_COUNTS_FILE = "entity_counts.npy"
+
+ENTITY_FILES = [ENTITIES_FILE, ENTITY_OFFSETS_FILE, ENTITY_CHUNK_IDS_FILE, ENTITY_COUNTS_FILE]
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+_PARENTHESIZED = re.compile(r"\(([^)]*)\)")
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN.findall(text.lower())
+
+
+def normalize_name(name: str) -> str:
+    """Lowercase, punctuation-free form used for both aliases and lookups."""
+    return " ".join(tokenize(name))
+
+
+def load_entity_table(path: Path = ENTITY_TABLE) -> Dict[str, Dict[str, List[str]]]:
+    """Load the {"conditions": {...}, "drugs": {...}} synonym table."""
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class EntityIndex:
+    """Maps normalized condition and drug names to the chunks that mention them."""
+
+    def __init__(
+        self,
+        names: List[str],
+        types: List[str],
+        aliases: Dict[str, int],
+        offsets: np.ndarray,
+        chunk_ids: np.ndarray,
+        counts: np.ndarray,
+    ):
+        self.names = names
+        self.types = types
+        self.aliases = aliases
+        self.offsets = offsets
+        self.chunk_ids = chunk_ids
+        self.counts = counts
+        self._max_alias_tokens = max((len(alias.split()) for alias in aliases), default=0)
+        self._first_tokens = {alias.split()[0] for alias in aliases}
+
+    # --- Construction ---
+
+    @classmethod
+    def from_table(cls, table: Optional[Dict[str, Dict[str, List[str]]]] = None) -> "EntityIndex":
+        """An empty index holding only the alias table."""
+        table = table or load_entity_table()
+        names, types, aliases = [], [], {}
+        for entity_type, key in (("condition", "conditions"), ("drug", "drugs")):
+            for canonical, synonyms in table.get(key, {}).items():
+                entity = len(names)
+                names.append(canonical)
+                types.append(entity_type)
+                for alias in [canonical, *synonyms]:
+                    # First entity to claim an alias keeps it
+                    aliases.setdefault(normalize_name(alias), entity)
+        empty = np.zeros(len(names) + 1, dtype="int64")
+        return cls(names, types, aliases, empty, np.zeros(0, dtype="int64"), np.zeros(0, dtype="int32"))
+
+    def find_mentions(self, text: str) -> Counter:
+        """Count entity mentions in text, preferring the longest alias at each position."""
+        tokens = tokenize(text)
+        mentions: Counter = Counter()
+        i = 0
+        while i < len(tokens):
+            if tokens[i] in self._first_tokens:
+                for length in range(min(self._max_alias_tokens, len(tokens) - i), 0, -1):
+                    entity = self.aliases.get(" ".join(tokens[i:i + length]))
+                    if entity is not None:
+                        mentions[entity] += 1
+                        i += length
+                        break
+                else:
+                    i += 1
+            else:
+                i += 1
+        return mentions
+
+    @classmethod
+    def build(
+        cls,
+        texts: Iterable[str],
+        chunk_ids: Iterable[int],
+        table: Optional[Dict[str, Dict[str, List[str]]]] = None,
+    ) -> "EntityIndex":
+        """Scan chunk texts and build the entity -> chunk postings."""
+        index = cls.from_table(table)
+        postings: List[List[Tuple[int, int]]] = [[] for _ in index.names]
+        for chunk_id, text in zip(chunk_ids, texts):
+            for entity, count in index.find_mentions(text).items():
+                postings[entity].append((int(chunk_id), count))
+
+        offsets = np.zeros(len(index.names) + 1, dtype="int64")
+        ids, counts = [], []
+        for entity, entries in enumerate(postings):
+            entries.sort(key=lambda entry: (-entry[1], entry[0]))
+            ids.extend(chunk_id for chunk_id, _ in entries)
+            counts.extend(count for _, count in entries)
+            offsets[entity + 1] = len(ids)
+
+        index.offsets = offsets
+        index.chunk_ids = np.asarray(ids, dtype="int64")
+        index.counts = np.asarray(counts, dtype="int32")
+        return index
+
+    # --- Persistence ---
+
+    def save(self, directory: Path) -> List[str]:
+        """Write the entity files into an index directory and return their names."""
+        with open(directory / ENTITIES_FILE, "w", encoding="utf-8") as f:
+            json.dump({"names": self.names, "types": self.types, "aliases": self.aliases}, f, ensure_ascii=False)
+        np.save(directory / ENTITY_OFFSETS_FILE, self.offsets, allow_pickle=False)
+        np.save(directory / ENTITY_CHUNK_IDS_FILE, self.chunk_ids, allow_pickle=False)
+        np.save(directory / ENTITY_COUNTS_FILE, self.counts, allow_pickle=False)
+        return list(ENTITY_FILES)
+
+    @classmethod
+    def load(cls, directory: Path) -> "EntityIndex":
+        with open(directory / ENTITIES_FILE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(
+            data["names"],
+            data["types"],
+            data["aliases"],
+            np.load(directory / ENTITY_OFFSETS_FILE, allow_pickle=False),
+            np.load(directory / ENTITY_CHUNK_IDS_FILE, allow_pickle=False),
+            np.load(directory / ENTITY_COUNTS_FILE, allow_pickle=False),
+        )
+
+    # --- Lookup ---
+
+    def resolve(self, name: str) -> Optional[int]:
+        """
+        Entity number for a free-text name, or None.
+
+        Tries the whole name, then an abbreviation in parentheses (e.g.
+        "Postural Orthostatic Tachycardia Syndrome (POTS)"), then the most
+        frequent known alias inside the name (e.g. "Migraine without aura").
+        """
+        normalized = normalize_name(_PARENTHESIZED.sub(" ", name))
+        if normalized in self.aliases:
+            return self.aliases[normalized]
+        for inner in _PARENTHESIZED.findall(name):
+            if normalize_name(inner) in self.aliases:
+                return self.aliases[normalize_name(inner)]
+        mentions = self.find_mentions(normalized)
+        if mentions:
+            return mentions.most_common(1)[0][0]
+        return None
+
+    def postings(self, entity: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Chunk ids and mention counts for an entity number (array views)."""
+        start, end = self.offsets[entity], self.offsets[entity + 1]
+        return self.chunk_ids[start:end], self.counts[start:end]
+
+    def lookup(self, name: str, limit: Optional[int] = None) -> List[Tuple[int, int]]:
+        """(chunk_id, mention_count) pairs for a name, most mentions first."""
+        entity = self.resolve(name)
+        if entity is None:
+            return []
+        ids, counts = self.postings(entity)
+        return list(zip(ids[:limit].tolist(), counts[:limit].tolist()))
@@ -0,0 +1,559 @@
+"""
+Native on-disk format for the medical knowledge base.
+
+The index directory holds only plain data, so loading it never executes code:
+
+    header.json         format version, embedding model, dimension, chunking
+                        parameters, and the size, modification time and SHA-256
+                        checksum of every file below
+    index.faiss         raw FAISS index (labels are chunk ids)
+    chunk_ids.npy       int64 chunk id for every row of the text store
+    chunk_offsets.npy   int64 byte offsets into chunks.bin (num_chunks + 1)
+    chunks.bin          UTF-8 chunk text, concatenated
+    chunk_sources.npy   int32 index into sources.json for every chunk
+    sources.json        per-book metadata shared by all chunks of the book
+    entities.json, entity_*.npy
+                        condition/drug name -> chunk postings (see entity_index)
+    likelihoods.json, likelihood_*.npy
+                        symptom-condition co-occurrence counts (see likelihood_table)
+    vectors.f32         full-precision float32 vectors, row-major; written only
+                        for quantized indexes and memory-mapped at load time so
+                        candidates can be re-scored exactly without holding the
+                        vectors in RAM
+
+Loading checks each file's size and modification time; only a file whose
+modification time changed since `save` (or every file, with
+verify_checksums=True or `verify`) is hashed again.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+
+from .entity_index import ENTITY_FILES, EntityIndex
+from .likelihood_table import LIKELIHOOD_FILES, LikelihoodTable
+from .subjects import SUBJECTS, tag_book
+
+FORMAT_NAME = "healgentic-knowledge-index"
+FORMAT_VERSION = 1
+
+HEADER_FILE = "header.json"
+INDEX_FILE = "index.faiss"
+CHUNK_IDS_FILE = "chunk_ids.npy"
+CHUNK_OFFSETS_FILE = "chunk_offsets.npy"
+CHUNK_TEXT_FILE = "chunks.bin"
+CHUNK_SOURCES_FILE = "chunk_sources.npy"
+SOURCES_FILE = "sources.json"
+VECTORS_FILE = "vectors.f32"
+
+DATA_FILES = [
+    INDEX_FILE,
+    CHUNK_IDS_FILE,
+    CHUNK_OFFSETS_FILE,
+    CHUNK_TEXT_FILE,
+    CHUNK_SOURCES_FILE,
+    SOURCES_FILE,
+]
+
+# Per-book metadata keys stored in sources.json
+SOURCE_METADATA_KEYS = ("source_book", "book_type", "file_path", "source", "subjects")
+
+# Vector storage options: "none" keeps exact float32 vectors in the FAISS index,
+# the others store compressed codes and re-score candidates from vectors.f32
+QUANTIZATION_TYPES = ("none", "fp16", "int8", "pq")
+PQ_SUBVECTOR_DIMS = 8  # each 8-dim sub-vector becomes one byte
+PQ_MIN_TRAINING_VECTORS = 256
+DEFAULT_RESCORE_FACTOR = 4
+
+
+class KnowledgeIndexError(RuntimeError):
+    """Raised when an index directory is missing, corrupt or incompatible."""
+
+
+def _make_faiss_index(vectors: np.ndarray, quantization: str):
+    """Create and train the FAISS storage index for the given quantization."""
+    dimension = vectors.shape[1]
+    if quantization == "none":
+        return faiss.IndexFlatL2(dimension)
+    if quantization == "fp16":
+        index = faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_L2)
+    elif quantization == "int8":
+        index = faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_L2)
+    elif quantization == "pq":
+        if dimension % PQ_SUBVECTOR_DIMS:
+            raise KnowledgeIndexError(f"PQ needs a dimension divisible by {PQ_SUBVECTOR_DIMS}, got {dimension}")
+        if len(vectors) < PQ_MIN_TRAINING_VECTORS:
+            raise KnowledgeIndexError(f"PQ needs at least {PQ_MIN_TRAINING_VECTORS} chunks to train, got {len(vectors)}")
+        index = faiss.IndexPQ(dimension, dimension // PQ_SUBVECTOR_DIMS, 8, faiss.METRIC_L2)
+    else:
+        raise KnowledgeIndexError(
+            f"Unknown quantization '{quantization}'; expected one of {', '.join(QUANTIZATION_TYPES)}"
+        )
+    index.train(vectors)
+    return index
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _check_file(path: Path, expected: Optional[Dict[str, Any]], checksum: bool):
+    """Raise KnowledgeIndexError unless `path` matches its header entry; hash it if `checksum` or it was touched"""
+    if not path.exists() or expected is None:
+        raise KnowledgeIndexError(f"Index file missing: {path}")
+    stat = path.stat()
+    if stat.st_size != expected["bytes"]:
+        raise KnowledgeIndexError(f"Index file has unexpected size: {path}")
+    # Indexes saved before modification times were recorded are only hashed on request
+    touched = expected.get("mtime_ns", stat.st_mtime_ns) != stat.st_mtime_ns
+    if (checksum or touched) and _sha256(path) != expected["sha256"]:
+        raise KnowledgeIndexError(f"Checksum mismatch for {path}")
+
+
+class KnowledgeIndex:
+    """
+    FAISS index plus chunk text and metadata, stored without pickle.
+
+    Chunk ids are the FAISS labels and the row numbers of the text store, so a
+    search result maps straight to its passage. For quantized indexes `vectors`
+    holds the full-precision vectors (a read-only memory map once loaded).
+    """
+
+    def __init__(
+        self,
+        index,
+        chunk_ids: np.ndarray,
+        chunk_offsets: np.ndarray,
+        chunk_text,
+        chunk_sources: np.ndarray,
+        sources: List[Dict[str, Any]],
+        header: Dict[str, Any],
+        vectors: Optional[np.ndarray] = None,
+        entities: Optional[EntityIndex] = None,
+        likelihoods: Optional[LikelihoodTable] = None,
+    ):
+        self.index = index
+        self.chunk_ids = chunk_ids
+        self.chunk_offsets = chunk_offsets
+        self.chunk_text = chunk_text
+        self.chunk_sources = chunk_sources
+        self.sources = sources
+        self.header = header
+        self.vectors = vectors
+        self.entities = entities
+        self.likelihoods = likelihoods
+        self.rescore_factor = DEFAULT_RESCORE_FACTOR
+        self._row_of_id = {int(chunk_id): row for row, chunk_id in enumerate(chunk_ids)}
+        self._subject_rows = self._index_subjects()
+        self._selectors: Dict[Tuple[str, ...], Tuple[Any, np.ndarray, np.ndarray]] = {}
+
+    # --- Construction ---
+
+    @classmethod
+    def build(
+        cls,
+        documents: Sequence[Document],
+        vectors: np.ndarray,
+        embedding_model: str,
+        chunk_size: int,
+        chunk_overlap: int,
+        quantization: str = "none",
+    ) -> "KnowledgeIndex":
+        """Build an in-memory index from split documents and their embeddings."""
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        if vectors.ndim != 2 or vectors.shape[0] != len(documents):
+            raise KnowledgeIndexError(
+                f"Expected {len(documents)} embeddings, got array of shape {vectors.shape}"
+            )
+
+        dimension = vectors.shape[1]
+        chunk_ids = np.arange(len(documents), dtype="int64")
+        index = faiss.IndexIDMap2(_make_faiss_index(vectors, quantization))
+        index.add_with_ids(vectors, chunk_ids)
+
+        sources: List[Dict[str, Any]] = []
+        source_lookup: Dict[str, int] = {}
+        chunk_sources = np.empty(len(documents), dtype="int32")
+        encoded = []
+        for row, doc in enumerate(documents):
+            source = {key: doc.metadata[key] for key in SOURCE_METADATA_KEYS if key in doc.metadata}
+            source_key = json.dumps(source, sort_keys=True)
+            if source_key not in source_lookup:
+                source_lookup[source_key] = len(sources)
+                sources.append(source)
+            chunk_sources[row] = source_lookup[source_key]
+            encoded.append(doc.page_content.encode("utf-8"))
+
+        chunk_offsets = np.zeros(len(documents) + 1, dtype="int64")
+        np.cumsum([len(text) for text in encoded], out=chunk_offsets[1:])
+        entities = EntityIndex.build((doc.page_content for doc in documents), chunk_ids)
+        likelihoods = LikelihoodTable.build((doc.page_content for doc in documents), chunk_ids, entities)
+
+        header = {
+            "format": FORMAT_NAME,
+            "format_version": FORMAT_VERSION,
+            "embedding_model": embedding_model,
+            "dimension": int(dimension),
+            "metric": "l2",
+            "quantization": quantization,
+            "chunk_size": chunk_size,
+            "chunk_overlap": chunk_overlap,
+            "num_chunks": len(documents),
+            "num_sources": len(sources),
+            "num_entities": int((np.diff(entities.offsets) > 0).sum()),
+            "num_symptoms": int((likelihoods.symptom_chunks > 0).sum()),
+        }
+        return cls(
+            index, chunk_ids, chunk_offsets, b"".join(encoded), chunk_sources, sources, header,
+            vectors=vectors if quantization != "none" else None,
+            entities=entities, likelihoods=likelihoods
+        )
+
+    def requantize(self, quantization: str) -> "KnowledgeIndex":
+        """
+        Return a copy of this index with different vector storage.
+
+        Reuses the stored full-precision vectors, so no re-embedding is needed.
+        The text store is shared with this index.
+        """
+        vectors = self.full_precision_vectors()
+        index = faiss.IndexIDMap2(_make_faiss_index(vectors, quantization))
+        index.add_with_ids(vectors, self.chunk_ids)
+        header = {key: value for key, value in self.header.items() if key != "files"}
+        header["quantization"] = quantization
+        return KnowledgeIndex(
+            index, self.chunk_ids, self.chunk_offsets, self.chunk_text, self.chunk_sources, self.sources, header,
+            vectors=vectors if quantization != "none" else None,
+            entities=self.entities, likelihoods=self.likelihoods
+        )
+
+    def full_precision_vectors(self) -> np.ndarray:
+        """Float32 vectors in text-store row order."""
+        if self.vectors is not None:
+            return np.ascontiguousarray(self.vectors, dtype="float32")
+        return np.vstack([self.index.reconstruct(int(chunk_id)) for chunk_id in self.chunk_ids]).astype("float32")
+
+    # --- Persistence ---
+
+    def save(self, path: str) -> None:
+        """Write the index directory, replacing any previous one at `path`."""
+        directory = Path(path)
+        directory.mkdir(parents=True, exist_ok=True)
+
+        faiss.write_index(self.index, str(directory / INDEX_FILE))
+        np.save(directory / CHUNK_IDS_FILE, self.chunk_ids, allow_pickle=False)
+        np.save(directory / CHUNK_OFFSETS_FILE, self.chunk_offsets, allow_pickle=False)
+        np.save(directory / CHUNK_SOURCES_FILE, self.chunk_sources, allow_pickle=False)
+        with open(directory / CHUNK_TEXT_FILE, "wb") as f:
+            f.write(self.chunk_text)
+        with open(directory / SOURCES_FILE, "w", encoding="utf-8") as f:
+            json.dump(self.sources, f, ensure_ascii=False)
+
+        files = list(DATA_FILES)
+        if self.entities is not None:
+            files.extend(self.entities.save(directory))
+        if self.likelihoods is not None:
+            files.extend(self.likelihoods.save(directory))
+        if self.quantized:
+            np.ascontiguousarray(self.vectors, dtype="float32").tofile(directory / VECTORS_FILE)
+            files.append(VECTORS_FILE)
+        elif (directory / VECTORS_FILE).exists():
+            (directory / VECTORS_FILE).unlink()
+
+        header = dict(self.header)
+        header["created_at"] = datetime.now(timezone.utc).isoformat()
+        header["files"] = {}
+        for name in files:
+            stat = (directory / name).stat()
+            header["files"][name] = {"sha256": _sha256(directory / name), "bytes": stat.st_size,
+                                     "mtime_ns": stat.st_mtime_ns}
+        # Header goes last so a half-written directory never looks valid
+        tmp_header = directory / f"{HEADER_FILE}.tmp"
+        with open(tmp_header, "w", encoding="utf-8") as f:
+            json.dump(header, f, indent=2, sort_keys=True)
+        os.replace(tmp_header, directory / HEADER_FILE)
+        self.header = header
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return (Path(path) / HEADER_FILE).exists()
+
+    @staticmethod
+    def read_header(path: str) -> Dict[str, Any]:
+        header_path = Path(path) / HEADER_FILE
+        try:
+            with open(header_path, "r", encoding="utf-8") as f:
+                header = json.load(f)
+        except FileNotFoundError:
+            raise KnowledgeIndexError(f"No knowledge index found at {path}")
+        except json.JSONDecodeError as e:
+            raise KnowledgeIndexError(f"Corrupt index header {header_path}: {e}")
+
+        if header.get("format") != FORMAT_NAME:
+            raise KnowledgeIndexError(f"{header_path} is not a knowledge index header")
+        if header.get("format_version") != FORMAT_VERSION:
+            raise KnowledgeIndexError(
+                f"Unsupported index format version {header.get('format_version')} "
+                f"(expected {FORMAT_VERSION}); rebuild the knowledge base"
+            )
+        return header
+
+    @classmethod
+    def verify(cls, path: str):
+        """Check every file of an index directory against its SHA-256 checksum; raises KnowledgeIndexError"""
+        directory = Path(path)
+        for name, expected in cls.read_header(path)["files"].items():
+            _check_file(directory / name, expected, checksum=True)
+
+    @classmethod
+    def load(
+        cls,
+        path: str,
+        embedding_model: Optional[str] = None,
+        dimension: Optional[int] = None,
+        verify_checksums: bool = False,
+    ) -> "KnowledgeIndex":
+        """
+        Load an index directory written by `save`.
+
+        The header is validated against the configured embedding model and
+        dimension before any data file is read. Files are checked by size and
+        modification time, and checksummed only if touched since `save`, or
+        all of them with verify_checksums.
+        """
+        directory = Path(path)
+        header = cls.read_header(path)
+
+        if embedding_model is not None and header["embedding_model"] != embedding_model:
+            raise KnowledgeIndexError(
+                f"Index was built with embedding model '{header['embedding_model']}' "
+                f"but '{embedding_model}' is configured; rebuild the knowledge base"
+            )
+        if dimension is not None and header["dimension"] != dimension:
+            raise KnowledgeIndexError(
+                f"Index dimension {header['dimension']} does not match embedding dimension {dimension}"
+            )
+
+        files = list(DATA_FILES)
+        # Indexes written before the entity index existed load without it
+        has_entities = ENTITY_FILES[0] in header["files"]
+        if has_entities:
+            files.extend(ENTITY_FILES)
+        # Likewise for indexes written before the likelihood table
+        has_likelihoods = has_entities and LIKELIHOOD_FILES[0] in header["files"]
+        if has_likelihoods:
+            files.extend(LIKELIHOOD_FILES)
+        if header.get("quantization", "none") != "none":
+            files.append(VECTORS_FILE)
+        for name in files:
+            _check_file(directory / name, header["files"].get(name), verify_checksums)
+
+        index = faiss.read_index(str(directory / INDEX_FILE))
+        if index.d != header["dimension"] or index.ntotal != header["num_chunks"]:
+            raise KnowledgeIndexError("FAISS index does not match its header")
+
+        chunk_ids = np.load(directory / CHUNK_IDS_FILE, allow_pickle=False)
+        chunk_offsets = np.load(directory / CHUNK_OFFSETS_FILE, allow_pickle=False)
+        chunk_sources = np.load(directory / CHUNK_SOURCES_FILE, allow_pickle=False)
+        with open(directory / SOURCES_FILE, "r", encoding="utf-8") as f:
+            sources = json.load(f)
+
+        # Text is paged in lazily; only the passages that are returned get decoded
+        with open(directory / CHUNK_TEXT_FILE, "rb") as f:
+            if header["files"][CHUNK_TEXT_FILE]["bytes"]:
+                chunk_text = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                chunk_text = b""
+
+        vectors = None
+        if VECTORS_FILE in files:
+            vectors = np.memmap(
+                directory / VECTORS_FILE, dtype="float32", mode="r",
+                shape=(header["num_chunks"], header["dimension"])
+            )
+
+        entities = EntityIndex.load(directory) if has_entities else None
+        likelihoods = LikelihoodTable.load(directory, entities) if has_likelihoods else None
+
+        return cls(
+            index, chunk_ids, chunk_offsets, chunk_text, chunk_sources, sources, header,
+            vectors=vectors, entities=entities, likelihoods=likelihoods
+        )
+
+    def _index_subjects(self) -> Dict[str, np.ndarray]:
+        """Text-store rows per subject category, derived from the per-book tags."""
+        books_by_subject: Dict[str, List[int]] = {}
+        for book, source in enumerate(self.sources):
+            subjects = source.get("subjects")
+            if subjects is None:
+                # Indexes built before subject tagging: tag from the book name
+                subjects = tag_book(source.get("source_book", ""))
+            for subject in subjects:
+                books_by_subject.setdefault(subject, []).append(book)
+        return {
+            subject: np.flatnonzero(np.isin(self.chunk_sources, books))
+            for subject, books in books_by_subject.items()
+        }
+
+    # --- Retrieval ---
+
+    def __len__(self) -> int:
+        return int(self.index.ntotal)
+
+    @property
+    def dimension(self) -> int:
+        return int(self.index.d)
+
+    @property
+    def quantized(self) -> bool:
+        return self.header.get("quantization", "none") != "none"
+
+    def subject_counts(self) -> Dict[str, int]:
+        return {subject: len(rows) for subject, rows in sorted(self._subject_rows.items())}
+
+    def _subject_filter(self, subjects: Sequence[str]) -> Tuple[Any, np.ndarray, np.ndarray]:
+        """
+        FAISS selector, selected rows and bitmap for a set of subjects.
+
+        The bitmap backs the selector's memory, so it is cached alongside it.
+        """
+        key = tuple(sorted(set(subjects)))
+        if key not in self._selectors:
+            unknown = [subject for subject in key if subject not in SUBJECTS]
+            if unknown:
+                raise KnowledgeIndexError(
+                    f"Unknown subject(s) {', '.join(unknown)}; expected any of {', '.join(SUBJECTS)}"
+                )
+            mask = np.zeros(len(self), dtype=bool)
+            for subject in key:
+                mask[self._subject_rows.get(subject, [])] = True
+            # FAISS filters by label, and labels are the chunk ids
+            id_mask = np.zeros(int(self.chunk_ids.max()) + 1 if len(self) else 0, dtype=bool)
+            id_mask[self.chunk_ids[mask]] = True
+            bitmap = np.packbits(id_mask, bitorder="little")
+            selector = faiss.IDSelectorBitmap(len(id_mask), faiss.swig_ptr(bitmap))
+            self._selectors[key] = (selector, np.flatnonzero(mask), bitmap)
+        return self._selectors[key]
+
+    def memory_usage(self) -> Dict[str, int]:
+        """Bytes of vector data held in RAM versus an unquantized float32 index."""
+        storage = faiss.downcast_index(self.index.index)
+        count = len(self)
+        vector_bytes = count * int(storage.code_size)
+        full_precision_bytes = count * self.dimension * 4
+        return {
+            "vector_memory_bytes": vector_bytes,
+            "full_precision_bytes": full_precision_bytes,
+            "memory_saved_bytes": full_precision_bytes - vector_bytes,
+        }
+
+    def search(
+        self,
+        vector: Sequence[float],
+        k: int = 10,
+        subjects: Optional[Sequence[str]] = None,
+    ) -> List[Tuple[int, float]]:
+        """
+        Return up to k (chunk_id, distance) pairs, nearest first.
+
+        `subjects` restricts the search to chunks from books tagged with any of
+        the given categories; non-matching vectors are skipped inside FAISS
+        rather than filtered afterwards. Quantized indexes over-fetch
+        `rescore_factor * k` candidates and rank them by exact distance to the
+        full-precision vectors.
+        """
+        query = np.asarray(vector, dtype="float32").reshape(1, -1)
+        if query.shape[1] != self.dimension:
+            raise KnowledgeIndexError(
+                f"Query dimension {query.shape[1]} does not match index dimension {self.dimension}"
+            )
+
+        fetch = k * self.rescore_factor if self.quantized else k
+        if subjects:
+            selector, rows, _ = self._subject_filter(subjects)
+            if not len(rows):
+                return []
+            if self.header.get("quantization") == "pq":
+                # IndexPQ doesn't accept search parameters; score the subset's codes directly
+                distances, labels = self._pq_subset_search(query, rows, min(fetch, len(rows)))
+            else:
+                distances, labels = self.index.search(
+                    query, min(fetch, len(rows)), params=faiss.SearchParameters(sel=selector)
+                )
+        else:
+            distances, labels = self.index.search(query, min(fetch, len(self)))
+        hits = [
+            (int(label), float(distance))
+            for label, distance in zip(labels[0], distances[0])
+            if label != -1
+        ]
+        if self.quantized and hits:
+            hits = self._rescore(query[0], [chunk_id for chunk_id, _ in hits])
+        return hits[:k]
+
+    def lookup_entity(
+        self,
+        name: str,
+        limit: int = 5,
+        subjects: Optional[Sequence[str]] = None,
+    ) -> List[Tuple[int, int]]:
+        """
+        (chunk_id, mention_count) pairs for a condition or drug name, most
+        mentions first, optionally limited to books in the given subjects.
+        """
+        if self.entities is None:
+            return []
+        entity = self.entities.resolve(name)
+        if entity is None:
+            return []
+        ids, counts = self.entities.postings(entity)
+        if subjects:
+            _, _, bitmap = self._subject_filter(subjects)
+            keep = ((bitmap[ids >> 3] >> (ids & 7)) & 1).astype(bool)
+            ids, counts = ids[keep], counts[keep]
+        return list(zip(ids[:limit].tolist(), counts[:limit].tolist()))
+
+    def _pq_subset_search(self, query: np.ndarray, rows: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Asymmetric PQ distances for the given rows only, in FAISS result layout."""
+        storage = faiss.downcast_index(self.index.index)
+        pq = storage.pq
+        tables = np.empty((1, pq.M * pq.ksub), dtype="float32")
+        pq.compute_distance_tables(1, faiss.swig_ptr(query), faiss.swig_ptr(tables))
+        all_codes = faiss.rev_swig_ptr(storage.codes.data(), storage.codes.size())  # zero-copy view
+        codes = all_codes.reshape(len(self), storage.code_size)[rows]
+        distances = tables.reshape(pq.M, pq.ksub)[np.arange(pq.M), codes].sum(axis=1)
+        nearest = np.argsort(distances, kind="stable")[:k]
+        return distances[nearest][None, :], self.chunk_ids[rows[nearest]][None, :]
+
+    def _rescore(self, query: np.ndarray, chunk_ids: List[int]) -> List[Tuple[int, float]]:
+        rows = np.array([self._row_of_id[chunk_id] for chunk_id in chunk_ids])
+        order = np.argsort(rows)  # sequential reads from the memory map
+        candidates = np.asarray(self.vectors[rows[order]], dtype="float32")
+        exact = ((candidates - query) ** 2).sum(axis=1)
+        ranked = np.argsort(exact, kind="stable")
+        return [(chunk_ids[order[i]], float(exact[i])) for i in ranked]
+
+    def get_text(self, chunk_id: int) -> str:
+        row = self._row_of_id[chunk_id]
+        start, end = self.chunk_offsets[row], self.chunk_offsets[row + 1]
+        return self.chunk_text[start:end].decode("utf-8")
+
+    def get_document(self, chunk_id: int, score: Optional[float] = None) -> Document:
+        row = self._row_of_id[chunk_id]
+        metadata = dict(self.sources[self.chunk_sources[row]])
+        metadata["chunk_id"] = chunk_id
+        if score is not None:
+            metadata["score"] = score
+        return Document(page_content=self.get_text(chunk_id), metadata=metadata)
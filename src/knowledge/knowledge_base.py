@@ -3,16 +3,20 @@ Medical knowledge base for document processing and retrieval
 """
 
 import os
-from typing import List
+import threading
+import time
+from typing import Iterable, List, Optional
 from pathlib import Path
 from dotenv import load_dotenv
 
+import numpy as np
 from langchain_community.document_loaders import PyPDFLoader
-from langchain_community.vectorstores import FAISS
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
 from langchain_community.document_loaders import TextLoader
 from .embeddings import SentenceTransformerEmbeddings
+from .index_store import KnowledgeIndex, KnowledgeIndexError, DEFAULT_RESCORE_FACTOR
+from .subjects import tag_book
 
 class MedicalKnowledgeBase:
     """
@@ -25,7 +29,7 @@ class MedicalKnowledgeBase:
     4. Source attribution
     """
     
-    def __init__(self, knowledge_dir: str = None):
+    def __init__(self, knowledge_dir: str = None, quantization: str = None):
         load_dotenv()
         
         # Set directories
@@ -37,9 +41,17 @@ class MedicalKnowledgeBase:
             "VECTOR_STORE_DIR", 
             "data/vector_store"
         )
+        self.vector_store_path = os.path.join(self.vector_store_dir, "medical_knowledge_index")
+        
+        # Vector storage: none (float32), fp16, int8 or pq; quantized indexes
+        # re-score rescore_factor * k candidates against full-precision vectors
+        self.quantization = quantization or os.getenv("VECTOR_QUANTIZATION", "none")
+        self.rescore_factor = int(os.getenv("VECTOR_RESCORE_FACTOR", DEFAULT_RESCORE_FACTOR))
         
         # Initialize components
         self.vector_store = None
+        # Workflows search from a thread pool; only one thread loads the index
+        self._load_lock = threading.Lock()
         self._setup_embeddings()
         self._setup_text_splitter()
         
@@ -59,9 +71,11 @@ class MedicalKnowledgeBase:
     
     def _setup_text_splitter(self):
         """Setup text splitter for optimal medical context"""
+        self.chunk_size = 1500  # Optimal for medical context
+        self.chunk_overlap = 200  # Preserve context between chunks
         self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1500,  # Optimal for medical context
-            chunk_overlap=200,  # Preserve context between chunks
+            chunk_size=self.chunk_size,
+            chunk_overlap=self.chunk_overlap,
             separators=["\n\n", "\n", ". ", " "],
             length_function=len
         )
@@ -95,7 +109,8 @@ class MedicalKnowledgeBase:
                     docs[0].metadata.update({
                         'source_book': file_path.name,
                         'book_type': 'medical_textbook',
-                        'file_path': str(file_path)
+                        'file_path': str(file_path),
+                        'subjects': tag_book(file_path.name)
                     })
                 
                 
@@ -113,11 +128,25 @@ class MedicalKnowledgeBase:
         if documents:
             try:
                 print("Creating vector database...")
-                self.vector_store = FAISS.from_documents(documents, self.embeddings)
+                build_start = time.perf_counter()
+                vectors = np.asarray(
+                    self.embeddings.embed_documents([doc.page_content for doc in documents]),
+                    dtype="float32"
+                )
+                self.vector_store = KnowledgeIndex.build(
+                    documents,
+                    vectors,
+                    embedding_model=self.embeddings.model_name,
+                    chunk_size=self.chunk_size,
+                    chunk_overlap=self.chunk_overlap,
+                    quantization=self.quantization
+                )
+                self.vector_store.rescore_factor = self.rescore_factor
+                self.vector_store.header["build_seconds"] = round(time.perf_counter() - build_start, 3)
                 
-                # Save vector store
-                vector_store_path = os.path.join(self.vector_store_dir, "medical_knowledge")
-                self.vector_store.save_local(vector_store_path)
+                # Save vector store, and read it back in full once
+                self.vector_store.save(self.vector_store_path)
+                KnowledgeIndex.verify(self.vector_store_path)
                 
                 print(f"✅ Vector database created with {len(documents)} chunks from {processed_files} books")
                 
@@ -131,32 +160,64 @@ class MedicalKnowledgeBase:
         """Load existing vector store"""
 
         try:
-            vector_store_path = os.path.join(self.vector_store_dir, "medical_knowledge")
-            if os.path.exists(vector_store_path):
-                self.vector_store = FAISS.load_local(
-                    vector_store_path, 
-                    self.embeddings,
-                    allow_dangerous_deserialization=True
+            if KnowledgeIndex.exists(self.vector_store_path):
+                self.vector_store = KnowledgeIndex.load(
+                    self.vector_store_path,
+                    embedding_model=self.embeddings.model_name,
+                    dimension=getattr(self.embeddings, "dimension", None)
                 )
+                self.vector_store.rescore_factor = self.rescore_factor
+                stored_quantization = self.vector_store.header.get("quantization", "none")
+                if stored_quantization != self.quantization:
+                    print(f"⚠️  Vector store uses '{stored_quantization}' storage but '{self.quantization}' is configured; "
+                          "rebuild the knowledge base to apply it")
                 print("✅ Vector store loaded successfully")
                 return True
             else:
                 print("⚠️  Vector store not found. Please run process_medical_textbooks() first.")
                 return False
+        except KnowledgeIndexError as e:
+            print(f"❌ Incompatible vector store: {e}")
+            return False
         except Exception as e:
             print(f"❌ Error loading vector store: {e}")
             return False
     
-    def search_medical_knowledge(self, query: str, k: int = 10) -> List[Document]:
-        """Search medical knowledge base for relevant information"""
-        if not self.vector_store:
-            if not self.load_vector_store():
-                print("⚠️  Vector store could not be loaded for search.")
-                return []
+    def verify_vector_store(self) -> bool:
+        """Check every vector store file against its checksum (loading only checks sizes and times)"""
+
+        try:
+            KnowledgeIndex.verify(self.vector_store_path)
+        except KnowledgeIndexError as e:
+            print(f"❌ Vector store failed verification: {e}")
+            return False
+        print("✅ Vector store files match their checksums")
+        return True
+    
+    def _ensure_vector_store(self) -> bool:
+        """Load the vector store on first use, once, even with concurrent callers"""
+        if self.vector_store is not None:
+            return True
+        with self._load_lock:
+            return self.vector_store is not None or self.load_vector_store()
+    
+    def search_medical_knowledge(self, query: str, k: int = 10, subjects: Optional[List[str]] = None) -> List[Document]:
+        """
+        Search medical knowledge base for relevant information
+        
+        `subjects` limits the search to books tagged with any of the given
+        categories (see knowledge.subjects.SUBJECTS), e.g. ["pharmacology"].
+        """
+        if not self._ensure_vector_store():
+            print("⚠️  Vector store could not be loaded for search.")
+            return []
         
         try:
-            # Use the simpler similarity_search, which directly returns Document objects
-            return self.vector_store.similarity_search(query, k=k)
+            query_vector = self.embeddings.embed_query(query)
+            return [
+                self.vector_store.get_document(chunk_id, score=score)
+                for chunk_id, score in self.vector_store.search(query_vector, k=k, subjects=subjects)
+            ]
             
         except Exception as e:
             import traceback
@@ -164,6 +225,59 @@ class MedicalKnowledgeBase:
             traceback.print_exc()
             return []
     
+    def lookup_condition(self, name: str, limit: int = 5, subjects: Optional[List[str]] = None) -> List[Document]:
+        """
+        Passages that mention a condition (or drug) by name or synonym
+        
+        Served from the entity index built at ingestion, so no embedding search
+        is needed. Passages are ranked by mention count; each Document carries
+        `chunk_id` and `mentions` metadata.
+        """
+        if not self._ensure_vector_store():
+            return []
+        
+        if self.vector_store.entities is None:
+            print("⚠️  Vector store has no entity index. Rebuild the knowledge base to enable condition lookup.")
+            return []
+        
+        documents = []
+        for chunk_id, mentions in self.vector_store.lookup_entity(name, limit=limit, subjects=subjects):
+            doc = self.vector_store.get_document(chunk_id)
+            doc.metadata["mentions"] = mentions
+            documents.append(doc)
+        return documents
+    
+    def get_likelihood_table(self):
+        """
+        The symptom-condition likelihood table built at ingestion, or None
+
+        Used by the local hypothesis refinement engine for its Bayesian update.
+        """
+        if not self._ensure_vector_store():
+            return None
+        
+        if self.vector_store.likelihoods is None:
+            print("⚠️  Vector store has no likelihood table. Rebuild the knowledge base to enable local refinement.")
+        return self.vector_store.likelihoods
+    
+    def get_passages(self, chunk_ids: Iterable[int]) -> List[Document]:
+        """
+        The passages with the given chunk IDs, in order
+
+        Workflow state keeps only chunk IDs; this reads the text back when a
+        prompt or a result display needs it. Unknown IDs are skipped.
+        """
+        if not self._ensure_vector_store():
+            return []
+
+        documents = []
+        for chunk_id in chunk_ids:
+            try:
+                documents.append(self.vector_store.get_document(int(chunk_id)))
+            except (KeyError, IndexError):
+                print(f"⚠️  Chunk {chunk_id} is not in the knowledge base.")
+        return documents
+
     def get_statistics(self) -> dict:
         """Get knowledge base statistics"""
 
@@ -177,6 +291,8 @@ class MedicalKnowledgeBase:
             "textbook_files": [f.name for f in textbook_files],
             "vector_store_exists": self.vector_store is not None
         }
+        if self.vector_store is not None:
+            stats["chunks_by_subject"] = self.vector_store.subject_counts()
         
         return stats
 
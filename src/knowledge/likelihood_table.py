@@ -0,0 +1,161 @@
+"""
+Symptom-condition likelihood table for the medical knowledge base.
+
+Built once at ingestion, next to the entity index: every chunk is scanned for
+the symptoms in the corpus symptom synonym table, and for each entity (rows
+are the entity index's numbering) the table counts the chunks that mention
+both the entity and each symptom. From those counts,
+
+    P(symptom | condition) = (co-occurring chunks + m * P(symptom)) / (condition chunks + m)
+    P(symptom)             = (chunks mentioning the symptom + 1) / (all chunks + 2)
+
+so a condition the corpus says little about stays close to the background
+rate instead of swinging to 0 or 1. Hypothesis refinement turns these into
+likelihood ratios for a Bayesian update (see agents/local_refinement.py).
+
+Stored next to the FAISS index as:
+
+    likelihoods.json          symptom names, chunk count and smoothing strength
+    likelihood_counts.npy     int32 co-occurring chunks, num_entities x num_symptoms
+    likelihood_symptoms.npy   int32 chunks mentioning each symptom
+"""
+
+import json
+from collections import Counter
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+import numpy as np
+
+from .entity_index import EntityIndex, tokenize
+from .symptom_synonyms import SymptomSynonyms, get_symptom_synonyms
+
+LIKELIHOODS_FILE = "likelihoods.json"
+LIKELIHOOD_COUNTS_FILE = "likelihood_counts.npy"
+LIKELIHOOD_SYMPTOMS_FILE = "likelihood_symptoms.npy"
+
+LIKELIHOOD_FILES = [LIKELIHOODS_FILE, LIKELIHOOD_COUNTS_FILE, LIKELIHOOD_SYMPTOMS_FILE]
+
+# Pseudo-chunks at the background rate added to every condition's counts
+DEFAULT_SMOOTHING = 20.0
+# Likelihoods are kept this far from 0 and 1, and each finding's ratio within
+# [1 / MAX_LIKELIHOOD_RATIO, MAX_LIKELIHOOD_RATIO], so no single answer is decisive
+LIKELIHOOD_FLOOR = 1e-3
+MAX_LIKELIHOOD_RATIO = 20.0
+
+
+class LikelihoodTable:
+    """Chunk co-occurrence counts between entities and symptoms, and the likelihoods derived from them."""
+
+    def __init__(
+        self,
+        symptoms: List[str],
+        counts: np.ndarray,
+        symptom_chunks: np.ndarray,
+        num_chunks: int,
+        entities: EntityIndex,
+        smoothing: float = DEFAULT_SMOOTHING,
+    ):
+        self.symptoms = symptoms
+        self.counts = counts
+        self.symptom_chunks = symptom_chunks
+        self.num_chunks = num_chunks
+        self.entities = entities
+        self.smoothing = smoothing
+        self._column = {symptom: column for column, symptom in enumerate(symptoms)}
+        self._background = (symptom_chunks + 1.0) / (num_chunks + 2.0)
+        entity_chunks = np.diff(entities.offsets).astype("float64")
+        likelihoods = (counts + smoothing * self._background) / (entity_chunks[:, None] + smoothing)
+        self._likelihoods = np.clip(likelihoods, LIKELIHOOD_FLOOR, 1.0 - LIKELIHOOD_FLOOR)
+
+    # --- Construction ---
+
+    @classmethod
+    def build(
+        cls,
+        texts: Iterable[str],
+        chunk_ids: Iterable[int],
+        entities: EntityIndex,
+        synonyms: Optional[SymptomSynonyms] = None,
+    ) -> "LikelihoodTable":
+        """Scan chunk texts for symptoms and count co-occurrences with the entity postings."""
+        synonyms = synonyms or get_symptom_synonyms()
+        symptoms = list(synonyms.counts)
+        column = {symptom: i for i, symptom in enumerate(symptoms)}
+        chunk_ids = np.asarray(list(chunk_ids), dtype="int64")
+
+        # Symptom x chunk-row indicator; rows follow chunk_ids order
+        mentioned = np.zeros((len(symptoms), len(chunk_ids)), dtype=bool)
+        for row, text in enumerate(texts):
+            aliases: Counter = Counter()
+            synonyms.count_aliases(tokenize(text), aliases)
+            for alias in aliases:
+                mentioned[column[synonyms.aliases[alias]], row] = True
+
+        # Co-occurrences per entity: sum the indicator over each entity's postings
+        row_of_id = np.full(int(chunk_ids.max(initial=-1)) + 1, -1, dtype="int64")
+        row_of_id[chunk_ids] = np.arange(len(chunk_ids))
+        posting_rows = row_of_id[entities.chunk_ids]
+        counts = np.zeros((len(entities.names), len(symptoms)), dtype="int32")
+        cumulative = np.zeros(len(posting_rows) + 1, dtype="int64")
+        for symptom in range(len(symptoms)):
+            np.cumsum(mentioned[symptom, posting_rows], out=cumulative[1:])
+            counts[:, symptom] = cumulative[entities.offsets[1:]] - cumulative[entities.offsets[:-1]]
+        return cls(symptoms, counts, mentioned.sum(axis=1).astype("int32"), len(chunk_ids), entities)
+
+    # --- Persistence ---
+
+    def save(self, directory: Path) -> List[str]:
+        """Write the likelihood files into an index directory and return their names."""
+        with open(directory / LIKELIHOODS_FILE, "w", encoding="utf-8") as f:
+            json.dump({"symptoms": self.symptoms, "num_chunks": self.num_chunks, "smoothing": self.smoothing}, f)
+        np.save(directory / LIKELIHOOD_COUNTS_FILE, self.counts, allow_pickle=False)
+        np.save(directory / LIKELIHOOD_SYMPTOMS_FILE, self.symptom_chunks, allow_pickle=False)
+        return list(LIKELIHOOD_FILES)
+
+    @classmethod
+    def load(cls, directory: Path, entities: EntityIndex) -> "LikelihoodTable":
+        with open(directory / LIKELIHOODS_FILE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(
+            data["symptoms"],
+            np.load(directory / LIKELIHOOD_COUNTS_FILE, allow_pickle=False),
+            np.load(directory / LIKELIHOOD_SYMPTOMS_FILE, allow_pickle=False),
+            data["num_chunks"],
+            entities,
+            data.get("smoothing", DEFAULT_SMOOTHING),
+        )
+
+    # --- Lookup ---
+
+    def condition_row(self, name: str) -> Optional[int]:
+        """Row for a free-text condition name (resolved like entity lookups), or None."""
+        entity = self.entities.resolve(name)
+        if entity is None or self.entities.types[entity] != "condition":
+            return None
+        return entity
+
+    def symptom_column(self, symptom: str) -> Optional[int]:
+        return self._column.get(symptom)
+
+    def likelihood_ratios(self, rows: List[Optional[int]], columns: List[int], present: List[bool]) -> np.ndarray:
+        """
+        Likelihood ratio of each finding under each condition, len(rows) x len(columns)
+
+        A present symptom contributes P(s | c) / P(s), an absent one
+        (1 - P(s | c)) / (1 - P(s)). Conditions without a row get 1.
+        Ratios are capped at MAX_LIKELIHOOD_RATIO either way.
+        """
+        ratios = np.ones((len(rows), len(columns)))
+        known = [i for i, row in enumerate(rows) if row is not None]
+        if not known or not columns:
+            return ratios
+        present = np.asarray(present, dtype=bool)
+        background = self._background[columns]
+        likelihoods = self._likelihoods[np.ix_([rows[i] for i in known], columns)]
+        ratios[known] = np.where(present, likelihoods / background, (1.0 - likelihoods) / (1.0 - background))
+        return np.clip(ratios, 1.0 / MAX_LIKELIHOOD_RATIO, MAX_LIKELIHOOD_RATIO)
+
+    def evidence_chunks(self, row: int, column: int) -> int:
+        """Chunks mentioning both the condition and the symptom (for audit trails)."""
+        return int(self.counts[row, column])
@@ -0,0 +1,61 @@
+"""
+Subject categories for medical textbooks.
+
+Books are tagged once at ingestion from their file names, so searches can be
+restricted to e.g. pharmacology sources without scanning the whole corpus.
+"""
+
+from typing import Dict, List, Tuple
+
+GENERAL_SUBJECT = "general"
+
+# Category -> lowercase fragments matched against the book file name.
+# A book can belong to several categories, except popular-press books, which
+# get no clinical category even when their titles mention one.
+POPULAR_PRESS = "popular_press"
+SUBJECT_RULES: Dict[str, Tuple[str, ...]] = {
+    "pharmacology": (
+        "pharmacolog", "drug", "prescribing", "therapeutics", "gilman",
+    ),
+    "clinical_medicine": (
+        "clinical medicine", "step-up to medicine", "morning report", "washington manual",
+        "examination medicine",
+    ),
+    "clinical_examination": (
+        "physical examination", "clinical examination", "essentials of examination",
+        "physical diagnosis", "clinical methods", "examination medicine",
+    ),
+    "immunology": ("immun", "allerg"),
+    "microbiology": ("microbiolog", "infectious"),
+    "biochemistry": (
+        "biochem", "enzyme", "glycobiology", "metabolic regulation", "metabolism",
+    ),
+    "endocrinology": ("endocrin", "hormone"),
+    "cardiology": ("heart",),
+    "respiratory": ("respiratory", "asthma"),
+    "haematology": ("haematolog", "hematolog"),
+    "neuroscience": ("neuroscience", "neurolog"),
+    "laboratory_medicine": ("clinical chemistry",),
+    "obstetrics_gynaecology": ("pregnancy", "women"),
+    POPULAR_PRESS: (
+        "hormone repair manual", "it's probably your hormones", "it must be my hormones",
+        "the hormone solution", "women, food, and hormones", "period repair manual",
+    ),
+}
+
+SUBJECTS: Tuple[str, ...] = tuple(SUBJECT_RULES) + (GENERAL_SUBJECT,)
+
+# Subjects the treatment-plan step draws on
+TREATMENT_SUBJECTS: Tuple[str, ...] = ("pharmacology", "clinical_medicine")
+
+
+def tag_book(file_name: str) -> List[str]:
+    """Return the subject categories for a textbook file name."""
+    name = file_name.lower()
+    if any(fragment in name for fragment in SUBJECT_RULES[POPULAR_PRESS]):
+        return [POPULAR_PRESS]
+    subjects = [
+        subject for subject, fragments in SUBJECT_RULES.items()
+        if any(fragment in name for fragment in fragments)
+    ]
+    return subjects or [GENERAL_SUBJECT]
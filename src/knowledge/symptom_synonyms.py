@@ -0,0 +1,169 @@
+"""
+Symptom synonym table for building search queries without an LLM call.
+
+medical_symptoms.json lists, for each canonical symptom, the lay phrasings a
+patient uses and the clinical terms a textbook uses. The table is derived from
+the corpus once: every alias is counted across the textbooks (longest alias
+wins at each position, as in the entity index), and symptom_synonyms.json keeps
+each symptom's aliases ranked by how often the books use them. Aliases the
+corpus never uses still match the patient's wording, but are never put in a
+query.
+
+    python src/knowledge/symptom_synonyms.py --build [--textbooks DIR]
+"""
+
+import argparse
+import json
+import sys
+from collections import Counter
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+if __name__ == "__main__":
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from knowledge.entity_index import normalize_name, tokenize
+
+SYMPTOM_TABLE = Path(__file__).resolve().parent / "medical_symptoms.json"
+SYNONYM_TABLE = Path(__file__).resolve().parent / "symptom_synonyms.json"
+DEFAULT_TEXTBOOKS = Path(__file__).resolve().parent / "data" / "medical_textbooks"
+
+
+def load_symptom_table(path: Path = SYMPTOM_TABLE) -> Dict[str, List[str]]:
+    """Load the curated {canonical: [aliases]} symptom table."""
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)["symptoms"]
+
+
+class SymptomSynonyms:
+    """Maps a patient's symptom wording to its canonical symptom and the corpus's terms for it."""
+
+    def __init__(self, counts: Dict[str, Dict[str, int]]):
+        # canonical -> {alias: corpus mentions}, most used first
+        self.counts = {
+            canonical: dict(sorted(aliases.items(), key=lambda item: -item[1]))
+            for canonical, aliases in counts.items()
+        }
+        self.aliases: Dict[str, str] = {}
+        for canonical, aliases in counts.items():
+            for alias in [canonical, *aliases]:
+                # First symptom to claim an alias keeps it
+                self.aliases.setdefault(normalize_name(alias), canonical)
+        self._max_alias_tokens = max((len(alias.split()) for alias in self.aliases), default=0)
+        self._first_tokens = {alias.split()[0] for alias in self.aliases}
+
+    @classmethod
+    def from_table(cls, table: Optional[Dict[str, List[str]]] = None) -> "SymptomSynonyms":
+        """Unranked synonyms straight from the curated table."""
+        table = table or load_symptom_table()
+        return cls({canonical: {alias: 0 for alias in aliases} for canonical, aliases in table.items()})
+
+    def alias_mentions(self, tokens: List[str]) -> List[Tuple[int, str]]:
+        """(position, alias) for each alias mention in a token list, preferring the longest alias at each position."""
+        mentions = []
+        i = 0
+        while i < len(tokens):
+            if tokens[i] in self._first_tokens:
+                for length in range(min(self._max_alias_tokens, len(tokens) - i), 0, -1):
+                    alias = " ".join(tokens[i:i + length])
+                    if alias in self.aliases:
+                        mentions.append((i, alias))
+                        i += length
+                        break
+                else:
+                    i += 1
+            else:
+                i += 1
+        return mentions
+
+    def count_aliases(self, tokens: List[str], counts: Counter):
+        """Add the alias mentions in a token list to counts, preferring the longest alias at each position."""
+        for _, alias in self.alias_mentions(tokens):
+            counts[alias] += 1
+
+    @classmethod
+    def build(cls, texts: Iterable[str], table: Optional[Dict[str, List[str]]] = None) -> "SymptomSynonyms":
+        """Rank every symptom's aliases by how often the texts use them."""
+        synonyms = cls.from_table(table)
+        mentions: Counter = Counter()
+        for text in texts:
+            synonyms.count_aliases(tokenize(text), mentions)
+        counts = {
+            canonical: {alias: mentions[normalize_name(alias)] for alias in aliases}
+            for canonical, aliases in synonyms.counts.items()
+        }
+        return cls(counts)
+
+    def save(self, path: Path = SYNONYM_TABLE):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"symptoms": self.counts}, f, indent=1, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: Path = SYNONYM_TABLE) -> "SymptomSynonyms":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f)["symptoms"])
+
+    # --- Lookups ---
+
+    def canonical(self, symptom: str) -> Optional[str]:
+        """The canonical symptom for a phrase: an exact alias, else the longest alias it mentions."""
+        name = normalize_name(symptom)
+        if name in self.aliases:
+            return self.aliases[name]
+        mentions: Counter = Counter()
+        self.count_aliases(name.split(), mentions)
+        if not mentions:
+            return None
+        return self.aliases[max(mentions, key=lambda alias: len(alias.split()))]
+
+    def clinical_term(self, symptom: str) -> str:
+        """The corpus's most used term for a symptom, or the symptom itself when it is not in the table."""
+        canonical = self.canonical(symptom)
+        if canonical is None:
+            return symptom
+        return next((alias for alias, count in self.counts[canonical].items() if count), canonical)
+
+    def expand(self, symptom: str, limit: int = 2) -> List[str]:
+        """Up to limit corpus terms for a symptom, most used first, excluding the patient's own wording."""
+        canonical = self.canonical(symptom)
+        if canonical is None:
+            return []
+        own = normalize_name(symptom)
+        return [
+            alias for alias, count in self.counts[canonical].items()
+            if count and normalize_name(alias) != own
+        ][:limit]
+
+
+@lru_cache(maxsize=1)
+def get_symptom_synonyms() -> SymptomSynonyms:
+    """The corpus-ranked table, or the curated one if it has not been built."""
+    if SYNONYM_TABLE.exists():
+        return SymptomSynonyms.load()
+    return SymptomSynonyms.from_table()
+
+
+def _read_textbooks(directory: Path) -> Iterable[str]:
+    for path in sorted(directory.glob("*.txt")):
+        yield path.read_text(encoding="utf-8", errors="ignore")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the corpus-ranked symptom synonym table")
+    parser.add_argument("--build", action="store_true", help="Count symptom aliases in the textbooks")
+    parser.add_argument("--textbooks", type=Path, default=DEFAULT_TEXTBOOKS, help="Directory of .txt textbooks")
+    args = parser.parse_args()
+
+    if not args.build:
+        parser.print_help()
+        return
+    synonyms = SymptomSynonyms.build(_read_textbooks(args.textbooks))
+    synonyms.save()
+    attested = sum(1 for aliases in synonyms.counts.values() for count in aliases.values() if count)
+    total = sum(len(aliases) for aliases in synonyms.counts.values())
+    print(f"✅ Wrote {SYNONYM_TABLE.name}: {len(synonyms.counts)} symptoms, {attested}/{total} aliases found in the corpus")
+
+
+if __name__ == "__main__":
+    main()
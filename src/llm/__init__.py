@@ -3,5 +3,15 @@ LLM Integration Components
 """
 
 from .llm_config import get_llm
+from .client_registry import ClientRegistry, get_client_registry
+from .rate_limiter import RateLimiter, get_rate_limiter, set_rate_limiter
+from .cassette import Cassette, CassetteRecorder, get_cassette_recorder, set_cassette_recorder
+from .model_router import ModelRouter, get_llm_for, get_model_router, set_model_router
+from .resilience import CallPolicy, DeadlineExceeded, get_call_policy, set_call_policy
+from .response_cache import ResponseCache, get_response_cache, set_response_cache, with_response_cache
 
-__all__ = ["get_llm"]
+__all__ = ["get_llm", "ClientRegistry", "get_client_registry", "ResponseCache", "get_response_cache", "set_response_cache", "with_response_cache",
+           "CallPolicy", "DeadlineExceeded", "get_call_policy", "set_call_policy",
+           "RateLimiter", "get_rate_limiter", "set_rate_limiter",
+           "ModelRouter", "get_llm_for", "get_model_router", "set_model_router",
+           "Cassette", "CassetteRecorder", "get_cassette_recorder", "set_cassette_recorder"]
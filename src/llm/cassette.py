@@ -0,0 +1,213 @@
+"""
+LLM Cassettes
+-------------
+Recordings of agent calls, for replaying the workflow without a model
+provider (see llm/replay.py).
+
+With LLM_RECORD=path, every agent call made through with_response_cache
+appends one JSON line to the cassette:
+
+    {"key": ..., "agent": "final_diagnosis", "schema": <output schema hash>,
+     "messages": [{"role": "system", "content": ...}, ...],
+     "response": {...structured output...},
+     "seconds": 1.84, "usage": {"input_tokens": 812, "output_tokens": 203}}
+
+`key` hashes the rendered prompt messages and the output schema, so the
+replay backend finds a response by prompt alone, whichever model recorded
+it. Calls answered from the response cache are recorded with no seconds or
+usage; record with LLM_CACHE=false to keep the real latencies.
+
+    cd src && python -m llm.cassette ../bench/cassette.jsonl   # entries, latency and tokens per agent
+"""
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.runnables import RunnableConfig
+
+from .usage import TokenUsageHandler
+
+_WORD = re.compile(r"\w+")
+
+
+def cassette_key(messages: list, schema_digest: str) -> str:
+    payload = json.dumps({"messages": [[message.type, message.content] for message in messages],
+                          "schema": schema_digest}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _words(text: str) -> frozenset:
+    return frozenset(_WORD.findall(text.lower()))
+
+
+def with_handler(config: Optional[RunnableConfig], handler: BaseCallbackHandler) -> RunnableConfig:
+    """A copy of `config` that also reports to `handler`"""
+    config = dict(config or {})
+    callbacks = config.get("callbacks")
+    if callbacks is None:
+        config["callbacks"] = [handler]
+    elif isinstance(callbacks, list):
+        config["callbacks"] = [*callbacks, handler]
+    else:
+        manager = callbacks.copy()
+        manager.add_handler(handler, inherit=True)
+        config["callbacks"] = manager
+    return config
+
+
+def with_usage_handler(config: Optional[RunnableConfig]):
+    """A copy of `config` that also reports to a fresh TokenUsageHandler, and the handler"""
+    handler = TokenUsageHandler()
+    return with_handler(config, handler), handler
+
+
+class Cassette:
+    """
+    Recorded responses, looked up by prompt and output schema
+
+    A prompt that wasn't recorded (the knowledge base or a prompt changed
+    since) finds nothing. With strict=False it is answered instead with the
+    recording for the same output schema (so the same agent) whose prompt
+    shares the most words with it, the earliest recorded on a tie. The
+    stand-in is logged, and `stats()` counts it as a miss.
+    """
+
+    def __init__(self, entries: List[Dict[str, Any]], strict: bool = True):
+        self.strict = strict
+        self._by_key: Dict[str, Dict[str, Any]] = {}
+        self._by_schema: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        for entry in entries:
+            if entry["key"] not in self._by_key:
+                self._by_schema[entry["schema"]].append(entry)
+            self._by_key[entry["key"]] = entry
+        self._words: Dict[str, frozenset] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def load(cls, path: str, strict: bool = True) -> "Cassette":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls([json.loads(line) for line in f if line.strip()], strict)
+
+    def __len__(self) -> int:
+        return len(self._by_key)
+
+    def _prompt_words(self, entry: Dict[str, Any]) -> frozenset:
+        if entry["key"] not in self._words:
+            self._words[entry["key"]] = _words(" ".join(str(message["content"]) for message in entry.get("messages") or []))
+        return self._words[entry["key"]]
+
+    def _closest(self, prompt: str, schema_digest: str) -> Optional[Dict[str, Any]]:
+        """The recording for the schema whose prompt is most like `prompt` (word overlap)"""
+        words = _words(prompt)
+        best, best_score = None, -1.0
+        for entry in self._by_schema.get(schema_digest, []):
+            recorded = self._prompt_words(entry)
+            score = len(words & recorded) / len(words | recorded) if words | recorded else 1.0
+            if score > best_score:
+                best, best_score = entry, score
+        return best
+
+    def lookup(self, key: str, schema_digest: str, prompt: str = "") -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._by_key.get(key)
+            if entry is not None and entry["schema"] == schema_digest:
+                self.hits += 1
+                return entry
+            self.misses += 1
+            if self.strict:
+                return None
+            entry = self._closest(prompt, schema_digest)
+        if entry is not None:
+            print(f"⚠️  Unrecorded {entry['agent']} prompt, replaying the closest recording ({entry['key'][:12]})")
+        return entry
+
+    def typical_seconds(self, schema_digest: str) -> float:
+        """Median recorded latency for a schema, for entries recorded without one"""
+        seconds = [entry["seconds"] for entry in self._by_schema.get(schema_digest, []) if entry.get("seconds") is not None]
+        return float(np.median(seconds)) if seconds else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        agents: Dict[str, Dict[str, Any]] = {}
+        for entry in self._by_key.values():
+            stats = agents.setdefault(entry["agent"], {"entries": 0, "seconds": [], "input_tokens": 0, "output_tokens": 0})
+            stats["entries"] += 1
+            if entry.get("seconds") is not None:
+                stats["seconds"].append(entry["seconds"])
+            for name in ("input_tokens", "output_tokens"):
+                stats[name] += (entry.get("usage") or {}).get(name, 0)
+        for stats in agents.values():
+            seconds = stats.pop("seconds")
+            stats["seconds_mean"] = round(float(np.mean(seconds)), 4) if seconds else None
+            stats["seconds_p95"] = round(float(np.percentile(seconds, 95)), 4) if seconds else None
+        with self._lock:
+            return {"entries": len(self), "hits": self.hits, "misses": self.misses, "agents": agents}
+
+
+class CassetteRecorder:
+    """Appends agent calls to a cassette file; safe to share between threads"""
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self.recorded = 0
+
+    def record(self, agent: str, messages: list, schema_digest: str, response: Any,
+               seconds: Optional[float] = None, usage: Optional[Dict[str, int]] = None):
+        entry = {
+            "key": cassette_key(messages, schema_digest),
+            "agent": agent,
+            "schema": schema_digest,
+            "messages": [{"role": message.type, "content": message.content} for message in messages],
+            "response": response.model_dump(mode="json"),
+            "seconds": None if seconds is None else round(seconds, 4),
+            "usage": usage,
+            "recorded_at": round(time.time(), 3),
+        }
+        line = json.dumps(entry, sort_keys=True, default=str) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+            self.recorded += 1
+
+
+_recorder: Optional[CassetteRecorder] = None
+_recorder_loaded = False
+_recorder_lock = threading.Lock()
+
+
+def get_cassette_recorder() -> Optional[CassetteRecorder]:
+    """The process-wide recorder (LLM_RECORD), or None when not recording"""
+    global _recorder, _recorder_loaded
+    with _recorder_lock:
+        if not _recorder_loaded:
+            path = os.getenv("LLM_RECORD")
+            _recorder = CassetteRecorder(path) if path else None
+            _recorder_loaded = True
+        return _recorder
+
+
+def set_cassette_recorder(recorder: Optional[CassetteRecorder]):
+    """Start recording to `recorder`, or stop with None"""
+    global _recorder, _recorder_loaded
+    with _recorder_lock:
+        _recorder = recorder
+        _recorder_loaded = True
+
+
+# --- Command line: summarize a cassette ---
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        sys.exit("usage: python -m llm.cassette CASSETTE")
+    print(json.dumps(Cassette.load(sys.argv[1]).stats(), indent=2))
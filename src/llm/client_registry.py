@@ -0,0 +1,148 @@
+"""
+LLM Client Registry
+-------------------
+Process-wide registry of LLM clients, one per (provider, model, params).
+
+Building a client opens its own connection (a gRPC channel or an HTTP
+session), so every workflow and agent that asks for the same configuration
+gets the same client back and reuses its warm connections instead of paying
+for client construction and a new TLS handshake.
+
+HTTP sessions (the Gemini "rest" transport) get a connection pool of
+`LLM_POOL_SIZE` keep-alive connections per host (default 16). gRPC channels
+already multiplex concurrent calls over one kept-alive connection.
+
+    python src/llm/client_registry.py   # print reuse metrics for this process
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", 16))
+
+
+def _params_key(params: Dict[str, Any]) -> str:
+    return json.dumps(params, sort_keys=True, default=str)
+
+
+def secret_fingerprint(secret: Optional[str]) -> Optional[str]:
+    """Short hash of a credential, so clients for different keys stay apart without keeping the key in the registry"""
+    return hashlib.sha256(secret.encode("utf-8")).hexdigest()[:12] if secret else None
+
+
+def configure_http_pool(session: Any, pool_size: int = LLM_POOL_SIZE) -> bool:
+    """Mount a keep-alive connection pool of `pool_size` on a requests session; False if it isn't one"""
+    try:
+        from requests.adapters import HTTPAdapter
+    except ImportError:
+        return False
+    if not hasattr(session, "mount"):
+        return False
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return True
+
+
+def http_pool_stats(session: Any) -> Dict[str, int]:
+    """Requests served vs connections opened by a requests session's pools"""
+    connections = requests = 0
+    for adapter in getattr(session, "adapters", {}).values():
+        pools = getattr(getattr(adapter, "poolmanager", None), "pools", None)
+        if pools is None:
+            continue
+        for key in pools.keys():
+            pool = pools[key]
+            connections += getattr(pool, "num_connections", 0)
+            requests += getattr(pool, "num_requests", 0)
+    return {"connections_opened": connections, "requests": requests, "connections_reused": max(0, requests - connections)}
+
+
+class ClientRegistry:
+    """Thread-safe map of (provider, model, params) to a shared client, with reuse counters"""
+
+    def __init__(self):
+        # Re-entrant: factories may call track_session while get() holds the lock
+        self._lock = threading.RLock()
+        self._clients: Dict[Tuple[str, str, str], Any] = {}
+        self._sessions: Dict[Tuple[str, str, str], Any] = {}
+        self._created_at: Dict[Tuple[str, str, str], float] = {}
+        self._reuses: Dict[Tuple[str, str, str], int] = {}
+
+    def get(self, provider: str, model: str, params: Dict[str, Any], factory: Callable[[], Any]) -> Any:
+        """
+        The client for this configuration, built with `factory()` the first time it is asked for.
+
+        The lock is held while building so concurrent first requests share
+        one client rather than racing to build several.
+        """
+        key = (provider, model, _params_key(params))
+        with self._lock:
+            if key in self._clients:
+                self._reuses[key] += 1
+                return self._clients[key]
+            client = factory()
+            self._clients[key] = client
+            self._created_at[key] = time.time()
+            self._reuses[key] = 0
+            return client
+
+    def track_session(self, provider: str, model: str, params: Dict[str, Any], session: Any):
+        """Report connection reuse for the HTTP session behind a registered client"""
+        with self._lock:
+            self._sessions[(provider, model, _params_key(params))] = session
+
+    def stats(self) -> Dict[str, Any]:
+        """Clients built vs reused, and connection reuse for tracked HTTP sessions"""
+        with self._lock:
+            clients = []
+            for key in self._clients:
+                provider, model, params = key
+                entry = {
+                    "provider": provider,
+                    "model": model,
+                    "params": json.loads(params),
+                    "reuses": self._reuses[key],
+                    "age_seconds": round(time.time() - self._created_at[key], 1),
+                }
+                if key in self._sessions:
+                    entry["http"] = http_pool_stats(self._sessions[key])
+                clients.append(entry)
+        created = len(clients)
+        reused = sum(entry["reuses"] for entry in clients)
+        return {
+            "clients_created": created,
+            "clients_reused": reused,
+            "reuse_rate": round(reused / (created + reused), 4) if created + reused else 0.0,
+            "clients": clients,
+        }
+
+    def clear(self):
+        """Forget every client, e.g. after credentials change; clients in use keep working"""
+        with self._lock:
+            self._clients.clear()
+            self._sessions.clear()
+            self._created_at.clear()
+            self._reuses.clear()
+
+
+_registry = ClientRegistry()
+
+
+def get_client_registry() -> ClientRegistry:
+    return _registry
+
+
+# --- Example Usage ---
+if __name__ == '__main__':
+    import sys
+    from pathlib import Path
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    from llm.llm_config import get_llm
+
+    for _ in range(7):
+        get_llm()
+    print(json.dumps(get_client_registry().stats(), indent=2))
@@ -3,10 +3,16 @@ LLM Configuration
 -----------------
 Preparing the LLM to use in the agent system.
 """
+import asyncio
 import os
 from dotenv import load_dotenv
 from langchain_google_genai import ChatGoogleGenerativeAI
 from pathlib import Path
+from typing import Optional
+from pydantic import PrivateAttr
+
+from .client_registry import configure_http_pool, get_client_registry, secret_fingerprint, LLM_POOL_SIZE
+from .resilience import LLM_TIMEOUT_SECONDS
 
 # Disable LangSmith warnings and tracing
 os.environ["LANGCHAIN_TRACING_V2"] = "false"
@@ -19,11 +25,46 @@ dotenv_path = Path(__file__).resolve().parents[0].parent.parent / '.env'
 load_dotenv(dotenv_path)
 
 print(f"🔍 Loading environment variables from:\n {dotenv_path}")
-def get_llm():
+DEFAULT_MAX_TOKENS = 900
+
+
+class SharedChatGoogleGenerativeAI(ChatGoogleGenerativeAI):
+    """
+    Gemini chat model that is safe to share between event loops.
+
+    The async gRPC client only works on the event loop that created it, and
+    a shared client outlives loops (each `asyncio.run` starts a new one), so
+    the async client is rebuilt whenever the running loop changes.
+    """
+
+    _async_client_loop: object = PrivateAttr(default=None)
+
+    @property
+    def async_client(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is not None and loop is not self._async_client_loop:
+            self.async_client_running = None
+            self._async_client_loop = loop
+        return super().async_client
+
+def get_llm(max_tokens: int = DEFAULT_MAX_TOKENS, model_name: Optional[str] = None):
     """
-    Initializes and returns the configured Language Model.
+    Returns the configured Language Model.
     
-    Currently configured to use Google Gemini.
+    Currently configured to use Google Gemini. Clients come from the
+    process-wide client registry, so every agent and workflow asking for the
+    same model and settings shares one client and its connections.
+    Set GEMINI_TRANSPORT=rest to use HTTP with a pooled keep-alive session
+    (LLM_POOL_SIZE connections) instead of the default gRPC channel.
+    
+    Args:
+        max_tokens: Output token limit; agents that return several outputs
+            in one call need more than the default.
+        model_name: Gemini model to use instead of GEMINI_MODEL (the model
+            router picks one per agent, see llm/model_router.py).
     
     Raises:
         ValueError: If the required API key is not found in the environment variables.
@@ -33,7 +74,8 @@ def get_llm():
     """
 
     api_key = os.getenv("GOOGLE_API_KEY")
-    model_name = os.getenv("GEMINI_MODEL", "models/gemini-2.0-flash") # Default model if not set
+    model_name = model_name or os.getenv("GEMINI_MODEL", "models/gemini-2.0-flash") # Default model if not set
+    transport = os.getenv("GEMINI_TRANSPORT") or None
     
     
     if not api_key:
@@ -42,15 +84,34 @@ def get_llm():
             "Please ensure it is set in your .env file."
         )
 
-    # Initialize the ChatGoogleGenerativeAI model
-    llm = ChatGoogleGenerativeAI(
-        model=model_name,
-        google_api_key=api_key,
-        temperature=0.0,  # Set to 0 for deterministic, factual responses
-        max_tokens=900
-    )
-    
-    return llm
+    params = {
+        "temperature": 0.0,  # Set to 0 for deterministic, factual responses
+        "max_tokens": max_tokens,
+        "transport": transport,
+        "timeout": LLM_TIMEOUT_SECONDS,
+        "key": secret_fingerprint(api_key),
+    }
+
+    def create_llm():
+        # Initialize the ChatGoogleGenerativeAI model
+        llm = SharedChatGoogleGenerativeAI(
+            model=model_name,
+            google_api_key=api_key,
+            temperature=params["temperature"],
+            max_tokens=max_tokens,
+            transport=transport,
+            # Requests end on their own even when the call policy has given up on them,
+            # and it does the retrying (1 = a single attempt)
+            timeout=LLM_TIMEOUT_SECONDS,
+            max_retries=1,
+        )
+        session = getattr(getattr(llm.client, "_transport", None), "_session", None)
+        if session is not None and configure_http_pool(session, LLM_POOL_SIZE):
+            registry.track_session("google", model_name, params, session)
+        return llm
+
+    registry = get_client_registry()
+    return registry.get("google", model_name, params, create_llm)
 
 # --- Example Usage (for testing this module directly) ---
 if __name__ == '__main__':
@@ -0,0 +1,430 @@
+"""
+LLM Model Router
+----------------
+Per-agent model routes with failover between providers.
+
+LLM_ROUTES maps agent names (as given to with_response_cache) to an ordered
+list of backends, "provider:model"; "default" covers the agents not listed:
+
+    LLM_ROUTES='{"initial_assessment": ["google:models/gemini-2.0-flash-lite"],
+                 "final_diagnosis": ["google:models/gemini-2.5-flash", "together:Qwen/Qwen2.5-72B-Instruct-Turbo"],
+                 "default": ["google:models/gemini-2.0-flash"]}'
+
+A route may also be {"backends": [...], "slo_seconds": 8}. LLM_ROUTES=tiered
+uses ROUTE_PRESETS["tiered"]: a small fast model for the assessment, search
+queries and questions, a stronger one for the hypotheses, their refinement
+and the final diagnosis. LLM_FALLBACK (comma-separated backends) is added to
+the end of every route.
+
+Providers:
+    google    Gemini through get_llm (GOOGLE_API_KEY)
+    together  Together's OpenAI-compatible API (TOGETHER_API_KEY)
+    openai    any OpenAI-compatible server, "openai:model@base_url"
+              (OPENAI_API_KEY if it needs one), e.g. llm/stub_server.py
+    replay    a recorded cassette, "replay:path" (see llm/replay.py);
+              LLM_REPLAY=path routes every agent to it
+
+A call goes to the route's first healthy backend and fails over to the next
+when it errors, or when it hasn't answered within the route's latency SLO
+(LLM_ROUTE_SLO_SECONDS, default 20); then the next backend is asked as well
+and the first answer wins. Health is tracked per backend across agents:
+after LLM_ROUTE_FAILURES (default 3) consecutive errors or SLO breaches its
+circuit opens and the backend goes to the back of every route for
+LLM_ROUTE_COOLDOWN_SECONDS (default 30), after which it is tried again.
+Failovers are reported as FAILOVER_EVENT callback events for the workflow
+metrics.
+
+Each backend is called under its own rate-limiter quota. A response is cached
+under the backend that gave it, and looked up under the backend the route will
+try first (see with_response_cache). Without LLM_ROUTES every agent gets
+get_llm() as before, and a route with a single backend is that backend's client.
+
+    cd src && python -m llm.model_router   # print each agent's route
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, wait
+from typing import Any, Callable, Deque, Dict, List, NamedTuple, Optional, Type
+
+import numpy as np
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
+from pydantic import BaseModel
+
+from .llm_config import DEFAULT_MAX_TOKENS, get_llm
+from .openai_compatible import get_openai_compatible_llm
+from .rate_limiter import Quota, estimate_tokens, get_rate_limiter, model_key
+from .replay import get_replay_llm
+from .resilience import _areport, _report, _submit
+from .response_cache import ROUTE_ANSWER_EVENT
+
+LLM_ROUTE_SLO_SECONDS = float(os.getenv("LLM_ROUTE_SLO_SECONDS", "20"))
+LLM_ROUTE_FAILURES = int(os.getenv("LLM_ROUTE_FAILURES", "3"))
+LLM_ROUTE_COOLDOWN_SECONDS = float(os.getenv("LLM_ROUTE_COOLDOWN_SECONDS", "30"))
+
+TOGETHER_BASE_URL = "https://api.together.xyz/v1"
+
+FAILOVER_EVENT = "llm_failover"
+
+_FAST = ["google:models/gemini-2.0-flash-lite"]
+_STRONG = ["google:models/gemini-2.5-flash"]
+
+ROUTE_PRESETS: Dict[str, Dict[str, List[str]]] = {
+    "tiered": {
+        "initial_assessment": _FAST,
+        "information_gathering": _FAST,
+        "assessment_query": _FAST,
+        "clarifying_questions": _FAST,
+        "refinement_narrative": _FAST,
+        "hypothesis_generation": _STRONG,
+        "hypothesis_refinement": _STRONG,
+        "final_diagnosis": _STRONG,
+        "diagnosis_treatment": _STRONG,
+    },
+}
+
+
+class Backend(NamedTuple):
+    """One provider and model, parsed from "provider:model" (or "openai:model@base_url")"""
+    provider: str
+    model: str
+    base_url: Optional[str] = None
+
+    @property
+    def name(self) -> str:
+        return f"{self.provider}:{self.model}" + (f"@{self.base_url}" if self.base_url else "")
+
+    @classmethod
+    def parse(cls, spec: str) -> "Backend":
+        provider, _, model = spec.strip().partition(":")
+        if not model:
+            raise ValueError(f"Backend {spec!r} is not of the form provider:model")
+        if provider not in PROVIDERS:
+            raise ValueError(f"Unknown LLM provider {provider!r} in {spec!r}; known: {', '.join(PROVIDERS)}")
+        model, _, base_url = model.partition("@")
+        return cls(provider, model, base_url or None)
+
+
+def _google(backend: Backend, max_tokens: int) -> Any:
+    return get_llm(max_tokens, model_name=backend.model)
+
+
+def _together(backend: Backend, max_tokens: int) -> Any:
+    api_key = os.getenv("TOGETHER_API_KEY")
+    if not api_key:
+        raise ValueError("TOGETHER_API_KEY not found in environment variables.")
+    return get_openai_compatible_llm(backend.model, backend.base_url or TOGETHER_BASE_URL, api_key, max_tokens)
+
+
+def _openai(backend: Backend, max_tokens: int) -> Any:
+    if not backend.base_url:
+        raise ValueError(f"Backend {backend.name!r} needs a server, openai:model@base_url")
+    return get_openai_compatible_llm(backend.model, backend.base_url, os.getenv("OPENAI_API_KEY"), max_tokens)
+
+
+def _replay(backend: Backend, max_tokens: int) -> Any:
+    return get_replay_llm(backend.model, max_tokens)
+
+
+# Provider name -> factory(backend, max_tokens) returning a LangChain chat model
+PROVIDERS: Dict[str, Callable[[Backend, int], Any]] = {
+    "google": _google, "together": _together, "openai": _openai, "replay": _replay,
+}
+
+
+class Route(NamedTuple):
+    backends: List[Backend]
+    slo_seconds: float
+
+
+class BackendHealth:
+    """Recent outcomes per backend, and a circuit breaker over consecutive failures"""
+
+    def __init__(self, failure_threshold: int = LLM_ROUTE_FAILURES,
+                 cooldown_seconds: float = LLM_ROUTE_COOLDOWN_SECONDS, window: int = 200):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self._lock = threading.Lock()
+        self._latencies: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=window))
+        self._counts: Dict[str, Dict[str, int]] = defaultdict(lambda: {"calls": 0, "errors": 0, "slo_breaches": 0})
+        self._consecutive: Dict[str, int] = defaultdict(int)
+        self._opened_at: Dict[str, float] = {}
+
+    def available(self, backend: str) -> bool:
+        """False while the backend's circuit is open; after the cooldown it gets another try"""
+        with self._lock:
+            opened_at = self._opened_at.get(backend)
+            return opened_at is None or time.monotonic() - opened_at >= self.cooldown_seconds
+
+    def record(self, backend: str, seconds: float, error: bool = False, slo_breach: bool = False):
+        with self._lock:
+            counts = self._counts[backend]
+            counts["calls"] += 1
+            counts["errors"] += error
+            counts["slo_breaches"] += slo_breach
+            if not error:
+                self._latencies[backend].append(seconds)
+            if error or slo_breach:
+                self._consecutive[backend] += 1
+                if self._consecutive[backend] >= self.failure_threshold:
+                    self._opened_at[backend] = time.monotonic()
+            else:
+                self._consecutive[backend] = 0
+                self._opened_at.pop(backend, None)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            backends = list(self._counts)
+            entries = {}
+            for backend in backends:
+                latencies = list(self._latencies[backend])
+                entries[backend] = {
+                    **self._counts[backend],
+                    "p50_seconds": round(float(np.percentile(latencies, 50)), 4) if latencies else None,
+                    "p95_seconds": round(float(np.percentile(latencies, 95)), 4) if latencies else None,
+                    "circuit": "open" if backend in self._opened_at else "closed",
+                }
+        for backend, entry in entries.items():
+            if entry["circuit"] == "open" and self.available(backend):
+                entry["circuit"] = "half_open"
+        return entries
+
+
+class ModelRoute:
+    """
+    Chat model stand-in for a route with several backends
+
+    Exposes the first backend's model and settings; with_structured_output
+    returns a runnable that fails over between the backends. Each backend
+    call waits for that backend's quota, and the backend that answered is
+    reported as a ROUTE_ANSWER_EVENT, so with_response_cache caches the
+    response under the model that gave it.
+    """
+
+    def __init__(self, agent: str, route: Route, max_tokens: int, health: BackendHealth):
+        self.agent = agent
+        self.backends = route.backends
+        self.slo_seconds = route.slo_seconds
+        self.health = health
+        self.model = route.backends[0].model
+        self.temperature = 0.0
+        self.max_tokens = max_tokens
+        self._lock = threading.Lock()
+        self._runnables: Dict[tuple, Runnable] = {}
+
+    def _model(self, backend: Backend) -> Any:
+        # Built on first use, so a backend without credentials only fails (over) when it is needed
+        return PROVIDERS[backend.provider](backend, self.max_tokens)
+
+    def backend_model(self, name: Optional[str] = None) -> Any:
+        """The chat model of the named backend, or of the backend the route tries first"""
+        return self._model(next(b for b in self.backends if b.name == name) if name else self._ordered()[0])
+
+    def _runnable(self, backend: Backend, schema: Type[BaseModel], kwargs: Dict[str, Any]) -> Runnable:
+        key = (backend, schema, json.dumps(kwargs, sort_keys=True, default=str))
+        with self._lock:
+            if key not in self._runnables:
+                self._runnables[key] = self._model(backend).with_structured_output(schema, **kwargs)
+            return self._runnables[key]
+
+    def _quota(self, backend: Backend, inputs: Any) -> Quota:
+        text = inputs.to_string() if hasattr(inputs, "to_string") else str(inputs)
+        return Quota(get_rate_limiter(), model_key(self._model(backend)), self.agent,
+                     estimate_tokens(text))
+
+    def _ordered(self) -> List[Backend]:
+        healthy = [backend for backend in self.backends if self.health.available(backend.name)]
+        return healthy + [backend for backend in self.backends if backend not in healthy]
+
+    def _record(self, backend: Backend, start: float, error: bool = False):
+        seconds = time.perf_counter() - start
+        self.health.record(backend.name, seconds, error=error, slo_breach=not error and seconds > self.slo_seconds)
+
+    def _call(self, backend: Backend, schema: Type[BaseModel], kwargs: Dict[str, Any], inputs: Any,
+              config: RunnableConfig) -> Any:
+        quota = self._quota(backend, inputs)
+        ticket = quota.admit(config)
+        # Time the request only: waiting for quota says nothing about the backend's health
+        start = time.perf_counter()
+        try:
+            result = self._runnable(backend, schema, kwargs).invoke(inputs, config)
+        except Exception as error:
+            quota.failed(error)
+            self._record(backend, start, error=True)
+            raise
+        quota.done(ticket, result)
+        self._record(backend, start)
+        return result
+
+    async def _acall(self, backend: Backend, schema: Type[BaseModel], kwargs: Dict[str, Any], inputs: Any,
+                     config: RunnableConfig) -> Any:
+        quota = self._quota(backend, inputs)
+        ticket = await quota.aadmit(config)
+        start = time.perf_counter()
+        try:
+            result = await self._runnable(backend, schema, kwargs).ainvoke(inputs, config)
+        except Exception as error:
+            quota.failed(error)
+            self._record(backend, start, error=True)
+            raise
+        quota.done(ticket, result)
+        self._record(backend, start)
+        return result
+
+    def _failover(self, backend: Backend, to: Backend, reason: str) -> dict:
+        return {"agent": self.agent, "from": backend.name, "to": to.name, "reason": reason}
+
+    def _answer(self, backend: Backend) -> dict:
+        return {"agent": self.agent, "backend": backend.name}
+
+    def invoke_structured(self, schema: Type[BaseModel], inputs: Any, config: Optional[RunnableConfig] = None,
+                          **kwargs: Any) -> Any:
+        backends = self._ordered()
+        pending, last_error = {}, None
+        for index, backend in enumerate(backends):
+            future = _submit(lambda backend=backend: self._call(backend, schema, kwargs, inputs, config))
+            pending[future] = backend
+            # The last backend is waited for; the others until they fail or breach the SLO
+            has_next = index + 1 < len(backends)
+            slo_at = time.perf_counter() + self.slo_seconds
+            reason = None
+            while pending:
+                timeout = max(0.0, slo_at - time.perf_counter()) if has_next else None
+                done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    reason = "slo"
+                    break
+                for finished in done:
+                    answered = pending.pop(finished)
+                    if finished.exception() is None:
+                        _report(ROUTE_ANSWER_EVENT, self._answer(answered), config)
+                        return finished.result()
+                    last_error = finished.exception()
+                if future not in pending and has_next:
+                    reason = "error"
+                    break
+            if has_next:
+                _report(FAILOVER_EVENT, self._failover(backend, backends[index + 1], reason), config)
+        raise last_error
+
+    async def ainvoke_structured(self, schema: Type[BaseModel], inputs: Any,
+                                 config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        backends = self._ordered()
+        pending, last_error, answering = set(), None, {}
+        try:
+            for index, backend in enumerate(backends):
+                task = asyncio.ensure_future(self._acall(backend, schema, kwargs, inputs, config))
+                answering[task] = backend
+                pending.add(task)
+                has_next = index + 1 < len(backends)
+                slo_at = time.perf_counter() + self.slo_seconds
+                reason = None
+                while pending:
+                    timeout = max(0.0, slo_at - time.perf_counter()) if has_next else None
+                    done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                    if not done:
+                        reason = "slo"
+                        break
+                    for finished in done:
+                        if finished.exception() is None:
+                            await _areport(ROUTE_ANSWER_EVENT, self._answer(answering[finished]), config)
+                            return finished.result()
+                        last_error = finished.exception()
+                    if task.done() and has_next:
+                        reason = "error"
+                        break
+                if has_next:
+                    await _areport(FAILOVER_EVENT, self._failover(backend, backends[index + 1], reason), config)
+            raise last_error
+        finally:
+            # Abandon the slower requests
+            for task in pending:
+                task.cancel()
+
+    def with_structured_output(self, schema: Type[BaseModel], **kwargs: Any) -> Runnable:
+        def run(inputs, config):
+            return self.invoke_structured(schema, inputs, config, **kwargs)
+
+        async def arun(inputs, config):
+            return await self.ainvoke_structured(schema, inputs, config, **kwargs)
+
+        return RunnableLambda(run, afunc=arun, name=f"{self.agent}_route")
+
+
+class ModelRouter:
+    """Agent routes and the health of their backends; the routes come from the environment by default"""
+
+    def __init__(self, routes: Optional[Dict[str, Any]] = None, fallback: Optional[List[str]] = None,
+                 slo_seconds: float = LLM_ROUTE_SLO_SECONDS, health: Optional[BackendHealth] = None):
+        self.health = health or BackendHealth()
+        self.routes: Dict[str, Route] = {}
+        for agent, entry in (routes or {}).items():
+            if isinstance(entry, dict):
+                specs, slo = entry["backends"], float(entry.get("slo_seconds", slo_seconds))
+            else:
+                specs, slo = entry, slo_seconds
+            specs = list(specs) + [spec for spec in fallback or [] if spec not in specs]
+            self.routes[agent] = Route([Backend.parse(spec) for spec in specs], slo)
+
+    @classmethod
+    def from_env(cls) -> "ModelRouter":
+        if os.getenv("LLM_REPLAY"):
+            return cls({"default": ["replay:" + os.environ["LLM_REPLAY"]]})
+        config = os.getenv("LLM_ROUTES", "").strip()
+        routes = dict(ROUTE_PRESETS[config]) if config in ROUTE_PRESETS else json.loads(config) if config else {}
+        fallback = [spec for spec in os.getenv("LLM_FALLBACK", "").split(",") if spec.strip()]
+        if fallback and "default" not in routes:
+            routes["default"] = ["google:" + os.getenv("GEMINI_MODEL", "models/gemini-2.0-flash")]
+        return cls(routes, fallback)
+
+    def route(self, agent: str) -> Optional[Route]:
+        return self.routes.get(agent) or self.routes.get("default")
+
+    def llm_for(self, agent: str, max_tokens: int = DEFAULT_MAX_TOKENS) -> Any:
+        route = self.route(agent)
+        if route is None:
+            return get_llm(max_tokens)
+        if len(route.backends) == 1:
+            backend = route.backends[0]
+            return PROVIDERS[backend.provider](backend, max_tokens)
+        return ModelRoute(agent, route, max_tokens, self.health)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "routes": {agent: {"backends": [backend.name for backend in route.backends], "slo_seconds": route.slo_seconds}
+                       for agent, route in self.routes.items()},
+            "backends": self.health.stats(),
+        }
+
+
+_router: Optional[ModelRouter] = None
+_router_lock = threading.Lock()
+
+
+def get_model_router() -> ModelRouter:
+    """The process-wide model router, configured from the environment on first use"""
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = ModelRouter.from_env()
+        return _router
+
+
+def set_model_router(router: Optional[ModelRouter]):
+    """Replace the process-wide model router (None re-reads the environment on next use)"""
+    global _router
+    with _router_lock:
+        _router = router
+
+
+def get_llm_for(agent: str, max_tokens: int = DEFAULT_MAX_TOKENS) -> Any:
+    """The chat model for an agent's route (get_llm() when no route covers it)"""
+    return get_model_router().llm_for(agent, max_tokens)
+
+
+# --- Example Usage ---
+if __name__ == '__main__':
+    print(json.dumps(get_model_router().stats(), indent=2))
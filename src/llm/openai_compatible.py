@@ -0,0 +1,173 @@
+"""
+OpenAI-Compatible Chat Model
+----------------------------
+A LangChain chat model for any server speaking the OpenAI chat completions
+API: Together, vLLM, llama.cpp, Ollama, or the local stand-in server in
+llm/stub_server.py. Requests go over a pooled keep-alive httpx connection
+(LLM_POOL_SIZE connections), so no provider SDK is needed.
+
+Structured output asks for a JSON object with the schema as a
+"json_schema" response format and validates the reply against it.
+"""
+import asyncio
+import json
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional, Type
+
+import httpx
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.runnables import Runnable, RunnableLambda
+from pydantic import BaseModel, PrivateAttr
+
+from .client_registry import LLM_POOL_SIZE, get_client_registry, secret_fingerprint
+from .llm_config import DEFAULT_MAX_TOKENS
+from .resilience import LLM_TIMEOUT_SECONDS
+
+_ROLES = {"system": "system", "human": "user", "ai": "assistant", "tool": "tool"}
+_JSON_FENCE = re.compile(r"^```(?:json)?\s*(.*?)\s*```$", re.DOTALL)
+
+
+class ProviderError(RuntimeError):
+    """An error response from the server; `status_code` lets the call policy tell transient ones apart"""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(f"HTTP {status_code}: {message}")
+        self.status_code = status_code
+
+
+def _message(message: BaseMessage) -> Dict[str, Any]:
+    return {"role": _ROLES.get(message.type, "user"), "content": message.content}
+
+
+def _json_content(content: str) -> str:
+    content = content.strip()
+    fenced = _JSON_FENCE.match(content)
+    return fenced.group(1) if fenced else content
+
+
+async def _close_at_shutdown(client: httpx.AsyncClient):
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await client.aclose()
+
+
+class OpenAICompatibleChat(BaseChatModel):
+    """Chat model for an OpenAI-compatible /chat/completions endpoint"""
+
+    model: str
+    base_url: str
+    api_key: Optional[str] = None
+    temperature: float = 0.0
+    max_tokens: int = DEFAULT_MAX_TOKENS
+    timeout: float = LLM_TIMEOUT_SECONDS
+
+    _client: Any = PrivateAttr(default=None)
+    _client_lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _async_clients: Dict[Any, tuple] = PrivateAttr(default_factory=dict)
+
+    @property
+    def _llm_type(self) -> str:
+        return "openai-compatible"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"model": self.model, "base_url": self.base_url, "temperature": self.temperature,
+                "max_tokens": self.max_tokens}
+
+    def _headers(self) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+
+    def _limits(self) -> httpx.Limits:
+        return httpx.Limits(max_connections=LLM_POOL_SIZE, max_keepalive_connections=LLM_POOL_SIZE)
+
+    @property
+    def client(self) -> httpx.Client:
+        # Worker threads make the first calls concurrently; only one of them opens the client
+        with self._client_lock:
+            if self._client is None:
+                self._client = httpx.Client(base_url=self.base_url, headers=self._headers(), timeout=self.timeout,
+                                            limits=self._limits())
+        return self._client
+
+    @property
+    def async_client(self) -> httpx.AsyncClient:
+        # An async client's connections belong to the event loop that opened them: one client per
+        # loop, closed as the loop shuts down (asyncio.run cancels the waiting task)
+        loop = asyncio.get_running_loop()
+        entry = self._async_clients.get(loop)
+        if entry is None:
+            for stale in [other for other in list(self._async_clients) if other.is_closed()]:
+                self._async_clients.pop(stale, None)
+            client = httpx.AsyncClient(base_url=self.base_url, headers=self._headers(),
+                                       timeout=self.timeout, limits=self._limits())
+            entry = self._async_clients[loop] = (client, loop.create_task(_close_at_shutdown(client)))
+        return entry[0]
+
+    def _payload(self, messages: List[BaseMessage], stop: Optional[List[str]], **kwargs: Any) -> Dict[str, Any]:
+        payload = {"model": self.model, "messages": [_message(m) for m in messages],
+                   "temperature": self.temperature, "max_tokens": self.max_tokens, **kwargs}
+        if stop:
+            payload["stop"] = stop
+        return payload
+
+    @staticmethod
+    def _result(response: httpx.Response) -> ChatResult:
+        if response.status_code >= 400:
+            raise ProviderError(response.status_code, response.text[:500])
+        body = response.json()
+        usage = body.get("usage") or {}
+        message = AIMessage(
+            content=body["choices"][0]["message"].get("content") or "",
+            usage_metadata={
+                "input_tokens": usage.get("prompt_tokens", 0),
+                "output_tokens": usage.get("completion_tokens", 0),
+                "total_tokens": usage.get("total_tokens", 0),
+            },
+            response_metadata={"model_name": body.get("model"), "finish_reason": body["choices"][0].get("finish_reason")},
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        return self._result(self.client.post("/chat/completions", json=self._payload(messages, stop, **kwargs)))
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        response = await self.async_client.post("/chat/completions", json=self._payload(messages, stop, **kwargs))
+        return self._result(response)
+
+    def with_structured_output(self, schema: Type[BaseModel], **kwargs: Any) -> Runnable:
+        # The reply is JSON text whatever the `method`, which is all method="json_mode" asks for
+        response_format = {
+            "type": "json_schema",
+            "json_schema": {"name": schema.__name__, "schema": schema.model_json_schema(), "strict": False},
+        }
+
+        def parse(message: AIMessage) -> BaseModel:
+            return schema.model_validate_json(_json_content(message.content))
+
+        return self.bind(response_format=response_format) | RunnableLambda(parse, name=f"parse_{schema.__name__}")
+
+
+def get_openai_compatible_llm(model: str, base_url: str, api_key: Optional[str] = None,
+                              max_tokens: int = DEFAULT_MAX_TOKENS) -> OpenAICompatibleChat:
+    """The process-wide client for this endpoint, model and settings"""
+    base_url = base_url.rstrip("/")
+    params = {"base_url": base_url, "temperature": 0.0, "max_tokens": max_tokens, "key": secret_fingerprint(api_key)}
+    return get_client_registry().get(
+        "openai", model, params,
+        lambda: OpenAICompatibleChat(model=model, base_url=base_url, api_key=api_key, max_tokens=max_tokens),
+    )
+
+
+# --- Example Usage ---
+if __name__ == '__main__':
+    llm = get_openai_compatible_llm(os.getenv("OPENAI_MODEL", "stub"),
+                                    os.getenv("OPENAI_BASE_URL", "http://127.0.0.1:8089/v1"),
+                                    os.getenv("OPENAI_API_KEY"))
+    print(json.dumps(llm.invoke("Hello, how are you?").content))
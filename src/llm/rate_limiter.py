@@ -0,0 +1,475 @@
+"""
+LLM Rate Limiter
+----------------
+Token-bucket metering of provider quotas, with a fair, priority-ordered
+queue in front of it.
+
+Every agent call passes through the process-wide limiter before each
+attempt. Each model has a requests-per-minute and a tokens-per-minute
+bucket refilled at `headroom` x the quota. A call reserves one request plus
+its estimated tokens (the prompt's length plus the agent's recent answer
+size) and settles the estimate once the answer is in. Buckets hold at most
+LLM_RATE_BURST_SECONDS of refill, so even a full bucket plus a minute of
+refill stays under the quota.
+
+Waiting calls are admitted in this order:
+    1. priority: steps further along the diagnosis go first, so diagnoses in
+       flight finish before new ones start (the workflow passes its step
+       priorities in the run config)
+    2. fairness: the session (diagnosis) that has been admitted least
+    3. arrival order
+
+When the provider still answers "rate limited" (429 / ResourceExhausted),
+the model's buckets are emptied and its rate is cut by a fifth, then
+recovers a little with every successful call.
+
+Configuration (environment):
+    LLM_RPM                 default requests per minute per model (0 = unlimited)
+    LLM_TPM                 default tokens per minute per model (0 = unlimited)
+    LLM_RATE_LIMITS         per-model overrides as JSON,
+                            e.g. {"gemini-2.0-flash": {"rpm": 2000, "tpm": 4000000}}
+    LLM_RATE_HEADROOM       fraction of the quota to use (default 0.95)
+    LLM_RATE_BURST_SECONDS  bucket size in seconds of refill (default 2)
+    LLM_RATE_LIMIT_DB       SQLite file to share the buckets between processes
+                            on one machine (default: this process only)
+"""
+import asyncio
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.runnables import RunnableConfig
+
+from .resilience import DeadlineExceeded, remaining_seconds
+
+LLM_RPM = float(os.getenv("LLM_RPM", "0"))
+LLM_TPM = float(os.getenv("LLM_TPM", "0"))
+LLM_RATE_HEADROOM = float(os.getenv("LLM_RATE_HEADROOM", "0.95"))
+LLM_RATE_BURST_SECONDS = float(os.getenv("LLM_RATE_BURST_SECONDS", "2"))
+
+# Expected answer size for an agent with no calls yet, in tokens
+DEFAULT_COMPLETION_TOKENS = 300
+RATE_LIMIT_ERRORS = {"ResourceExhausted", "TooManyRequests", "RateLimitError"}
+# Cut on a 429, and the recovery per successful call, of a model's rate
+THROTTLE_FACTOR = 0.8
+MIN_RATE_FACTOR = 0.25
+RECOVERY_STEP = 0.01
+# Sessions whose admissions are remembered for fairness; the least recently admitted are forgotten first
+MAX_TRACKED_SESSIONS = 1024
+
+# Bucket -> (amount to take, refill per second, capacity)
+Costs = Dict[str, Tuple[float, float, float]]
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count: about four characters per token"""
+    return len(text) // 4 + 1
+
+
+def is_rate_limited(error: BaseException) -> bool:
+    if type(error).__name__ in RATE_LIMIT_ERRORS:
+        return True
+    return (getattr(error, "status_code", None) or getattr(error, "code", None)) == 429
+
+
+def model_key(llm: Any) -> str:
+    """The name quotas are kept under: the model name without the "models/" prefix"""
+    name = str(getattr(llm, "model", None) or getattr(llm, "model_name", None) or type(llm).__name__)
+    return name.split("/", 1)[1] if name.startswith("models/") else name
+
+
+class LocalBuckets:
+    """Token buckets in this process's memory"""
+
+    def __init__(self):
+        self._levels: Dict[Tuple[str, str], Tuple[float, float]] = {}
+
+    def _level(self, key: str, name: str, rate: float, capacity: float, now: float) -> float:
+        level, updated = self._levels.get((key, name), (capacity, now))
+        return min(capacity, level + (now - updated) * rate)
+
+    def try_take(self, key: str, costs: Costs) -> float:
+        """Take every cost if all buckets allow it and return 0, else take nothing and return the seconds to wait"""
+        now = time.time()
+        levels = {name: self._level(key, name, rate, capacity, now) for name, (_, rate, capacity) in costs.items()}
+        wait = 0.0
+        for name, (amount, rate, capacity) in costs.items():
+            # A cost larger than the whole bucket waits for a full bucket and leaves it in debt
+            need = min(amount, capacity)
+            if levels[name] < need:
+                wait = max(wait, (need - levels[name]) / rate)
+        for name, (amount, _, _) in costs.items():
+            self._levels[(key, name)] = (levels[name] - (0 if wait else amount), now)
+        return wait
+
+    def adjust(self, key: str, name: str, amount: float, rate: float, capacity: float):
+        """Take `amount` more from a bucket (negative gives it back)"""
+        now = time.time()
+        self._levels[(key, name)] = (min(capacity, self._level(key, name, rate, capacity, now) - amount), now)
+
+    def drain(self, key: str, names: List[str]):
+        now = time.time()
+        for name in names:
+            level, _ = self._levels.get((key, name), (0.0, now))
+            self._levels[(key, name)] = (min(level, 0.0), now)
+
+
+class SharedBuckets(LocalBuckets):
+    """
+    Token buckets in a SQLite file, shared by every process that opens it
+
+    Each operation is one short IMMEDIATE transaction, so processes on the
+    same machine draw from the same quota.
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets (key TEXT, name TEXT, level REAL, updated REAL, PRIMARY KEY (key, name))"
+        )
+
+    def _transaction(self, key: str, operation):
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._levels = {
+                (key, name): (level, updated) for name, level, updated in
+                self._conn.execute("SELECT name, level, updated FROM buckets WHERE key = ?", (key,))
+            }
+            result = operation()
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO buckets (key, name, level, updated) VALUES (?, ?, ?, ?)",
+                [(k, name, level, updated) for (k, name), (level, updated) in self._levels.items()]
+            )
+            self._conn.execute("COMMIT")
+            return result
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def try_take(self, key: str, costs: Costs) -> float:
+        return self._transaction(key, lambda: LocalBuckets.try_take(self, key, costs))
+
+    def adjust(self, key: str, name: str, amount: float, rate: float, capacity: float):
+        self._transaction(key, lambda: LocalBuckets.adjust(self, key, name, amount, rate, capacity))
+
+    def drain(self, key: str, names: List[str]):
+        self._transaction(key, lambda: LocalBuckets.drain(self, key, names))
+
+
+@dataclass
+class Ticket:
+    """An admitted call: what it reserved, and how long it queued"""
+    key: str
+    agent: str
+    prompt_tokens: int
+    reserved_tokens: int
+    queued_seconds: float = 0.0
+
+
+@dataclass
+class _Waiter:
+    key: str
+    tokens: int
+    priority: int
+    session: str
+    seq: int
+    granted: bool = False
+    event: Optional[threading.Event] = None
+    future: Optional[asyncio.Future] = None
+    loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+@dataclass
+class _ModelStats:
+    admitted: int = 0
+    queued: int = 0
+    queued_seconds: float = 0.0
+    throttled: int = 0
+    tokens: int = 0
+    rate_factor: float = 1.0
+    completion_tokens: Dict[str, float] = field(default_factory=dict)
+
+
+class RateLimiter:
+    """Per-model request and token quotas with a fair, priority-ordered admission queue"""
+
+    def __init__(self, rpm: float = LLM_RPM, tpm: float = LLM_TPM, limits: Optional[Dict[str, Dict[str, float]]] = None,
+                 headroom: float = LLM_RATE_HEADROOM, burst_seconds: float = LLM_RATE_BURST_SECONDS,
+                 buckets: Optional[LocalBuckets] = None):
+        self.rpm, self.tpm = rpm, tpm
+        self.limits = limits or {}
+        self.headroom = headroom
+        self.burst_seconds = burst_seconds
+        self.buckets = buckets or LocalBuckets()
+        self._lock = threading.Lock()
+        self._waiters: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._admitted_by_session: "OrderedDict[str, int]" = OrderedDict()
+        self._models: Dict[str, _ModelStats] = defaultdict(_ModelStats)
+        self._timer: Optional[threading.Timer] = None
+        self._timer_at = float("inf")
+
+    @classmethod
+    def from_env(cls) -> "RateLimiter":
+        limits = json.loads(os.getenv("LLM_RATE_LIMITS") or "{}")
+        path = os.getenv("LLM_RATE_LIMIT_DB")
+        return cls(limits=limits, buckets=SharedBuckets(path) if path else None)
+
+    def _costs(self, key: str, tokens: int) -> Costs:
+        limits = self.limits.get(key, {})
+        factor = self.headroom * self._models[key].rate_factor / 60
+        costs = {}
+        for name, amount, per_minute in (("requests", 1, limits.get("rpm", self.rpm)),
+                                         ("tokens", tokens, limits.get("tpm", self.tpm))):
+            if per_minute:
+                rate = per_minute * factor
+                costs[name] = (amount, rate, max(1.0, rate * self.burst_seconds))
+        return costs
+
+    def is_limited(self, key: str) -> bool:
+        limits = self.limits.get(key, {})
+        return bool(limits.get("rpm", self.rpm) or limits.get("tpm", self.tpm))
+
+    def expected_tokens(self, key: str, agent: str, prompt_tokens: int) -> int:
+        """Tokens to reserve: the prompt plus the agent's recent answer size"""
+        with self._lock:
+            completion = self._models[key].completion_tokens.get(agent, DEFAULT_COMPLETION_TOKENS)
+        return prompt_tokens + int(completion)
+
+    # --- Admission queue ---
+
+    def _pump(self):
+        """Admit waiting calls in order while their buckets allow; must hold the lock"""
+        blocked: Dict[str, float] = {}
+        order = sorted(self._waiters, key=lambda w: (-w.priority, self._admitted_by_session.get(w.session, 0), w.seq))
+        for waiter in order:
+            if waiter.key in blocked:
+                continue
+            wait = self.buckets.try_take(waiter.key, self._costs(waiter.key, waiter.tokens))
+            if wait:
+                blocked[waiter.key] = wait
+                continue
+            self._waiters.remove(waiter)
+            self._grant(waiter)
+        if blocked:
+            self._wake_in(min(blocked.values()))
+
+    def _grant(self, waiter: _Waiter):
+        waiter.granted = True
+        self._admitted_by_session[waiter.session] = self._admitted_by_session.pop(waiter.session, 0) + 1
+        if len(self._admitted_by_session) > MAX_TRACKED_SESSIONS:
+            self._admitted_by_session.popitem(last=False)
+        if waiter.event is not None:
+            waiter.event.set()
+        elif waiter.loop is not None:
+            try:
+                waiter.loop.call_soon_threadsafe(lambda: waiter.future.done() or waiter.future.set_result(None))
+            except RuntimeError:
+                # Its event loop has closed; nobody is left to use the quota
+                pass
+
+    def _wake_in(self, seconds: float):
+        at = time.monotonic() + seconds
+        if self._timer is not None and self._timer_at <= at:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer, self._timer_at = threading.Timer(seconds, self._on_timer), at
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _on_timer(self):
+        with self._lock:
+            self._timer, self._timer_at = None, float("inf")
+            self._pump()
+
+    def _enqueue(self, key: str, tokens: int, priority: int, session: str, **wakeup) -> _Waiter:
+        waiter = _Waiter(key, tokens, priority, session, next(self._seq), **wakeup)
+        with self._lock:
+            self._waiters.append(waiter)
+            self._pump()
+        return waiter
+
+    def _cancel(self, waiter: _Waiter) -> bool:
+        """Withdraw a waiter; False if it was admitted in the meantime"""
+        with self._lock:
+            if waiter.granted:
+                return False
+            self._waiters.remove(waiter)
+            return True
+
+    def _ticket(self, key: str, agent: str, prompt_tokens: int, tokens: int, queued: float) -> Ticket:
+        with self._lock:
+            stats = self._models[key]
+            stats.admitted += 1
+            stats.tokens += tokens
+            if queued > 0.001:
+                stats.queued += 1
+                stats.queued_seconds += queued
+        return Ticket(key, agent, prompt_tokens, tokens, queued)
+
+    @staticmethod
+    def _wait_limit(config: Optional[RunnableConfig]) -> Optional[float]:
+        remaining = remaining_seconds(config)
+        return None if remaining is None else max(0.0, remaining)
+
+    def admit(self, key: str, agent: str, prompt_tokens: int, config: Optional[RunnableConfig] = None) -> Ticket:
+        """Wait for quota for one call (bounded by the config's deadline)"""
+        tokens = self.expected_tokens(key, agent, prompt_tokens)
+        if not self.is_limited(key):
+            return Ticket(key, agent, prompt_tokens, tokens)
+        start = time.perf_counter()
+        waiter = self._enqueue(key, tokens, *_scheduling(config), event=threading.Event())
+        if not waiter.event.wait(self._wait_limit(config)) and self._cancel(waiter):
+            raise DeadlineExceeded(f"Diagnosis deadline passed while {agent} waited for {key} quota")
+        return self._ticket(key, agent, prompt_tokens, tokens, time.perf_counter() - start)
+
+    async def aadmit(self, key: str, agent: str, prompt_tokens: int, config: Optional[RunnableConfig] = None) -> Ticket:
+        tokens = self.expected_tokens(key, agent, prompt_tokens)
+        if not self.is_limited(key):
+            return Ticket(key, agent, prompt_tokens, tokens)
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        waiter = self._enqueue(key, tokens, *_scheduling(config), future=loop.create_future(), loop=loop)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self._wait_limit(config))
+        except asyncio.TimeoutError:
+            if self._cancel(waiter):
+                raise DeadlineExceeded(f"Diagnosis deadline passed while {agent} waited for {key} quota") from None
+        except asyncio.CancelledError:
+            if not self._cancel(waiter):
+                self.release(Ticket(key, agent, prompt_tokens, tokens))
+            raise
+        return self._ticket(key, agent, prompt_tokens, tokens, time.perf_counter() - start)
+
+    def try_admit(self, key: str, agent: str, prompt_tokens: int) -> Optional[Ticket]:
+        """Admit a call only if quota is free right now and nothing is queued (used for hedged requests)"""
+        tokens = self.expected_tokens(key, agent, prompt_tokens)
+        if not self.is_limited(key):
+            return Ticket(key, agent, prompt_tokens, tokens)
+        with self._lock:
+            if any(waiter.key == key for waiter in self._waiters):
+                return None
+            if self.buckets.try_take(key, self._costs(key, tokens)):
+                return None
+        return self._ticket(key, agent, prompt_tokens, tokens, 0.0)
+
+    # --- Accounting ---
+
+    def settle(self, ticket: Ticket, completion_tokens: int):
+        """Correct a finished call's reservation to the tokens it used, and let the model's rate recover"""
+        with self._lock:
+            stats = self._models[ticket.key]
+            previous = stats.completion_tokens.get(ticket.agent, DEFAULT_COMPLETION_TOKENS)
+            stats.completion_tokens[ticket.agent] = 0.8 * previous + 0.2 * completion_tokens
+            stats.rate_factor = min(1.0, stats.rate_factor + RECOVERY_STEP)
+            costs = self._costs(ticket.key, 0)
+            if "tokens" in costs:
+                _, rate, capacity = costs["tokens"]
+                used = ticket.prompt_tokens + completion_tokens
+                self.buckets.adjust(ticket.key, "tokens", used - ticket.reserved_tokens, rate, capacity)
+                stats.tokens += used - ticket.reserved_tokens
+            if self._waiters:
+                self._pump()
+
+    def release(self, ticket: Ticket):
+        """Return an admitted call's tokens when it was never sent"""
+        with self._lock:
+            costs = self._costs(ticket.key, 0)
+            for name, amount in (("requests", 1), ("tokens", ticket.reserved_tokens)):
+                if name in costs:
+                    _, rate, capacity = costs[name]
+                    self.buckets.adjust(ticket.key, name, -amount, rate, capacity)
+            if self._waiters:
+                self._pump()
+
+    def throttled(self, key: str):
+        """The provider rejected a call for rate: pause the model's calls and lower its rate"""
+        with self._lock:
+            stats = self._models[key]
+            stats.throttled += 1
+            stats.rate_factor = max(MIN_RATE_FACTOR, stats.rate_factor * THROTTLE_FACTOR)
+            self.buckets.drain(key, ["requests", "tokens"])
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            models = {
+                key: {
+                    "admitted": stats.admitted,
+                    "queued": stats.queued,
+                    "mean_queue_seconds": round(stats.queued_seconds / stats.queued, 4) if stats.queued else 0.0,
+                    "throttled": stats.throttled,
+                    "tokens": stats.tokens,
+                    "rate_factor": round(stats.rate_factor, 3),
+                }
+                for key, stats in self._models.items()
+            }
+            return {"waiting": len(self._waiters), "models": models}
+
+
+class Quota:
+    """One agent call's claim on its model's quota; CallPolicy admits each attempt through it"""
+
+    def __init__(self, limiter: RateLimiter, key: str, agent: str, prompt_tokens: int):
+        self.limiter, self.key, self.agent, self.prompt_tokens = limiter, key, agent, prompt_tokens
+
+    def admit(self, config: Optional[RunnableConfig]) -> Ticket:
+        return self.limiter.admit(self.key, self.agent, self.prompt_tokens, config)
+
+    async def aadmit(self, config: Optional[RunnableConfig]) -> Ticket:
+        return await self.limiter.aadmit(self.key, self.agent, self.prompt_tokens, config)
+
+    def try_admit(self) -> Optional[Ticket]:
+        return self.limiter.try_admit(self.key, self.agent, self.prompt_tokens)
+
+    def done(self, ticket: Ticket, response: Any):
+        dump = getattr(response, "model_dump_json", None)
+        self.limiter.settle(ticket, estimate_tokens(dump() if callable(dump) else str(response)))
+
+    def release(self, ticket: Ticket):
+        self.limiter.release(ticket)
+
+    def failed(self, error: BaseException):
+        if is_rate_limited(error):
+            self.limiter.throttled(self.key)
+
+
+def _scheduling(config: Optional[RunnableConfig]) -> Tuple[int, str]:
+    """(priority, session) of a call from its run config"""
+    config = config or {}
+    configurable = config.get("configurable") or {}
+    step = (config.get("metadata") or {}).get("langgraph_node")
+    priority = (configurable.get("step_priorities") or {}).get(step, 0)
+    session = configurable.get("session_id") or configurable.get("thread_id") or "default"
+    return priority, str(session)
+
+
+_limiter: Optional[RateLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """The process-wide rate limiter, configured from the environment on first use"""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter.from_env()
+        return _limiter
+
+
+def set_rate_limiter(limiter: Optional[RateLimiter]):
+    """Replace the process-wide rate limiter (None re-reads the environment on next use)"""
+    global _limiter
+    with _limiter_lock:
+        _limiter = limiter
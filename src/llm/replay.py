@@ -0,0 +1,140 @@
+"""
+Replay LLM Backend
+------------------
+A chat model that answers from a cassette recorded with LLM_RECORD (see
+llm/cassette.py), so the workflow runs end to end with no network and no
+API key: benchmarking and profiling the retrieval, graph and scheduling
+code with the model calls held constant.
+
+    LLM_REPLAY=bench/cassette.jsonl python src/workflow/benchmark.py
+
+Every agent is routed to the replay backend (see llm/model_router.py).
+Each answer waits a synthetic latency first:
+
+    LLM_REPLAY_LATENCY        "recorded" (default): the call's recorded
+                              latency; a number of seconds for every call;
+                              or per agent, e.g. '{"final_diagnosis": 2, "default": 0.5}'
+    LLM_REPLAY_LATENCY_SCALE  multiplier for all of the above (default 1; 0 = no waiting)
+    LLM_REPLAY_STRICT         "true" (default) fails calls whose prompt wasn't
+                              recorded; "false" replays the recording for the
+                              same output schema with the closest prompt
+                              instead, with a warning
+
+Recorded token usage is reported as the model's, so usage metrics and the
+rate limiter see the same numbers as the live run. Replayed responses skip
+the response cache, which would otherwise also skip the latency.
+"""
+import asyncio
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional, Type, Union
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.runnables import Runnable, RunnableLambda
+from pydantic import BaseModel, PrivateAttr
+
+from .cassette import Cassette, cassette_key
+from .client_registry import get_client_registry
+from .llm_config import DEFAULT_MAX_TOKENS
+from .response_cache import schema_hash
+
+
+class CassetteMiss(LookupError):
+    """The prompt isn't in the cassette (strict replay)"""
+
+
+def replay_latency_from_env() -> Union[None, float, Dict[str, float]]:
+    """LLM_REPLAY_LATENCY: None for the recorded latencies, seconds, or seconds per agent"""
+    value = os.getenv("LLM_REPLAY_LATENCY", "recorded").strip()
+    if value in ("", "recorded"):
+        return None
+    return json.loads(value) if value.startswith("{") else float(value)
+
+
+class ReplayChatModel(BaseChatModel):
+    """Chat model answering structured-output calls from a recorded cassette"""
+
+    model: str
+    latency: Union[None, float, Dict[str, float]] = None
+    latency_scale: float = 1.0
+    strict: bool = True
+    temperature: float = 0.0
+    max_tokens: int = DEFAULT_MAX_TOKENS
+    # Read by with_response_cache
+    cache_responses: bool = False
+
+    _cassette: Any = PrivateAttr(default=None)
+
+    def model_post_init(self, __context: Any) -> None:
+        self._cassette = Cassette.load(self.model, self.strict)
+
+    @property
+    def cassette(self) -> Cassette:
+        return self._cassette
+
+    @property
+    def _llm_type(self) -> str:
+        return "replay"
+
+    def _replay(self, messages: List[BaseMessage], schema_digest: Optional[str]):
+        """The recorded message and how long to wait before returning it"""
+        if schema_digest is None:
+            raise ValueError("The replay backend only answers structured output calls")
+        entry = self._cassette.lookup(cassette_key(messages, schema_digest), schema_digest,
+                                      " ".join(str(message.content) for message in messages))
+        if entry is None:
+            raise CassetteMiss(f"No recording in {self.model} for this prompt")
+        if self.latency is None:
+            seconds = entry.get("seconds")
+            seconds = self._cassette.typical_seconds(schema_digest) if seconds is None else seconds
+        elif isinstance(self.latency, dict):
+            seconds = self.latency.get(entry["agent"], self.latency.get("default", 0.0))
+        else:
+            seconds = self.latency
+        usage = entry.get("usage") or {}
+        message = AIMessage(
+            content=json.dumps(entry["response"]),
+            usage_metadata={
+                "input_tokens": usage.get("input_tokens", 0),
+                "output_tokens": usage.get("output_tokens", 0),
+                "total_tokens": usage.get("input_tokens", 0) + usage.get("output_tokens", 0),
+            },
+            response_metadata={"model_name": "replay", "agent": entry["agent"]},
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)]), seconds * self.latency_scale
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, schema_digest: Optional[str] = None, **kwargs: Any) -> ChatResult:
+        result, seconds = self._replay(messages, schema_digest)
+        if seconds > 0:
+            time.sleep(seconds)
+        return result
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, schema_digest: Optional[str] = None, **kwargs: Any) -> ChatResult:
+        result, seconds = self._replay(messages, schema_digest)
+        if seconds > 0:
+            await asyncio.sleep(seconds)
+        return result
+
+    def with_structured_output(self, schema: Type[BaseModel], **kwargs: Any) -> Runnable:
+        def parse(message: AIMessage) -> BaseModel:
+            return schema.model_validate_json(message.content)
+
+        return self.bind(schema_digest=schema_hash(schema)) | RunnableLambda(parse, name=f"parse_{schema.__name__}")
+
+
+def get_replay_llm(path: str, max_tokens: int = DEFAULT_MAX_TOKENS) -> ReplayChatModel:
+    """The process-wide replay model for a cassette, configured from the environment"""
+    latency = replay_latency_from_env()
+    scale = float(os.getenv("LLM_REPLAY_LATENCY_SCALE", "1"))
+    strict = os.getenv("LLM_REPLAY_STRICT", "true").lower() in ("1", "true", "yes")
+    params = {"latency": latency, "scale": scale, "strict": strict}
+    # One model per cassette: agents share its lookup counters whatever their token limits
+    return get_client_registry().get(
+        "replay", path, params,
+        lambda: ReplayChatModel(model=path, latency=latency, latency_scale=scale, strict=strict),
+    )
@@ -0,0 +1,333 @@
+"""
+LLM Call Policy
+---------------
+Deadlines, timeouts, jittered retries and hedged requests for agent calls.
+
+A diagnosis carries an absolute deadline in its config
+(config["configurable"]["deadline"], see with_deadline); every agent call
+made under it gets:
+
+    timeout   min(LLM_TIMEOUT_SECONDS, time left before the deadline) per attempt
+    retries   up to LLM_MAX_RETRIES more attempts after a timeout or a
+              transient provider error, after a "full jitter" backoff of
+              uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2**attempt))
+              seconds, and only while the deadline leaves room for them
+    hedging   with LLM_HEDGING=true, a duplicate request once the first has
+              run longer than that agent's recent p95 latency; the first
+              answer wins and the other request is abandoned
+
+Retries and hedges are reported as custom callback events (RETRY_EVENT,
+HEDGE_EVENT) for the workflow metrics. Calls made with a quota (see
+llm.rate_limiter) wait for it before every attempt; that wait counts
+against the deadline but not the attempt's timeout, and a hedge is only
+sent when quota is free.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+import numpy as np
+from langchain_core.callbacks.manager import adispatch_custom_event, dispatch_custom_event
+from langchain_core.runnables import RunnableConfig
+
+T = TypeVar("T")
+
+DIAGNOSIS_DEADLINE_SECONDS = float(os.getenv("DIAGNOSIS_DEADLINE_SECONDS", "180"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "8"))
+LLM_HEDGING = os.getenv("LLM_HEDGING", "false").lower() in ("1", "true", "yes")
+# Hedge only once an agent has this many latency samples to take a p95 from
+HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+HEDGE_QUANTILE = 95
+
+RETRY_EVENT = "llm_retry"
+HEDGE_EVENT = "llm_hedge"
+
+# Provider errors worth another attempt; matched by name so no provider SDK is imported here
+TRANSIENT_ERRORS = {
+    "ResourceExhausted", "ServiceUnavailable", "DeadlineExceeded", "InternalServerError", "TooManyRequests",
+    "RateLimitError", "APIConnectionError", "APITimeoutError", "ConnectError", "ReadTimeout", "RemoteProtocolError",
+}
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class DeadlineExceeded(TimeoutError):
+    """The diagnosis deadline passed before an agent call could finish"""
+
+
+def with_deadline(config: Optional[RunnableConfig], seconds: Optional[float]) -> RunnableConfig:
+    """A copy of `config` whose runs must finish within `seconds` from now (None or 0 = no deadline)"""
+    config = dict(config or {})
+    if seconds:
+        configurable = dict(config.get("configurable") or {})
+        configurable["deadline"] = time.time() + seconds
+        config["configurable"] = configurable
+    return config
+
+
+def remaining_seconds(config: Optional[RunnableConfig]) -> Optional[float]:
+    """Seconds left before the config's deadline, or None without one"""
+    deadline = ((config or {}).get("configurable") or {}).get("deadline")
+    return None if deadline is None else deadline - time.time()
+
+
+def check_deadline(config: Optional[RunnableConfig], what: str):
+    remaining = remaining_seconds(config)
+    if remaining is not None and remaining <= 0:
+        raise DeadlineExceeded(f"Diagnosis deadline passed before {what}")
+
+
+def is_transient(error: BaseException) -> bool:
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError, FutureTimeoutError, ConnectionError)):
+        return not isinstance(error, DeadlineExceeded)
+    if type(error).__name__ in TRANSIENT_ERRORS:
+        return True
+    status = getattr(error, "status_code", None) or getattr(error, "code", None)
+    return isinstance(status, int) and status in TRANSIENT_STATUS_CODES
+
+
+def backoff_delay(attempt: int, base: float = LLM_RETRY_BASE_DELAY, cap: float = LLM_RETRY_MAX_DELAY) -> float:
+    """Full-jitter exponential backoff before retry number `attempt` (0-based)"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def _report(event: str, data: dict, config: Optional[RunnableConfig]):
+    # Custom events need a parent run; calls made outside a runnable have no one to tell
+    if (config or {}).get("callbacks"):
+        dispatch_custom_event(event, data, config=config)
+
+
+async def _areport(event: str, data: dict, config: Optional[RunnableConfig]):
+    if (config or {}).get("callbacks"):
+        await adispatch_custom_event(event, data, config=config)
+
+
+def _submit(request: Callable[[], T]) -> "Future[T]":
+    """
+    Run a sync request on a thread of its own, so it can be timed out and hedged
+
+    A timed-out request can't be cancelled; with a thread each, abandoned
+    requests never hold up later calls, and the clients' own request timeout
+    (LLM_TIMEOUT_SECONDS, see llm_config) ends them.
+    """
+    future: Future = Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(request())
+        except BaseException as error:
+            future.set_exception(error)
+
+    threading.Thread(target=run, name="llm-call", daemon=True).start()
+    return future
+
+
+def _settle_hedge(quota: Any, ticket: Any, future: Any):
+    """Settle a hedged request's quota ticket when it finishes, as the attempt's own ticket is"""
+    if future.cancelled():
+        quota.release(ticket)
+    elif future.exception() is not None:
+        quota.failed(future.exception())
+    else:
+        quota.done(ticket, future.result())
+
+
+class LatencyTracker:
+    """Recent successful call latencies per agent, for the hedging threshold"""
+
+    def __init__(self, window: int = 200):
+        self._lock = threading.Lock()
+        self._samples: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=window))
+
+    def record(self, agent: str, seconds: float):
+        with self._lock:
+            self._samples[agent].append(seconds)
+
+    def hedge_after(self, agent: str) -> Optional[float]:
+        """The agent's p95 latency, or None until there are enough samples"""
+        with self._lock:
+            samples = list(self._samples[agent])
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return float(np.percentile(samples, HEDGE_QUANTILE))
+
+
+class CallPolicy:
+    """Timeout, retry and hedging settings for agent calls; the defaults come from the environment"""
+
+    def __init__(self, timeout: float = LLM_TIMEOUT_SECONDS, max_retries: int = LLM_MAX_RETRIES,
+                 hedging: bool = LLM_HEDGING, latencies: Optional[LatencyTracker] = None,
+                 retry_base_delay: float = LLM_RETRY_BASE_DELAY, retry_max_delay: float = LLM_RETRY_MAX_DELAY):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.hedging = hedging
+        self.latencies = latencies or LatencyTracker()
+
+    def _attempt_timeout(self, agent: str, config: Optional[RunnableConfig]) -> float:
+        check_deadline(config, f"calling {agent}")
+        remaining = remaining_seconds(config)
+        return self.timeout if remaining is None else min(self.timeout, remaining)
+
+    def _retry_delay(self, agent: str, attempt: int, error: BaseException, config: Optional[RunnableConfig]) -> Optional[float]:
+        """Backoff before the next attempt, or None when the error or the deadline rules one out"""
+        if attempt >= self.max_retries or not is_transient(error):
+            return None
+        delay = backoff_delay(attempt, self.retry_base_delay, self.retry_max_delay)
+        remaining = remaining_seconds(config)
+        if remaining is not None and remaining <= delay:
+            return None
+        return delay
+
+    def _hedge_after(self, agent: str, timeout: float) -> Optional[float]:
+        if not self.hedging:
+            return None
+        threshold = self.latencies.hedge_after(agent)
+        return threshold if threshold is not None and threshold < timeout else None
+
+    # --- Synchronous ---
+
+    def call(self, agent: str, request: Callable[[], T], config: Optional[RunnableConfig] = None,
+             quota: Any = None) -> T:
+        attempt = 0
+        while True:
+            self._attempt_timeout(agent, config)
+            ticket = quota.admit(config) if quota else None
+            timeout = self._attempt_timeout(agent, config)
+            start = time.perf_counter()
+            try:
+                result = self._attempt(agent, request, timeout, config, quota)
+                self.latencies.record(agent, time.perf_counter() - start)
+                if quota:
+                    quota.done(ticket, result)
+                return result
+            except Exception as error:
+                if quota:
+                    quota.failed(error)
+                delay = self._retry_delay(agent, attempt, error, config)
+                if delay is None:
+                    raise
+                _report(RETRY_EVENT, {"agent": agent, "attempt": attempt + 1, "error": repr(error)}, config)
+                time.sleep(delay)
+                attempt += 1
+
+    def _attempt(self, agent: str, request: Callable[[], T], timeout: float, config: Optional[RunnableConfig],
+                 quota: Any = None) -> T:
+        futures = [_submit(request)]
+        hedge_after = self._hedge_after(agent, timeout)
+        if hedge_after is not None:
+            done, _ = wait(futures, timeout=hedge_after)
+            ticket = quota.try_admit() if quota and not done else None
+            if not done and (quota is None or ticket is not None):
+                _report(HEDGE_EVENT, {"agent": agent, "after_seconds": hedge_after}, config)
+                futures.append(_submit(request))
+                if ticket is not None:
+                    futures[-1].add_done_callback(lambda future: _settle_hedge(quota, ticket, future))
+        deadline = time.perf_counter() + timeout - (hedge_after or 0)
+        pending, first_error = set(futures), None
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, deadline - time.perf_counter()), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                first_error = first_error or future.exception()
+        if first_error is not None and not pending:
+            raise first_error
+        raise TimeoutError(f"{agent} did not answer within {timeout:.1f}s")
+
+    # --- Asynchronous ---
+
+    async def acall(self, agent: str, request: Callable[[], Awaitable[T]], config: Optional[RunnableConfig] = None,
+                    quota: Any = None) -> T:
+        attempt = 0
+        while True:
+            self._attempt_timeout(agent, config)
+            ticket = await quota.aadmit(config) if quota else None
+            timeout = self._attempt_timeout(agent, config)
+            start = time.perf_counter()
+            try:
+                result = await self._aattempt(agent, request, timeout, config, quota)
+                self.latencies.record(agent, time.perf_counter() - start)
+                if quota:
+                    quota.done(ticket, result)
+                return result
+            except Exception as error:
+                if quota:
+                    quota.failed(error)
+                delay = self._retry_delay(agent, attempt, error, config)
+                if delay is None:
+                    raise
+                await _areport(RETRY_EVENT, {"agent": agent, "attempt": attempt + 1, "error": repr(error)}, config)
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def _aattempt(self, agent: str, request: Callable[[], Awaitable[T]], timeout: float,
+                        config: Optional[RunnableConfig], quota: Any = None) -> T:
+        hedge_after = self._hedge_after(agent, timeout)
+        if hedge_after is None:
+            try:
+                return await asyncio.wait_for(request(), timeout)
+            except asyncio.TimeoutError:
+                raise TimeoutError(f"{agent} did not answer within {timeout:.1f}s") from None
+
+        tasks = [asyncio.ensure_future(request())]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+            ticket = quota.try_admit() if quota and not done else None
+            if not done and (quota is None or ticket is not None):
+                await _areport(HEDGE_EVENT, {"agent": agent, "after_seconds": hedge_after}, config)
+                tasks.append(asyncio.ensure_future(request()))
+                if ticket is not None:
+                    tasks[-1].add_done_callback(lambda task: _settle_hedge(quota, ticket, task))
+            deadline = time.perf_counter() + timeout - hedge_after
+            pending, first_error = set(tasks), None
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=max(0.0, deadline - time.perf_counter()),
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    break
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    first_error = first_error or task.exception()
+            if first_error is not None and not pending:
+                raise first_error
+            raise TimeoutError(f"{agent} did not answer within {timeout:.1f}s")
+        finally:
+            # Abandon the slower request
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+
+_policy: Optional[CallPolicy] = None
+_policy_lock = threading.Lock()
+
+
+def get_call_policy() -> CallPolicy:
+    """The process-wide call policy, configured from the environment on first use"""
+    global _policy
+    with _policy_lock:
+        if _policy is None:
+            _policy = CallPolicy()
+        return _policy
+
+
+def set_call_policy(policy: Optional[CallPolicy]):
+    """Replace the process-wide call policy (None re-reads the environment on next use)"""
+    global _policy
+    with _policy_lock:
+        _policy = policy
@@ -0,0 +1,402 @@
+"""
+LLM Response Cache
+------------------
+Persistent SQLite cache for structured agent responses.
+
+Agents run at temperature 0, so the same rendered prompt to the same model
+with the same output schema gets a reusable answer. Each agent wraps its
+structured LLM with `with_response_cache`; the key is a hash of the model
+settings, the rendered prompt messages and the output schema, so editing a
+prompt or a schema invalidates its entries automatically.
+
+Configuration (environment):
+    LLM_CACHE                 "false" disables the cache (default "true")
+    LLM_CACHE_PATH            database file (default data/llm_cache/responses.sqlite)
+    LLM_CACHE_TTL_SECONDS     entry lifetime (default 7 days; 0 = never expire)
+    LLM_CACHE_MAX_BYTES       total response size before least recently used
+                              entries are evicted (default 100 MB)
+    LLM_CACHE_DISABLED_AGENTS comma-separated agent names never to cache
+
+    python src/llm/response_cache.py --stats
+    python src/llm/response_cache.py --clear
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, Optional, Type
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.callbacks.manager import adispatch_custom_event, dispatch_custom_event
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import Runnable, RunnableLambda
+from pydantic import BaseModel
+
+# Run as a script (the --stats / --clear command line), src/ isn't on the path yet
+if __package__ in (None, ""):
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from llm.cassette import get_cassette_recorder, with_handler, with_usage_handler
+from llm.rate_limiter import Quota, estimate_tokens, get_rate_limiter, model_key
+from llm.resilience import get_call_policy
+
+# Custom callback event dispatched on every cache lookup, {"agent": ..., "hit": bool}
+CACHE_EVENT = "llm_cache"
+
+# Custom callback event a ModelRoute dispatches with the backend that answered, {"agent": ..., "backend": name}
+ROUTE_ANSWER_EVENT = "llm_route_answer"
+
+# Bump to drop every existing entry, e.g. when the key format changes
+CACHE_VERSION = 1
+
+# Under the project root, wherever the workflow is run from
+DEFAULT_CACHE_PATH = str(Path(__file__).resolve().parents[2] / "data" / "llm_cache" / "responses.sqlite")
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+DEFAULT_MAX_BYTES = 100 * 1024 * 1024
+
+# Model settings that change the response
+_MODEL_SETTINGS = ("model", "model_name", "temperature", "max_tokens", "max_output_tokens", "top_p", "top_k")
+
+
+def model_fingerprint(llm: Any) -> str:
+    """The model class and the settings that affect its output"""
+    settings = {name: getattr(llm, name) for name in _MODEL_SETTINGS if getattr(llm, name, None) is not None}
+    return json.dumps({"class": type(llm).__name__, **settings}, sort_keys=True, default=str)
+
+
+def schema_hash(schema: Type[BaseModel]) -> str:
+    return hashlib.sha256(json.dumps(schema.model_json_schema(), sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    SQLite-backed response store with TTL and size-based LRU eviction
+
+    One connection is shared by all threads behind a lock; lookups are a
+    primary-key read, so the lock is held for well under a millisecond.
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_CACHE_PATH,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        enabled: bool = True,
+        disabled_agents: Optional[set] = None,
+    ):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.disabled_agents = set(disabled_agents or ())
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self._conn = None
+        if enabled:
+            self._connect()
+
+    def _connect(self):
+        if self.path != ":memory:":
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, agent TEXT NOT NULL, value TEXT NOT NULL,"
+            " size INTEGER NOT NULL, created_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+
+    @classmethod
+    def from_env(cls) -> "ResponseCache":
+        disabled = {name.strip() for name in os.getenv("LLM_CACHE_DISABLED_AGENTS", "").split(",") if name.strip()}
+        return cls(
+            path=os.getenv("LLM_CACHE_PATH", DEFAULT_CACHE_PATH),
+            ttl_seconds=float(os.getenv("LLM_CACHE_TTL_SECONDS", DEFAULT_TTL_SECONDS)),
+            max_bytes=int(os.getenv("LLM_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)),
+            enabled=os.getenv("LLM_CACHE", "true").lower() not in ("0", "false", "no"),
+            disabled_agents=disabled,
+        )
+
+    # --- Flags ---
+
+    def is_enabled(self, agent: str) -> bool:
+        return self.enabled and agent not in self.disabled_agents
+
+    def set_agent_enabled(self, agent: str, enabled: bool):
+        if enabled:
+            self.disabled_agents.discard(agent)
+        else:
+            self.disabled_agents.add(agent)
+
+    # --- Keys ---
+
+    @staticmethod
+    def make_key(fingerprint: str, messages: list, schema_digest: str) -> str:
+        payload = json.dumps(
+            {
+                "version": CACHE_VERSION,
+                "model": fingerprint,
+                "messages": [[message.type, message.content] for message in messages],
+                "schema": schema_digest,
+            },
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    # --- Store ---
+
+    def get(self, agent: str, key: str) -> Optional[str]:
+        """Cached response text, or None on a miss or an expired entry"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self._stats[agent]["misses"] += 1
+                return None
+            value, created_at = row
+            if self.ttl_seconds and now - created_at > self.ttl_seconds:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._stats[agent]["expired"] += 1
+                self._stats[agent]["misses"] += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self._stats[agent]["hits"] += 1
+            return value
+
+    def put(self, agent: str, key: str, value: str):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, agent, value, size, created_at, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, agent, value, len(value.encode("utf-8")), now, now),
+            )
+            self._stats[agent]["writes"] += 1
+            self._evict(agent)
+
+    def _evict(self, agent: str):
+        """Drop least recently used entries until the cache fits in max_bytes (caller holds the lock)"""
+        if not self.max_bytes:
+            return
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = 0
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall():
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+        self._stats[agent]["evictions"] += evicted
+
+    def invalidate(self, agent: Optional[str] = None) -> int:
+        """Delete all entries, or one agent's; returns the number removed (0 when the cache is disabled)"""
+        with self._lock:
+            if self._conn is None:
+                return 0
+            if agent is None:
+                cursor = self._conn.execute("DELETE FROM responses")
+            else:
+                cursor = self._conn.execute("DELETE FROM responses WHERE agent = ?", (agent,))
+            return cursor.rowcount
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters per agent since startup, plus what is stored on disk"""
+        agents = {}
+        with self._lock:
+            for agent, counts in self._stats.items():
+                lookups = counts["hits"] + counts["misses"]
+                agents[agent] = {**counts, "hit_rate": round(counts["hits"] / lookups, 4) if lookups else 0.0}
+            stored = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone() if self._conn else (0, 0)
+        hits = sum(counts["hits"] for counts in agents.values())
+        misses = sum(counts["misses"] for counts in agents.values())
+        return {
+            "enabled": self.enabled,
+            "path": self.path,
+            "entries": stored[0],
+            "bytes": stored[1],
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+            "agents": agents,
+        }
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+_cache: Optional[ResponseCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """The process-wide response cache, configured from the environment on first use"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache.from_env()
+        return _cache
+
+
+def set_response_cache(cache: Optional[ResponseCache]):
+    """Replace the process-wide cache (None re-reads the environment on next use)"""
+    global _cache
+    with _cache_lock:
+        _cache = cache
+
+
+class _RouteAnswer(BaseCallbackHandler):
+    """Notes which backend of a ModelRoute answered a call"""
+
+    run_inline = True
+
+    def __init__(self):
+        self.backend: Optional[str] = None
+
+    def on_custom_event(self, name: str, data: Any, **kwargs: Any) -> None:
+        if name == ROUTE_ANSWER_EVENT and self.backend is None:
+            self.backend = data["backend"]
+
+
+def with_response_cache(
+    agent: str,
+    prompt: ChatPromptTemplate,
+    structured_llm: Runnable,
+    schema: Type[BaseModel],
+    llm: Any,
+) -> Runnable:
+    """
+    `prompt | structured_llm`, answering from the response cache when it can
+
+    Cache problems (unreadable entries, database errors) fall back to calling
+    the model. Model calls wait for the model's quota (llm.rate_limiter) and
+    follow the process-wide call policy (deadline, timeouts, retries,
+    hedging; see llm.resilience). The runnable carries {"agent": agent}
+    metadata, and each lookup dispatches a CACHE_EVENT callback event, for
+    the workflow metrics. Models with `cache_responses = False` (the replay
+    backend) are always called; with a cassette recorder set (LLM_RECORD),
+    every response is recorded.
+
+    A ModelRoute (llm.model_router) answers from one of several models: it
+    takes each backend's quota itself, lookups go under the backend it will
+    try first, and responses are stored under the backend that answered.
+    """
+    schema_digest = schema_hash(schema)
+    quota_key = model_key(llm)
+    cacheable = getattr(llm, "cache_responses", True)
+    backend_model = getattr(llm, "backend_model", None)
+
+    def fingerprint(backend: Optional[str] = None) -> str:
+        return model_fingerprint(llm if backend_model is None else backend_model(backend))
+
+    def quota(prompt_value):
+        if backend_model is not None:
+            return None
+        return Quota(get_rate_limiter(), quota_key, agent, estimate_tokens(prompt_value.to_string()))
+
+    def answered_key(cache, key, prompt_value, answer):
+        if key is None or answer is None or answer.backend is None:
+            return key
+        return cache.make_key(fingerprint(answer.backend), prompt_value.to_messages(), schema_digest)
+
+    def call_config(config, recorder):
+        config, usage = with_usage_handler(config) if recorder else (config, None)
+        answer = _RouteAnswer() if backend_model is not None else None
+        return (config if answer is None else with_handler(config, answer)), usage, answer
+
+    def lookup(prompt_value):
+        cache = get_response_cache()
+        if not cacheable or not cache.is_enabled(agent):
+            return cache, None, None
+        key = cache.make_key(fingerprint(), prompt_value.to_messages(), schema_digest)
+        try:
+            cached = cache.get(agent, key)
+            return cache, key, schema.model_validate_json(cached) if cached is not None else None
+        except Exception as e:
+            print(f"⚠️  LLM cache read failed for {agent}: {e}")
+            return cache, None, None
+
+    def store(cache, key, response):
+        if key is not None and isinstance(response, BaseModel):
+            try:
+                cache.put(agent, key, response.model_dump_json())
+            except Exception as e:
+                print(f"⚠️  LLM cache write failed for {agent}: {e}")
+
+    def record(recorder, prompt_value, response, seconds=None, usage=None):
+        if recorder is None or not isinstance(response, BaseModel):
+            return
+        try:
+            recorder.record(agent, prompt_value.to_messages(), schema_digest, response, seconds,
+                            usage and {name: usage.summary()[name] for name in ("input_tokens", "output_tokens")})
+        except Exception as e:
+            print(f"⚠️  LLM cassette write failed for {agent}: {e}")
+
+    def run(inputs, config):
+        prompt_value = prompt.invoke(inputs, config)
+        recorder = get_cassette_recorder()
+        cache, key, cached = lookup(prompt_value)
+        if key is not None:
+            dispatch_custom_event(CACHE_EVENT, {"agent": agent, "hit": cached is not None}, config=config)
+        if cached is not None:
+            record(recorder, prompt_value, cached)
+            return cached
+        request_config, usage, answer = call_config(config, recorder)
+        # The recorded latency is the answering request's, without quota waits and retries
+        timing = {}
+
+        def request():
+            start = time.perf_counter()
+            response = structured_llm.invoke(prompt_value, request_config)
+            timing.setdefault("seconds", time.perf_counter() - start)
+            return response
+
+        response = get_call_policy().call(agent, request, config, quota(prompt_value))
+        record(recorder, prompt_value, response, timing.get("seconds"), usage)
+        store(cache, answered_key(cache, key, prompt_value, answer), response)
+        return response
+
+    async def arun(inputs, config):
+        prompt_value = await prompt.ainvoke(inputs, config)
+        recorder = get_cassette_recorder()
+        cache, key, cached = lookup(prompt_value)
+        if key is not None:
+            await adispatch_custom_event(CACHE_EVENT, {"agent": agent, "hit": cached is not None}, config=config)
+        if cached is not None:
+            record(recorder, prompt_value, cached)
+            return cached
+        request_config, usage, answer = call_config(config, recorder)
+        timing = {}
+
+        async def request():
+            start = time.perf_counter()
+            response = await structured_llm.ainvoke(prompt_value, request_config)
+            timing.setdefault("seconds", time.perf_counter() - start)
+            return response
+
+        response = await get_call_policy().acall(agent, request, config, quota(prompt_value))
+        record(recorder, prompt_value, response, timing.get("seconds"), usage)
+        store(cache, answered_key(cache, key, prompt_value, answer), response)
+        return response
+
+    return RunnableLambda(run, afunc=arun, name=agent).with_config(metadata={"agent": agent})
+
+
+# --- Command line: inspect or clear the cache ---
+if __name__ == '__main__':
+    cache = ResponseCache.from_env()
+    if "--clear" in sys.argv:
+        print(f"🗑️  Removed {cache.invalidate()} cached responses from {cache.path}")
+    else:
+        print(json.dumps(cache.stats(), indent=2))
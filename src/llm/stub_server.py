@@ -0,0 +1,162 @@
+"""
+OpenAI-Compatible Stand-in Server
+---------------------------------
+A local server answering the OpenAI chat completions API, for exercising
+the model router, failover and the OpenAI-compatible client without a
+provider account. Structured requests (a "json_schema" response format) get
+a minimal JSON object valid for the schema; other requests get a fixed
+sentence. Latency and failures can be dialled in, also while it runs.
+
+    python src/llm/stub_server.py --port 8089 --latency 0.3 --error-rate 0.1
+    LLM_FALLBACK="openai:stub@http://127.0.0.1:8089/v1" python src/main.py ...
+
+From code (tests):
+
+    server = StubServer(latency=0.05).start()
+    llm = get_openai_compatible_llm("stub", server.base_url)
+    server.error_status = 503   # fail every request from now on
+    server.stop()
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+
+STUB_TEXT = "This is a stand-in response."
+
+
+def schema_instance(schema: Dict[str, Any], definitions: Optional[Dict[str, Any]] = None) -> Any:
+    """The smallest value a JSON schema accepts: one item per array, every property filled in"""
+    definitions = definitions if definitions is not None else schema.get("$defs", {})
+    if "$ref" in schema:
+        return schema_instance(definitions[schema["$ref"].rsplit("/", 1)[-1]], definitions)
+    for key in ("anyOf", "oneOf", "allOf"):
+        if key in schema:
+            options = [option for option in schema[key] if option.get("type") != "null"] or schema[key]
+            return schema_instance(options[0], definitions)
+    if "enum" in schema:
+        return schema["enum"][0]
+    if "default" in schema and schema["default"] is not None:
+        return schema["default"]
+    kind = schema.get("type", "object")
+    if kind == "object":
+        return {name: schema_instance(prop, definitions) for name, prop in schema.get("properties", {}).items()}
+    if kind == "array":
+        return [schema_instance(schema.get("items", {"type": "string"}), definitions)]
+    if kind == "string":
+        return "stub"
+    if kind == "integer":
+        return int(schema.get("minimum", 1))
+    if kind == "number":
+        return float(min(max(0.5, schema.get("minimum", 0.5)), schema.get("maximum", 0.5)))
+    if kind == "boolean":
+        return False
+    return None
+
+
+class StubServer:
+    """Threaded stand-in server; `latency`, `error_rate` and `error_status` may be changed while it runs"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0,
+                 error_rate: float = 0.0, error_status: Optional[int] = None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler())
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def completion(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        response_format = request.get("response_format") or {}
+        if response_format.get("type") == "json_schema":
+            content = json.dumps(schema_instance(response_format["json_schema"]["schema"]))
+        elif response_format.get("type") == "json_object":
+            content = "{}"
+        else:
+            content = STUB_TEXT
+        prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in request.get("messages", []))
+        completion_tokens = len(content.split())
+        return {
+            "id": f"stub-{self.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "stub"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _send(self, status: int, body: Dict[str, Any]):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path.rstrip("/").endswith("/models"):
+                    self._send(200, {"object": "list", "data": [{"id": "stub", "object": "model"}]})
+                else:
+                    self._send(404, {"error": {"message": "not found"}})
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                with server._lock:
+                    server.requests += 1
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send(404, {"error": {"message": "not found"}})
+                    return
+                if server.latency:
+                    time.sleep(server.latency)
+                if server.error_status or (server.error_rate and random.random() < server.error_rate):
+                    self._send(server.error_status or 503, {"error": {"message": "stand-in failure"}})
+                    return
+                self._send(200, server.completion(request))
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> "StubServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="llm-stub-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+# --- Command line: run the stand-in server ---
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible stand-in LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before every answer")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 503")
+    args = parser.parse_args()
+
+    stub = StubServer(args.host, args.port, args.latency, args.error_rate)
+    print(f"🧪 Stand-in LLM server at {stub.base_url} (Ctrl+C to stop)")
+    try:
+        stub._httpd.serve_forever()
+    except KeyboardInterrupt:
+        stub.stop()
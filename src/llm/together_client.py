@@ -7,13 +7,21 @@ from typing import List
 from together import Together
 from dotenv import load_dotenv
 
+from .client_registry import get_client_registry, secret_fingerprint
+
+
+def get_together_client() -> Together:
+    """The process-wide Together client for the configured API key (it serves every model)"""
+    api_key = os.getenv("TOGETHER_API_KEY")
+    return get_client_registry().get("together", "*", {"key": secret_fingerprint(api_key)}, lambda: Together(api_key=api_key))
+
 
 class TogetherMedicalLLM:
     """Medical LLM using Together AI"""
     
     def __init__(self):
         load_dotenv()
-        self.client = Together()
+        self.client = get_together_client()
         self.model = os.getenv("TOGETHER_MODEL", "Qwen/Qwen3-Coder-480B-A35B-Instruct-FP8")
     
     def analyze_symptoms(self, symptoms: str, medical_context: str = "") -> str:
@@ -0,0 +1,49 @@
+"""
+LLM Usage Tracking
+------------------
+Callback handler that counts LLM calls and tokens for whatever runs it is
+passed to, e.g. one diagnosis:
+
+    usage = TokenUsageHandler()
+    workflow.run_diagnosis(symptoms, config={"callbacks": [usage]})
+    print(usage.summary())
+"""
+import threading
+from typing import Any, Dict
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+
+class TokenUsageHandler(BaseCallbackHandler):
+    """Sums LLM calls and input/output tokens; safe to share between parallel steps"""
+
+    # Counting is cheap, so don't hop to a thread for async runs
+    run_inline = True
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.llm_calls = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        input_tokens = output_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                input_tokens += usage.get("input_tokens", 0)
+                output_tokens += usage.get("output_tokens", 0)
+        with self._lock:
+            self.llm_calls += 1
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+
+    def summary(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "llm_calls": self.llm_calls,
+                "input_tokens": self.input_tokens,
+                "output_tokens": self.output_tokens,
+                "total_tokens": self.input_tokens + self.output_tokens,
+            }
@@ -2,6 +2,7 @@
 Main entry point for the Medical Diagnosis AI System
 """
 
+import asyncio
 import sys
 import os
 from pathlib import Path
@@ -18,20 +19,24 @@ sys.path.insert(0, str(Path(__file__).parent))
 from utils.disable_warnings import suppress_warnings
 
 from knowledge.knowledge_base import MedicalKnowledgeBase
-from workflow.graph import MedicalDiagnosisWorkflow
+from workflow.graph import BATCH_CONCURRENCY
+from workflow.fast_graph import WORKFLOW_VARIANTS
+from workflow.batch import run_batch
+from workflow.metrics import get_workflow_metrics
 
 
 class MedicalDiagnosisSystem:
     """Main Medical Diagnosis System"""
     
-    def __init__(self):
+    def __init__(self, variant: str = None):
         print("🏥 Initializing Medical Diagnosis System...")
         
         # Initialize knowledge base
         self.knowledge_base = MedicalKnowledgeBase()
         
-        # Initialize workflow
-        self.workflow = MedicalDiagnosisWorkflow(self.knowledge_base)
+        # Initialize workflow: "standard", or "fast" for fewer, combined LLM calls
+        variant = variant or os.getenv("WORKFLOW_VARIANT", "standard")
+        self.workflow = WORKFLOW_VARIANTS[variant](self.knowledge_base)
         
         print("✅ Medical Diagnosis System initialized")
     
@@ -42,10 +47,38 @@ class MedicalDiagnosisSystem:
         print(f"✅ Knowledge base initialized with {chunks_processed} chunks")
         return chunks_processed
     
-    def diagnose(self, symptoms: str, patient_info: dict = None) -> dict:
-        """Run diagnosis on symptoms"""
-        return self.workflow.run_diagnosis(symptoms, patient_info)
+    def diagnose(self, symptoms: str, patient_info: dict = None, budget_seconds: float = None) -> dict:
+        """Run diagnosis on symptoms; with a budget, return the best diagnosis reached in time"""
+        return self.workflow.run_diagnosis(symptoms, patient_info, budget_seconds=budget_seconds)
     
+    async def diagnose_streaming(self, symptoms: str, patient_info: dict = None) -> dict:
+        """Run diagnosis, printing each step and the diagnosis text as they arrive"""
+        streaming = None
+        result = {}
+        async for event in self.workflow.astream_diagnosis_events(symptoms, patient_info):
+            if event["type"] == "token":
+                if (event["step"], event["field"]) != streaming:
+                    streaming = (event["step"], event["field"])
+                    print(f"\n   {_field_label(event['field'])}: ", end="")
+                print(event["text"], end="", flush=True)
+            elif event["type"] == "step":
+                if streaming:
+                    print()
+                    streaming = None
+                summary = _step_summary(event["update"])
+                print(f"✔️  {event['step'].replace('_', ' ')} ({event['seconds']:.1f}s){summary}", flush=True)
+            else:
+                result = event["result"]
+        return result
+
+    def ask_patient(self, session: dict) -> dict:
+        """Put a paused session's questions to the patient on the terminal and finish the diagnosis"""
+        if session.get("status") != "awaiting_answers":
+            return session
+        print(f"\n❓ A few questions (session {session['session_id']}):")
+        answers = [input(f"   {question}\n   > ") for question in session["questions"]]
+        return self.workflow.resume_session(session["session_id"], answers)
+
     def get_system_status(self) -> dict:
         """Get system status"""
         return {
@@ -54,43 +87,110 @@ class MedicalDiagnosisSystem:
         }
 
 
+def _field_label(field: str) -> str:
+    """'next_steps.0' -> 'next steps #1'"""
+    parts = [f"#{int(part) + 1}" if part.isdigit() else part.replace("_", " ") for part in field.split(".")]
+    return " ".join(parts)
+
+
+def _step_summary(update: dict) -> str:
+    """A short line about what a step found, for the streaming display"""
+    if update.get("final_diagnosis"):
+        diagnosis = update["final_diagnosis"]
+        return f": {diagnosis.get('primary_diagnosis')} ({diagnosis.get('confidence_score', 0):.0%})"
+    if update.get("differential_diagnosis"):
+        hypotheses = update["differential_diagnosis"].get("hypotheses", [])
+        return ": " + ", ".join(f"{h['condition']} ({h['probability']:.0%})" for h in hypotheses[:3])
+    if update.get("symptom_analysis"):
+        return f": {update['symptom_analysis'].get('initial_summary')}"
+    if update.get("questions_asked"):
+        return f": {len(update['questions_asked'].get('questions', []))} questions"
+    return ""
+
+
+def _print_result(result: dict):
+    print("\n" + "="*50)
+    print("📋 DIAGNOSIS RESULTS")
+    print("="*50)
+    
+    final_diagnosis = result.get("final_diagnosis", {})
+    if final_diagnosis:
+        print(f"🎯 Diagnosis: {final_diagnosis.get('primary_diagnosis', 'Unknown')}")
+        print(f"🎯 Confidence: {result.get('confidence_score', 0):.1%}")
+    
+    print(f"📚 Sources: {', '.join(result.get('knowledge_sources', [])[:3])}")
+
+
 def main():
     """Command line interface"""
     if len(sys.argv) < 2:
         print("Usage:")
         print("  python main.py --init-kb                 # Initialize knowledge base")
+        print("  python main.py --verify                  # Check the knowledge base files against their checksums")
         print("  python main.py --symptoms 'your symptoms'  # Run diagnosis")
+        print("  python main.py --symptoms 'your symptoms' --interactive  # Answer the clarifying questions yourself")
+        print("  python main.py --symptoms 'your symptoms' --budget SECONDS  # Best diagnosis within a time budget")
+        print("  python main.py --resume SESSION_ID        # Answer a paused session's questions")
+        print("  python main.py --follow-up SESSION_ID 'new information'  # Re-diagnose a finished session")
         print("  python main.py --status                   # Check system status")
+        print("  python main.py --batch cases.jsonl results.jsonl [--concurrency N] [--metrics FILE]  # Diagnose a JSONL file")
+        print("  Add --fast to --symptoms or --batch to use the fast workflow (fewer LLM calls)")
         return
     
     command = sys.argv[1]
+    variant = "fast" if "--fast" in sys.argv else None
     
     if command == "--init-kb":
         system = MedicalDiagnosisSystem()
         system.initialize_knowledge_base()
         
+    elif command == "--verify":
+        if not MedicalKnowledgeBase().verify_vector_store():
+            sys.exit(1)
+        
     elif command == "--symptoms":
         if len(sys.argv) < 3:
             print("Please provide symptoms: python main.py --symptoms 'your symptoms'")
             return
         
         symptoms = sys.argv[2]
-        system = MedicalDiagnosisSystem()
+        system = MedicalDiagnosisSystem(variant)
         
         print(f"🔍 Analyzing symptoms: {symptoms}")
-        result = system.diagnose(symptoms)
-        
-        # Display results
-        print("\n" + "="*50)
-        print("📋 DIAGNOSIS RESULTS")
-        print("="*50)
-        
-        final_diagnosis = result.get("final_diagnosis", {})
-        if final_diagnosis:
-            print(f"🎯 Diagnosis: {final_diagnosis.get('condition', 'Unknown')}")
-            print(f"🎯 Confidence: {result.get('confidence_score', 0):.1%}")
-        
-        print(f"📚 Sources: {', '.join(result.get('knowledge_sources', [])[:3])}")
+        if "--interactive" in sys.argv:
+            result = system.ask_patient(system.workflow.start_session(symptoms))
+        elif "--budget" in sys.argv:
+            result = system.diagnose(symptoms, budget_seconds=float(sys.argv[sys.argv.index("--budget") + 1]))
+            if result.get("elided_steps"):
+                print(f"⏭️  Skipped to stay within the budget: {', '.join(result['elided_steps'])}")
+        else:
+            result = asyncio.run(system.diagnose_streaming(symptoms))
+        _print_result(result)
+
+    elif command == "--resume":
+        if len(sys.argv) < 3:
+            print("Please provide a session ID: python main.py --resume SESSION_ID")
+            return
+
+        system = MedicalDiagnosisSystem(variant)
+        session = system.workflow.get_session(sys.argv[2])
+        if session is None:
+            print(f"Unknown session: {sys.argv[2]}")
+            return
+        _print_result(system.ask_patient(session))
+
+    elif command == "--follow-up":
+        if len(sys.argv) < 4:
+            print("Please provide a session ID and the new information: python main.py --follow-up SESSION_ID 'new information'")
+            return
+
+        system = MedicalDiagnosisSystem(variant)
+        result = system.workflow.update_session(sys.argv[2], sys.argv[3])
+        if result.get("error"):
+            print(f"❌ {result['error']}")
+            return
+        print(f"🔁 Re-diagnosing from {result['reentered_at'].replace('_', ' ')}")
+        _print_result(system.ask_patient(result))
         
     elif command == "--status":
         system = MedicalDiagnosisSystem()
@@ -101,6 +201,32 @@ def main():
         print(f"Knowledge Base: {status['knowledge_base']}\n")
         print(f"Workflow: {status['workflow']}\n")
 
+    elif command == "--batch":
+        if len(sys.argv) < 4:
+            print("Please provide input and output files: python main.py --batch cases.jsonl results.jsonl [--concurrency N]")
+            return
+        
+        input_path, output_path = sys.argv[2], sys.argv[3]
+        concurrency = BATCH_CONCURRENCY
+        if "--concurrency" in sys.argv:
+            concurrency = int(sys.argv[sys.argv.index("--concurrency") + 1])
+        system = MedicalDiagnosisSystem(variant)
+        
+        print(f"📦 Diagnosing cases from {input_path} ({concurrency} at a time)")
+        stats = run_batch(system.workflow, input_path, output_path, concurrency)
+        print(f"✅ Wrote {stats['written']} results to {output_path} "
+              f"({stats['skipped']} already done, {stats['errors']} errors, "
+              f"{stats['cases_per_second']} cases/s)")
+
+        metrics = get_workflow_metrics()
+        tail = metrics.tail_breakdown()
+        if tail["dominant_step"]:
+            print(f"⏱️  Slowest 1% of diagnoses (≥ {tail['threshold_seconds']}s) spend most time in: {tail['dominant_step']}")
+        if "--metrics" in sys.argv:
+            metrics_path = sys.argv[sys.argv.index("--metrics") + 1]
+            metrics.write_prometheus(metrics_path)
+            print(f"📈 Prometheus metrics written to {metrics_path}")
+
     else:
         print(f"Unknown command: {command}")
 
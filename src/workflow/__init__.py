@@ -4,5 +4,7 @@ Workflow Components
 
 from .state import MedicalDiagnosisState
 from .graph import MedicalDiagnosisWorkflow
+from .fast_graph import FastDiagnosisWorkflow, WORKFLOW_VARIANTS
+from .batch import run_batch, run_batch_async
 
-__all__ = ["MedicalDiagnosisState", "MedicalDiagnosisWorkflow"]
+__all__ = ["MedicalDiagnosisState", "MedicalDiagnosisWorkflow", "FastDiagnosisWorkflow", "WORKFLOW_VARIANTS", "run_batch", "run_batch_async"]
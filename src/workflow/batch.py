@@ -0,0 +1,106 @@
+"""
+JSONL batch diagnosis
+
+Input: one case per line, {"id": ..., "symptoms": ..., "patient_info": {...}}
+("id" defaults to the line number, "patient_info" is optional).
+Output: one line per case, in input order, {"id": ..., "symptoms": ..., "result": {...}}.
+
+Output is appended and flushed line by line, so an interrupted run can be
+restarted with the same arguments: cases already in the output file are
+skipped and a half-written last line is discarded.
+"""
+
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from typing import Dict, Iterator, Set
+
+from utils.logging_utils import logger
+from .graph import BATCH_CONCURRENCY
+
+
+def read_cases(input_path: str) -> Iterator[Dict]:
+    """Yield cases from a JSONL file, skipping blank lines"""
+    with open(input_path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            case = json.loads(line)
+            if isinstance(case, str):
+                case = {"symptoms": case}
+            case.setdefault("id", line_number)
+            yield case
+
+
+def completed_case_ids(output_path: str) -> Set[str]:
+    """
+    Ids already written to an output file
+
+    A trailing partial line (from an interrupted run) is truncated so the
+    file can be appended to.
+    """
+    if not os.path.exists(output_path):
+        return set()
+    with open(output_path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            logger.warning(f"Discarding partial last line in {output_path}")
+            f.truncate(end)
+    completed = set()
+    for line in data[:end].splitlines():
+        if line.strip():
+            completed.add(str(json.loads(line)["id"]))
+    return completed
+
+
+async def run_batch_async(workflow, input_path: str, output_path: str,
+                          max_concurrency: int = BATCH_CONCURRENCY) -> Dict[str, float]:
+    """Diagnose every case in input_path not yet in output_path; returns run counts and timing"""
+    completed = completed_case_ids(output_path)
+    skipped = 0
+
+    def todo():
+        nonlocal skipped
+        for case in read_cases(input_path):
+            if str(case["id"]) in completed:
+                skipped += 1
+                continue
+            yield case
+
+    cases = deque()
+
+    def track(case_iter):
+        # stream_diagnoses yields in input order, so a FIFO pairs results with cases
+        for case in case_iter:
+            cases.append(case)
+            yield case
+
+    start = time.perf_counter()
+    written = errors = 0
+    with open(output_path, "a", encoding="utf-8") as out:
+        async for result in workflow.stream_diagnoses(track(todo()), max_concurrency):
+            case = cases.popleft()
+            record = {"id": case["id"], "symptoms": case["symptoms"], "result": result}
+            out.write(json.dumps(record, default=str) + "\n")
+            out.flush()
+            written += 1
+            errors += "error" in result
+            if written % 50 == 0:
+                logger.info(f"Batch progress: {written} cases written")
+
+    elapsed = time.perf_counter() - start
+    return {
+        "written": written,
+        "skipped": skipped,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "cases_per_second": round(written / elapsed, 3) if elapsed and written else 0.0,
+    }
+
+
+def run_batch(workflow, input_path: str, output_path: str,
+              max_concurrency: int = BATCH_CONCURRENCY) -> Dict[str, float]:
+    return asyncio.run(run_batch_async(workflow, input_path, output_path, max_concurrency))
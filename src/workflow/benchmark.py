@@ -0,0 +1,316 @@
+"""
+Latency and token benchmark for the diagnosis workflow variants.
+
+Runs a fixed set of case vignettes through each workflow variant (see
+fast_graph.WORKFLOW_VARIANTS), one case at a time, and reports end-to-end
+latency percentiles, critical-path time, LLM calls and tokens per diagnosis,
+plus the fast variant's savings against the standard graph. Results are JSON
+with sorted keys, comparable across runs with `--compare`.
+
+`--early-exit` also evaluates the confidence-gated early exit: how often it
+triggers and what it saves against running every case through the
+clarifying questions. `--query-ab` compares the local search query
+generator against the LLM-generated queries: retrieval recall against the
+passages the LLM queries find, and end-to-end latency.
+
+    python src/workflow/benchmark.py --output bench/workflow.json
+    python src/workflow/benchmark.py --variants fast --output bench/fast.json --compare bench/workflow.json
+    python src/workflow/benchmark.py --variants standard --early-exit --output bench/early_exit.json
+    python src/workflow/benchmark.py --variants standard --query-ab --output bench/queries.json
+
+`--record CASSETTE` records every agent call of the run (with the response
+cache off, so the latencies are real); `--replay CASSETTE` answers them from
+the recording instead of a model, with no network or API key, so the
+non-LLM parts can be measured and profiled on their own (synthetic latency:
+LLM_REPLAY_LATENCY, see llm/replay.py):
+
+    python src/workflow/benchmark.py --record bench/cassette.jsonl --output bench/live.json
+    LLM_REPLAY_LATENCY_SCALE=0 python src/workflow/benchmark.py --replay bench/cassette.jsonl
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import platform
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from knowledge.benchmark import compare_results, percentiles_ms, print_comparison
+from knowledge.knowledge_base import MedicalKnowledgeBase
+from llm.cassette import CassetteRecorder, set_cassette_recorder
+from llm.model_router import ModelRouter, set_model_router
+from llm.response_cache import ResponseCache, get_response_cache, set_response_cache
+from llm.usage import TokenUsageHandler
+from workflow.batch import read_cases
+from workflow.fast_graph import WORKFLOW_VARIANTS
+from workflow.graph import QUERY_GENERATORS, MedicalDiagnosisWorkflow, critical_path_report
+
+DEFAULT_CASES = Path(__file__).resolve().parent / "benchmark_cases.jsonl"
+
+# Metrics where a lower value is better; everything else is higher-is-better
+LOWER_IS_BETTER = ("latency", "seconds", "tokens", "llm_calls", "errors")
+
+
+async def benchmark_variant(workflow, cases: List[Dict[str, Any]], repeat: int = 1,
+                            outcomes: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """
+    Run each case `repeat` times, sequentially, and summarize latency and usage
+
+    `outcomes`, if given, receives each run's primary diagnosis and
+    diagnosis path (None for both on errors), in run order.
+    """
+    latencies, critical_paths, early_exits = [], [], []
+    usage: Dict[str, List[int]] = {"llm_calls": [], "input_tokens": [], "output_tokens": [], "total_tokens": []}
+    errors = 0
+    for case in cases:
+        for _ in range(max(1, repeat)):
+            handler = TokenUsageHandler()
+            start = time.perf_counter()
+            result = await workflow.run_diagnosis_async(
+                case["symptoms"], case.get("patient_info"), config={"callbacks": [handler]}
+            )
+            latencies.append(time.perf_counter() - start)
+            if outcomes is not None:
+                failed = "error" in result
+                outcomes.append({
+                    "diagnosis": None if failed else result["final_diagnosis"].get("primary_diagnosis"),
+                    "path": None if failed else result.get("diagnosis_path"),
+                })
+            if "error" in result:
+                errors += 1
+                continue
+            early_exits.append(result.get("diagnosis_path") == "early_exit")
+            critical_paths.append(critical_path_report(result["step_timings"], workflow.step_dependencies)["critical_path_seconds"])
+            for name, value in handler.summary().items():
+                usage[name].append(value)
+
+    metrics = {f"latency_ms_{name}": value for name, value in percentiles_ms(latencies).items()}
+    metrics["critical_path_seconds_mean"] = round(float(np.mean(critical_paths)), 4) if critical_paths else 0.0
+    for name, values in usage.items():
+        metrics[f"{name}_mean"] = round(float(np.mean(values)), 2) if values else 0.0
+    metrics["early_exit_rate"] = round(float(np.mean(early_exits)), 4) if early_exits else 0.0
+    metrics["errors"] = errors
+    return metrics
+
+
+def evaluate_early_exit(knowledge_base: MedicalKnowledgeBase, cases: List[Dict[str, Any]],
+                        variant: str = "standard", repeat: int = 1) -> Dict[str, Any]:
+    """
+    How often the early exit triggers, what it saves, and what it changes
+
+    Runs the cases with early exit off, then on, with the response cache
+    turned off so neither run is answered from the other's. Reports the
+    share of diagnoses that exited early, the latency and LLM call savings,
+    and `agreement_rate`: how often a case that exited early reached the same
+    primary diagnosis as with the questions asked.
+    """
+    runs: Dict[bool, Dict[str, Any]] = {}
+    outcomes: Dict[bool, List[Dict[str, Any]]] = {False: [], True: []}
+    cache = get_response_cache()
+    set_response_cache(ResponseCache(enabled=False))
+    try:
+        for early_exit in (False, True):
+            workflow = WORKFLOW_VARIANTS[variant](knowledge_base, early_exit=early_exit)
+            try:
+                print(f"⏱️  Evaluating '{variant}' workflow with early exit {'on' if early_exit else 'off'}...")
+                runs[early_exit] = asyncio.run(benchmark_variant(workflow, cases, repeat, outcomes[early_exit]))
+            finally:
+                workflow.close()
+    finally:
+        set_response_cache(cache)
+
+    off, on = runs[False], runs[True]
+    metrics = {
+        "early_exit_rate": on["early_exit_rate"],
+        "latency_ms_mean_off": off["latency_ms_mean"],
+        "latency_ms_mean_on": on["latency_ms_mean"],
+        "llm_calls_mean_off": off["llm_calls_mean"],
+        "llm_calls_mean_on": on["llm_calls_mean"],
+        "errors": off["errors"] + on["errors"],
+    }
+    if off["latency_ms_mean"]:
+        metrics["wall_time_saving_pct"] = round(100.0 * (off["latency_ms_mean"] - on["latency_ms_mean"]) / off["latency_ms_mean"], 2)
+    exited = [(full["diagnosis"], gated["diagnosis"]) for full, gated in zip(outcomes[False], outcomes[True])
+              if gated["path"] == "early_exit" and full["diagnosis"]]
+    metrics["agreement_rate"] = round(sum(a == b for a, b in exited) / len(exited), 4) if exited else 1.0
+    return metrics
+
+
+def evaluate_query_generators(knowledge_base: MedicalKnowledgeBase, cases: List[Dict[str, Any]],
+                              repeat: int = 1) -> Dict[str, Any]:
+    """
+    A/B of the local search query generator against the LLM-generated queries
+
+    Each case is assessed once and both generators build queries from the same
+    assessment. `chunk_recall` and `source_recall` are the shares of the
+    passages and books the LLM queries retrieve that the local queries also
+    retrieve. Both generators then run the standard workflow end to end, with
+    the response cache turned off, for the latency and LLM call comparison.
+    """
+    generators = QUERY_GENERATORS
+    cache = get_response_cache()
+    set_response_cache(ResponseCache(enabled=False))
+    workflows = {name: MedicalDiagnosisWorkflow(knowledge_base, query_generator=name) for name in generators}
+    try:
+        query_seconds: Dict[str, List[float]] = {name: [] for name in generators}
+        chunk_recalls, source_recalls = [], []
+        print(f"🔎 Comparing search queries on {len(cases)} cases...")
+        for case in cases:
+            assessment = workflows["llm"]._assess(case["symptoms"], {})
+            retrieved = {}
+            for name, workflow in workflows.items():
+                start = time.perf_counter()
+                queries = workflow.information_gathering_agent.invoke(assessment)
+                query_seconds[name].append(time.perf_counter() - start)
+                retrieved[name] = workflow._retrieval_update(workflow._search_all(workflow._query_texts(queries)))
+            reference, local = retrieved["llm"], retrieved["local"]
+            if reference["retrieved_chunks"]:
+                chunk_recalls.append(len(set(reference["retrieved_chunks"]) & set(local["retrieved_chunks"]))
+                                     / len(reference["retrieved_chunks"]))
+                source_recalls.append(len(set(reference["knowledge_sources"]) & set(local["knowledge_sources"]))
+                                      / len(reference["knowledge_sources"]))
+
+        runs = {}
+        for name, workflow in workflows.items():
+            print(f"⏱️  Running the standard workflow with {name} search queries...")
+            runs[name] = asyncio.run(benchmark_variant(workflow, cases, repeat))
+    finally:
+        for workflow in workflows.values():
+            workflow.close()
+        set_response_cache(cache)
+
+    metrics: Dict[str, Any] = {
+        "chunk_recall": round(float(np.mean(chunk_recalls)), 4) if chunk_recalls else 0.0,
+        "source_recall": round(float(np.mean(source_recalls)), 4) if source_recalls else 0.0,
+        "errors": runs["llm"]["errors"] + runs["local"]["errors"],
+    }
+    for name in generators:
+        metrics[f"query_latency_ms_mean_{name}"] = round(1000.0 * float(np.mean(query_seconds[name])), 3) if query_seconds[name] else 0.0
+        metrics[f"latency_ms_mean_{name}"] = runs[name]["latency_ms_mean"]
+        metrics[f"llm_calls_mean_{name}"] = runs[name]["llm_calls_mean"]
+    if runs["llm"]["latency_ms_mean"]:
+        metrics["wall_time_saving_pct"] = round(
+            100.0 * (runs["llm"]["latency_ms_mean"] - runs["local"]["latency_ms_mean"]) / runs["llm"]["latency_ms_mean"], 2
+        )
+    return metrics
+
+
+def run_benchmark(
+    knowledge_base: MedicalKnowledgeBase,
+    cases: List[Dict[str, Any]],
+    variants: Sequence[str] = tuple(WORKFLOW_VARIANTS),
+    repeat: int = 1,
+    early_exit: bool = False,
+    query_ab: bool = False,
+    llm_backend: str = "live",
+) -> Dict[str, Any]:
+    """
+    Benchmark each workflow variant on the same cases.
+
+    Metrics are prefixed with the variant name. When the standard variant is
+    included, every other variant also gets `<variant>_wall_time_saving_pct`
+    and `<variant>_token_saving_pct` relative to it. With early_exit, each
+    variant's evaluate_early_exit metrics are added as `<variant>_early_exit_*`.
+    With query_ab, evaluate_query_generators metrics are added as `query_ab_*`.
+    `llm_backend` ("live" or "replay") is recorded in the config.
+    """
+    metrics: Dict[str, Any] = {}
+    for variant in variants:
+        workflow = WORKFLOW_VARIANTS[variant](knowledge_base)
+        try:
+            print(f"⏱️  Benchmarking '{variant}' workflow on {len(cases)} cases...")
+            results = asyncio.run(benchmark_variant(workflow, cases, repeat))
+        finally:
+            workflow.close()
+        metrics.update({f"{variant}_{name}": value for name, value in results.items()})
+        if early_exit:
+            evaluation = evaluate_early_exit(knowledge_base, cases, variant, repeat)
+            metrics.update({f"{variant}_early_exit_{name}": value for name, value in evaluation.items()})
+
+    if "standard" in variants:
+        for variant in variants:
+            if variant == "standard":
+                continue
+            for saving, name in (("wall_time_saving_pct", "latency_ms_mean"), ("token_saving_pct", "total_tokens_mean")):
+                baseline = metrics["standard_" + name]
+                if baseline:
+                    metrics[f"{variant}_{saving}"] = round(100.0 * (baseline - metrics[f"{variant}_{name}"]) / baseline, 2)
+
+    if query_ab:
+        evaluation = evaluate_query_generators(knowledge_base, cases, repeat)
+        metrics.update({f"query_ab_{name}": value for name, value in evaluation.items()})
+
+    case_set = json.dumps(cases, sort_keys=True).encode("utf-8")
+    return {
+        "config": {
+            "variants": list(variants),
+            "repeat": repeat,
+            "early_exit_evaluation": early_exit,
+            "query_ab_evaluation": query_ab,
+            "llm_backend": llm_backend,
+            "num_cases": len(cases),
+            "case_set_sha256": hashlib.sha256(case_set).hexdigest(),
+        },
+        "metrics": metrics,
+        "run": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark diagnosis workflow latency and token usage")
+    parser.add_argument("--cases", default=str(DEFAULT_CASES), help="JSONL file of case vignettes")
+    parser.add_argument("--variants", nargs="+", choices=list(WORKFLOW_VARIANTS), default=list(WORKFLOW_VARIANTS),
+                        help="Workflow variants to run")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per case")
+    parser.add_argument("--early-exit", action="store_true",
+                        help="Also evaluate the confidence-gated early exit against asking every case's questions")
+    parser.add_argument("--query-ab", action="store_true",
+                        help="Also compare locally built search queries against LLM-generated ones")
+    llm = parser.add_mutually_exclusive_group()
+    llm.add_argument("--record", metavar="CASSETTE", help="Record every agent call to this cassette")
+    llm.add_argument("--replay", metavar="CASSETTE", help="Answer agent calls from this cassette instead of a model")
+    parser.add_argument("--output", "-o", help="Write results JSON to this file")
+    parser.add_argument("--compare", help="Baseline results JSON to compare against")
+    args = parser.parse_args()
+
+    if args.record:
+        set_response_cache(ResponseCache(enabled=False))
+        set_cassette_recorder(CassetteRecorder(args.record))
+    if args.replay:
+        set_model_router(ModelRouter({"default": ["replay:" + args.replay]}))
+
+    results = run_benchmark(MedicalKnowledgeBase(), list(read_cases(args.cases)), args.variants, args.repeat,
+                            args.early_exit, args.query_ab, "replay" if args.replay else "live")
+
+    serialized = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(serialized + "\n")
+        print(f"💾 Results written to {args.output}")
+    else:
+        print(serialized)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline["config"].get("case_set_sha256") != results["config"]["case_set_sha256"]:
+            print("⚠️  Baseline was run with a different case set; results are not comparable")
+        if baseline["config"].get("llm_backend", "live") != results["config"]["llm_backend"]:
+            print("⚠️  Baseline used a different LLM backend (live vs replay); latencies are not comparable")
+        print_comparison(compare_results(baseline, results, LOWER_IS_BETTER))
+
+
+if __name__ == "__main__":
+    main()
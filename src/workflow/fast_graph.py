@@ -0,0 +1,152 @@
+"""
+Fast diagnosis workflow
+
+Same MedicalDiagnosisState output as MedicalDiagnosisWorkflow with five LLM
+calls instead of seven: the initial assessment and search query generation
+are one structured-output call, and so are the final diagnosis and the
+treatment plan. The combined final call gets treatment passages for the
+leading hypotheses, prefetched while questions are asked and the diagnosis is
+refined.
+"""
+
+from typing import Dict, List
+
+from .state import MedicalDiagnosisState
+from .graph import MedicalDiagnosisWorkflow
+from agents import (
+    get_assessment_query_agent,
+    get_hypothesis_generation_agent,
+    get_clarifying_question_agent,
+    get_hypothesis_refinement_agent,
+    get_local_refinement_engine,
+    get_diagnosis_treatment_agent,
+    InitialQuery
+)
+from utils.logging_utils import logger
+from langchain_core.runnables import RunnableConfig
+from langgraph.graph import StateGraph
+from langsmith import traceable
+
+FAST_STEP_DEPENDENCIES: Dict[str, List[str]] = {
+    "assessment": [],
+    "hypothesis_generation": ["assessment"],
+    "clarifying_questions": ["hypothesis_generation"],
+    "treatment_prefetch": ["hypothesis_generation"],
+    "hypothesis_refinement": ["clarifying_questions"],
+    "diagnosis_and_treatment": ["hypothesis_refinement", "treatment_prefetch"],
+}
+
+
+class FastDiagnosisWorkflow(MedicalDiagnosisWorkflow):
+    """Diagnosis workflow with fused LLM steps; see the module docstring"""
+
+    streamed_steps = ("diagnosis_and_treatment",)
+
+    def __init__(self, knowledge_base, retrieval_workers: int = None, sessions_path: str = None,
+                 early_exit: bool = None, refinement: str = None):
+        # Speculation drafts a separate treatment plan, which the fused final step makes redundant
+        super().__init__(knowledge_base, retrieval_workers=retrieval_workers, speculative=False,
+                         sessions_path=sessions_path, early_exit=early_exit, refinement=refinement)
+
+    def setup_agents(self):
+        logger.info("🤖 Initializing fast-path diagnosis agents...")
+        self.assessment_query_agent = get_assessment_query_agent()
+        self.hypothesis_generation_agent = get_hypothesis_generation_agent()
+        self.clarifying_question_agent = get_clarifying_question_agent()
+        # Local refinement here skips the narrative: the summary stays the engine's own
+        if self.refinement == "local":
+            self.hypothesis_refinement_agent = get_local_refinement_engine(self.knowledge_base)
+        else:
+            self.hypothesis_refinement_agent = get_hypothesis_refinement_agent()
+        self.diagnosis_treatment_agent = get_diagnosis_treatment_agent()
+        logger.info("✅ All agents initialized")
+
+    def setup_workflow(self):
+        logger.info("🔄 Setting up fast diagnosis workflow...")
+        self.step_dependencies = FAST_STEP_DEPENDENCIES
+        workflow = StateGraph(MedicalDiagnosisState)
+        self._add_step(workflow, "assessment", self._assessment_step, self._assessment_step_async)
+        self._add_step(workflow, "hypothesis_generation", self._hypothesis_generation_step, self._hypothesis_generation_step_async)
+        self._add_step(workflow, "clarifying_questions", self._clarifying_questions_step, self._clarifying_questions_step_async)
+        self._add_step(workflow, "treatment_prefetch", self._treatment_prefetch_step, self._treatment_prefetch_step_async)
+        self._add_step(workflow, "hypothesis_refinement", self._hypothesis_refinement_step, self._hypothesis_refinement_step_async)
+        self._add_step(workflow, "diagnosis_and_treatment", self._diagnosis_and_treatment_step, self._diagnosis_and_treatment_step_async)
+        self._connect_steps(workflow, self.step_dependencies, self._shortcuts())
+        self.builder = workflow
+        self.app = workflow.compile()
+        logger.info("✅ Workflow setup complete\n")
+
+    # --- Fused steps ---
+
+    def _assessment_update(self, combined, results) -> dict:
+        return {
+            **self._initial_assessment_update(combined.assessment),
+            **self._retrieval_update(results),
+            "current_step": "hypothesis_generation"
+        }
+
+    def _assessment_queries(self, combined) -> List[str]:
+        # Generated queries plus the ones taken straight from the assessment
+        state = {"symptom_analysis": combined.assessment.model_dump()}
+        return self._query_texts(combined) + self._symptom_queries(state)
+
+    def _assess(self, symptoms: str, config: RunnableConfig) -> dict:
+        return self.assessment_query_agent.invoke(InitialQuery(text=symptoms).model_dump(), config).assessment.model_dump()
+
+    async def _aassess(self, symptoms: str, config: RunnableConfig) -> dict:
+        combined = await self.assessment_query_agent.ainvoke(InitialQuery(text=symptoms).model_dump(), config)
+        return combined.assessment.model_dump()
+
+    @traceable(name="Fast Step 1: Assessment and Retrieval")
+    def _assessment_step(self, state: MedicalDiagnosisState) -> dict:
+        logger.info("Executing Fast Step 1: Assessment and Retrieval")
+        combined = self.assessment_query_agent.invoke(InitialQuery(text=state["user_symptoms"]).model_dump())
+        return self._assessment_update(combined, self._search_all(self._assessment_queries(combined)))
+
+    @traceable(name="Fast Step 1: Assessment and Retrieval")
+    async def _assessment_step_async(self, state: MedicalDiagnosisState) -> dict:
+        logger.info("Executing Fast Step 1: Assessment and Retrieval")
+        combined = await self.assessment_query_agent.ainvoke(InitialQuery(text=state["user_symptoms"]).model_dump())
+        return self._assessment_update(combined, await self._search_all_async(self._assessment_queries(combined)))
+
+    def _diagnosis_and_treatment_inputs(self, state: MedicalDiagnosisState) -> dict:
+        chunks = state.get("treatment_chunks") or {}
+        if not chunks and state.get("diagnosis_path") == "early_exit":
+            # An early exit starts this step alongside the prefetch rather than after it
+            chunks = self._prefetch_treatment_knowledge(state)["treatment_chunks"]
+        treatment_knowledge = "\n\n".join(
+            f"### {condition}\n{self._passages_text(chunk_ids)}" for condition, chunk_ids in chunks.items()
+        )
+        return {
+            "refined_diagnosis": state["differential_diagnosis"],
+            "treatment_knowledge": treatment_knowledge or self._retrieved_knowledge(state)
+        }
+
+    def _diagnosis_and_treatment_update(self, combined) -> dict:
+        return {
+            **self._final_diagnosis_update(combined.final_diagnosis),
+            **self._treatment_plan_update(combined.treatment_plan)
+        }
+
+    def _fallback_update(self, name: str, state: MedicalDiagnosisState) -> dict:
+        # The fused steps fall back like the first and last of the steps they fuse
+        fused = {"assessment": "initial_assessment", "diagnosis_and_treatment": "finalize_diagnosis"}
+        return super()._fallback_update(fused.get(name, name), state)
+
+    @traceable(name="Fast Step 4: Final Diagnosis and Treatment Plan")
+    def _diagnosis_and_treatment_step(self, state: MedicalDiagnosisState) -> dict:
+        logger.info("Executing Fast Step 4: Final Diagnosis and Treatment Plan")
+        combined = self.diagnosis_treatment_agent.invoke(self._diagnosis_and_treatment_inputs(state))
+        return self._diagnosis_and_treatment_update(combined)
+
+    @traceable(name="Fast Step 4: Final Diagnosis and Treatment Plan")
+    async def _diagnosis_and_treatment_step_async(self, state: MedicalDiagnosisState) -> dict:
+        logger.info("Executing Fast Step 4: Final Diagnosis and Treatment Plan")
+        combined = await self.diagnosis_treatment_agent.ainvoke(self._diagnosis_and_treatment_inputs(state))
+        return self._diagnosis_and_treatment_update(combined)
+
+
+WORKFLOW_VARIANTS = {
+    "standard": MedicalDiagnosisWorkflow,
+    "fast": FastDiagnosisWorkflow,
+}
@@ -1,35 +1,262 @@
 
 # Imports
+import asyncio
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from .metrics import DiagnosisMetricsHandler, get_workflow_metrics, with_callbacks
 from .state import MedicalDiagnosisState
+from .sessions import ANSWERS_STEP, DEFAULT_SESSIONS_PATH, open_checkpointer
+from .streaming import StructuredTextStream, chunk_text
 from agents import (
     get_initial_assessment_agent,
     get_information_gathering_agent,
+    get_local_query_generator,
     get_hypothesis_generation_agent,
     get_clarifying_question_agent,
     get_hypothesis_refinement_agent,
+    get_local_refinement_engine,
+    get_refinement_narrative_agent,
     get_final_diagnosis_agent,
     get_treatment_plan_agent,
     InitialQuery
 )
+from knowledge.subjects import TREATMENT_SUBJECTS
+from llm.resilience import DIAGNOSIS_DEADLINE_SECONDS, check_deadline, remaining_seconds, with_deadline
 from utils.logging_utils import logger
-from langgraph.graph import StateGraph, END
+from langchain_core.documents import Document
+from langchain_core.runnables import RunnableConfig, RunnableLambda
+from langgraph.graph import StateGraph, START, END
 from langsmith import traceable
 
+# Knowledge base searches are blocking (embedding + FAISS), so the async
+# workflow runs them on a shared thread pool
+RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", "8"))
+
+# Batch runs: diagnoses in flight at once, and how many finished results may
+# wait behind a slow earlier case (as a multiple of max_concurrency)
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+REORDER_WINDOW_FACTOR = 4
+
+# A batch case is either the symptom text or {"symptoms": ..., "patient_info": {...}}
+Case = Union[str, Dict]
+
+# Treatment passages are prefetched for this many leading hypotheses
+TREATMENT_PREFETCH_HYPOTHESES = 3
+
+# Step -> steps whose output it reads. The graph is wired from this table, so
+# independent steps run in parallel and a step starts once all of its
+# dependencies have finished.
+STEP_DEPENDENCIES: Dict[str, List[str]] = {
+    "initial_assessment": [],
+    "information_gathering": ["initial_assessment"],
+    "symptom_retrieval": ["initial_assessment"],
+    "hypothesis_generation": ["information_gathering", "symptom_retrieval"],
+    "clarifying_questions": ["hypothesis_generation"],
+    "treatment_prefetch": ["hypothesis_generation"],
+    "hypothesis_refinement": ["clarifying_questions"],
+    "finalize_diagnosis": ["hypothesis_refinement"],
+    "treatment_plan": ["finalize_diagnosis", "treatment_prefetch"],
+}
+
+# Speculative mode also drafts the treatment plan for the leading hypothesis
+# as soon as hypotheses exist, in parallel with questions and refinement
+SPECULATIVE_STEP_DEPENDENCIES: Dict[str, List[str]] = {
+    **STEP_DEPENDENCIES,
+    "speculative_treatment": ["hypothesis_generation"],
+    "treatment_plan": ["finalize_diagnosis", "treatment_prefetch", "speculative_treatment"],
+}
+
+# Local refinement computes the refined probabilities in-process; the LLM only
+# writes the narrative refinement_summary, in parallel with the final diagnosis
+NARRATIVE_STEP_DEPENDENCIES: Dict[str, List[str]] = {
+    "refinement_narrative": ["hypothesis_refinement"],
+}
+
+SPECULATIVE_TREATMENT = os.getenv("SPECULATIVE_TREATMENT", "false").lower() in ("1", "true", "yes")
+
+# Steps an anytime (budgeted) diagnosis skips when the time left won't cover
+# them and the required steps after them
+OPTIONAL_STEPS = ("clarifying_questions", "hypothesis_refinement", "treatment_plan", "speculative_treatment",
+                  "refinement_narrative")
+
+# Early exit: when hypothesis generation already has a dominant hypothesis
+# (at least this probability, and this far ahead of the runner-up), the
+# clarifying questions and refinement are skipped
+EARLY_EXIT = os.getenv("EARLY_EXIT", "false").lower() in ("1", "true", "yes")
+EARLY_EXIT_PROBABILITY = float(os.getenv("EARLY_EXIT_PROBABILITY", "0.85"))
+EARLY_EXIT_MARGIN = float(os.getenv("EARLY_EXIT_MARGIN", "0.5"))
+
+# Information gathering search queries: "llm" asks the information gathering
+# agent, "local" builds them in-process from the assessment and the corpus
+# symptom synonym table (agents/local_query_generator.py)
+QUERY_GENERATORS = ("llm", "local")
+QUERY_GENERATOR = os.getenv("QUERY_GENERATOR", "llm")
+
+# Hypothesis refinement: "llm" asks the refinement agent, "local" applies a
+# Bayesian update over the knowledge base's likelihood table
+# (agents/local_refinement.py)
+REFINEMENT_ENGINES = ("llm", "local")
+REFINEMENT_ENGINE = os.getenv("REFINEMENT_ENGINE", "llm")
+
+
+def critical_path_report(step_timings: Dict[str, float],
+                         dependencies: Dict[str, List[str]] = STEP_DEPENDENCIES) -> dict:
+    """
+    Compare a run's step timings run back to back against its critical path
+
+    `sequential_seconds` is what the steps cost as a strict chain (the sum of
+    all steps); `critical_path_seconds` is the longest dependency chain, which
+    bounds wall time when independent steps run in parallel.
+    """
+    finish: Dict[str, float] = {}
+    previous: Dict[str, Optional[str]] = {}
+
+    def finish_time(step: str) -> float:
+        if step not in finish:
+            ready, previous[step] = 0.0, None
+            for dependency in dependencies.get(step, []):
+                if dependency in step_timings and finish_time(dependency) > ready:
+                    ready, previous[step] = finish_time(dependency), dependency
+            finish[step] = ready + step_timings[step]
+        return finish[step]
+
+    if not step_timings:
+        return {"sequential_seconds": 0.0, "critical_path_seconds": 0.0, "critical_path": [], "parallel_saving_seconds": 0.0}
+    last = max(step_timings, key=finish_time)
+    path = [last]
+    while previous[path[-1]]:
+        path.append(previous[path[-1]])
+    sequential = sum(step_timings.values())
+    return {
+        "sequential_seconds": round(sequential, 4),
+        "critical_path_seconds": round(finish[last], 4),
+        "critical_path": path[::-1],
+        "parallel_saving_seconds": round(sequential - finish[last], 4),
+    }
+
+
+def _hypotheses_summary(differential: dict) -> str:
+    """'Migraine 80%, Tension Headache 20%' for logs"""
+    return ", ".join(f"{h.get('condition')} {h.get('probability', 0):.0%}" for h in differential.get("hypotheses", []))
+
+
+def dominant_hypothesis(differential: dict, probability: float, margin: float) -> Optional[dict]:
+    """The leading hypothesis if it has at least `probability` and leads the runner-up by `margin`, else None"""
+    ranked = sorted(differential.get("hypotheses", []), key=lambda h: h.get("probability", 0.0), reverse=True)
+    if not ranked:
+        return None
+    runner_up = ranked[1].get("probability", 0.0) if len(ranked) > 1 else 0.0
+    leading = ranked[0].get("probability", 0.0)
+    return ranked[0] if leading >= probability and leading - runner_up >= margin else None
+
+
+def step_priorities(dependencies: Dict[str, List[str]]) -> Dict[str, int]:
+    """
+    LLM rate limiter priority per step: its depth in the dependency graph
+
+    Deeper steps belong to diagnoses closer to done, so when quota is short
+    they are served first and diagnoses in flight finish before new ones
+    start. Speculative work and the refinement narrative are off the
+    critical path and are served last.
+    """
+    depth: Dict[str, int] = {}
+
+    def step_depth(step: str) -> int:
+        if step not in depth:
+            depth[step] = 1 + max((step_depth(dependency) for dependency in dependencies.get(step, [])), default=0)
+        return depth[step]
+
+    priorities = {step: step_depth(step) for step in dependencies}
+    for step in ("speculative_treatment", "refinement_narrative"):
+        if step in priorities:
+            priorities[step] = 0
+    return priorities
+
 
 class MedicalDiagnosisWorkflow:
-    """Linear workflow for medical diagnosis using a stub executor"""
-    def __init__(self, knowledge_base):
+    """
+    Multi-step medical diagnosis workflow
+
+    Steps form the dependency graph in STEP_DEPENDENCIES: retrieval from the
+    assessment runs alongside search query generation, and treatment passages
+    for the leading hypotheses are fetched while questions are asked and the
+    diagnosis is refined.
+
+    With speculative=True the treatment plan for the leading hypothesis is
+    drafted in parallel too, and kept if the final diagnosis agrees with it;
+    see speculation_metrics().
+
+    Runs synchronously through run_diagnosis, or on an event loop through
+    run_diagnosis_async / astream_diagnosis. Agents are stateless and the
+    knowledge base is read-only, so one workflow instance can serve many
+    concurrent diagnoses.
+
+    With early_exit=True (EARLY_EXIT, off by default), a differential with a dominant
+    hypothesis goes straight to the final diagnosis, skipping the clarifying
+    questions and refinement; result["diagnosis_path"] says which way it went.
+
+    query_generator="local" (QUERY_GENERATOR) builds the information
+    gathering search queries without an LLM call, and refinement="local"
+    (REFINEMENT_ENGINE) refines the hypotheses without one, leaving the LLM
+    only the narrative summary, written alongside the final diagnosis.
+
+    run_diagnosis(budget_seconds=...) is the anytime mode: steps that won't
+    fit in the budget are skipped or fall back to what the state already
+    has, so a final_diagnosis always comes back, with "elided_steps".
+
+    run_diagnosis answers the clarifying questions with placeholders. To ask
+    a real patient, start_session pauses before hypothesis refinement and
+    resume_session continues with the answers (see workflow.sessions).
+    update_session re-diagnoses a finished session after a follow-up message,
+    re-running only the steps the new information affects.
+    """
+    # Steps whose output text astream_diagnosis_events streams token by token
+    streamed_steps = ("finalize_diagnosis", "treatment_plan")
+
+    def __init__(self, knowledge_base, retrieval_workers: int = None, speculative: bool = None,
+                 sessions_path: str = None, early_exit: bool = None, query_generator: str = None,
+                 refinement: str = None):
         self.knowledge_base = knowledge_base
+        self.query_generator = query_generator or QUERY_GENERATOR
+        self.refinement = refinement or REFINEMENT_ENGINE
+        self.early_exit = EARLY_EXIT if early_exit is None else early_exit
+        self.early_exit_probability = EARLY_EXIT_PROBABILITY
+        self.early_exit_margin = EARLY_EXIT_MARGIN
+        self.sessions_path = sessions_path or DEFAULT_SESSIONS_PATH
+        self._session_app = None
+        self._session_lock = threading.Lock()
+        self.speculative = SPECULATIVE_TREATMENT if speculative is None else speculative
+        self.step_dependencies = SPECULATIVE_STEP_DEPENDENCIES if self.speculative else STEP_DEPENDENCIES
+        if self.refinement == "local":
+            self.step_dependencies = {**self.step_dependencies, **NARRATIVE_STEP_DEPENDENCIES}
+        self._speculation_lock = threading.Lock()
+        self._speculation_stats = {"hits": 0, "misses": 0, "saved_seconds": 0.0, "wasted_seconds": 0.0}
+        self.retrieval_executor = ThreadPoolExecutor(
+            max_workers=retrieval_workers or RETRIEVAL_WORKERS,
+            thread_name_prefix="retrieval"
+        )
         self.setup_agents()
         self.setup_workflow()
 
     def setup_agents(self):
         logger.info("🤖 Initializing medical diagnosis agents...")
         self.initial_assessment_agent = get_initial_assessment_agent()
-        self.information_gathering_agent = get_information_gathering_agent()
+        if self.query_generator == "local":
+            self.information_gathering_agent = get_local_query_generator()
+        else:
+            self.information_gathering_agent = get_information_gathering_agent()
         self.hypothesis_generation_agent = get_hypothesis_generation_agent()
         self.clarifying_question_agent = get_clarifying_question_agent()
-        self.hypothesis_refinement_agent = get_hypothesis_refinement_agent()
+        if self.refinement == "local":
+            self.hypothesis_refinement_agent = get_local_refinement_engine(self.knowledge_base)
+            self.refinement_narrative_agent = get_refinement_narrative_agent()
+        else:
+            self.hypothesis_refinement_agent = get_hypothesis_refinement_agent()
         self.final_diagnosis_agent = get_final_diagnosis_agent()
         self.treatment_plan_agent = get_treatment_plan_agent()
         logger.info("✅ All agents initialized")
@@ -37,132 +264,598 @@ class MedicalDiagnosisWorkflow:
     def setup_workflow(self):
         logger.info("🔄 Setting up diagnosis workflow...")
         workflow = StateGraph(MedicalDiagnosisState)
-        workflow.add_node("initial_assessment", self._initial_assessment_step)
-        workflow.add_node("information_gathering", self._information_gathering_step)
-        workflow.add_node("hypothesis_generation", self._hypothesis_generation_step)
-        workflow.add_node("clarifying_questions", self._clarifying_questions_step)
-        workflow.add_node("hypothesis_refinement", self._hypothesis_refinement_step)
-        workflow.add_node("final_diagnosis", self._final_diagnosis_step)
-        workflow.add_node("treatment_plan", self._treatment_plan_step)
-        
-        workflow.add_edge("initial_assessment", "information_gathering")
-        workflow.add_edge("information_gathering", "hypothesis_generation")
-        workflow.add_edge("hypothesis_generation", "clarifying_questions")
-        workflow.add_edge("clarifying_questions", "hypothesis_refinement")
-        workflow.add_edge("hypothesis_refinement", "final_diagnosis")
-        workflow.add_edge("final_diagnosis", "treatment_plan")
-        workflow.add_edge("treatment_plan", END)
-        
-        workflow.set_entry_point("initial_assessment")
+        self._add_step(workflow, "initial_assessment", self._initial_assessment_step, self._initial_assessment_step_async)
+        self._add_step(workflow, "information_gathering", self._information_gathering_step, self._information_gathering_step_async)
+        self._add_step(workflow, "symptom_retrieval", self._symptom_retrieval_step, self._symptom_retrieval_step_async)
+        self._add_step(workflow, "hypothesis_generation", self._hypothesis_generation_step, self._hypothesis_generation_step_async)
+        self._add_step(workflow, "clarifying_questions", self._clarifying_questions_step, self._clarifying_questions_step_async)
+        self._add_step(workflow, "treatment_prefetch", self._treatment_prefetch_step, self._treatment_prefetch_step_async)
+        self._add_step(workflow, "hypothesis_refinement", self._hypothesis_refinement_step, self._hypothesis_refinement_step_async)
+        # Node names can't shadow state keys, so this one isn't called "final_diagnosis"
+        self._add_step(workflow, "finalize_diagnosis", self._final_diagnosis_step, self._final_diagnosis_step_async)
+        self._add_step(workflow, "treatment_plan", self._treatment_plan_step, self._treatment_plan_step_async)
+        if self.speculative:
+            self._add_step(workflow, "speculative_treatment", self._speculative_treatment_step, self._speculative_treatment_step_async)
+        if "refinement_narrative" in self.step_dependencies:
+            self._add_step(workflow, "refinement_narrative", self._refinement_narrative_step, self._refinement_narrative_step_async)
+        self._connect_steps(workflow, self.step_dependencies, self._shortcuts())
+        self.builder = workflow
         self.app = workflow.compile()
         logger.info("✅ Workflow setup complete\n")
 
+    @staticmethod
+    def _connect_steps(workflow: StateGraph, dependencies: Dict[str, List[str]],
+                       shortcuts: Dict[str, Tuple[Callable[[dict], bool], str]] = None):
+        """
+        Add edges so each step waits for all of its dependencies
+
+        `shortcuts` maps a step with one dependency to (skip, target): the
+        edge into it becomes conditional, going to `target` instead when
+        skip(state) is true.
+        """
+        shortcuts = shortcuts or {}
+        for step, requires in dependencies.items():
+            if not requires:
+                workflow.set_entry_point(step)
+            elif len(requires) == 1 and step in shortcuts:
+                skip, target = shortcuts[step]
+                def route(state: MedicalDiagnosisState, skip=skip, step=step, target=target) -> str:
+                    return target if skip(state) else step
+                workflow.add_conditional_edges(requires[0], route, [step, target])
+            elif len(requires) == 1:
+                workflow.add_edge(requires[0], step)
+            else:
+                workflow.add_edge(requires, step)
+        required = {dependency for requires in dependencies.values() for dependency in requires}
+        for step in dependencies:
+            if step not in required:
+                workflow.add_edge(step, END)
+
+    def _shortcuts(self) -> Dict[str, Tuple[Callable[[dict], bool], str]]:
+        """The early exit: an edge from hypothesis generation past questions and refinement"""
+        if not self.early_exit:
+            return {}
+        after_refinement = next(step for step, requires in self.step_dependencies.items() if ANSWERS_STEP in requires)
+        return {"clarifying_questions": (lambda state: state.get("diagnosis_path") == "early_exit", after_refinement)}
+
+    def _add_step(self, workflow: StateGraph, name: str, step, async_step):
+        """
+        Register a node that runs `step` under invoke and `async_step` under ainvoke
+
+        Steps return only the state keys they change; the node adds the step's
+        duration to step_timings. A step doesn't start once the diagnosis
+        deadline has passed. In an anytime diagnosis it is elided instead,
+        as it is when it fails or (if optional) won't fit in the time left.
+        """
+        def run(state: MedicalDiagnosisState, config: RunnableConfig) -> dict:
+            if not self._anytime(config):
+                check_deadline(config, name)
+            elif self._should_elide(name, state, config):
+                return self._elided(name, state)
+            start = time.perf_counter()
+            try:
+                update = step(state)
+            except Exception as e:
+                if not self._anytime(config):
+                    raise
+                update = self._elided(name, state, e)
+            return {**update, "step_timings": {name: round(time.perf_counter() - start, 4)}}
+
+        async def arun(state: MedicalDiagnosisState, config: RunnableConfig) -> dict:
+            if not self._anytime(config):
+                check_deadline(config, name)
+            elif self._should_elide(name, state, config):
+                return self._elided(name, state)
+            start = time.perf_counter()
+            try:
+                update = await async_step(state)
+            except Exception as e:
+                if not self._anytime(config):
+                    raise
+                update = self._elided(name, state, e)
+            return {**update, "step_timings": {name: round(time.perf_counter() - start, 4)}}
+
+        workflow.add_node(name, RunnableLambda(run, afunc=arun, name=name))
+
+    def _downstream(self, step: str) -> set:
+        """Steps that depend on `step`, directly or through other steps"""
+        downstream = set()
+        while True:
+            found = {s for s, requires in self.step_dependencies.items() if downstream.union([step]).intersection(requires)}
+            if found <= downstream:
+                return downstream
+            downstream |= found
+
+    # --- Steps ---
+    # Each step has a synchronous and an asynchronous version returning the
+    # same state update; the async one awaits the agent with ainvoke.
+
     @traceable(name="Step 1: Initial Assessment")
-    def _initial_assessment_step(self, state: MedicalDiagnosisState) -> MedicalDiagnosisState:
+    def _initial_assessment_step(self, state: MedicalDiagnosisState) -> dict:
         logger.info("Executing Step 1: Initial Assessment")
         query = InitialQuery(text=state["user_symptoms"])
         assessment = self.initial_assessment_agent.invoke(query.model_dump())
-        state["symptom_analysis"] = assessment.model_dump()
-        logger.debug(f"Symptom Analysis Output: {state['symptom_analysis']}")
-        state["current_step"] = "information_gathering"
-        return state
+        return self._initial_assessment_update(assessment)
+
+    @traceable(name="Step 1: Initial Assessment")
+    async def _initial_assessment_step_async(self, state: MedicalDiagnosisState) -> dict:
+        logger.info("Executing Step 1: Initial Assessment")
+        query = InitialQuery(text=state["user_symptoms"])
+        assessment = await self.initial_assessment_agent.ainvoke(query.model_dump())
+        return self._initial_assessment_update(assessment)
+
+    def _initial_assessment_update(self, assessment) -> dict:
+        symptom_analysis = assessment.model_dump()
+        logger.debug(f"Symptom Analysis Output: {symptom_analysis}")
+        return {"symptom_analysis": symptom_analysis, "current_step": "information_gathering"}
+
+    def _assess(self, symptoms: str, config: RunnableConfig) -> dict:
+        """The symptom analysis of `symptoms`, for use outside the graph"""
+        return self.initial_assessment_agent.invoke(InitialQuery(text=symptoms).model_dump(), config).model_dump()
+
+    async def _aassess(self, symptoms: str, config: RunnableConfig) -> dict:
+        assessment = await self.initial_assessment_agent.ainvoke(InitialQuery(text=symptoms).model_dump(), config)
+        return assessment.model_dump()
+
+    def _search_knowledge(self, query: str) -> List[Document]:
+        """One knowledge base search; errors are logged and yield no documents"""
+        try:
+            return self.knowledge_base.search_medical_knowledge(query, k=3) or []
+        except Exception as e:
+            logger.error(f"Error searching knowledge base for '{query}': {type(e).__name__}: {repr(e)}", exc_info=True)
+            return []
+
+    def _query_texts(self, search_queries) -> List[str]:
+        queries = [q.query for q in getattr(search_queries, 'queries', [])]
+        logger.info(f"Generated Search Queries: {queries}")
+        return queries
+
+    def _retrieval_update(self, results: List[List[Document]]) -> dict:
+        """
+        State update for retrieved documents: their chunk IDs with scores, and their books
+
+        Scores are the index's L2 distances, so a chunk found by several
+        queries keeps its lowest. Parallel retrieval steps' updates are
+        merged by the state reducers.
+        """
+        chunks: Dict[int, float] = {}
+        sources = []
+        for doc in (doc for docs in results for doc in docs):
+            chunk_id, score = int(doc.metadata["chunk_id"]), float(doc.metadata.get("score", 0.0))
+            chunks[chunk_id] = min(score, chunks.get(chunk_id, score))
+            sources.append(doc.metadata.get("source_book", "Unknown"))
+        logger.info(f"Retrieved {len(chunks)} passages from the knowledge base.")
+        logger.debug(f"Retrieved chunks: {chunks}")
+        return {"knowledge_sources": list(dict.fromkeys(sources)), "retrieved_chunks": chunks}
+
+    def _passages_text(self, chunk_ids: Iterable[int]) -> str:
+        """Prompt text for knowledge base passages, read back by chunk ID"""
+        return "\n\n".join(doc.page_content for doc in self.knowledge_base.get_passages(list(chunk_ids)))
+
+    def _retrieved_knowledge(self, state: MedicalDiagnosisState) -> str:
+        return self._passages_text(state.get("retrieved_chunks") or {})
+
+    def _search_all(self, queries: List[str]) -> List[List[Document]]:
+        # Queries are independent; search them side by side
+        return list(self.retrieval_executor.map(self._search_knowledge, queries))
+
+    async def _search_all_async(self, queries: List[str]) -> List[List[Document]]:
+        loop = asyncio.get_running_loop()
+        return await asyncio.gather(*[
+            loop.run_in_executor(self.retrieval_executor, self._search_knowledge, query)
+            for query in queries
+        ])
 
     @traceable(name="Step 2: Information Gathering")
-    def _information_gathering_step(self, state: MedicalDiagnosisState) -> MedicalDiagnosisState:
+    def _information_gathering_step(self, state: MedicalDiagnosisState) -> dict:
         logger.info("Executing Step 2: Information Gathering")
         try:
             search_queries = self.information_gathering_agent.invoke(state["symptom_analysis"])
-            logger.info(f"Generated Search Queries: {[q.query for q in getattr(search_queries, 'queries', [])]}")
-            retrieved_docs = []
-            for query_obj in getattr(search_queries, 'queries', []):
-                docs = self.knowledge_base.search_medical_knowledge(query_obj.query, k=3)
-                if docs:
-                    retrieved_docs.extend(docs)
-            
-            state["knowledge_sources"] = [doc.metadata.get("source_book", "Unknown") for doc in retrieved_docs] if retrieved_docs else []
-            state["retrieved_knowledge"] = "\n\n".join([doc.page_content for doc in retrieved_docs]) if retrieved_docs else ""
-            logger.info(f"Retrieved {len(retrieved_docs)} documents from the knowledge base.")
-            logger.debug(f"Retrieved Knowledge Snippet: {state['retrieved_knowledge'][:200]}...")
+            results = self._search_all(self._query_texts(search_queries))
+        except Exception as e:
+            logger.error(f"Error searching knowledge base: {type(e).__name__}: {repr(e)}", exc_info=True)
+            results = []
+        return {**self._retrieval_update(results), "current_step": "hypothesis_generation"}
 
+    @traceable(name="Step 2: Information Gathering")
+    async def _information_gathering_step_async(self, state: MedicalDiagnosisState) -> dict:
+        logger.info("Executing Step 2: Information Gathering")
+        try:
+            search_queries = await self.information_gathering_agent.ainvoke(state["symptom_analysis"])
+            results = await self._search_all_async(self._query_texts(search_queries))
         except Exception as e:
             logger.error(f"Error searching knowledge base: {type(e).__name__}: {repr(e)}", exc_info=True)
-            state["knowledge_sources"] = []
-            state["retrieved_knowledge"] = ""
-        state["current_step"] = "hypothesis_generation"
-        return state
+            results = []
+        return {**self._retrieval_update(results), "current_step": "hypothesis_generation"}
+
+    def _symptom_queries(self, state: MedicalDiagnosisState) -> List[str]:
+        """Search queries taken straight from the assessment, with no LLM call"""
+        analysis = state["symptom_analysis"]
+        queries = [", ".join(analysis.get("main_symptoms") or []), analysis.get("initial_summary") or ""]
+        return [query for query in queries if query.strip()]
+
+    @traceable(name="Step 2b: Symptom Retrieval")
+    def _symptom_retrieval_step(self, state: MedicalDiagnosisState) -> dict:
+        logger.info("Executing Step 2b: Symptom Retrieval")
+        return self._retrieval_update(self._search_all(self._symptom_queries(state)))
+
+    @traceable(name="Step 2b: Symptom Retrieval")
+    async def _symptom_retrieval_step_async(self, state: MedicalDiagnosisState) -> dict:
+        logger.info("Executing Step 2b: Symptom Retrieval")
+        return self._retrieval_update(await self._search_all_async(self._symptom_queries(state)))
+
+    def _hypothesis_generation_inputs(self, state: MedicalDiagnosisState) -> dict:
+        return {
+            "assessment": state["symptom_analysis"],
+            "retrieved_knowledge": self._retrieved_knowledge(state)
+        }
+
+    def _hypothesis_generation_update(self, differential) -> dict:
+        differential_diagnosis = differential.model_dump()
+        logger.info(f"Generated Differential Diagnosis: {_hypotheses_summary(differential_diagnosis)}")
+        logger.debug(f"Differential Diagnosis: {differential_diagnosis}")
+        dominant = self.early_exit and dominant_hypothesis(
+            differential_diagnosis, self.early_exit_probability, self.early_exit_margin
+        )
+        if dominant:
+            logger.info(f"'{dominant['condition']}' is dominant; skipping clarifying questions and refinement")
+            return {"differential_diagnosis": differential_diagnosis, "diagnosis_path": "early_exit",
+                    "current_step": "final_diagnosis"}
+        return {"differential_diagnosis": differential_diagnosis, "diagnosis_path": "clarified",
+                "current_step": "clarifying_questions"}
 
     @traceable(name="Step 3: Hypothesis Generation")
-    def _hypothesis_generation_step(self, state: MedicalDiagnosisState) -> MedicalDiagnosisState:
+    def _hypothesis_generation_step(self, state: MedicalDiagnosisState) -> dict:
         logger.info("Executing Step 3: Hypothesis Generation")
-        differential = self.hypothesis_generation_agent.invoke({
-            "assessment": state["symptom_analysis"],
-            "retrieved_knowledge": state["retrieved_knowledge"]
-        })
-        state["differential_diagnosis"] = differential.model_dump()
-        logger.info(f"Generated Differential Diagnosis: {state['differential_diagnosis']}")
-        state["current_step"] = "clarifying_questions"
-        return state
+        differential = self.hypothesis_generation_agent.invoke(self._hypothesis_generation_inputs(state))
+        return self._hypothesis_generation_update(differential)
 
-    @traceable(name="Step 4: Clarifying Questions")
-    def _clarifying_questions_step(self, state: MedicalDiagnosisState) -> MedicalDiagnosisState:
-        logger.info("Executing Step 4: Clarifying Questions")
-        questions = self.clarifying_question_agent.invoke({
+    @traceable(name="Step 3: Hypothesis Generation")
+    async def _hypothesis_generation_step_async(self, state: MedicalDiagnosisState) -> dict:
+        logger.info("Executing Step 3: Hypothesis Generation")
+        differential = await self.hypothesis_generation_agent.ainvoke(self._hypothesis_generation_inputs(state))
+        return self._hypothesis_generation_update(differential)
+
+    def _clarifying_questions_inputs(self, state: MedicalDiagnosisState) -> dict:
+        return {
             "differential_diagnosis": state["differential_diagnosis"],
             "assessment": state["symptom_analysis"]
-        })
-        state["questions_asked"] = questions.model_dump()
-        logger.info(f"Generated Clarifying Questions: {state['questions_asked']}")
-        state["user_answers"] = self._simulate_user_answers(questions)
-        logger.info(f"Simulated User Answers: {state['user_answers']}")
-        state["current_step"] = "hypothesis_refinement"
-        return state
-
-    def _simulate_user_answers(self, questions) -> dict:
+        }
+
+    def _clarifying_questions_update(self, questions) -> dict:
+        questions_asked = questions.model_dump()
+        logger.info(f"Generated {len(questions_asked.get('questions', []))} Clarifying Questions")
+        logger.debug(f"Clarifying Questions: {questions_asked}")
+        return {"questions_asked": questions_asked, "current_step": "hypothesis_refinement"}
+
+    @traceable(name="Step 4: Clarifying Questions")
+    def _clarifying_questions_step(self, state: MedicalDiagnosisState) -> dict:
+        logger.info("Executing Step 4: Clarifying Questions")
+        questions = self.clarifying_question_agent.invoke(self._clarifying_questions_inputs(state))
+        return self._clarifying_questions_update(questions)
+
+    @traceable(name="Step 4: Clarifying Questions")
+    async def _clarifying_questions_step_async(self, state: MedicalDiagnosisState) -> dict:
+        logger.info("Executing Step 4: Clarifying Questions")
+        questions = await self.clarifying_question_agent.ainvoke(self._clarifying_questions_inputs(state))
+        return self._clarifying_questions_update(questions)
+
+    def _simulate_user_answers(self, questions_asked: dict) -> dict:
+        """Placeholder answers for runs with no patient to ask; sessions get the real ones"""
         answers = {}
-        for i, q in enumerate(getattr(questions, 'questions', [])):
-            answers[q.question] = f"Simulated answer {i+1}"
+        for i, q in enumerate(questions_asked.get("questions", [])):
+            answers[q["question"]] = f"Simulated answer {i+1}"
+        logger.debug(f"Simulated User Answers: {answers}")
         return answers
 
+    def _user_answers(self, state: MedicalDiagnosisState) -> dict:
+        return state.get("user_answers") or self._simulate_user_answers(state.get("questions_asked") or {})
+
+    def _hypothesis_refinement_inputs(self, state: MedicalDiagnosisState, user_answers: dict) -> dict:
+        return {
+            "differential_diagnosis": state["differential_diagnosis"],
+            "user_answers": user_answers
+        }
+
+    def _hypothesis_refinement_update(self, refined, user_answers: dict) -> dict:
+        differential_diagnosis = refined.model_dump()
+        logger.info(f"Refined Diagnosis: {_hypotheses_summary(differential_diagnosis)}")
+        logger.debug(f"Refined Differential Diagnosis: {differential_diagnosis}")
+        return {"differential_diagnosis": differential_diagnosis, "user_answers": user_answers, "current_step": "final_diagnosis"}
+
     @traceable(name="Step 5: Hypothesis Refinement")
-    def _hypothesis_refinement_step(self, state: MedicalDiagnosisState) -> MedicalDiagnosisState:
+    def _hypothesis_refinement_step(self, state: MedicalDiagnosisState) -> dict:
         logger.info("Executing Step 5: Hypothesis Refinement")
-        refined = self.hypothesis_refinement_agent.invoke({
-            "differential_diagnosis": state["differential_diagnosis"],
-            "user_answers": state["user_answers"]
-        })
-        state["differential_diagnosis"] = refined.model_dump()
-        logger.info(f"Refined Diagnosis: {state['differential_diagnosis']}")
-        state["current_step"] = "final_diagnosis"
-        return state
+        user_answers = self._user_answers(state)
+        refined = self.hypothesis_refinement_agent.invoke(self._hypothesis_refinement_inputs(state, user_answers))
+        return self._hypothesis_refinement_update(refined, user_answers)
+
+    @traceable(name="Step 5: Hypothesis Refinement")
+    async def _hypothesis_refinement_step_async(self, state: MedicalDiagnosisState) -> dict:
+        logger.info("Executing Step 5: Hypothesis Refinement")
+        user_answers = self._user_answers(state)
+        refined = await self.hypothesis_refinement_agent.ainvoke(self._hypothesis_refinement_inputs(state, user_answers))
+        return self._hypothesis_refinement_update(refined, user_answers)
+
+    def _refinement_narrative_update(self, state: MedicalDiagnosisState, narrative) -> dict:
+        """The narrative replaces the local engine's summary, which is kept as likelihood_update"""
+        differential_diagnosis = state["differential_diagnosis"]
+        return {"differential_diagnosis": {
+            **differential_diagnosis,
+            "refinement_summary": narrative.refinement_summary,
+            "likelihood_update": differential_diagnosis.get("refinement_summary"),
+        }}
+
+    @traceable(name="Step 5b: Refinement Narrative")
+    def _refinement_narrative_step(self, state: MedicalDiagnosisState) -> dict:
+        logger.info("Executing Step 5b: Refinement Narrative")
+        narrative = self.refinement_narrative_agent.invoke(self._hypothesis_refinement_inputs(state, state["user_answers"]))
+        return self._refinement_narrative_update(state, narrative)
+
+    @traceable(name="Step 5b: Refinement Narrative")
+    async def _refinement_narrative_step_async(self, state: MedicalDiagnosisState) -> dict:
+        logger.info("Executing Step 5b: Refinement Narrative")
+        narrative = await self.refinement_narrative_agent.ainvoke(self._hypothesis_refinement_inputs(state, state["user_answers"]))
+        return self._refinement_narrative_update(state, narrative)
+
+    def _final_diagnosis_update(self, final) -> dict:
+        final_diagnosis = final.model_dump()
+        logger.info(f"Final Diagnosis: {final.primary_diagnosis} with confidence {final.confidence_score}")
+        logger.debug(f"Final Diagnosis: {final_diagnosis}")
+        return {"final_diagnosis": final_diagnosis, "confidence_score": final.confidence_score, "current_step": "treatment_plan"}
 
     @traceable(name="Step 6: Final Diagnosis")
-    def _final_diagnosis_step(self, state: MedicalDiagnosisState) -> MedicalDiagnosisState:
+    def _final_diagnosis_step(self, state: MedicalDiagnosisState) -> dict:
         logger.info("Executing Step 6: Final Diagnosis")
         final = self.final_diagnosis_agent.invoke({
             "refined_diagnosis": state["differential_diagnosis"]
         })
-        state["final_diagnosis"] = final.model_dump()
-        state["confidence_score"] = final.confidence_score
-        logger.info(f"Final Diagnosis: {state['final_diagnosis']} with confidence {state['confidence_score']}")
-        state["current_step"] = "treatment_plan"
-        return state
+        return self._final_diagnosis_update(final)
+
+    @traceable(name="Step 6: Final Diagnosis")
+    async def _final_diagnosis_step_async(self, state: MedicalDiagnosisState) -> dict:
+        logger.info("Executing Step 6: Final Diagnosis")
+        final = await self.final_diagnosis_agent.ainvoke({
+            "refined_diagnosis": state["differential_diagnosis"]
+        })
+        return self._final_diagnosis_update(final)
+
+    def _lookup_condition(self, condition: str) -> Optional[List[int]]:
+        """Chunk IDs of treatment passages about a condition from the entity index, or None"""
+        try:
+            docs = self.knowledge_base.lookup_condition(condition, limit=5, subjects=list(TREATMENT_SUBJECTS))
+            if docs:
+                logger.info(f"Found {len(docs)} passages about '{condition}' in the entity index.")
+                return [int(doc.metadata["chunk_id"]) for doc in docs]
+        except Exception as e:
+            logger.error(f"Error looking up condition '{condition}': {type(e).__name__}: {repr(e)}", exc_info=True)
+        return None
+
+    def _leading_conditions(self, state: MedicalDiagnosisState) -> List[str]:
+        hypotheses = state["differential_diagnosis"].get("hypotheses", [])
+        ranked = sorted(hypotheses, key=lambda h: h.get("probability", 0.0), reverse=True)
+        return [h["condition"] for h in ranked[:TREATMENT_PREFETCH_HYPOTHESES] if h.get("condition")]
+
+    def _prefetch_treatment_knowledge(self, state: MedicalDiagnosisState) -> dict:
+        chunks = {}
+        for condition in self._leading_conditions(state):
+            chunk_ids = self._lookup_condition(condition)
+            if chunk_ids:
+                chunks[condition.strip().lower()] = chunk_ids
+        return {"treatment_chunks": chunks}
+
+    @traceable(name="Step 4b: Treatment Prefetch")
+    def _treatment_prefetch_step(self, state: MedicalDiagnosisState) -> dict:
+        logger.info("Executing Step 4b: Treatment Prefetch")
+        return self._prefetch_treatment_knowledge(state)
+
+    @traceable(name="Step 4b: Treatment Prefetch")
+    async def _treatment_prefetch_step_async(self, state: MedicalDiagnosisState) -> dict:
+        logger.info("Executing Step 4b: Treatment Prefetch")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.retrieval_executor, self._prefetch_treatment_knowledge, state)
+
+    def _knowledge_about(self, condition: Optional[str], state: MedicalDiagnosisState) -> str:
+        """
+        Passage text about a condition
+
+        Uses the passages prefetched for the leading hypotheses when the
+        condition is one of them, otherwise looks it up in the entity index,
+        falling back to the retrieved knowledge.
+        """
+        chunk_ids = None
+        if condition:
+            chunk_ids = (state.get("treatment_chunks") or {}).get(condition.strip().lower()) or self._lookup_condition(condition)
+        return self._passages_text(chunk_ids) if chunk_ids else self._retrieved_knowledge(state)
+
+    def _condition_knowledge(self, state: MedicalDiagnosisState) -> str:
+        """Passage text about the final diagnosis"""
+        return self._knowledge_about(state["final_diagnosis"].get("primary_diagnosis"), state)
+
+    def _treatment_plan_update(self, plan) -> dict:
+        medications = plan.model_dump()
+        logger.info(f"Generated Treatment Plan for '{medications.get('condition')}': "
+                    f"{len(medications.get('suggestions', []))} suggestions")
+        logger.debug(f"Treatment Plan: {medications}")
+        return {"medications": medications, "current_step": "complete"}
 
     @traceable(name="Step 7: Treatment Plan")
-    def _treatment_plan_step(self, state: MedicalDiagnosisState) -> MedicalDiagnosisState:
+    def _treatment_plan_step(self, state: MedicalDiagnosisState) -> dict:
         logger.info("Executing Step 7: Treatment Plan")
+        speculation = self._resolve_speculation(state)
+        if "medications" in speculation:
+            return speculation
         plan = self.treatment_plan_agent.invoke({
             "final_diagnosis": state["final_diagnosis"],
-            "retrieved_knowledge": state["retrieved_knowledge"]
+            "retrieved_knowledge": self._condition_knowledge(state)
         })
-        state["medications"] = plan.model_dump()
-        logger.info(f"Generated Treatment Plan: {state['medications']}")
-        state["current_step"] = "complete"
-        return state
+        return {**self._treatment_plan_update(plan), **speculation}
 
-    @traceable(name="Medical Diagnosis Workflow")
-    def run_diagnosis(self, symptoms: str, patient_info: dict = None) -> dict:
-        logger.info(f"🩺 Starting medical diagnosis for: {symptoms[:50]}...")
-        initial_state = MedicalDiagnosisState(
+    @traceable(name="Step 7: Treatment Plan")
+    async def _treatment_plan_step_async(self, state: MedicalDiagnosisState) -> dict:
+        logger.info("Executing Step 7: Treatment Plan")
+        speculation = self._resolve_speculation(state)
+        if "medications" in speculation:
+            return speculation
+        loop = asyncio.get_running_loop()
+        knowledge = await loop.run_in_executor(self.retrieval_executor, self._condition_knowledge, state)
+        plan = await self.treatment_plan_agent.ainvoke({
+            "final_diagnosis": state["final_diagnosis"],
+            "retrieved_knowledge": knowledge
+        })
+        return {**self._treatment_plan_update(plan), **speculation}
+
+    # --- Speculative treatment ---
+
+    def _provisional_diagnosis(self, state: MedicalDiagnosisState) -> Optional[dict]:
+        """A final-diagnosis-shaped dict for the leading hypothesis, or None"""
+        hypotheses = state["differential_diagnosis"].get("hypotheses", [])
+        if not hypotheses:
+            return None
+        leading = max(hypotheses, key=lambda h: h.get("probability", 0.0))
+        return {
+            "primary_diagnosis": leading["condition"],
+            "confidence_score": leading.get("probability", 0.0),
+            "final_summary": leading.get("reasoning", ""),
+            "next_steps": [],
+            "disclaimer": ""
+        }
+
+    def _speculative_treatment_update(self, diagnosis: dict, plan) -> dict:
+        logger.info(f"Drafted speculative treatment plan for '{diagnosis['primary_diagnosis']}'")
+        return {"speculation": {"condition": diagnosis["primary_diagnosis"], "plan": plan.model_dump()}}
+
+    @traceable(name="Step 4c: Speculative Treatment Plan")
+    def _speculative_treatment_step(self, state: MedicalDiagnosisState) -> dict:
+        logger.info("Executing Step 4c: Speculative Treatment Plan")
+        diagnosis = self._provisional_diagnosis(state)
+        if diagnosis is None:
+            return {}
+        knowledge = self._knowledge_about(diagnosis["primary_diagnosis"], state)
+        plan = self.treatment_plan_agent.invoke({"final_diagnosis": diagnosis, "retrieved_knowledge": knowledge})
+        return self._speculative_treatment_update(diagnosis, plan)
+
+    @traceable(name="Step 4c: Speculative Treatment Plan")
+    async def _speculative_treatment_step_async(self, state: MedicalDiagnosisState) -> dict:
+        logger.info("Executing Step 4c: Speculative Treatment Plan")
+        diagnosis = self._provisional_diagnosis(state)
+        if diagnosis is None:
+            return {}
+        loop = asyncio.get_running_loop()
+        knowledge = await loop.run_in_executor(
+            self.retrieval_executor, self._knowledge_about, diagnosis["primary_diagnosis"], state
+        )
+        plan = await self.treatment_plan_agent.ainvoke({"final_diagnosis": diagnosis, "retrieved_knowledge": knowledge})
+        return self._speculative_treatment_update(diagnosis, plan)
+
+    def _resolve_speculation(self, state: MedicalDiagnosisState) -> dict:
+        """
+        Check a speculative treatment plan against the final diagnosis
+
+        On a hit, returns the full treatment plan update, with "medications"
+        taken from the speculative plan. On a miss, returns only the
+        speculation outcome and the plan must be regenerated. Returns {} when
+        nothing was speculated. Outcomes are counted in speculation_metrics().
+        """
+        speculation = state.get("speculation") or {}
+        if not speculation.get("condition"):
+            return {}
+        final_condition = state["final_diagnosis"].get("primary_diagnosis") or ""
+        hit = speculation["condition"].strip().lower() == final_condition.strip().lower()
+        # A hit takes the treatment plan call off the critical path; a miss
+        # spent that call for nothing
+        seconds = state.get("step_timings", {}).get("speculative_treatment", 0.0)
+        with self._speculation_lock:
+            self._speculation_stats["hits" if hit else "misses"] += 1
+            self._speculation_stats["saved_seconds" if hit else "wasted_seconds"] += seconds
+        outcome = {**speculation, "hit": hit, "seconds": seconds}
+        if not hit:
+            logger.info(f"Speculative plan for '{speculation['condition']}' discarded; final diagnosis is '{final_condition}'")
+            return {"speculation": outcome}
+        logger.info(f"Committed speculative treatment plan for '{final_condition}', saving {seconds}s")
+        return {"medications": speculation["plan"], "speculation": outcome, "current_step": "complete"}
+
+    def speculation_metrics(self) -> dict:
+        """Speculative treatment hit rate and latency saved across all runs of this workflow"""
+        with self._speculation_lock:
+            stats = dict(self._speculation_stats)
+        attempts = stats["hits"] + stats["misses"]
+        return {
+            **stats,
+            "saved_seconds": round(stats["saved_seconds"], 4),
+            "wasted_seconds": round(stats["wasted_seconds"], 4),
+            "attempts": attempts,
+            "hit_rate": round(stats["hits"] / attempts, 4) if attempts else 0.0
+        }
+
+    # --- Anytime diagnoses ---
+
+    @staticmethod
+    def _anytime(config: RunnableConfig) -> bool:
+        return bool((config.get("configurable") or {}).get("anytime"))
+
+    def _should_elide(self, name: str, state: MedicalDiagnosisState, config: RunnableConfig) -> bool:
+        """
+        Whether an anytime diagnosis skips a step without starting it
+
+        Every step is skipped once the budget is spent. An optional step is
+        also skipped when the time left is less than its typical duration plus
+        that of the required steps after it, so they still get to run;
+        refinement is pointless once the questions were skipped.
+        """
+        remaining = remaining_seconds(config)
+        if remaining is not None and remaining <= 0:
+            return True
+        if name not in OPTIONAL_STEPS:
+            return False
+        if name == ANSWERS_STEP and "clarifying_questions" in (state.get("elided_steps") or []) and not state.get("user_answers"):
+            return True
+        if remaining is None:
+            return False
+        metrics = get_workflow_metrics()
+        needed = [name] + [step for step in self._downstream(name) if step not in OPTIONAL_STEPS]
+        return remaining < sum(metrics.typical_step_seconds(step) or 0.0 for step in needed)
+
+    def _elided(self, name: str, state: MedicalDiagnosisState, error: Exception = None) -> dict:
+        if error is None:
+            logger.info(f"⏭️  Skipping {name}: not enough time left in the budget")
+        else:
+            logger.warning(f"⏭️  {name} failed within the budget ({type(error).__name__}: {error}); using its fallback")
+        return {**self._fallback_update(name, state), "elided_steps": [name]}
+
+    def _fallback_update(self, name: str, state: MedicalDiagnosisState) -> dict:
+        """
+        A step's state update when it's elided: no LLM call, only what the state already supports
+
+        The final diagnosis falls back to the leading hypothesis and the
+        treatment plan to a matching speculative draft; other steps leave
+        the state as it is, except the assessment, which keeps the raw
+        symptom text for the steps after it.
+        """
+        if name == "initial_assessment":
+            return {"symptom_analysis": {"main_symptoms": [], "secondary_symptoms": [],
+                                         "initial_summary": state["user_symptoms"]}}
+        if name == "finalize_diagnosis":
+            return self._fallback_diagnosis(state)
+        if name == "treatment_plan":
+            return self._resolve_speculation(state)
+        return {}
+
+    def _fallback_diagnosis(self, state: MedicalDiagnosisState) -> dict:
+        """The leading hypothesis as the final diagnosis, or an undetermined one without hypotheses"""
+        diagnosis = self._provisional_diagnosis(state) if state.get("differential_diagnosis") else None
+        if diagnosis is None:
+            diagnosis = {"primary_diagnosis": "Undetermined", "confidence_score": 0.0,
+                         "final_summary": "No hypothesis was reached within the time budget.", "next_steps": []}
+        diagnosis["disclaimer"] = "Provisional: the leading hypothesis, not reviewed by the final diagnosis step."
+        logger.info(f"Final Diagnosis (provisional): {diagnosis['primary_diagnosis']} "
+                    f"with confidence {diagnosis['confidence_score']}")
+        return {"final_diagnosis": diagnosis, "confidence_score": diagnosis["confidence_score"], "current_step": "treatment_plan"}
+
+    # --- Running ---
+
+    def _initial_state(self, symptoms: str, patient_info: dict = None) -> MedicalDiagnosisState:
+        return MedicalDiagnosisState(
             user_symptoms=symptoms,
             patient_info=patient_info or {},
             symptom_analysis={},
@@ -173,19 +866,459 @@ class MedicalDiagnosisWorkflow:
             medications={},
             confidence_score=0.0,
             knowledge_sources=[],
-            retrieved_knowledge="",
-            current_step="initial_assessment"
+            retrieved_chunks={},
+            treatment_chunks={},
+            speculation={},
+            elided_steps=[],
+            diagnosis_path="",
+            current_step="initial_assessment",
+            step_timings={}
         )
+
+    @staticmethod
+    def _error_result(message: str) -> dict:
+        return {"error": message, "final_diagnosis": {"primary_diagnosis": "System Error", "confidence_score": 0.0}, "confidence_score": 0.0}
+
+    def _run_config(self, config: Optional[RunnableConfig], deadline_seconds: Optional[float],
+                    budget_seconds: Optional[float] = None):
+        """
+        A metrics collector for one diagnosis, and `config` with it, the
+        diagnosis deadline, and the session and step priorities the LLM rate
+        limiter schedules by. A budget replaces the deadline and makes the
+        diagnosis anytime.
+        """
+        handler = DiagnosisMetricsHandler(self.step_dependencies)
+        if budget_seconds is not None:
+            deadline_seconds = budget_seconds
+        elif deadline_seconds is None:
+            deadline_seconds = DIAGNOSIS_DEADLINE_SECONDS
+        config = with_deadline(with_callbacks(config, handler), deadline_seconds)
+        config["configurable"] = {
+            "session_id": uuid.uuid4().hex,
+            "step_priorities": step_priorities(self.step_dependencies),
+            "anytime": budget_seconds is not None,
+            **(config.get("configurable") or {}),
+        }
+        return handler, config
+
+    def _failed(self, error: Exception, metrics: DiagnosisMetricsHandler) -> dict:
+        logger.error(f"❌ Error in diagnosis workflow: {error}", exc_info=True)
+        result = self._error_result(str(error))
+        result["metrics"] = metrics.summary()
+        get_workflow_metrics().record(result["metrics"], error=True)
+        return result
+
+    def _check_result(self, result, metrics: DiagnosisMetricsHandler) -> dict:
+        if result is None:
+            return self._failed(RuntimeError("Workflow returned None"), metrics)
+        report = critical_path_report(result.get("step_timings", {}), self.step_dependencies)
+        logger.info(f"✅ Diagnosis workflow completed: critical path {report['critical_path_seconds']}s "
+                    f"of {report['sequential_seconds']}s total step time ({' -> '.join(report['critical_path'])})")
+        # Skipped steps ran as no-ops; their node time would skew the typical step durations
+        timings = result.get("step_timings") or {}
+        result["metrics"] = metrics.summary([step for step in result.get("elided_steps") or [] if step not in timings])
+        get_workflow_metrics().record(result["metrics"])
+        return result
+
+    @traceable(name="Medical Diagnosis Workflow")
+    def run_diagnosis(self, symptoms: str, patient_info: dict = None, config: Optional[RunnableConfig] = None,
+                      deadline_seconds: Optional[float] = None, budget_seconds: Optional[float] = None) -> dict:
+        """
+        Run the workflow; result["metrics"] summarizes time, tokens and cache use per step and agent
+
+        Steps and agent calls must finish within deadline_seconds
+        (DIAGNOSIS_DEADLINE_SECONDS by default; 0 for none): agent calls time
+        out and stop retrying as it approaches.
+
+        With budget_seconds the diagnosis is anytime instead: rather than
+        failing at the deadline, steps that won't fit are skipped (optional
+        ones: questions, refinement, treatment plan) or fall back to what the
+        state already has, and the result always carries a final_diagnosis,
+        the leading hypothesis if the final diagnosis step didn't run.
+        result["elided_steps"] lists the steps that were skipped or fell back.
+        """
+        logger.info(f"🩺 Starting medical diagnosis for: {symptoms[:50]}...")
+        metrics, config = self._run_config(config, deadline_seconds, budget_seconds)
+        try:
+            return self._check_result(self.app.invoke(self._initial_state(symptoms, patient_info), config), metrics)
+        except Exception as e:
+            return self._failed(e, metrics)
+
+    @traceable(name="Medical Diagnosis Workflow")
+    async def run_diagnosis_async(self, symptoms: str, patient_info: dict = None,
+                                  config: Optional[RunnableConfig] = None, deadline_seconds: Optional[float] = None,
+                                  budget_seconds: Optional[float] = None) -> dict:
+        """
+        Asynchronous run_diagnosis
+
+        Agents are awaited with ainvoke and knowledge base lookups run on the
+        retrieval thread pool, so many diagnoses can share one event loop:
+
+            results = await asyncio.gather(*(workflow.run_diagnosis_async(s) for s in cases))
+        """
+        logger.info(f"🩺 Starting medical diagnosis for: {symptoms[:50]}...")
+        metrics, config = self._run_config(config, deadline_seconds, budget_seconds)
         try:
-            result = self.app.invoke(initial_state)
-            logger.info("✅ Diagnosis workflow completed")
-            if result is None:
-                logger.error("Workflow returned None")
-                return {"error": "Workflow returned None", "final_diagnosis": {"primary_diagnosis": "System Error", "confidence_score": 0.0}, "confidence_score": 0.0}
-            return result
+            return self._check_result(await self.app.ainvoke(self._initial_state(symptoms, patient_info), config), metrics)
         except Exception as e:
-            logger.error(f"❌ Error in diagnosis workflow: {e}", exc_info=True)
-            return {"error": str(e), "final_diagnosis": {"primary_diagnosis": "System Error", "confidence_score": 0.0}, "confidence_score": 0.0}
+            return self._failed(e, metrics)
+
+    async def astream_diagnosis(self, symptoms: str, patient_info: dict = None,
+                                config: Optional[RunnableConfig] = None,
+                                deadline_seconds: Optional[float] = None) -> AsyncIterator[dict]:
+        """
+        Yield {step_name: state} after each step completes
+
+        Lets a caller show progress while later steps are still running.
+        Runs under the same deadline and metrics as run_diagnosis; errors
+        propagate to the caller.
+        """
+        logger.info(f"🩺 Starting medical diagnosis for: {symptoms[:50]}...")
+        metrics, config = self._run_config(config, deadline_seconds)
+        try:
+            async for update in self.app.astream(self._initial_state(symptoms, patient_info), config):
+                yield update
+        except Exception:
+            get_workflow_metrics().record(metrics.summary(), error=True)
+            raise
+        get_workflow_metrics().record(metrics.summary())
+
+    async def astream_diagnosis_events(self, symptoms: str, patient_info: dict = None,
+                                       config: Optional[RunnableConfig] = None,
+                                       deadline_seconds: Optional[float] = None) -> AsyncIterator[dict]:
+        """
+        Yield structured events as the diagnosis runs (see workflow.streaming)
+
+        A "step" event follows each completed step, the text of the
+        streamed_steps' outputs arrives as "token" events while the model is
+        still writing, and a "result" event with the final state comes last.
+        """
+        logger.info(f"🩺 Starting medical diagnosis for: {symptoms[:50]}...")
+        metrics, config = self._run_config(config, deadline_seconds)
+        streams: Dict[str, StructuredTextStream] = {}
+        completed = set()
+        result = None
+        try:
+            async for event in self.app.astream_events(self._initial_state(symptoms, patient_info), config, version="v2"):
+                kind, name = event["event"], event["name"]
+                node = event.get("metadata", {}).get("langgraph_node")
+                if kind == "on_chat_model_stream" and node in self.streamed_steps:
+                    for field, text in streams.setdefault(node, StructuredTextStream()).feed(chunk_text(event["data"]["chunk"])):
+                        yield {"type": "token", "step": node, "field": field, "text": text}
+                elif kind == "on_chain_end" and not event.get("parent_ids"):
+                    result = event["data"].get("output")
+                elif kind == "on_chain_end" and name == node and name not in completed:
+                    # Nested runs can share the node's name; the node's own output carries its timing
+                    update = event["data"].get("output")
+                    if isinstance(update, dict) and name in update.get("step_timings", {}):
+                        completed.add(name)
+                        seconds = update["step_timings"][name]
+                        update = {key: value for key, value in update.items() if key != "step_timings"}
+                        yield {"type": "step", "step": name, "seconds": seconds, "update": update}
+        except Exception as e:
+            yield {"type": "result", "result": self._failed(e, metrics)}
+            return
+        yield {"type": "result", "result": self._check_result(result, metrics)}
+
+    # --- Sessions ---
+
+    def _sessions(self):
+        """The workflow graph with the session checkpointer, pausing for the patient's answers; built on first use"""
+        with self._session_lock:
+            if self._session_app is None:
+                self._session_app = self.builder.compile(
+                    checkpointer=open_checkpointer(self.sessions_path),
+                    interrupt_before=[ANSWERS_STEP]
+                )
+            return self._session_app
+
+    @staticmethod
+    def _session_config(session_id: str, config: Optional[RunnableConfig]) -> RunnableConfig:
+        config = dict(config or {})
+        config["configurable"] = {**(config.get("configurable") or {}), "thread_id": session_id, "session_id": session_id}
+        return config
+
+    def _session_answers(self, values: dict, answers: Union[Dict[str, str], List[str]]) -> Dict[str, str]:
+        """
+        The session's answers so far plus `answers`, keyed by question; a
+        list answers the session's questions in order
+        """
+        if not isinstance(answers, dict):
+            answers = dict(zip(self._questions(values), answers))
+        return {**(values.get("user_answers") or {}), **answers}
+
+    @staticmethod
+    def _session_status(snapshot) -> Optional[str]:
+        if not snapshot.values:
+            return None
+        return "awaiting_answers" if ANSWERS_STEP in snapshot.next else "complete" if not snapshot.next else "running"
+
+    @staticmethod
+    def _questions(state: dict) -> List[str]:
+        return [q["question"] for q in (state.get("questions_asked") or {}).get("questions", [])]
+
+    def _paused(self, session_id: str, state: dict, metrics: DiagnosisMetricsHandler) -> dict:
+        """A session waiting for answers: the state so far and the questions to put to the patient"""
+        questions = self._questions(state)
+        logger.info(f"⏸️  Session {session_id} waiting for answers to {len(questions)} questions")
+        return {**state, "session_id": session_id, "status": "awaiting_answers", "questions": questions,
+                "metrics": metrics.summary()}
+
+    def _resumed(self, session_id: str, result, metrics: DiagnosisMetricsHandler) -> dict:
+        return {**self._check_result(result, metrics), "session_id": session_id, "status": "complete"}
+
+    def _session_result(self, session_id: str, snapshot, result, metrics: DiagnosisMetricsHandler) -> dict:
+        """A run's result, paused or complete; an early exit finishes without asking anything"""
+        if self._session_status(snapshot) == "awaiting_answers":
+            return self._paused(session_id, result, metrics)
+        return self._resumed(session_id, result, metrics)
+
+    def _unavailable(self, session_id: str, status: Optional[str], reason: str) -> dict:
+        message = f"Unknown session {session_id}" if status is None else f"Session {session_id} {reason} ({status})"
+        return {**self._error_result(message), "session_id": session_id, "status": status}
+
+    def get_session(self, session_id: str) -> Optional[dict]:
+        """
+        A session's latest state with its "status" (awaiting_answers or
+        complete) and, while it waits, its "questions"; None if unknown
+        """
+        snapshot = self._sessions().get_state(self._session_config(session_id, None))
+        status = self._session_status(snapshot)
+        if status is None:
+            return None
+        session = {**snapshot.values, "session_id": session_id, "status": status}
+        if status == "awaiting_answers":
+            session["questions"] = self._questions(snapshot.values)
+        return session
+
+    def start_session(self, symptoms: str, patient_info: dict = None, session_id: str = None,
+                      config: Optional[RunnableConfig] = None, deadline_seconds: Optional[float] = None) -> dict:
+        """
+        Run a diagnosis up to the clarifying questions and pause
+
+        Returns the state so far with "session_id", "status" (awaiting_answers)
+        and "questions". The session is checkpointed to disk; answer it with
+        resume_session, from this process or a later one. A diagnosis that
+        exits early has no questions and comes back complete.
+        """
+        session_id = session_id or uuid.uuid4().hex
+        logger.info(f"🩺 Starting diagnosis session {session_id} for: {symptoms[:50]}...")
+        metrics, config = self._run_config(self._session_config(session_id, config), deadline_seconds)
+        app = self._sessions()
+        try:
+            result = app.invoke(self._initial_state(symptoms, patient_info), config)
+            return self._session_result(session_id, app.get_state(config), result, metrics)
+        except Exception as e:
+            return {**self._failed(e, metrics), "session_id": session_id}
+
+    def resume_session(self, session_id: str, answers: Union[Dict[str, str], List[str]],
+                       config: Optional[RunnableConfig] = None, deadline_seconds: Optional[float] = None) -> dict:
+        """
+        Finish a paused session with the patient's answers
+
+        `answers` maps questions to answers, or lists them in question order.
+        Only the steps after the questions run: refinement, the final
+        diagnosis and the treatment plan.
+        """
+        app = self._sessions()
+        metrics, config = self._run_config(self._session_config(session_id, config), deadline_seconds)
+        try:
+            snapshot = app.get_state(config)
+            status = self._session_status(snapshot)
+            if status != "awaiting_answers":
+                return self._unavailable(session_id, status, "is not waiting for answers")
+            app.update_state(config, {"user_answers": self._session_answers(snapshot.values, answers)},
+                             as_node="clarifying_questions")
+            return self._resumed(session_id, app.invoke(None, config), metrics)
+        except Exception as e:
+            return {**self._failed(e, metrics), "session_id": session_id}
+
+    async def astart_session(self, symptoms: str, patient_info: dict = None, session_id: str = None,
+                             config: Optional[RunnableConfig] = None, deadline_seconds: Optional[float] = None) -> dict:
+        """Asynchronous start_session"""
+        session_id = session_id or uuid.uuid4().hex
+        logger.info(f"🩺 Starting diagnosis session {session_id} for: {symptoms[:50]}...")
+        metrics, config = self._run_config(self._session_config(session_id, config), deadline_seconds)
+        app = self._sessions()
+        try:
+            result = await app.ainvoke(self._initial_state(symptoms, patient_info), config)
+            return self._session_result(session_id, await app.aget_state(config), result, metrics)
+        except Exception as e:
+            return {**self._failed(e, metrics), "session_id": session_id}
+
+    async def aresume_session(self, session_id: str, answers: Union[Dict[str, str], List[str]],
+                              config: Optional[RunnableConfig] = None, deadline_seconds: Optional[float] = None) -> dict:
+        """Asynchronous resume_session"""
+        app = self._sessions()
+        metrics, config = self._run_config(self._session_config(session_id, config), deadline_seconds)
+        try:
+            snapshot = await app.aget_state(config)
+            status = self._session_status(snapshot)
+            if status != "awaiting_answers":
+                return self._unavailable(session_id, status, "is not waiting for answers")
+            await app.aupdate_state(config, {"user_answers": self._session_answers(snapshot.values, answers)},
+                                    as_node="clarifying_questions")
+            return self._resumed(session_id, await app.ainvoke(None, config), metrics)
+        except Exception as e:
+            return {**self._failed(e, metrics), "session_id": session_id}
+
+    # --- Follow-up messages ---
+
+    def _follow_up(self, values: dict, information: str, symptoms: str, analysis: dict) -> Tuple[str, dict, List[str]]:
+        """
+        What a follow-up message changes in a finished session
+
+        Returns the earliest step the message affects, the state update that
+        records it, and the symptoms it adds. New symptoms change the
+        knowledge and the hypotheses, so the diagnosis re-enters at hypothesis
+        generation; anything else (duration, history, how a symptom evolved)
+        reaches the diagnosis through refinement, as one more answer.
+        """
+        def listed(symptom_analysis: dict) -> List[str]:
+            return [s for key in ("main_symptoms", "secondary_symptoms") for s in symptom_analysis.get(key) or []]
+
+        known = {s.strip().lower() for s in listed(values.get("symptom_analysis") or {})}
+        new_symptoms = list(dict.fromkeys(s for s in listed(analysis) if s.strip().lower() not in known))
+        answers = values.get("user_answers") or {}
+        added = sum(question.startswith("Additional information") for question in answers) + 1
+        update = {
+            "user_symptoms": symptoms,
+            "symptom_analysis": analysis,
+            "user_answers": {**answers, f"Additional information {added}": information},
+        }
+        step = "hypothesis_generation" if new_symptoms else ANSWERS_STEP
+        logger.info(f"Follow-up adds symptoms {new_symptoms}; re-entering at {step}")
+        return step, update, new_symptoms
+
+    def _reentry_updates(self, step: str, values: dict) -> List[Tuple[str, dict]]:
+        """
+        (as_node, update) pairs that make `step` the next step of a finished session
+
+        `step` and everything downstream of it run again. The steps they wait
+        on from outside that set keep their checkpointed output and are only
+        marked as finished, the step's own dependencies last and carrying
+        `values`, so each join in the graph fires once. An entry step has
+        none: the diagnosis restarts from the top.
+        """
+        rerun = {step} | self._downstream(step)
+        finished = [dependency for s in self.step_dependencies if s in rerun
+                    for dependency in self.step_dependencies[s] if dependency not in rerun]
+        if not finished:
+            return [(START, values)]
+        finished = sorted(dict.fromkeys(finished), key=lambda dependency: dependency in self.step_dependencies[step])
+        return [(dependency, {}) for dependency in finished[:-1]] + [(finished[-1], values)]
+
+    def update_session(self, session_id: str, information: str, config: Optional[RunnableConfig] = None,
+                       deadline_seconds: Optional[float] = None) -> dict:
+        """
+        Re-diagnose a finished session with a follow-up message from the patient
+
+        The message is assessed together with the earlier symptoms and the
+        new symptom analysis is compared with the session's. Only symptoms not
+        seen before are searched, and their passages are merged into those
+        already retrieved; the diagnosis then re-enters the graph at the
+        earliest step the message affects (see _follow_up) and every other
+        step's output is reused. A follow-up that adds symptoms pauses again
+        for the new clarifying questions; answer them with resume_session.
+
+        The result carries "reentered_at" and "new_symptoms".
+        """
+        app = self._sessions()
+        metrics, config = self._run_config(self._session_config(session_id, config), deadline_seconds)
+        try:
+            snapshot = app.get_state(config)
+            status = self._session_status(snapshot)
+            if status != "complete":
+                return self._unavailable(session_id, status, "has not finished")
+            symptoms = f"{snapshot.values['user_symptoms']}\n{information}"
+            analysis = self._assess(symptoms, config)
+            step, values, new_symptoms = self._follow_up(snapshot.values, information, symptoms, analysis)
+            if new_symptoms:
+                values.update(self._retrieval_update(self._search_all(new_symptoms)))
+            for as_node, update in self._reentry_updates(step, values):
+                app.update_state(config, update, as_node=as_node)
+            result = app.invoke(None, config)
+            return {**self._session_result(session_id, app.get_state(config), result, metrics),
+                    "reentered_at": step, "new_symptoms": new_symptoms}
+        except Exception as e:
+            return {**self._failed(e, metrics), "session_id": session_id}
+
+    async def aupdate_session(self, session_id: str, information: str, config: Optional[RunnableConfig] = None,
+                              deadline_seconds: Optional[float] = None) -> dict:
+        """Asynchronous update_session"""
+        app = self._sessions()
+        metrics, config = self._run_config(self._session_config(session_id, config), deadline_seconds)
+        try:
+            snapshot = await app.aget_state(config)
+            status = self._session_status(snapshot)
+            if status != "complete":
+                return self._unavailable(session_id, status, "has not finished")
+            symptoms = f"{snapshot.values['user_symptoms']}\n{information}"
+            analysis = await self._aassess(symptoms, config)
+            step, values, new_symptoms = self._follow_up(snapshot.values, information, symptoms, analysis)
+            if new_symptoms:
+                values.update(self._retrieval_update(await self._search_all_async(new_symptoms)))
+            for as_node, update in self._reentry_updates(step, values):
+                await app.aupdate_state(config, update, as_node=as_node)
+            result = await app.ainvoke(None, config)
+            return {**self._session_result(session_id, await app.aget_state(config), result, metrics),
+                    "reentered_at": step, "new_symptoms": new_symptoms}
+        except Exception as e:
+            return {**self._failed(e, metrics), "session_id": session_id}
+
+    async def stream_diagnoses(self, cases: Iterable[Case], max_concurrency: int = BATCH_CONCURRENCY) -> AsyncIterator[dict]:
+        """
+        Diagnose many cases, yielding results in input order
+
+        At most max_concurrency diagnoses run at once. Results that finish
+        ahead of an earlier, slower case are held back until it completes;
+        new cases stop starting while more than
+        max_concurrency * REORDER_WINDOW_FACTOR are pending, so memory stays
+        bounded however long the input is. `cases` is consumed lazily.
+        """
+        max_concurrency = max(1, max_concurrency)
+        window = max_concurrency * REORDER_WINDOW_FACTOR
+        remaining = iter(cases)
+        pending: Dict[int, asyncio.Task] = {}
+        next_index = started = 0
+
+        def start_cases():
+            nonlocal started
+            while len(pending) < window and sum(not task.done() for task in pending.values()) < max_concurrency:
+                case = next(remaining, None)
+                if case is None:
+                    return
+                if isinstance(case, str):
+                    case = {"symptoms": case}
+                pending[started] = asyncio.create_task(
+                    self.run_diagnosis_async(case["symptoms"], case.get("patient_info"))
+                )
+                started += 1
+
+        start_cases()
+        try:
+            while pending:
+                head = pending[next_index]
+                if not head.done():
+                    running = [task for task in pending.values() if not task.done()]
+                    await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                    start_cases()
+                    continue
+                del pending[next_index]
+                next_index += 1
+                start_cases()
+                yield head.result()
+        finally:
+            # Consumer stopped early: don't leave diagnoses running
+            for task in pending.values():
+                task.cancel()
 
+    def run_diagnoses(self, cases: Iterable[Case], max_concurrency: int = BATCH_CONCURRENCY) -> List[dict]:
+        """Diagnose many cases concurrently; results are in input order"""
+        async def collect():
+            return [result async for result in self.stream_diagnoses(cases, max_concurrency)]
+        return asyncio.run(collect())
 
-    
+    def close(self):
+        """Shut down the retrieval thread pool"""
+        self.retrieval_executor.shutdown(wait=False)
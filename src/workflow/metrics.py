@@ -0,0 +1,396 @@
+"""
+Workflow Metrics
+----------------
+Per-diagnosis and process-wide latency, token and cache metrics, with no
+dependencies beyond LangChain's callback system.
+
+Every run_diagnosis / run_diagnosis_async / astream_diagnosis_events call
+attaches a DiagnosisMetricsHandler, which records for each step and each
+agent call:
+
+    seconds        wall time
+    queue_seconds  steps: time between all dependencies finishing and the
+                   step starting; agents: time from the call to the model
+                   request (prompt rendering, cache lookup, waiting)
+    prompt_tokens / completion_tokens, retries, hedges, failovers,
+    cache_hits / cache_misses
+
+The summary is attached to the result as result["metrics"] and added to the
+process-wide WorkflowMetrics, which exports Prometheus text and reports
+per-step percentiles and which step dominates the slowest diagnoses:
+
+    metrics = get_workflow_metrics()
+    print(metrics.render_prometheus())
+    print(metrics.summary()["tail"]["dominant_step"])
+"""
+import bisect
+import math
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict, Iterable, List, Optional
+from uuid import UUID
+
+import numpy as np
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from langchain_core.runnables import RunnableConfig
+
+from llm.model_router import FAILOVER_EVENT
+from llm.resilience import HEDGE_EVENT, RETRY_EVENT
+from llm.response_cache import CACHE_EVENT
+
+# Histogram bucket upper bounds, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Recent samples kept per series for percentiles and the tail breakdown
+RECENT_SAMPLES = 2048
+
+
+def with_callbacks(config: Optional[RunnableConfig], *handlers: BaseCallbackHandler) -> RunnableConfig:
+    """A copy of `config` with extra callback handlers, keeping the caller's own"""
+    config = dict(config or {})
+    callbacks = config.get("callbacks")
+    if callbacks is None:
+        config["callbacks"] = list(handlers)
+    elif isinstance(callbacks, list):
+        config["callbacks"] = [*callbacks, *handlers]
+    else:
+        manager = callbacks.copy()
+        for handler in handlers:
+            manager.add_handler(handler, inherit=True)
+        config["callbacks"] = manager
+    return config
+
+
+def _label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Histogram:
+    """Prometheus-style cumulative histogram per label value, plus recent samples for percentiles"""
+
+    def __init__(self, name: str, help_text: str, label: str, buckets=LATENCY_BUCKETS):
+        self.name, self.help_text, self.label = name, help_text, label
+        self.buckets = tuple(buckets)
+        self._series: Dict[str, dict] = {}
+
+    def observe(self, label_value: str, value: float):
+        series = self._series.get(label_value)
+        if series is None:
+            series = self._series[label_value] = {
+                "counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "recent": deque(maxlen=RECENT_SAMPLES)
+            }
+        series["counts"][bisect.bisect_left(self.buckets, value)] += 1
+        series["sum"] += value
+        series["recent"].append(value)
+
+    def percentiles(self) -> Dict[str, Dict[str, float]]:
+        report = {}
+        for label_value, series in sorted(self._series.items()):
+            samples = np.asarray(series["recent"], dtype=np.float64)
+            p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+            report[label_value] = {
+                "count": sum(series["counts"]),
+                "mean": round(series["sum"] / sum(series["counts"]), 4),
+                "p50": round(float(p50), 4), "p95": round(float(p95), 4), "p99": round(float(p99), 4),
+            }
+        return report
+
+    def median(self, label_value: str) -> Optional[float]:
+        series = self._series.get(label_value)
+        return float(np.median(series["recent"])) if series else None
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_value, series in sorted(self._series.items()):
+            label = f'{self.label}="{_label(label_value)}"'
+            cumulative = 0
+            for bound, count in zip([*self.buckets, math.inf], series["counts"]):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else repr(bound)
+                lines.append(f'{self.name}_bucket{{{label},le="{le}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{label}}} {series['sum']:.6f}")
+            lines.append(f"{self.name}_count{{{label}}} {cumulative}")
+        return lines
+
+
+class Counter:
+    """Monotonic counter per label value"""
+
+    def __init__(self, name: str, help_text: str, label: str):
+        self.name, self.help_text, self.label = name, help_text, label
+        self.values: Dict[str, float] = defaultdict(float)
+
+    def inc(self, label_value: str, amount: float = 1):
+        self.values[label_value] += amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for label_value, value in sorted(self.values.items()):
+            lines.append(f'{self.name}{{{self.label}="{_label(label_value)}"}} {value:g}')
+        return lines
+
+
+class WorkflowMetrics:
+    """Process-wide aggregate of per-diagnosis metric summaries"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.diagnosis_seconds = Histogram("diagnosis_seconds", "End-to-end diagnosis wall time", "status")
+        self.step_seconds = Histogram("diagnosis_step_seconds", "Wall time of each workflow step", "step")
+        self.step_queue_seconds = Histogram(
+            "diagnosis_step_queue_seconds", "Time a step waited after its dependencies finished", "step")
+        self.agent_seconds = Histogram("llm_agent_call_seconds", "Agent call wall time per diagnosis", "agent")
+        self.agent_queue_seconds = Histogram(
+            "llm_agent_queue_seconds", "Time from agent calls to their model requests, per diagnosis", "agent")
+        self.counters = {
+            name: Counter(f"llm_{name}_total", help_text, "agent")
+            for name, help_text in (
+                ("calls", "Agent calls"),
+                ("prompt_tokens", "Prompt tokens sent"),
+                ("completion_tokens", "Completion tokens received"),
+                ("retries", "Retried model requests"),
+                ("hedges", "Hedged duplicate model requests"),
+                ("failovers", "Model requests passed to the next backend of the agent's route"),
+                ("cache_hits", "Agent calls answered from the response cache"),
+                ("cache_misses", "Agent calls that missed the response cache"),
+            )
+        }
+        # (total seconds, {step: seconds}) of recent diagnoses, for the tail breakdown
+        self._recent: Deque[tuple] = deque(maxlen=RECENT_SAMPLES)
+
+    def record(self, summary: Dict[str, Any], error: bool = False):
+        with self._lock:
+            self.diagnosis_seconds.observe("error" if error else "ok", summary["total_seconds"])
+            for step, values in summary["steps"].items():
+                self.step_seconds.observe(step, values["seconds"])
+                self.step_queue_seconds.observe(step, values["queue_seconds"])
+            for agent, values in summary["agents"].items():
+                self.agent_seconds.observe(agent, values["seconds"])
+                self.agent_queue_seconds.observe(agent, values["queue_seconds"])
+                for name, counter in self.counters.items():
+                    counter.inc(agent, values[name])
+            if not error:
+                steps = {step: values["seconds"] for step, values in summary["steps"].items()}
+                self._recent.append((summary["total_seconds"], steps))
+
+    def typical_step_seconds(self, step: str) -> Optional[float]:
+        """Median wall time of a step over recent diagnoses, or None before it has run"""
+        with self._lock:
+            return self.step_seconds.median(step)
+
+    def tail_breakdown(self, quantile: float = 0.99) -> Dict[str, Any]:
+        """
+        Mean step times over the diagnoses at or above the `quantile` latency
+
+        The step with the largest share is the one to optimize for tail latency.
+        """
+        with self._lock:
+            recent = list(self._recent)
+        if not recent:
+            return {"quantile": quantile, "threshold_seconds": 0.0, "diagnoses": 0, "steps": {}, "dominant_step": None}
+        threshold = float(np.percentile([total for total, _ in recent], quantile * 100))
+        tail = [steps for total, steps in recent if total >= threshold]
+        names = sorted({step for steps in tail for step in steps})
+        means = {step: round(float(np.mean([steps.get(step, 0.0) for steps in tail])), 4) for step in names}
+        return {
+            "quantile": quantile,
+            "threshold_seconds": round(threshold, 4),
+            "diagnoses": len(tail),
+            "steps": dict(sorted(means.items(), key=lambda item: -item[1])),
+            "dominant_step": max(means, key=means.get) if means else None,
+        }
+
+    def summary(self) -> Dict[str, Any]:
+        """Percentiles per step and agent, counters, and the p99 tail breakdown, as JSON-ready dicts"""
+        with self._lock:
+            report = {
+                "diagnoses": self.diagnosis_seconds.percentiles(),
+                "steps": self.step_seconds.percentiles(),
+                "step_queue": self.step_queue_seconds.percentiles(),
+                "agents": self.agent_seconds.percentiles(),
+                "counters": {name: dict(counter.values) for name, counter in self.counters.items()},
+            }
+        report["tail"] = self.tail_breakdown()
+        return report
+
+    def render_prometheus(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            lines = []
+            for histogram in (self.diagnosis_seconds, self.step_seconds, self.step_queue_seconds,
+                              self.agent_seconds, self.agent_queue_seconds):
+                lines.extend(histogram.render())
+            for counter in self.counters.values():
+                lines.extend(counter.render())
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str):
+        """Write the metrics file atomically, e.g. for node_exporter's textfile collector"""
+        temporary = f"{path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            f.write(self.render_prometheus())
+        os.replace(temporary, path)
+
+    def reset(self):
+        self.__init__()
+
+
+_metrics = WorkflowMetrics()
+
+
+def get_workflow_metrics() -> WorkflowMetrics:
+    return _metrics
+
+
+def _agent_stats() -> Dict[str, float]:
+    return {"calls": 0, "seconds": 0.0, "queue_seconds": 0.0, "prompt_tokens": 0, "completion_tokens": 0,
+            "retries": 0, "hedges": 0, "failovers": 0, "cache_hits": 0, "cache_misses": 0}
+
+
+class DiagnosisMetricsHandler(BaseCallbackHandler):
+    """
+    Collects step and agent metrics for one diagnosis from LangChain callbacks
+
+    Steps are the graph's nodes (runs whose name matches the langgraph_node
+    metadata); agents are runs tagged with "agent" metadata by
+    with_response_cache. Model calls outside an agent are attributed to
+    their step.
+    """
+
+    # Bookkeeping only, so don't hop to a thread for async runs
+    run_inline = True
+
+    def __init__(self, dependencies: Dict[str, List[str]]):
+        self.dependencies = dependencies
+        self._lock = threading.Lock()
+        self.started = time.perf_counter()
+        self._step_runs: Dict[UUID, tuple] = {}
+        self._step_ends: Dict[str, float] = {}
+        self.steps: Dict[str, Dict[str, float]] = {}
+        self._agent_runs: Dict[UUID, tuple] = {}
+        self._parents: Dict[UUID, Optional[UUID]] = {}
+        self._run_agents: Dict[UUID, str] = {}
+        self._llm_agents: Dict[UUID, str] = {}
+        self.agents: Dict[str, Dict[str, float]] = defaultdict(_agent_stats)
+
+    # --- Steps and agents ---
+
+    def on_chain_start(self, serialized, inputs, *, run_id: UUID, parent_run_id: Optional[UUID] = None,
+                       tags=None, metadata: Optional[dict] = None, **kwargs: Any) -> None:
+        now = time.perf_counter()
+        metadata = metadata or {}
+        name = kwargs.get("name")
+        node = metadata.get("langgraph_node")
+        agent = metadata.get("agent")
+        with self._lock:
+            self._parents[run_id] = parent_run_id
+            if agent:
+                self._run_agents[run_id] = agent
+            # Nested runs can share a node's or agent's name (and agents can share their step's); only the outermost counts
+            if agent and name == agent:
+                if parent_run_id not in self._agent_runs:
+                    self._agent_runs[run_id] = (agent, now, None)
+            elif node in self.dependencies and name == node and parent_run_id not in self._step_runs:
+                self._step_runs[run_id] = (node, now)
+
+    def _end_run(self, run_id: UUID):
+        now = time.perf_counter()
+        with self._lock:
+            if run_id in self._step_runs:
+                node, start = self._step_runs.pop(run_id)
+                requires = self.dependencies.get(node, [])
+                # A skipped dependency (see early exit in workflow.graph) doesn't hold a step back
+                ready = max((self._step_ends[dependency] for dependency in requires if dependency in self._step_ends),
+                            default=max(self._step_ends.values(), default=self.started))
+                self._step_ends[node] = now
+                self.steps[node] = {"seconds": round(now - start, 4), "queue_seconds": round(max(0.0, start - ready), 4)}
+            elif run_id in self._agent_runs:
+                agent, start, first_request = self._agent_runs.pop(run_id)
+                stats = self.agents[agent]
+                stats["calls"] += 1
+                stats["seconds"] += now - start
+                stats["queue_seconds"] += (first_request or now) - start
+
+    def on_chain_end(self, outputs, *, run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        self._end_run(run_id)
+
+    def on_chain_error(self, error, *, run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        self._end_run(run_id)
+
+    # --- Model requests ---
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, parent_run_id: Optional[UUID] = None,
+                            tags=None, metadata: Optional[dict] = None, **kwargs: Any) -> None:
+        self._start_request(run_id, parent_run_id, metadata)
+
+    def on_llm_start(self, serialized, prompts, *, run_id: UUID, parent_run_id: Optional[UUID] = None,
+                     tags=None, metadata: Optional[dict] = None, **kwargs: Any) -> None:
+        self._start_request(run_id, parent_run_id, metadata)
+
+    def _start_request(self, run_id: UUID, parent_run_id: Optional[UUID], metadata: Optional[dict]):
+        now = time.perf_counter()
+        metadata = metadata or {}
+        agent = metadata.get("agent") or metadata.get("langgraph_node") or "unknown"
+        with self._lock:
+            self._llm_agents[run_id] = agent
+            self._run_agents[run_id] = agent
+            # The enclosing agent call's queue time ends at its first model request
+            ancestor = parent_run_id
+            while ancestor is not None and ancestor not in self._agent_runs:
+                ancestor = self._parents.get(ancestor)
+            if ancestor is not None:
+                name, start, first_request = self._agent_runs[ancestor]
+                if first_request is None:
+                    self._agent_runs[ancestor] = (name, start, now)
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        prompt_tokens = completion_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                prompt_tokens += usage.get("input_tokens", 0)
+                completion_tokens += usage.get("output_tokens", 0)
+        with self._lock:
+            agent = self._llm_agents.pop(run_id, "unknown")
+            stats = self.agents[agent]
+            stats["prompt_tokens"] += prompt_tokens
+            stats["completion_tokens"] += completion_tokens
+
+    def on_retry(self, retry_state, *, run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        with self._lock:
+            agent = self._run_agents.get(run_id) or self._run_agents.get(parent_run_id, "unknown")
+            self.agents[agent]["retries"] += 1
+
+    def on_custom_event(self, name: str, data: Any, *, run_id: UUID, tags=None,
+                        metadata: Optional[dict] = None, **kwargs: Any) -> None:
+        with self._lock:
+            if name == CACHE_EVENT:
+                self.agents[data["agent"]]["cache_hits" if data["hit"] else "cache_misses"] += 1
+            elif name == RETRY_EVENT:
+                self.agents[data["agent"]]["retries"] += 1
+            elif name == HEDGE_EVENT:
+                self.agents[data["agent"]]["hedges"] += 1
+            elif name == FAILOVER_EVENT:
+                self.agents[data["agent"]]["failovers"] += 1
+
+    # --- Report ---
+
+    def summary(self, skipped: Iterable[str] = ()) -> Dict[str, Any]:
+        """The diagnosis' metrics; `skipped` steps ran as no-ops and are left out"""
+        with self._lock:
+            agents = {
+                agent: {name: round(value, 4) if isinstance(value, float) else value for name, value in stats.items()}
+                for agent, stats in self.agents.items()
+            }
+            steps = {step: values for step, values in self.steps.items() if step not in skipped}
+        return {
+            "total_seconds": round(time.perf_counter() - self.started, 4),
+            "steps": steps,
+            "agents": agents,
+            "slowest_step": max(steps, key=lambda step: steps[step]["seconds"]) if steps else None,
+            "prompt_tokens": sum(stats["prompt_tokens"] for stats in agents.values()),
+            "completion_tokens": sum(stats["completion_tokens"] for stats in agents.values()),
+        }
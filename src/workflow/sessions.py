@@ -0,0 +1,55 @@
+"""
+Persistent diagnosis sessions.
+
+A session runs the workflow up to the clarifying questions and pauses
+before hypothesis refinement; the state is checkpointed to SQLite under
+the session ID, so the patient's answers can arrive later, even after the
+process restarted, and resuming runs only the steps after the pause.
+
+    DIAGNOSIS_SESSIONS_DB   checkpoint database (default data/sessions/checkpoints.sqlite)
+"""
+import asyncio
+import os
+import sqlite3
+from pathlib import Path
+from typing import Any, AsyncIterator, Optional
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import CheckpointTuple
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+DEFAULT_SESSIONS_PATH = os.getenv("DIAGNOSIS_SESSIONS_DB", os.path.join("data", "sessions", "checkpoints.sqlite"))
+
+# The graph pauses before this step until the patient's answers are in
+ANSWERS_STEP = "hypothesis_refinement"
+
+
+class SessionCheckpointer(SqliteSaver):
+    """
+    SQLite checkpointer usable from both invoke and ainvoke
+
+    SqliteSaver only implements the synchronous interface; the async one
+    runs the same calls on a worker thread, so one checkpointer (and one
+    connection) serves sync runs and any number of event loops.
+    """
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config: Optional[RunnableConfig], **kwargs: Any) -> AsyncIterator[CheckpointTuple]:
+        for checkpoint in await asyncio.to_thread(lambda: list(self.list(config, **kwargs))):
+            yield checkpoint
+
+    async def aput(self, *args: Any, **kwargs: Any) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, *args, **kwargs)
+
+    async def aput_writes(self, *args: Any, **kwargs: Any) -> None:
+        await asyncio.to_thread(self.put_writes, *args, **kwargs)
+
+
+def open_checkpointer(path: str = DEFAULT_SESSIONS_PATH) -> SessionCheckpointer:
+    """A checkpointer on the session database at `path`, created if missing"""
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return SessionCheckpointer(conn)
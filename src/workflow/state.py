@@ -2,30 +2,60 @@
 State definition for the medical diagnosis system
 """
 
-from typing import Dict, List, TypedDict, Any
+from typing import Annotated, Dict, List, TypedDict, Any
+
+
+def merge_unique(left: List, right: List) -> List:
+    """Reducer for lists written by parallel branches, keeping each item once in first-seen order"""
+    return list(dict.fromkeys([*left, *right]))
+
+
+def merge_best_scores(left: Dict[int, float], right: Dict[int, float]) -> Dict[int, float]:
+    """Reducer for retrieved chunks from parallel branches, keeping each chunk's best score (the lowest L2 distance)"""
+    merged = dict(left)
+    for chunk_id, score in right.items():
+        merged[chunk_id] = min(score, merged.get(chunk_id, score))
+    return merged
+
+
+def merge_dicts(left: Dict, right: Dict) -> Dict:
+    """Reducer for per-key results written by parallel branches"""
+    return {**left, **right}
 
 
 class MedicalDiagnosisState(TypedDict):
-    """State shared between all agents in the medical diagnosis workflow"""
-    
+    """
+    State shared between all agents in the medical diagnosis workflow
+
+    Steps return only the keys they change. Keys that several parallel
+    branches write to are merged by the reducer in their annotation.
+    Knowledge base passages are referenced by chunk ID; their text is only
+    read from the knowledge base when a prompt is built.
+    """
+
     # Input
     user_symptoms: str
     patient_info: Dict[str, Any]
-    
+
     # Analysis results
     symptom_analysis: Dict[str, Any]  # From initial_assessment_agent
     differential_diagnosis: Dict[str, Any]  # From hypothesis_generation_agent
     questions_asked: Dict[str, Any]  # From clarifying_question_agent
     user_answers: Dict[str, str]  # User's answers to questions
-    
+
     # Final results
     final_diagnosis: Dict[str, Any]  # From final_diagnosis_agent
     medications: Dict[str, Any]  # From treatment_plan_agent
     confidence_score: float
-    
+    speculation: Dict[str, Any]  # Speculative treatment plan: condition, plan, and once resolved hit / seconds
+
     # Knowledge base interaction
-    knowledge_sources: List[str]
-    retrieved_knowledge: str
-    
+    knowledge_sources: Annotated[List[str], merge_unique]  # Books the retrieved passages come from
+    retrieved_chunks: Annotated[Dict[int, float], merge_best_scores]  # Chunk ID -> best search score (L2 distance, lower is closer)
+    treatment_chunks: Dict[str, List[int]]  # Condition -> treatment passage chunk IDs, for the leading hypotheses
+
     # Workflow metadata
     current_step: str
+    elided_steps: Annotated[List[str], merge_unique]  # Steps an anytime diagnosis skipped or fell back on
+    diagnosis_path: str  # "early_exit" when hypothesis generation went straight to the final diagnosis, else "clarified"
+    step_timings: Annotated[Dict[str, float], merge_dicts]  # Node -> seconds
@@ -0,0 +1,73 @@
+"""
+Event streaming for the diagnosis workflow.
+
+MedicalDiagnosisWorkflow.astream_diagnosis_events yields one dict per event:
+
+    {"type": "step", "step": name, "seconds": 1.2, "update": {...}}
+        a workflow step finished; `update` is the state it wrote
+    {"type": "token", "step": name, "field": "final_summary", "text": "..."}
+        more text for a string field of a streamed step's structured output,
+        e.g. "final_summary" or "suggestions.0.suggestion"
+    {"type": "result", "result": {...}}
+        the final state (or the error result), always last
+
+Streamed steps' agents produce JSON; the text is decoded from the partial
+JSON as it arrives, so fields can be shown before the output is complete.
+Responses served from the LLM cache produce no token events, only the step.
+"""
+from typing import Any, Dict, List, Tuple
+
+from langchain_core.utils.json import parse_partial_json
+
+
+def string_fields(value: Any, prefix: str = "") -> Dict[str, str]:
+    """Flatten the string leaves of parsed JSON to {"a.0.b": text}"""
+    if isinstance(value, str):
+        return {prefix: value}
+    if isinstance(value, dict):
+        items = value.items()
+    elif isinstance(value, list):
+        items = enumerate(value)
+    else:
+        return {}
+    fields = {}
+    for key, item in items:
+        fields.update(string_fields(item, f"{prefix}.{key}" if prefix else str(key)))
+    return fields
+
+
+def chunk_text(chunk: Any) -> str:
+    """Text of a chat model chunk: JSON content, or tool call arguments for tool-calling models"""
+    content = getattr(chunk, "content", "")
+    if isinstance(content, list):
+        content = "".join(part if isinstance(part, str) else part.get("text", "") for part in content)
+    if content:
+        return content
+    return "".join(call.get("args") or "" for call in getattr(chunk, "tool_call_chunks", None) or [])
+
+
+class StructuredTextStream:
+    """Turns streamed JSON text into per-field text deltas"""
+
+    def __init__(self):
+        self._raw = ""
+        self._seen: Dict[str, str] = {}
+
+    def feed(self, text: str) -> List[Tuple[str, str]]:
+        """Add a chunk; returns (field, new_text) for every string field that grew"""
+        if not text:
+            return []
+        self._raw += text
+        try:
+            parsed = parse_partial_json(self._raw)
+        except Exception:
+            return []
+        deltas = []
+        for field, value in string_fields(parsed).items():
+            seen = self._seen.get(field, "")
+            # A partial string only ever grows; anything else is a re-parse, so resend it whole
+            delta = value[len(seen):] if value.startswith(seen) else value
+            if delta:
+                deltas.append((field, delta))
+                self._seen[field] = value
+        return deltas
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Test the process-wide LLM client registry (offline; no requests are sent)
+"""
+
+import asyncio
+import os
+import sys
+import threading
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / "src"))
+
+os.environ['LANGCHAIN_TRACING_V2'] = 'false'
+os.environ.setdefault('GOOGLE_API_KEY', 'test')
+
+import requests
+
+from llm.client_registry import ClientRegistry, configure_http_pool, get_client_registry, http_pool_stats
+from llm.llm_config import get_llm
+
+
+def test_same_configuration_reuses_client():
+    registry = ClientRegistry()
+    built = []
+    factory = lambda: built.append(object()) or built[-1]
+    first = registry.get("google", "gemini", {"temperature": 0.0}, factory)
+    second = registry.get("google", "gemini", {"temperature": 0.0}, factory)
+    other = registry.get("google", "gemini", {"temperature": 0.5}, factory)
+
+    assert first is second and first is not other
+    assert len(built) == 2
+    stats = registry.stats()
+    assert stats["clients_created"] == 2 and stats["clients_reused"] == 1
+
+
+def test_concurrent_first_use_builds_once():
+    registry = ClientRegistry()
+    built = []
+    barrier = threading.Barrier(8)
+
+    def fetch():
+        barrier.wait()
+        registry.get("together", "*", {}, lambda: built.append(object()) or built[-1])
+
+    threads = [threading.Thread(target=fetch) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(built) == 1
+    assert registry.stats()["clients_reused"] == 7
+
+
+def test_get_llm_shares_clients():
+    registry = get_client_registry()
+    registry.clear()
+    agents = [get_llm() for _ in range(7)]
+    fused = get_llm(max_tokens=1800)
+
+    assert all(llm is agents[0] for llm in agents)
+    assert fused is not agents[0]
+    stats = registry.stats()
+    assert stats["clients_created"] == 2 and stats["clients_reused"] == 6
+
+
+def test_async_client_follows_event_loop():
+    llm = get_llm()
+
+    async def async_client():
+        return llm.async_client, llm.async_client
+
+    first, same_loop = asyncio.run(async_client())
+    second, _ = asyncio.run(async_client())
+    assert first is same_loop
+    assert first is not second
+
+
+def test_http_pool_configured():
+    session = requests.Session()
+    assert configure_http_pool(session, pool_size=4)
+    adapter = session.get_adapter("https://generativelanguage.googleapis.com")
+    assert adapter._pool_maxsize == 4
+    assert http_pool_stats(session) == {"connections_opened": 0, "requests": 0, "connections_reused": 0}
+    assert not configure_http_pool(object())
+
+
+if __name__ == "__main__":
+    print("🔍 Testing LLM client registry...")
+    test_same_configuration_reuses_client()
+    test_concurrent_first_use_builds_once()
+    test_get_llm_shares_clients()
+    test_async_client_follows_event_loop()
+    test_http_pool_configured()
+    print("\n✅ Client registry tests passed!")
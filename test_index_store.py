@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Test the native knowledge index format (no pickle, header validation)
+"""
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# Add the src directory to Python path
+project_root = Path(__file__).parent
+src_path = project_root / "src"
+sys.path.insert(0, str(src_path))
+
+import numpy as np
+from langchain_core.documents import Document
+
+from knowledge.index_store import KnowledgeIndex, KnowledgeIndexError, CHUNK_TEXT_FILE
+from knowledge.subjects import tag_book
+
+
+def _build_index():
+    documents = [
+        Document(page_content="Migraine is often accompanied by nausea and photophobia.",
+                 metadata={"source_book": "Neurology.txt", "book_type": "medical_textbook"}),
+        Document(page_content="Type 2 diabetes presents with polyuria and polydipsia.",
+                 metadata={"source_book": "Endocrinology.txt", "book_type": "medical_textbook"}),
+        Document(page_content="Tension headache is described as a band-like pressure — not throbbing.",
+                 metadata={"source_book": "Neurology.txt", "book_type": "medical_textbook"}),
+    ]
+    vectors = np.eye(3, 4, dtype="float32")
+    return KnowledgeIndex.build(documents, vectors, "test-model", chunk_size=1500, chunk_overlap=200)
+
+
+def test_round_trip():
+    """Saved index loads back with identical search results and text"""
+    with tempfile.TemporaryDirectory() as tmp:
+        _build_index().save(tmp)
+        index = KnowledgeIndex.load(tmp, embedding_model="test-model", dimension=4)
+
+        assert len(index) == 3
+        assert index.header["chunk_size"] == 1500
+        assert len(index.sources) == 2
+
+        hits = index.search([0.0, 0.0, 1.0, 0.0], k=2)
+        assert hits[0] == (2, 0.0)
+        doc = index.get_document(2)
+        assert doc.page_content.endswith("not throbbing.")
+        assert doc.metadata["source_book"] == "Neurology.txt"
+        assert doc.metadata["chunk_id"] == 2
+
+
+def test_header_validation():
+    """Loading with a different embedding model or dimension is rejected"""
+    with tempfile.TemporaryDirectory() as tmp:
+        _build_index().save(tmp)
+        for kwargs in ({"embedding_model": "other-model"}, {"dimension": 384}):
+            try:
+                KnowledgeIndex.load(tmp, **kwargs)
+            except KnowledgeIndexError:
+                continue
+            raise AssertionError(f"load accepted mismatching {kwargs}")
+
+
+def test_checksum_mismatch():
+    """A modified data file fails checksum verification"""
+    with tempfile.TemporaryDirectory() as tmp:
+        _build_index().save(tmp)
+        text_path = Path(tmp) / CHUNK_TEXT_FILE
+        data = bytearray(text_path.read_bytes())
+        data[0] ^= 0xFF
+        text_path.write_bytes(bytes(data))
+        try:
+            KnowledgeIndex.load(tmp)
+        except KnowledgeIndexError:
+            return
+        raise AssertionError("load accepted a corrupted chunk store")
+
+
+def test_load_skips_checksums_of_untouched_files():
+    """Loading hashes only files touched since save; verify hashes everything"""
+    with tempfile.TemporaryDirectory() as tmp:
+        _build_index().save(tmp)
+        text_path = Path(tmp) / CHUNK_TEXT_FILE
+        stat = text_path.stat()
+        data = bytearray(text_path.read_bytes())
+        data[0] ^= 0xFF
+        text_path.write_bytes(bytes(data))
+        os.utime(text_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+        KnowledgeIndex.load(tmp)
+        for check in (lambda: KnowledgeIndex.load(tmp, verify_checksums=True), lambda: KnowledgeIndex.verify(tmp)):
+            try:
+                check()
+            except KnowledgeIndexError:
+                continue
+            raise AssertionError("a full verification accepted a corrupted chunk store")
+
+
+def test_quantized_rescoring():
+    """Quantized indexes return the same neighbours and exact distances as float32"""
+    rng = np.random.default_rng(7)
+    vectors = rng.normal(size=(300, 16)).astype("float32")
+    documents = [Document(page_content=f"chunk {i}", metadata={"source_book": "Book.txt"}) for i in range(300)]
+    exact = KnowledgeIndex.build(documents, vectors, "test-model", chunk_size=1500, chunk_overlap=200)
+    queries = rng.normal(size=(10, 16)).astype("float32")
+
+    for quantization in ("fp16", "int8"):
+        with tempfile.TemporaryDirectory() as tmp:
+            exact.requantize(quantization).save(tmp)
+            index = KnowledgeIndex.load(tmp)
+            assert isinstance(index.vectors, np.memmap)
+            assert index.memory_usage()["memory_saved_bytes"] > 0
+            for query in queries:
+                expected = exact.search(query, k=5)
+                got = index.search(query, k=5)
+                assert [chunk_id for chunk_id, _ in got] == [chunk_id for chunk_id, _ in expected]
+                assert np.allclose([d for _, d in got], [d for _, d in expected], rtol=1e-4)
+
+
+def test_subject_filter():
+    """Subject-filtered searches only return chunks from matching books"""
+    rng = np.random.default_rng(11)
+    vectors = rng.normal(size=(300, 16)).astype("float32")
+    books = [("Pharmacology.txt", ["pharmacology"]), ("Immunology.txt", ["immunology"])]
+    documents = [
+        Document(page_content=f"chunk {i}",
+                 metadata={"source_book": books[i % 2][0], "subjects": books[i % 2][1]})
+        for i in range(300)
+    ]
+    exact = KnowledgeIndex.build(documents, vectors, "test-model", chunk_size=1500, chunk_overlap=200)
+    pharmacology = np.arange(0, 300, 2)
+    query = rng.normal(size=16).astype("float32")
+    expected = pharmacology[np.argsort(((vectors[pharmacology] - query) ** 2).sum(axis=1))[:5]]
+
+    for quantization in ("none", "int8", "pq"):
+        index = exact if quantization == "none" else exact.requantize(quantization)
+        hits = index.search(query, k=5, subjects=["pharmacology"])
+        assert [chunk_id for chunk_id, _ in hits] == list(expected), quantization
+        assert index.get_document(hits[0][0]).metadata["subjects"] == ["pharmacology"]
+
+    assert exact.search(query, k=5, subjects=["cardiology"]) == []
+    assert exact.subject_counts() == {"immunology": 150, "pharmacology": 150}
+
+
+def test_popular_press_is_exclusive():
+    """Popular-press books never land in a clinical subject filter"""
+    assert tag_book("The Hormone Solution.pdf") == ["popular_press"]
+    assert tag_book("Women, Food, and Hormones.epub") == ["popular_press"]
+    assert tag_book("Period Repair Manual.pdf") == ["popular_press"]
+    assert tag_book("Williams Textbook of Endocrinology.pdf") == ["endocrinology"]
+    assert tag_book("Medical Disorders in Pregnancy.pdf") == ["obstetrics_gynaecology"]
+
+
+def test_entity_lookup():
+    """Conditions resolve through synonyms to the chunks that mention them most"""
+    with tempfile.TemporaryDirectory() as tmp:
+        _build_index().save(tmp)
+        index = KnowledgeIndex.load(tmp)
+
+        assert index.lookup_entity("Migraine without aura") == [(0, 1)]
+        assert index.lookup_entity("Tension-type headache") == [(2, 1)]
+        assert index.lookup_entity("type II diabetes") == []
+        assert index.lookup_entity("Type 2 Diabetes Mellitus (T2DM)") == [(1, 1)]
+        assert index.lookup_entity("Migraine", subjects=["neuroscience"]) == [(0, 1)]
+        assert index.lookup_entity("Migraine", subjects=["pharmacology"]) == []
+
+
+def test_likelihood_table():
+    """Symptom-condition co-occurrences are counted at build time and survive a round trip"""
+    with tempfile.TemporaryDirectory() as tmp:
+        _build_index().save(tmp)
+        table = KnowledgeIndex.load(tmp).likelihoods
+
+        migraine, diabetes = table.condition_row("Migraine without aura"), table.condition_row("Type 2 Diabetes (T2DM)")
+        photophobia, polydipsia = table.symptom_column("photophobia"), table.symptom_column("polydipsia")
+        assert (table.evidence_chunks(migraine, photophobia), table.evidence_chunks(migraine, polydipsia)) == (1, 0)
+        assert table.condition_row("Sumatriptan") is None
+
+        ratios = table.likelihood_ratios([migraine, diabetes, None], [photophobia, polydipsia], [True, True])
+        assert ratios[0, 0] > 1 > ratios[1, 0] and ratios[1, 1] > 1 > ratios[0, 1]
+        assert list(ratios[2]) == [1.0, 1.0]
+        # An absent symptom counts against the conditions that go with it
+        assert table.likelihood_ratios([migraine], [photophobia], [False])[0, 0] < 1
+
+
+if __name__ == "__main__":
+    print("🔍 Testing native knowledge index format...")
+    test_round_trip()
+    test_header_validation()
+    test_checksum_mismatch()
+    test_load_skips_checksums_of_untouched_files()
+    test_quantized_rescoring()
+    test_subject_filter()
+    test_popular_press_is_exclusive()
+    test_entity_lookup()
+    test_likelihood_table()
+    print("\n✅ Knowledge index tests passed!")
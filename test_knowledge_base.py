@@ -33,8 +33,8 @@ def test_knowledge_base():
         print(f"🔍 Testing search with query: '{query}'")
         
         # Check if we have any documents
-        if hasattr(kb, 'vector_store') and kb.vector_store:
-            results = kb.search_knowledge(query, k=2)
+        if kb.load_vector_store():
+            results = kb.search_medical_knowledge(query, k=2)
             print(f"✅ Search returned {len(results)} results")
             for i, result in enumerate(results):
                 print(f"  Result {i+1}: {result.page_content[:100]}...")
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Test per-agent model routes, failover and backend health (offline, against local stand-in servers)
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).parent / "src"))
+
+os.environ['LANGCHAIN_TRACING_V2'] = 'false'
+os.environ.setdefault('GOOGLE_API_KEY', 'test')
+
+from langchain_core.prompts import ChatPromptTemplate
+from pydantic import BaseModel, Field
+
+from llm.model_router import Backend, BackendHealth, ModelRoute, ModelRouter
+from llm.openai_compatible import OpenAICompatibleChat, ProviderError, get_openai_compatible_llm
+from llm.rate_limiter import RateLimiter, set_rate_limiter
+from llm.resilience import is_transient
+from llm.response_cache import ResponseCache, model_fingerprint, schema_hash, set_response_cache, with_response_cache
+from llm.stub_server import StubServer
+
+
+class Hypothesis(BaseModel):
+    condition: str
+    probability: float = Field(ge=0, le=1)
+
+
+class Differential(BaseModel):
+    hypotheses: List[Hypothesis]
+    summary: str
+
+
+PROMPT = [("system", "You are a diagnostician."), ("human", "Headache and fever.")]
+
+
+async def _async_client(llm):
+    return llm.async_client
+
+
+def _route(*servers, slo_seconds=5.0, health=None):
+    router = ModelRouter({"agent": [f"openai:stub-{i}@{server.base_url}" for i, server in enumerate(servers)]},
+                         slo_seconds=slo_seconds, health=health or BackendHealth(failure_threshold=2, cooldown_seconds=60))
+    return router, router.llm_for("agent")
+
+
+def test_routes_from_config():
+    router = ModelRouter(
+        {"initial_assessment": ["google:models/gemini-2.0-flash-lite"],
+         "final_diagnosis": {"backends": ["google:models/gemini-2.5-flash"], "slo_seconds": 8},
+         "default": ["openai:local@http://127.0.0.1:9/v1"]},
+        fallback=["openai:local@http://127.0.0.1:9/v1"],
+    )
+    assert router.route("final_diagnosis").slo_seconds == 8
+    assert [b.name for b in router.route("final_diagnosis").backends] == [
+        "google:models/gemini-2.5-flash", "openai:local@http://127.0.0.1:9/v1"]
+    # The fallback isn't repeated when a route already ends with it
+    assert len(router.route("treatment_plan").backends) == 1
+    assert isinstance(router.llm_for("treatment_plan"), OpenAICompatibleChat)
+
+    route = router.llm_for("initial_assessment")
+    assert isinstance(route, ModelRoute)
+    assert route.model == "models/gemini-2.0-flash-lite"
+    assert ModelRouter().llm_for("initial_assessment").model == os.getenv("GEMINI_MODEL", "models/gemini-2.0-flash")
+    assert Backend.parse("openai:m@http://h:1/v1") == Backend("openai", "m", "http://h:1/v1")
+    for bad in ("gemini", "nowhere:model"):
+        try:
+            Backend.parse(bad)
+            raise AssertionError(f"{bad} should not parse")
+        except ValueError:
+            pass
+
+
+def test_stub_server_structured_output():
+    server = StubServer().start()
+    try:
+        llm = get_openai_compatible_llm("stub", server.base_url)
+        assert llm is get_openai_compatible_llm("stub", server.base_url + "/")
+        structured = llm.with_structured_output(Differential)
+        result = structured.invoke(PROMPT)
+        assert isinstance(result, Differential) and len(result.hypotheses) == 1
+        assert 0 <= result.hypotheses[0].probability <= 1
+        assert asyncio.run(structured.ainvoke(PROMPT)) == result
+        assert llm.invoke(PROMPT).usage_metadata["input_tokens"] > 0
+        # Concurrent first calls share one sync client
+        fresh = OpenAICompatibleChat(model="stub", base_url=server.base_url)
+        with ThreadPoolExecutor(8) as pool:
+            assert len({id(client) for client in pool.map(lambda _: fresh.client, range(8))}) == 1
+        fresh.client.close()
+        # Each event loop gets its own async client, closed when the loop shuts down
+        first = asyncio.run(_async_client(llm))
+        assert first.is_closed and asyncio.run(_async_client(llm)) is not first
+
+        server.error_status = 503
+        try:
+            structured.invoke(PROMPT)
+            raise AssertionError("the stand-in server was told to fail")
+        except ProviderError as e:
+            assert e.status_code == 503 and is_transient(e)
+    finally:
+        server.stop()
+
+
+def test_failover_on_error_opens_circuit():
+    primary, secondary = StubServer(error_status=503).start(), StubServer().start()
+    try:
+        router, route = _route(primary, secondary)
+        structured = route.with_structured_output(Differential)
+        for _ in range(3):
+            assert isinstance(structured.invoke(PROMPT), Differential)
+        # Two consecutive errors open the primary's circuit; the third call goes straight to the secondary
+        assert primary.requests == 2 and secondary.requests == 3
+        health = router.stats()["backends"]
+        assert health[route.backends[0].name]["circuit"] == "open"
+        assert health[route.backends[1].name]["errors"] == 0
+
+        # Every backend failing surfaces the error for the call policy to retry
+        secondary.error_status = 500
+        try:
+            structured.invoke(PROMPT)
+            raise AssertionError("both backends fail")
+        except ProviderError:
+            pass
+    finally:
+        primary.stop()
+        secondary.stop()
+
+
+def test_failover_keys_cache_and_quota():
+    primary, secondary = StubServer(error_status=503).start(), StubServer().start()
+    cache = ResponseCache(path=os.path.join(tempfile.mkdtemp(), "responses.sqlite"))
+    limiter = RateLimiter(rpm=6000)
+    set_response_cache(cache)
+    set_rate_limiter(limiter)
+    try:
+        router, route = _route(primary, secondary)
+        prompt = ChatPromptTemplate.from_messages(PROMPT)
+        agent = with_response_cache("agent", prompt, route.with_structured_output(Differential, method="json_mode"),
+                                    Differential, route)
+        answer = agent.invoke({})
+        # Stored under, and charged to, the backend that answered
+        messages = prompt.invoke({}).to_messages()
+        for backend, stored in ((route.backends[0], False), (route.backends[1], True)):
+            key = cache.make_key(model_fingerprint(route.backend_model(backend.name)), messages, schema_hash(Differential))
+            assert (cache.get("agent", key) is not None) == stored
+        assert limiter.stats()["models"]["stub-1"]["admitted"] == 1
+        assert route._runnables and all("json_mode" in key[2] for key in route._runnables)
+
+        # The second call opens the primary's circuit; lookups then go to the secondary and find the answer
+        agent.invoke({})
+        assert asyncio.run(agent.ainvoke({})) == answer
+        assert secondary.requests == 2
+    finally:
+        primary.stop()
+        secondary.stop()
+        set_response_cache(None)
+        set_rate_limiter(None)
+
+
+def test_failover_on_slo_breach():
+    slow, fast = StubServer(latency=1.0).start(), StubServer(latency=0.05).start()
+    try:
+        router, route = _route(slow, fast, slo_seconds=0.2)
+        structured = route.with_structured_output(Differential)
+        start = time.perf_counter()
+        assert isinstance(structured.invoke(PROMPT), Differential)
+        assert time.perf_counter() - start < 0.6
+        start = time.perf_counter()
+        assert isinstance(asyncio.run(structured.ainvoke(PROMPT)), Differential)
+        assert time.perf_counter() - start < 0.6
+
+        time.sleep(1.0)
+        health = router.stats()["backends"][route.backends[0].name]
+        # The abandoned sync request still finished and counted as a breach
+        assert health["slo_breaches"] >= 1 and health["errors"] == 0
+    finally:
+        slow.stop()
+        fast.stop()
+
+
+def test_half_open_after_cooldown():
+    health = BackendHealth(failure_threshold=1, cooldown_seconds=0.1)
+    health.record("a", 0.5, error=True)
+    assert not health.available("a") and health.stats()["a"]["circuit"] == "open"
+    time.sleep(0.15)
+    assert health.available("a") and health.stats()["a"]["circuit"] == "half_open"
+    health.record("a", 0.2)
+    assert health.stats()["a"]["circuit"] == "closed" and health.stats()["a"]["p50_seconds"] == 0.2
+
+
+if __name__ == "__main__":
+    print("🔍 Testing model routes and failover...")
+    test_routes_from_config()
+    test_stub_server_structured_output()
+    test_failover_on_error_opens_circuit()
+    test_failover_keys_cache_and_quota()
+    test_failover_on_slo_breach()
+    test_half_open_after_cooldown()
+    print("\n✅ Model router tests passed!")
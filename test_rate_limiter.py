@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Test the LLM rate limiter: quota metering, admission order and 429 handling (offline)
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / "src"))
+
+os.environ['LANGCHAIN_TRACING_V2'] = 'false'
+
+from llm.rate_limiter import MAX_TRACKED_SESSIONS, Quota, RateLimiter, SharedBuckets
+from llm.resilience import CallPolicy, DeadlineExceeded, with_deadline
+
+
+def _config(session, step=None, priority=0):
+    return {"metadata": {"langgraph_node": step}, "configurable": {"session_id": session, "step_priorities": {step: priority}}}
+
+
+def test_requests_metered_under_quota():
+    limiter = RateLimiter(rpm=1200, headroom=1.0, burst_seconds=0.05)
+    start = time.perf_counter()
+    for _ in range(10):
+        limiter.admit("model", "agent", 10)
+    elapsed = time.perf_counter() - start
+    # 20 requests/s with a one-request bucket: nine waits of 50ms
+    assert 0.4 <= elapsed < 1.0
+    stats = limiter.stats()["models"]["model"]
+    assert stats["admitted"] == 10 and stats["queued"] >= 8
+
+    unlimited = RateLimiter()
+    start = time.perf_counter()
+    for _ in range(100):
+        unlimited.admit("model", "agent", 10)
+    assert time.perf_counter() - start < 0.1
+
+
+def test_priority_then_fairness():
+    limiter = RateLimiter(rpm=600, headroom=1.0, burst_seconds=0.01)
+    order = []
+
+    async def call(session, step, priority, delay):
+        await asyncio.sleep(delay)
+        await limiter.aadmit("model", step, 10, _config(session, step, priority))
+        order.append((session, step))
+
+    async def main():
+        await limiter.aadmit("model", "first", 10, _config("a"))
+        await asyncio.gather(
+            call("a", "refine", 1, 0.0), call("a", "refine", 1, 0.001),
+            call("b", "refine", 1, 0.002), call("c", "final", 5, 0.003),
+        )
+
+    asyncio.run(main())
+    # Highest priority first, then the session admitted least, then arrival
+    assert order == [("c", "final"), ("b", "refine"), ("a", "refine"), ("a", "refine")]
+
+
+def test_sessions_forgotten():
+    limiter = RateLimiter(rpm=6_000_000, headroom=1.0)
+    for i in range(MAX_TRACKED_SESSIONS + 10):
+        limiter.admit("model", "agent", 10, _config(f"session-{i}"))
+    limiter.admit("model", "agent", 10, _config("session-10"))
+    # Only the most recently admitted sessions are remembered
+    assert len(limiter._admitted_by_session) == MAX_TRACKED_SESSIONS
+    assert "session-0" not in limiter._admitted_by_session
+    assert next(reversed(limiter._admitted_by_session)) == "session-10"
+    assert limiter._admitted_by_session["session-10"] == 2
+
+
+def test_tokens_settled_to_actual_use():
+    limiter = RateLimiter(tpm=6000, headroom=1.0, burst_seconds=10)
+    ticket = limiter.admit("model", "agent", 100)
+    assert ticket.reserved_tokens == 400
+    limiter.settle(ticket, 20)
+    assert limiter.stats()["models"]["model"]["tokens"] == 120
+    # The expected answer size moves toward what the agent returned
+    assert limiter.expected_tokens("model", "agent", 100) < 400
+
+
+def test_deadline_while_queued():
+    limiter = RateLimiter(rpm=6, headroom=1.0, burst_seconds=0.01)
+    limiter.admit("model", "agent", 10)
+    for admit in (lambda config: limiter.admit("model", "agent", 10, config),
+                  lambda config: asyncio.run(limiter.aadmit("model", "agent", 10, config))):
+        try:
+            admit(with_deadline(None, 0.05))
+            assert False, "should give up at the deadline"
+        except DeadlineExceeded:
+            pass
+    assert limiter.stats()["waiting"] == 0
+
+
+def test_rate_limited_calls_slow_the_model():
+    class ResourceExhausted(Exception):
+        pass
+
+    limiter = RateLimiter(rpm=60000, headroom=1.0, burst_seconds=1)
+    policy = CallPolicy(max_retries=2, retry_base_delay=0.001)
+    calls = []
+
+    def request():
+        calls.append(None)
+        if len(calls) == 1:
+            raise ResourceExhausted("429 quota exceeded")
+        return "answer"
+
+    assert policy.call("agent", request, None, Quota(limiter, "model", "agent", 10)) == "answer"
+    stats = limiter.stats()["models"]["model"]
+    assert stats["admitted"] == 2 and stats["throttled"] == 1
+    assert stats["rate_factor"] < 1.0
+
+
+def test_buckets_shared_between_processes():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "quota.sqlite")
+        first = RateLimiter(rpm=60, headroom=1.0, burst_seconds=1, buckets=SharedBuckets(path))
+        second = RateLimiter(rpm=60, headroom=1.0, burst_seconds=1, buckets=SharedBuckets(path))
+        assert first.try_admit("model", "agent", 10) is not None
+        # The other limiter sees the request already taken from the shared bucket
+        assert second.try_admit("model", "agent", 10) is None
+        assert second.try_admit("other-model", "agent", 10) is not None
+
+
+if __name__ == "__main__":
+    print("🔍 Testing LLM rate limiter...")
+    test_requests_metered_under_quota()
+    test_priority_then_fairness()
+    test_sessions_forgotten()
+    test_tokens_settled_to_actual_use()
+    test_deadline_while_queued()
+    test_rate_limited_calls_slow_the_model()
+    test_buckets_shared_between_processes()
+    print("\n✅ Rate limiter tests passed!")
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Test recording agent calls to a cassette and replaying them offline (against a local stand-in server)
+"""
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).parent / "src"))
+
+os.environ['LANGCHAIN_TRACING_V2'] = 'false'
+
+from langchain_core.documents import Document
+from langchain_core.messages import HumanMessage
+from pydantic import BaseModel
+
+import agents
+from agents.initial_assessment_agent import get_initial_assessment_agent
+from llm.cassette import Cassette, CassetteRecorder, cassette_key, set_cassette_recorder
+from llm.model_router import ModelRouter, set_model_router
+from llm.rate_limiter import RateLimiter, set_rate_limiter
+from llm.replay import CassetteMiss, ReplayChatModel
+from llm.response_cache import ResponseCache, schema_hash, set_response_cache
+from llm.stub_server import StubServer
+from llm.usage import TokenUsageHandler
+from workflow import fast_graph, graph
+
+
+class Symptoms(BaseModel):
+    main_symptoms: List[str]
+
+
+class OfflineKnowledgeBase:
+    def _document(self, text, source_book):
+        return Document(page_content=text, metadata={"source_book": source_book, "chunk_id": sum(map(ord, text))})
+
+    def search_medical_knowledge(self, query, k=10, subjects=None):
+        return [self._document(f"{query} passage {i}", "Neurology.txt") for i in range(3)]
+
+    def lookup_condition(self, name, limit=5, subjects=None):
+        return [self._document(f"Treatment of {name}", "Pharmacology.txt")]
+
+    def get_passages(self, chunk_ids):
+        return [Document(page_content=str(chunk_id)) for chunk_id in chunk_ids]
+
+
+def _real_agents():
+    # Other test modules stub the workflow's agents out
+    for module in (graph, fast_graph):
+        for name in agents.__all__:
+            if name.startswith("get_") and hasattr(module, name):
+                setattr(module, name, getattr(agents, name))
+
+
+def _recording(path, server):
+    set_response_cache(ResponseCache(enabled=False))
+    set_cassette_recorder(CassetteRecorder(path))
+    set_model_router(ModelRouter({"default": [f"openai:stub@{server.base_url}"]}))
+
+
+def _replaying(path, latency="0", strict="true"):
+    os.environ["LLM_REPLAY_LATENCY"] = latency
+    os.environ["LLM_REPLAY_STRICT"] = strict
+    set_cassette_recorder(None)
+    set_model_router(ModelRouter({"default": [f"replay:{path}"]}))
+
+
+def _reset():
+    for name in ("LLM_REPLAY_LATENCY", "LLM_REPLAY_STRICT"):
+        os.environ.pop(name, None)
+    set_model_router(None)
+    set_cassette_recorder(None)
+    set_response_cache(None)
+
+
+def test_record_and_replay_agent():
+    path = os.path.join(tempfile.mkdtemp(), "cassette.jsonl")
+    server = StubServer().start()
+    try:
+        _recording(path, server)
+        query = {"text": "I've had a throbbing headache for two days."}
+        recorded = get_initial_assessment_agent().invoke(query)
+        assert server.requests == 1
+        entries = Cassette.load(path).stats()["agents"]["initial_assessment"]
+        assert entries["entries"] == 1 and entries["input_tokens"] > 0
+
+        _replaying(path, latency="0.2")
+        usage = TokenUsageHandler()
+        agent = get_initial_assessment_agent()
+        start = time.perf_counter()
+        assert agent.invoke(query, {"callbacks": [usage]}) == recorded
+        assert time.perf_counter() - start >= 0.2
+        assert asyncio.run(agent.ainvoke(query)) == recorded
+        # Served from the cassette, with the recorded usage, and never from the response cache
+        assert server.requests == 1
+        assert usage.summary()["llm_calls"] == 1 and usage.summary()["input_tokens"] == entries["input_tokens"]
+    finally:
+        server.stop()
+        _reset()
+
+
+def test_unrecorded_prompts():
+    digest = schema_hash(Symptoms)
+    prompts = ["sudden chest pain radiating to the left arm", "throbbing headache with nausea and light sensitivity"]
+    entries = [
+        {"key": cassette_key([HumanMessage(content=prompt)], digest), "agent": "initial_assessment",
+         "schema": digest, "messages": [{"role": "human", "content": prompt}],
+         "response": {"main_symptoms": [f"symptom {i}"]}, "seconds": 1.0 + i}
+        for i, prompt in enumerate(prompts)
+    ]
+    # Strict by default: an unrecorded prompt finds nothing
+    assert Cassette(entries).lookup("unknown", digest, prompts[0]) is None
+    cassette = Cassette(entries, strict=False)
+    assert cassette.lookup(entries[1]["key"], digest) is entries[1]
+    # With strict=False, another prompt for the same schema gets the recording with the closest prompt, every time
+    for _ in range(2):
+        assert cassette.lookup("unknown", digest, "throbbing headache and nausea since yesterday") is entries[1]
+    assert cassette.lookup("unknown", digest, "chest pain on exertion") is entries[0]
+    assert cassette.lookup("unknown", "other schema", prompts[0]) is None
+    assert cassette.stats()["hits"] == 1 and cassette.stats()["misses"] == 4
+    assert cassette.typical_seconds(digest) == 1.5
+
+    path = os.path.join(tempfile.mkdtemp(), "cassette.jsonl")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(json.dumps(entry) for entry in entries))
+    strict = ReplayChatModel(model=path, latency=0.0).with_structured_output(Symptoms)
+    assert strict.invoke([HumanMessage(content=prompts[0])]).main_symptoms == ["symptom 0"]
+    try:
+        strict.invoke([HumanMessage(content="case 9")])
+        raise AssertionError("strict replay should not answer an unrecorded prompt")
+    except CassetteMiss:
+        pass
+
+
+def test_recorded_latency_excludes_queueing():
+    path = os.path.join(tempfile.mkdtemp(), "cassette.jsonl")
+    server = StubServer().start()
+    # One request every half second: the second call waits for quota
+    set_rate_limiter(RateLimiter(rpm=120, headroom=1.0, burst_seconds=0.01))
+    try:
+        _recording(path, server)
+        agent = get_initial_assessment_agent()
+        start = time.perf_counter()
+        for text in ("Sore throat and fever.", "Itchy rash on both arms."):
+            agent.invoke({"text": text})
+        assert time.perf_counter() - start >= 0.4
+        assert all(entry["seconds"] < 0.3 for entry in Cassette.load(path)._by_key.values())
+    finally:
+        server.stop()
+        set_rate_limiter(None)
+        _reset()
+
+
+def test_workflow_replays_offline():
+    _real_agents()
+    path = os.path.join(tempfile.mkdtemp(), "cassette.jsonl")
+    server = StubServer().start()
+    try:
+        _recording(path, server)
+        workflow = graph.MedicalDiagnosisWorkflow(OfflineKnowledgeBase())
+        recorded = workflow.run_diagnosis("Throbbing headache with nausea")
+        workflow.close()
+        assert "error" not in recorded
+        calls = server.requests
+    finally:
+        server.stop()
+
+    try:
+        # Strict: every prompt of the replayed diagnosis was recorded
+        _replaying(path, latency="0.01")
+        workflow = graph.MedicalDiagnosisWorkflow(OfflineKnowledgeBase())
+        replayed = asyncio.run(workflow.run_diagnosis_async("Throbbing headache with nausea"))
+        workflow.close()
+        assert "error" not in replayed
+        assert replayed["final_diagnosis"] == recorded["final_diagnosis"]
+        assert replayed["medications"] == recorded["medications"]
+        assert sum(agent["calls"] for agent in replayed["metrics"]["agents"].values()) == calls
+    finally:
+        _reset()
+
+
+if __name__ == "__main__":
+    print("🔍 Testing LLM record and replay...")
+    test_record_and_replay_agent()
+    test_unrecorded_prompts()
+    test_recorded_latency_excludes_queueing()
+    test_workflow_replays_offline()
+    print("\n✅ Record and replay tests passed!")
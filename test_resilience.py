@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Test agent call deadlines, timeouts, retries and hedging (offline)
+"""
+
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / "src"))
+
+os.environ['LANGCHAIN_TRACING_V2'] = 'false'
+
+from langchain_core.exceptions import OutputParserException
+
+from llm.rate_limiter import Quota, RateLimiter, estimate_tokens
+from llm.resilience import CallPolicy, DeadlineExceeded, LatencyTracker, backoff_delay, is_transient, with_deadline
+
+
+def _flaky(failures, error=ConnectionError):
+    """A request failing `failures` times before answering, and its call count"""
+    calls = []
+
+    def request():
+        calls.append(time.perf_counter())
+        if len(calls) <= failures:
+            raise error("try again")
+        return "answer"
+
+    async def arequest():
+        return request()
+
+    return request, arequest, calls
+
+
+def test_transient_errors_retried():
+    policy = CallPolicy(max_retries=2, retry_base_delay=0.001)
+    request, arequest, calls = _flaky(2)
+    assert policy.call("agent", request) == "answer"
+    assert len(calls) == 3
+
+    request, arequest, calls = _flaky(2)
+    assert asyncio.run(policy.acall("agent", arequest)) == "answer"
+    assert len(calls) == 3
+
+    request, _, calls = _flaky(3)
+    try:
+        policy.call("agent", request)
+        assert False, "should give up after max_retries"
+    except ConnectionError:
+        pass
+    assert len(calls) == 3
+
+
+def test_permanent_errors_not_retried():
+    policy = CallPolicy(max_retries=2, retry_base_delay=0.001)
+    request, _, calls = _flaky(1, error=ValueError)
+    try:
+        policy.call("agent", request)
+        assert False, "ValueError should not be retried"
+    except ValueError:
+        pass
+    assert len(calls) == 1
+    assert not is_transient(DeadlineExceeded())
+    # Malformed structured output comes back the same every time at temperature 0
+    assert not is_transient(OutputParserException("not JSON"))
+    assert 0 <= backoff_delay(3, base=0.5, cap=1.0) <= 1.0
+
+
+def test_slow_call_times_out():
+    policy = CallPolicy(timeout=0.05, max_retries=0)
+
+    async def slow():
+        await asyncio.sleep(1)
+
+    start = time.perf_counter()
+    for run in (lambda: policy.call("agent", lambda: time.sleep(0.3)),
+                lambda: asyncio.run(policy.acall("agent", slow))):
+        try:
+            run()
+            assert False, "should time out"
+        except TimeoutError:
+            pass
+    assert time.perf_counter() - start < 0.5
+
+
+def test_abandoned_calls_dont_block():
+    policy = CallPolicy(timeout=0.05, max_retries=0)
+    for _ in range(40):
+        try:
+            policy.call("agent", lambda: time.sleep(0.5))
+        except TimeoutError:
+            pass
+    # The timed-out requests are still running, but not in the way
+    start = time.perf_counter()
+    assert policy.call("agent", lambda: "answer") == "answer"
+    assert time.perf_counter() - start < 0.05
+
+
+def test_deadline_bounds_calls():
+    policy = CallPolicy(timeout=10, max_retries=5, retry_base_delay=0.001)
+    config = with_deadline(None, 0.05)
+    start = time.perf_counter()
+    try:
+        policy.call("agent", lambda: time.sleep(1), config)
+        assert False, "should stop at the deadline"
+    except TimeoutError:
+        pass
+    assert time.perf_counter() - start < 0.3
+
+    request, _, calls = _flaky(0)
+    try:
+        policy.call("agent", request, {"configurable": {"deadline": time.time() - 1}})
+        assert False, "a passed deadline should not send the request"
+    except DeadlineExceeded:
+        pass
+    assert not calls
+
+
+def test_hedged_request_wins():
+    latencies = LatencyTracker()
+    for _ in range(20):
+        latencies.record("agent", 0.01)
+    policy = CallPolicy(timeout=5, max_retries=0, hedging=True, latencies=latencies)
+
+    calls = []
+
+    def stalls_first():
+        calls.append(None)
+        time.sleep(1 if len(calls) == 1 else 0.01)
+        return len(calls)
+
+    start = time.perf_counter()
+    assert policy.call("agent", stalls_first) == 2
+    assert time.perf_counter() - start < 0.5
+
+    attempts = []
+
+    async def astalls_first():
+        attempts.append(None)
+        await asyncio.sleep(1 if len(attempts) == 1 else 0.01)
+        return len(attempts)
+
+    start = time.perf_counter()
+    assert asyncio.run(policy.acall("agent", astalls_first)) == 2
+    assert time.perf_counter() - start < 0.5
+
+
+def test_hedge_settles_its_quota():
+    latencies = LatencyTracker()
+    for _ in range(20):
+        latencies.record("agent", 0.01)
+    policy = CallPolicy(timeout=5, max_retries=0, hedging=True, latencies=latencies)
+    used = 100 + estimate_tokens("2")
+
+    def stalls_first(calls):
+        def request():
+            calls.append(None)
+            time.sleep(0.3 if len(calls) == 1 else 0.01)
+            return len(calls)
+        return request
+
+    def astalls_first(calls):
+        async def request():
+            calls.append(None)
+            await asyncio.sleep(0.3 if len(calls) == 1 else 0.01)
+            return len(calls)
+        return request
+
+    for run in (lambda quota: policy.call("agent", stalls_first([]), quota=quota),
+                lambda quota: asyncio.run(policy.acall("agent", astalls_first([]), quota=quota))):
+        limiter = RateLimiter(rpm=6000, tpm=1_000_000)
+        assert run(Quota(limiter, "model", "agent", 100)) == 2
+        # Both the attempt and its hedge are charged what they used, not their reservations
+        stats = limiter.stats()["models"]["model"]
+        assert stats["admitted"] == 2 and stats["tokens"] == 2 * used
+
+
+if __name__ == "__main__":
+    print("🔍 Testing agent call policy...")
+    test_transient_errors_retried()
+    test_permanent_errors_not_retried()
+    test_slow_call_times_out()
+    test_abandoned_calls_dont_block()
+    test_deadline_bounds_calls()
+    test_hedged_request_wins()
+    test_hedge_settles_its_quota()
+    print("\n✅ Call policy tests passed!")
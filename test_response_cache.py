@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Test the persistent LLM response cache with a stub structured model
+"""
+
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / "src"))
+
+os.environ['LANGCHAIN_TRACING_V2'] = 'false'
+
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import RunnableLambda
+
+from llm.response_cache import ResponseCache, set_response_cache, with_response_cache
+from agents.information_gathering_agent import SearchQueries, SearchQuery
+
+PROMPT = ChatPromptTemplate.from_messages([("system", "Write search queries."), ("human", "{text}")])
+
+
+class StubModel:
+    model = "stub-model"
+    temperature = 0.0
+
+
+def _agent(prompt=PROMPT, name="information_gathering"):
+    calls = []
+
+    def answer(prompt_value):
+        calls.append(prompt_value)
+        return SearchQueries(queries=[SearchQuery(query=prompt_value.to_messages()[-1].content)])
+
+    return with_response_cache(name, prompt, RunnableLambda(answer), SearchQueries, StubModel()), calls
+
+
+def _cache(**options):
+    path = os.path.join(tempfile.mkdtemp(), "responses.sqlite")
+    cache = ResponseCache(path=path, **options)
+    set_response_cache(cache)
+    return cache
+
+
+def test_repeat_hits_cache():
+    cache = _cache()
+    agent, calls = _agent()
+    first = agent.invoke({"text": "headache"})
+    start = time.perf_counter()
+    second = agent.invoke({"text": "headache"})
+    elapsed = time.perf_counter() - start
+    agent.invoke({"text": "fever"})
+
+    assert first == second
+    assert len(calls) == 2
+    assert elapsed < 0.05
+    stats = cache.stats()
+    assert stats["entries"] == 2
+    assert stats["agents"]["information_gathering"]["hits"] == 1
+    assert stats["agents"]["information_gathering"]["misses"] == 2
+
+
+def test_cache_persists_across_instances():
+    cache = _cache()
+    agent, calls = _agent()
+    agent.invoke({"text": "headache"})
+    cache.close()
+
+    set_response_cache(ResponseCache(path=cache.path))
+    agent.invoke({"text": "headache"})
+    assert len(calls) == 1
+
+
+def test_prompt_change_invalidates():
+    _cache()
+    agent, calls = _agent()
+    agent.invoke({"text": "headache"})
+    changed = ChatPromptTemplate.from_messages([("system", "Write three search queries."), ("human", "{text}")])
+    new_agent, new_calls = _agent(changed)
+    new_agent.invoke({"text": "headache"})
+    assert len(calls) == 1 and len(new_calls) == 1
+
+
+def test_ttl_expiry():
+    cache = _cache(ttl_seconds=0.05)
+    agent, calls = _agent()
+    agent.invoke({"text": "headache"})
+    time.sleep(0.1)
+    agent.invoke({"text": "headache"})
+    assert len(calls) == 2
+    assert cache.stats()["agents"]["information_gathering"]["expired"] == 1
+
+
+def test_size_eviction():
+    cache = _cache(max_bytes=200)
+    agent, _ = _agent()
+    for i in range(10):
+        agent.invoke({"text": f"symptom number {i}"})
+    stats = cache.stats()
+    assert stats["bytes"] <= 200
+    assert stats["agents"]["information_gathering"]["evictions"] > 0
+
+
+def test_disabled_agent_bypasses_cache():
+    cache = _cache(disabled_agents={"information_gathering"})
+    agent, calls = _agent()
+    agent.invoke({"text": "headache"})
+    agent.invoke({"text": "headache"})
+    assert len(calls) == 2
+    assert cache.stats()["entries"] == 0
+
+    cache.set_agent_enabled("information_gathering", True)
+    agent.invoke({"text": "headache"})
+    agent.invoke({"text": "headache"})
+    assert len(calls) == 3
+
+
+def test_async_hits_cache():
+    _cache()
+    agent, calls = _agent()
+
+    async def run():
+        first = await agent.ainvoke({"text": "headache"})
+        second = await agent.ainvoke({"text": "headache"})
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first == second
+    assert len(calls) == 1
+
+
+def test_command_line():
+    path = os.path.join(tempfile.mkdtemp(), "responses.sqlite")
+    cache = ResponseCache(path=path)
+    cache.put("information_gathering", "key", "{}")
+    script = str(Path(__file__).parent / "src" / "llm" / "response_cache.py")
+    env = {**os.environ, "LLM_CACHE_PATH": path}
+
+    stats = subprocess.run([sys.executable, script, "--stats"], env=env, capture_output=True, text=True, timeout=120)
+    assert stats.returncode == 0, stats.stderr
+    assert json.loads(stats.stdout[stats.stdout.index("{"):])["entries"] == 1
+    cleared = subprocess.run([sys.executable, script, "--clear"], env=env, capture_output=True, text=True, timeout=120)
+    assert cleared.returncode == 0 and "Removed 1 cached responses" in cleared.stdout, cleared.stderr
+
+    disabled = subprocess.run([sys.executable, script, "--clear"], env={**env, "LLM_CACHE": "false"},
+                              capture_output=True, text=True, timeout=120)
+    assert disabled.returncode == 0 and "Removed 0 cached responses" in disabled.stdout, disabled.stderr
+    assert ResponseCache(enabled=False).invalidate("information_gathering") == 0
+
+
+if __name__ == "__main__":
+    print("🔍 Testing LLM response cache...")
+    test_repeat_hits_cache()
+    test_cache_persists_across_instances()
+    test_prompt_change_invalidates()
+    test_ttl_expiry()
+    test_size_eviction()
+    test_disabled_agent_bypasses_cache()
+    test_async_hits_cache()
+    test_command_line()
+    set_response_cache(None)
+    print("\n✅ Response cache tests passed!")
@@ -0,0 +1,731 @@
+#!/usr/bin/env python3
+"""
+Test the diagnosis workflow offline with stub agents and a stub knowledge base
+"""
+
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import zlib
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / "src"))
+
+os.environ['LANGCHAIN_TRACING_V2'] = 'false'
+os.environ.setdefault('GOOGLE_API_KEY', 'test')
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.output_parsers import PydanticOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import RunnableLambda
+
+import workflow.graph as graph
+import workflow.fast_graph as fast_graph
+from agents.assessment_query_agent import AssessmentWithQueries
+from agents.diagnosis_treatment_agent import DiagnosisWithTreatment
+from llm.resilience import DeadlineExceeded
+from llm.response_cache import ResponseCache, set_response_cache, with_response_cache
+from llm.usage import TokenUsageHandler
+from workflow.metrics import get_workflow_metrics
+from workflow.state import merge_best_scores
+from workflow.graph import critical_path_report, step_priorities, STEP_DEPENDENCIES
+from workflow.batch import run_batch
+from knowledge.entity_index import EntityIndex
+from knowledge.index_store import KnowledgeIndex
+from knowledge.likelihood_table import LikelihoodTable
+from knowledge.symptom_synonyms import SymptomSynonyms
+from workflow.benchmark import evaluate_early_exit, evaluate_query_generators
+from agents.initial_assessment_agent import StructuredAssessment
+from agents.information_gathering_agent import SearchQueries, SearchQuery
+from agents.local_query_generator import duration_course, generate_queries
+from agents.local_refinement import answer_findings
+from agents.hypothesis_generation_agent import DifferentialDiagnosis, DiagnosisHypothesis
+from agents.clarifying_question_agent import ClarifyingQuestions, ClarifyingQuestion
+from agents.hypothesis_refinement_agent import RefinedDifferentialDiagnosis
+from agents.refinement_narrative_agent import RefinementNarrative
+from agents.final_diagnosis_agent import FinalDiagnosis
+from agents.treatment_plan_agent import TreatmentPlan, TreatmentSuggestion
+
+AGENT_DELAY = 0.02
+
+
+def _hypotheses(probability):
+    return [
+        DiagnosisHypothesis(condition="Migraine", probability=probability, reasoning="Throbbing headache"),
+        DiagnosisHypothesis(condition="Tension Headache", probability=1 - probability, reasoning="Stress"),
+    ]
+
+
+STUB_OUTPUTS = {
+    "initial_assessment": lambda inputs: StructuredAssessment(
+        main_symptoms=["headache"], secondary_symptoms=["nausea"], duration_of_symptoms="1 week",
+        patient_age=45, patient_sex="male", other_relevant_info=None, initial_summary=inputs["text"]
+    ),
+    "information_gathering": lambda inputs: SearchQueries(
+        queries=[SearchQuery(query="migraine with nausea"), SearchQuery(query="tension headache")]
+    ),
+    "hypothesis_generation": lambda inputs: DifferentialDiagnosis(hypotheses=_hypotheses(0.7)),
+    "clarifying_question": lambda inputs: ClarifyingQuestions(
+        questions=[ClarifyingQuestion(question="Are you sensitive to light?", reasoning="Photophobia")]
+    ),
+    "hypothesis_refinement": lambda inputs: RefinedDifferentialDiagnosis(
+        hypotheses=_hypotheses(0.8), refinement_summary="Photophobia favours migraine"
+    ),
+    "final_diagnosis": lambda inputs: FinalDiagnosis(
+        primary_diagnosis="Migraine", confidence_score=0.8, final_summary="Migraine",
+        next_steps=["See a doctor"], disclaimer="Not medical advice"
+    ),
+    "refinement_narrative": lambda inputs: RefinementNarrative(refinement_summary="Light sensitivity points to migraine"),
+    "treatment_plan": lambda inputs: TreatmentPlan(
+        condition="Migraine", suggestions=[TreatmentSuggestion(suggestion="Rest", category="Home Care")],
+        important_note="Consult a doctor"
+    ),
+}
+STUB_OUTPUTS["assessment_query"] = lambda inputs: AssessmentWithQueries(
+    assessment=STUB_OUTPUTS["initial_assessment"](inputs), queries=STUB_OUTPUTS["information_gathering"](inputs).queries
+)
+STUB_OUTPUTS["diagnosis_treatment"] = lambda inputs: DiagnosisWithTreatment(
+    final_diagnosis=STUB_OUTPUTS["final_diagnosis"](inputs), treatment_plan=STUB_OUTPUTS["treatment_plan"](inputs)
+)
+
+
+# Names of the stub agents called, in order
+AGENT_CALLS = []
+# Async stub agent calls running now, and the most at once
+AGENTS_IN_FLIGHT = {"now": 0, "max": 0}
+
+
+def _stub_agent(name):
+    def run(inputs):
+        AGENT_CALLS.append(name)
+        time.sleep(AGENT_DELAY)
+        return STUB_OUTPUTS[name](inputs)
+
+    async def arun(inputs):
+        AGENT_CALLS.append(name)
+        AGENTS_IN_FLIGHT["now"] += 1
+        AGENTS_IN_FLIGHT["max"] = max(AGENTS_IN_FLIGHT["max"], AGENTS_IN_FLIGHT["now"])
+        try:
+            await asyncio.sleep(AGENT_DELAY)
+        finally:
+            AGENTS_IN_FLIGHT["now"] -= 1
+        return STUB_OUTPUTS[name](inputs)
+
+    return RunnableLambda(run, afunc=arun, name=name)
+
+
+class StubKnowledgeBase:
+    # Text -> chunk ID, shared like one index on disk
+    chunks = {}
+
+    def _document(self, text, source_book, score=None):
+        chunk_id = self.chunks.setdefault(text, zlib.crc32(text.encode("utf-8")))
+        metadata = {"source_book": source_book, "chunk_id": chunk_id}
+        if score is not None:
+            metadata["score"] = score
+        return Document(page_content=text, metadata=metadata)
+
+    def search_medical_knowledge(self, query, k=10, subjects=None):
+        return [self._document(f"{query} passage {i}", "Neurology.txt", score=i / 10) for i in range(k)]
+
+    def lookup_condition(self, name, limit=5, subjects=None):
+        return [self._document(f"Treatment of {name}", "Pharmacology.txt")]
+
+    def get_likelihood_table(self):
+        texts = [
+            "Migraine: throbbing headache with photophobia and nausea.",
+            "In migraine, photophobia and phonophobia are typical.",
+            "Tension-type headache is a band-like pressure.",
+            "Tension-type headache rarely causes nausea.",
+            "Pneumonia presents with fever and cough.",
+        ]
+        return LikelihoodTable.build(texts, range(len(texts)), EntityIndex.build(texts, range(len(texts))))
+
+    def get_passages(self, chunk_ids):
+        texts = {chunk_id: text for text, chunk_id in self.chunks.items()}
+        return [Document(page_content=texts[chunk_id]) for chunk_id in chunk_ids]
+
+
+def _workflow(variant="standard", **options):
+    for module in (graph, fast_graph):
+        for name in STUB_OUTPUTS:
+            setattr(module, f"get_{name}_agent", lambda name=name: _stub_agent(name))
+    return fast_graph.WORKFLOW_VARIANTS[variant](StubKnowledgeBase(), **options)
+
+
+def test_sync_diagnosis():
+    workflow = _workflow()
+    result = workflow.run_diagnosis("Throbbing headache with nausea")
+
+    assert result["current_step"] == "complete"
+    assert result["final_diagnosis"]["primary_diagnosis"] == "Migraine"
+    assert result["confidence_score"] == 0.8
+    # 2 generated queries plus 2 assessment queries, 3 passages each; state keeps chunk IDs and scores
+    assert result["knowledge_sources"] == ["Neurology.txt"]
+    assert len(result["retrieved_chunks"]) == 12
+    assert sorted(set(result["retrieved_chunks"].values())) == [0.0, 0.1, 0.2]
+    assert "retrieved_knowledge" not in result
+    texts = {chunk_id: text for text, chunk_id in workflow.knowledge_base.chunks.items()}
+    assert {texts[chunk_ids[0]] for chunk_ids in result["treatment_chunks"].values()} == {
+        "Treatment of Migraine", "Treatment of Tension Headache"
+    }
+    assert result["medications"]["condition"] == "Migraine"
+    assert set(result["step_timings"]) == set(STEP_DEPENDENCIES)
+
+
+def test_retrieval_keeps_nearest_match():
+    documents = [Document(page_content=text, metadata={"source_book": "Neurology.txt"})
+                 for text in ("Migraine with photophobia.", "Tension headache.")]
+    index = KnowledgeIndex.build(documents, np.eye(2, 3, dtype="float32"), "test-model", chunk_size=1500, chunk_overlap=200)
+    # Two queries find chunk 0, the second from further away
+    near, far = ([index.get_document(chunk_id, score) for chunk_id, score in index.search(query, k=1)]
+                 for query in ([1.0, 0.0, 0.0], [0.5, 0.0, 0.5]))
+    assert near[0].metadata["score"] < far[0].metadata["score"]
+    workflow = _workflow()
+    assert workflow._retrieval_update([near, far])["retrieved_chunks"] == {0: near[0].metadata["score"]}
+    # Parallel retrieval steps merge the same way
+    updates = [workflow._retrieval_update([docs])["retrieved_chunks"] for docs in (far, near)]
+    assert merge_best_scores(*updates) == {0: near[0].metadata["score"]}
+
+
+def test_async_matches_sync():
+    workflow = _workflow()
+    expected = workflow.run_diagnosis("Throbbing headache with nausea")
+    result = asyncio.run(workflow.run_diagnosis_async("Throbbing headache with nausea"))
+    assert result.pop("step_timings").keys() == expected.pop("step_timings").keys()
+    assert result.pop("metrics")["steps"].keys() == expected.pop("metrics")["steps"].keys()
+    assert result == expected
+
+
+def test_concurrent_async_diagnoses():
+    workflow = _workflow()
+    cases = [f"Headache case {i}" for i in range(50)]
+
+    async def run_all():
+        return await asyncio.gather(*(workflow.run_diagnosis_async(case) for case in cases))
+
+    AGENTS_IN_FLIGHT["max"] = 0
+    start = time.perf_counter()
+    results = asyncio.run(run_all())
+    elapsed = time.perf_counter() - start
+
+    assert [r["symptom_analysis"]["initial_summary"] for r in results] == cases
+    assert all(r["current_step"] == "complete" for r in results)
+    # Agent calls overlap instead of running one diagnosis after another
+    assert AGENTS_IN_FLIGHT["max"] > 1
+    assert elapsed < len(cases) * 7 * AGENT_DELAY
+
+
+def test_stream_steps():
+    workflow = _workflow()
+
+    async def collect():
+        return [update async for update in workflow.astream_diagnosis("Headache")]
+
+    steps = [next(iter(update)) for update in asyncio.run(collect())]
+    assert sorted(steps) == sorted(STEP_DEPENDENCIES)
+    # Every step is reported after the steps it depends on
+    for step, requires in STEP_DEPENDENCIES.items():
+        assert all(steps.index(dependency) < steps.index(step) for dependency in requires)
+
+    # Streaming runs under the diagnosis deadline too
+    async def collect_late():
+        return [update async for update in workflow.astream_diagnosis("Headache", deadline_seconds=AGENT_DELAY * 2)]
+
+    try:
+        asyncio.run(collect_late())
+        raise AssertionError("the deadline should stop the stream")
+    except DeadlineExceeded:
+        pass
+
+
+def test_stream_events():
+    final = STUB_OUTPUTS["final_diagnosis"]({})
+    model = GenericFakeChatModel(messages=iter([AIMessage(content=final.model_dump_json())]))
+    workflow = _workflow()
+    workflow.final_diagnosis_agent = (
+        RunnableLambda(lambda inputs: str(inputs)) | model | PydanticOutputParser(pydantic_object=FinalDiagnosis)
+    )
+
+    async def collect():
+        return [event async for event in workflow.astream_diagnosis_events("Headache")]
+
+    events = asyncio.run(collect())
+    steps = [event["step"] for event in events if event["type"] == "step"]
+    assert sorted(steps) == sorted(STEP_DEPENDENCIES)
+    tokens = [event for event in events if event["type"] == "token"]
+    assert len(tokens) > 1 and all(event["step"] == "finalize_diagnosis" for event in tokens)
+    summary = "".join(event["text"] for event in tokens if event["field"] == "final_summary")
+    assert summary == final.final_summary
+    # Text streams before the step completes, and the final state comes last
+    finalized = next(i for i, event in enumerate(events) if event["type"] == "step" and event["step"] == "finalize_diagnosis")
+    assert events.index(tokens[-1]) < finalized
+    assert events[-1]["type"] == "result"
+    assert events[-1]["result"]["final_diagnosis"]["primary_diagnosis"] == final.primary_diagnosis
+
+
+def test_critical_path():
+    timings = {step: 1.0 for step in STEP_DEPENDENCIES}
+    timings["clarifying_questions"] = 2.0
+    report = critical_path_report(timings)
+    assert report["sequential_seconds"] == 10.0
+    assert report["critical_path_seconds"] == 8.0
+    assert report["critical_path"][0] == "initial_assessment"
+    assert report["critical_path"][-3:] == ["hypothesis_refinement", "finalize_diagnosis", "treatment_plan"]
+
+    # Parallel branches overlap, so wall time tracks the critical path, not the sum
+    workflow = _workflow()
+    start = time.perf_counter()
+    result = workflow.run_diagnosis("Headache")
+    elapsed = time.perf_counter() - start
+    report = critical_path_report(result["step_timings"])
+    assert report["critical_path_seconds"] < report["sequential_seconds"]
+    assert elapsed < report["sequential_seconds"] + 0.1
+
+
+def test_step_priorities():
+    priorities = step_priorities(graph.SPECULATIVE_STEP_DEPENDENCIES)
+    assert priorities["initial_assessment"] == 1
+    assert priorities["treatment_plan"] > priorities["finalize_diagnosis"] > priorities["hypothesis_generation"]
+    assert priorities["speculative_treatment"] == 0
+
+
+def test_bulk_diagnoses_bounded_and_ordered():
+    workflow = _workflow()
+    in_flight = peak = 0
+
+    async def fake_diagnosis(symptoms, patient_info=None):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(random.uniform(0, 0.01))
+        in_flight -= 1
+        return {"symptoms": symptoms, "patient_info": patient_info}
+
+    workflow.run_diagnosis_async = fake_diagnosis
+    cases = [f"case {i}" for i in range(100)] + [{"symptoms": "last", "patient_info": {"age": 30}}]
+    results = workflow.run_diagnoses(cases, max_concurrency=5)
+
+    assert [r["symptoms"] for r in results] == cases[:-1] + ["last"]
+    assert results[-1]["patient_info"] == {"age": 30}
+    assert peak == 5
+
+
+def test_batch_resume():
+    workflow = _workflow()
+    with tempfile.TemporaryDirectory() as tmp:
+        input_path = os.path.join(tmp, "cases.jsonl")
+        output_path = os.path.join(tmp, "results.jsonl")
+        with open(input_path, "w") as f:
+            for i in range(6):
+                f.write(json.dumps({"id": f"c{i}", "symptoms": f"Headache case {i}"}) + "\n")
+
+        # An interrupted earlier run: two complete lines and a partial one
+        with open(output_path, "w") as f:
+            f.write(json.dumps({"id": "c0", "symptoms": "Headache case 0", "result": {}}) + "\n")
+            f.write(json.dumps({"id": "c1", "symptoms": "Headache case 1", "result": {}}) + "\n")
+            f.write('{"id": "c2", "sympt')
+
+        stats = run_batch(workflow, input_path, output_path, max_concurrency=3)
+        assert stats["written"] == 4 and stats["skipped"] == 2 and stats["errors"] == 0
+
+        with open(output_path) as f:
+            records = [json.loads(line) for line in f]
+        assert [r["id"] for r in records] == [f"c{i}" for i in range(6)]
+        assert records[-1]["result"]["symptom_analysis"]["initial_summary"] == "Headache case 5"
+
+        assert run_batch(workflow, input_path, output_path)["written"] == 0
+
+
+def test_speculative_treatment_hit():
+    workflow = _workflow(speculative=True)
+    expected = _workflow().run_diagnosis("Headache")
+    result = workflow.run_diagnosis("Headache")
+
+    assert result["speculation"]["hit"] is True
+    assert result["speculation"]["condition"] == "Migraine"
+    assert result["medications"] == expected["medications"]
+    # The plan was drafted off the critical path, so the final step makes no LLM call
+    assert result["step_timings"]["treatment_plan"] < AGENT_DELAY
+    report = critical_path_report(result["step_timings"], graph.SPECULATIVE_STEP_DEPENDENCIES)
+    assert "speculative_treatment" not in report["critical_path"]
+
+    metrics = workflow.speculation_metrics()
+    assert metrics["hits"] == 1 and metrics["attempts"] == 1 and metrics["hit_rate"] == 1.0
+    assert metrics["saved_seconds"] >= AGENT_DELAY
+
+
+def test_speculative_treatment_miss():
+    workflow = _workflow(speculative=True)
+    original = STUB_OUTPUTS["final_diagnosis"]
+    STUB_OUTPUTS["final_diagnosis"] = lambda inputs: FinalDiagnosis(
+        primary_diagnosis="Tension Headache", confidence_score=0.6, final_summary="Tension headache",
+        next_steps=[], disclaimer="Not medical advice"
+    )
+    try:
+        result = workflow.run_diagnosis("Headache")
+    finally:
+        STUB_OUTPUTS["final_diagnosis"] = original
+
+    assert result["speculation"]["condition"] == "Migraine"
+    assert result["speculation"]["hit"] is False
+    # Regenerated for the final diagnosis
+    assert result["step_timings"]["treatment_plan"] >= AGENT_DELAY
+    metrics = workflow.speculation_metrics()
+    assert metrics["misses"] == 1 and metrics["hit_rate"] == 0.0
+
+
+def test_fast_workflow():
+    standard = _workflow().run_diagnosis("Throbbing headache with nausea")
+    fast = _workflow("fast").run_diagnosis("Throbbing headache with nausea")
+
+    assert fast.keys() == standard.keys()
+    for key in ("symptom_analysis", "knowledge_sources", "differential_diagnosis",
+                "questions_asked", "user_answers", "final_diagnosis", "confidence_score", "medications",
+                "current_step"):
+        assert fast[key] == standard[key], key
+    assert fast["retrieved_chunks"] == standard["retrieved_chunks"]
+    assert fast["treatment_chunks"] == standard["treatment_chunks"]
+    assert set(fast["step_timings"]) == set(fast_graph.FAST_STEP_DEPENDENCIES)
+    report = critical_path_report(fast["step_timings"], fast_graph.FAST_STEP_DEPENDENCIES)
+    assert len(report["critical_path"]) == 5
+
+
+def test_early_exit_on_dominant_hypothesis():
+    generate = STUB_OUTPUTS["hypothesis_generation"]
+    STUB_OUTPUTS["hypothesis_generation"] = lambda inputs: DifferentialDiagnosis(hypotheses=_hypotheses(0.9))
+    try:
+        for variant, final_step in (("standard", "finalize_diagnosis"), ("fast", "diagnosis_and_treatment")):
+            workflow = _workflow(variant, early_exit=True)
+            AGENT_CALLS.clear()
+            result = workflow.run_diagnosis("Throbbing headache with nausea")
+            assert result["diagnosis_path"] == "early_exit"
+            assert "clarifying_question" not in AGENT_CALLS and "hypothesis_refinement" not in AGENT_CALLS
+            assert {"clarifying_questions", "hypothesis_refinement"}.isdisjoint(result["step_timings"])
+            assert final_step in result["step_timings"] and result["medications"]["condition"] == "Migraine"
+            # Treatment passages are still looked up for the leading hypotheses
+            assert "migraine" in result["treatment_chunks"]
+
+        # Thresholds are per workflow; a wider required margin asks the questions
+        workflow = _workflow(early_exit=True)
+        workflow.early_exit_margin = 0.9
+        assert workflow.run_diagnosis("Throbbing headache")["diagnosis_path"] == "clarified"
+
+        # Early exit is opt-in: by default even a dominant hypothesis gets the questions
+        for variant in ("standard", "fast"):
+            AGENT_CALLS.clear()
+            result = _workflow(variant).run_diagnosis("Throbbing headache")
+            assert result["diagnosis_path"] == "clarified" and "clarifying_question" in AGENT_CALLS
+
+        evaluation = evaluate_early_exit(StubKnowledgeBase(), [{"symptoms": "Throbbing headache"}])
+        assert evaluation["early_exit_rate"] == 1.0 and evaluation["agreement_rate"] == 1.0
+        assert evaluation["wall_time_saving_pct"] > 0
+    finally:
+        STUB_OUTPUTS["hypothesis_generation"] = generate
+    assert _workflow().run_diagnosis("Throbbing headache")["diagnosis_path"] == "clarified"
+
+
+def test_local_query_generator():
+    assessment = STUB_OUTPUTS["initial_assessment"]({"text": "Headache and feeling sick"}).model_dump()
+    assessment.update(main_symptoms=["throbbing headache", "nausea"], secondary_symptoms=["bright lights make it worse"])
+    start = time.perf_counter()
+    queries = [q.query for q in generate_queries(assessment).queries]
+    assert time.perf_counter() - start < 0.05
+    assert 3 <= len(queries) <= 5 and len(set(queries)) == len(queries)
+    # Patient wording is kept, and translated to the terms the textbooks use
+    assert queries[0] == "throbbing headache and nausea with bright lights make it worse"
+    assert any("photophobia" in query for query in queries)
+    assert any(query.startswith("acute ") and query.endswith("in a middle-aged man") for query in queries)
+    assert (duration_course("two days"), duration_course("several weeks"), duration_course("for months")) == \
+        ("acute", "subacute", "chronic")
+
+    workflow = _workflow(query_generator="local")
+    AGENT_CALLS.clear()
+    result = workflow.run_diagnosis("Throbbing headache with nausea")
+    assert result["current_step"] == "complete" and result["retrieved_chunks"]
+    assert "information_gathering" not in AGENT_CALLS
+
+    evaluation = evaluate_query_generators(StubKnowledgeBase(), [{"symptoms": "Throbbing headache"}])
+    assert 0.0 <= evaluation["chunk_recall"] <= 1.0 and 0.0 <= evaluation["source_recall"] <= 1.0
+    assert evaluation["query_latency_ms_mean_local"] < evaluation["query_latency_ms_mean_llm"]
+    assert evaluation["errors"] == 0 and "wall_time_saving_pct" in evaluation
+
+
+def test_local_refinement():
+    with tempfile.TemporaryDirectory() as tmp:
+        workflow = _workflow(sessions_path=os.path.join(tmp, "sessions.sqlite"), refinement="local")
+        assert workflow.step_dependencies["refinement_narrative"] == ["hypothesis_refinement"]
+
+        results = []
+        for answer in ("Yes, bright light hurts", "Yes, bright light hurts", "No"):
+            session = workflow.start_session("Throbbing headache with nausea")
+            AGENT_CALLS.clear()
+            results.append(workflow.resume_session(session["session_id"], [answer]))
+            # The probabilities come from the likelihood table; the LLM only writes the narrative
+            assert sorted(AGENT_CALLS) == ["final_diagnosis", "refinement_narrative", "treatment_plan"]
+        confirmed, repeated, denied = [result["differential_diagnosis"] for result in results]
+        migraine = {name: next(h["probability"] for h in d["hypotheses"] if h["condition"] == "Migraine")
+                    for name, d in (("confirmed", confirmed), ("denied", denied))}
+        assert migraine["confirmed"] > 0.7 > migraine["denied"]
+        assert confirmed["hypotheses"] == repeated["hypotheses"]
+        assert confirmed["refinement_summary"] == "Light sensitivity points to migraine"
+        assert confirmed["likelihood_update"].startswith("Bayesian update from 1 finding(s) (photophobia present)")
+        assert "refinement_narrative" in results[0]["step_timings"]
+
+        # The fast variant skips the narrative and keeps the engine's own summary
+        fast = _workflow("fast", sessions_path=os.path.join(tmp, "fast.sqlite"), refinement="local")
+        session = fast.start_session("Throbbing headache with nausea")
+        AGENT_CALLS.clear()
+        result = fast.resume_session(session["session_id"], ["Yes, bright light hurts"])
+        assert AGENT_CALLS == ["diagnosis_treatment"]
+        assert result["differential_diagnosis"]["hypotheses"] == confirmed["hypotheses"]
+        assert result["differential_diagnosis"]["refinement_summary"].startswith("Bayesian update")
+
+
+def test_answer_negation_scope():
+    synonyms = SymptomSynonyms.from_table()
+    # A negation only denies the symptoms after it in its own clause
+    assert dict(answer_findings({"Any fever?": "no fever but a bad cough"}, synonyms)) == {"fever": False, "cough": True}
+    assert dict(answer_findings({"Any fever?": "No, but I have a cough"}, synonyms)) == {"fever": False, "cough": True}
+    assert dict(answer_findings({"Any fever?": "Sometimes"}, synonyms)) == {"fever": True}
+    assert answer_findings({"Any fever?": "Since Tuesday"}, synonyms) == []
+
+
+def test_token_usage_reaches_agents():
+    model = GenericFakeChatModel(messages=iter([
+        AIMessage(content="ok", usage_metadata={"input_tokens": 120, "output_tokens": 30, "total_tokens": 150})
+    ]))
+
+    def assess_with_model(inputs):
+        model.invoke(inputs["text"])
+        return STUB_OUTPUTS["initial_assessment"](inputs)
+
+    workflow = _workflow()
+    workflow.initial_assessment_agent = RunnableLambda(assess_with_model)
+    usage = TokenUsageHandler()
+    result = asyncio.run(workflow.run_diagnosis_async("Headache", config={"callbacks": [usage]}))
+
+    assert result["current_step"] == "complete"
+    assert usage.summary() == {"llm_calls": 1, "input_tokens": 120, "output_tokens": 30, "total_tokens": 150}
+
+
+def test_diagnosis_metrics():
+    cache = ResponseCache(path=os.path.join(tempfile.mkdtemp(), "responses.sqlite"))
+    set_response_cache(cache)
+    model = GenericFakeChatModel(messages=iter([
+        AIMessage(content="ok", usage_metadata={"input_tokens": 120, "output_tokens": 30, "total_tokens": 150})
+    ]))
+
+    def assess_with_model(prompt_value):
+        model.invoke(prompt_value)
+        return STUB_OUTPUTS["initial_assessment"]({"text": "Headache"})
+
+    class StubModel:
+        model = "stub-model"
+
+    workflow = _workflow()
+    prompt = ChatPromptTemplate.from_messages([("human", "{text}")])
+    workflow.initial_assessment_agent = with_response_cache(
+        "initial_assessment", prompt, RunnableLambda(assess_with_model), StructuredAssessment, StubModel()
+    )
+    metrics = get_workflow_metrics()
+    metrics.reset()
+    try:
+        first = workflow.run_diagnosis("Headache")["metrics"]
+        second = asyncio.run(workflow.run_diagnosis_async("Headache"))["metrics"]
+    finally:
+        set_response_cache(None)
+
+    assert set(first["steps"]) == set(STEP_DEPENDENCIES)
+    assert all(step["seconds"] >= 0 and step["queue_seconds"] >= 0 for step in first["steps"].values())
+    assert first["slowest_step"] in STEP_DEPENDENCIES
+    assessment = first["agents"]["initial_assessment"]
+    assert (assessment["calls"], assessment["cache_misses"], assessment["cache_hits"]) == (1, 1, 0)
+    assert (assessment["prompt_tokens"], assessment["completion_tokens"]) == (120, 30)
+    # Replayed from the response cache: no model request, no tokens
+    assessment = second["agents"]["initial_assessment"]
+    assert (assessment["cache_hits"], assessment["prompt_tokens"]) == (1, 0)
+
+    summary = metrics.summary()
+    assert summary["diagnoses"]["ok"]["count"] == 2
+    assert summary["tail"]["dominant_step"] in STEP_DEPENDENCIES
+    assert summary["counters"]["cache_hits"]["initial_assessment"] == 1
+    text = metrics.render_prometheus()
+    assert 'diagnosis_step_seconds_bucket{step="treatment_plan",le="+Inf"} 2' in text
+    assert 'llm_prompt_tokens_total{agent="initial_assessment"} 120' in text
+
+
+def test_deadline_stops_diagnosis():
+    workflow = _workflow()
+    result = workflow.run_diagnosis("Throbbing headache with nausea", deadline_seconds=AGENT_DELAY * 2)
+    assert "deadline" in result["error"]
+    assert result["metrics"]["steps"]
+
+    result = asyncio.run(workflow.run_diagnosis_async("Throbbing headache with nausea", deadline_seconds=AGENT_DELAY * 2))
+    assert "deadline" in result["error"]
+
+
+def test_anytime_diagnosis_within_budget():
+    workflow = _workflow()
+    result = workflow.run_diagnosis("Throbbing headache", budget_seconds=10)
+    assert result["elided_steps"] == [] and result["medications"]["condition"] == "Migraine"
+
+    # Optional steps that typically take longer than the time left are skipped up front
+    metrics = get_workflow_metrics()
+    metrics.reset()
+    typical = {"clarifying_questions": 5.0, "treatment_plan": 5.0, "finalize_diagnosis": 0.02}
+    metrics.record({"total_seconds": 10.0, "agents": {},
+                    "steps": {step: {"seconds": seconds, "queue_seconds": 0.0} for step, seconds in typical.items()}})
+    AGENT_CALLS.clear()
+    try:
+        result = workflow.run_diagnosis("Throbbing headache", budget_seconds=2)
+    finally:
+        metrics.reset()
+    assert result["elided_steps"] == ["clarifying_questions", "hypothesis_refinement", "treatment_plan"]
+    assert AGENT_CALLS == ["initial_assessment", "information_gathering", "hypothesis_generation", "final_diagnosis"]
+    assert result["final_diagnosis"]["primary_diagnosis"] == "Migraine" and result["medications"] == {}
+
+    # A step that fails or overruns falls back, and the final diagnosis to the leading hypothesis
+    final = STUB_OUTPUTS["final_diagnosis"]
+    STUB_OUTPUTS["final_diagnosis"] = lambda inputs: (_ for _ in ()).throw(TimeoutError("slow model"))
+    try:
+        result = workflow.run_diagnosis("Throbbing headache", budget_seconds=10)
+    finally:
+        STUB_OUTPUTS["final_diagnosis"] = final
+    assert "error" not in result and result["elided_steps"] == ["finalize_diagnosis"]
+    assert result["final_diagnosis"]["primary_diagnosis"] == "Migraine" and result["confidence_score"] == 0.8
+    assert result["final_diagnosis"]["disclaimer"].startswith("Provisional")
+
+    generate = STUB_OUTPUTS["hypothesis_generation"]
+    STUB_OUTPUTS["hypothesis_generation"] = lambda inputs: time.sleep(0.2) or generate(inputs)
+    try:
+        start = time.perf_counter()
+        result = asyncio.run(workflow.run_diagnosis_async("Throbbing headache", budget_seconds=0.1))
+        elapsed = time.perf_counter() - start
+    finally:
+        STUB_OUTPUTS["hypothesis_generation"] = generate
+    assert elapsed < 0.5 and "error" not in result
+    assert {"clarifying_questions", "finalize_diagnosis", "treatment_plan"} <= set(result["elided_steps"])
+    assert result["final_diagnosis"]["primary_diagnosis"] == "Migraine" and result["confidence_score"] == 0.7
+
+    # Without a budget the deadline still fails the diagnosis
+    assert "error" in workflow.run_diagnosis("Throbbing headache", deadline_seconds=AGENT_DELAY * 2)
+
+
+def test_session_pauses_for_answers():
+    with tempfile.TemporaryDirectory() as tmp:
+        sessions_path = os.path.join(tmp, "sessions.sqlite")
+        session = _workflow(sessions_path=sessions_path).start_session("Throbbing headache with nausea")
+        assert session["status"] == "awaiting_answers"
+        assert session["questions"] == ["Are you sensitive to light?"]
+        assert "final_diagnosis" not in session or not session["final_diagnosis"]
+
+        # A new workflow, as after a restart, finishes the session with only the remaining LLM calls
+        workflow = _workflow(sessions_path=sessions_path)
+        assert workflow.get_session(session["session_id"])["questions"] == session["questions"]
+        refinement_inputs = []
+        refine = STUB_OUTPUTS["hypothesis_refinement"]
+        STUB_OUTPUTS["hypothesis_refinement"] = lambda inputs: refinement_inputs.append(inputs) or refine(inputs)
+        AGENT_CALLS.clear()
+        try:
+            result = workflow.resume_session(session["session_id"], ["Yes, bright light hurts"])
+        finally:
+            STUB_OUTPUTS["hypothesis_refinement"] = refine
+        assert AGENT_CALLS == ["hypothesis_refinement", "final_diagnosis", "treatment_plan"]
+        assert refinement_inputs[0]["user_answers"] == {"Are you sensitive to light?": "Yes, bright light hurts"}
+        assert result["status"] == "complete" and result["final_diagnosis"]["primary_diagnosis"] == "Migraine"
+        assert len(result["retrieved_chunks"]) == 12
+        assert set(result["step_timings"]) == set(STEP_DEPENDENCIES)
+        assert workflow.get_session(session["session_id"])["status"] == "complete"
+
+        again = workflow.resume_session(session["session_id"], ["No"])
+        assert "not waiting" in again["error"]
+        assert workflow.get_session("missing") is None
+
+        async def run_async():
+            started = await workflow.astart_session("Headache", session_id="async-session")
+            return started, await workflow.aresume_session("async-session", {"Are you sensitive to light?": "No"})
+
+        started, finished = asyncio.run(run_async())
+        assert started["status"] == "awaiting_answers"
+        assert finished["user_answers"] == {"Are you sensitive to light?": "No"}
+        assert finished["medications"]["condition"] == "Migraine"
+
+
+def test_follow_up_reruns_affected_steps():
+    with tempfile.TemporaryDirectory() as tmp:
+        workflow = _workflow(sessions_path=os.path.join(tmp, "sessions.sqlite"))
+        workflow.start_session("Throbbing headache with nausea", session_id="follow-up")
+        first = workflow.resume_session("follow-up", ["Yes"])
+        searches = []
+        search = workflow.knowledge_base.search_medical_knowledge
+        workflow.knowledge_base.search_medical_knowledge = lambda query, **kwargs: searches.append(query) or search(query, **kwargs)
+
+        # Nothing new to search: only the assessment and the steps from refinement on run
+        AGENT_CALLS.clear()
+        result = workflow.update_session("follow-up", "It has lasted two weeks")
+        assert result["status"] == "complete" and result["reentered_at"] == "hypothesis_refinement"
+        assert AGENT_CALLS == ["initial_assessment", "hypothesis_refinement", "final_diagnosis", "treatment_plan"]
+        assert searches == [] and result["retrieved_chunks"] == first["retrieved_chunks"]
+        assert result["user_answers"]["Additional information 1"] == "It has lasted two weeks"
+
+        # A new symptom is searched on its own and re-enters at hypothesis generation
+        assess = STUB_OUTPUTS["initial_assessment"]
+        STUB_OUTPUTS["initial_assessment"] = lambda inputs: assess(inputs).model_copy(
+            update={"main_symptoms": ["headache", "fever"]}
+        )
+        AGENT_CALLS.clear()
+        try:
+            result = asyncio.run(workflow.aupdate_session("follow-up", "Now I have a fever too"))
+        finally:
+            STUB_OUTPUTS["initial_assessment"] = assess
+        assert result["status"] == "awaiting_answers" and result["new_symptoms"] == ["fever"]
+        assert AGENT_CALLS == ["initial_assessment", "hypothesis_generation", "clarifying_question"]
+        assert searches == ["fever"]
+        assert set(first["retrieved_chunks"]) < set(result["retrieved_chunks"])
+        assert "Now I have a fever too" in result["user_symptoms"]
+
+        result = workflow.resume_session("follow-up", ["No"])
+        assert result["status"] == "complete" and len(result["user_answers"]) == 3
+        assert "Unknown session" in workflow.update_session("missing", "fever")["error"]
+
+        # Re-entering at the entry step restarts the whole diagnosis
+        app, config = workflow._sessions(), {"configurable": {"thread_id": "follow-up"}}
+        for as_node, update in workflow._reentry_updates("initial_assessment", {"user_symptoms": "Fever"}):
+            app.update_state(config, update, as_node=as_node)
+        assert app.get_state(config).next == ("initial_assessment",)
+
+
+if __name__ == "__main__":
+    print("🔍 Testing diagnosis workflow with stub agents...")
+    test_sync_diagnosis()
+    test_retrieval_keeps_nearest_match()
+    test_async_matches_sync()
+    test_concurrent_async_diagnoses()
+    test_stream_steps()
+    test_stream_events()
+    test_critical_path()
+    test_step_priorities()
+    test_speculative_treatment_hit()
+    test_speculative_treatment_miss()
+    test_fast_workflow()
+    test_early_exit_on_dominant_hypothesis()
+    test_local_query_generator()
+    test_local_refinement()
+    test_answer_negation_scope()
+    test_token_usage_reaches_agents()
+    test_diagnosis_metrics()
+    test_deadline_stops_diagnosis()
+    test_anytime_diagnosis_within_budget()
+    test_session_pauses_for_answers()
+    test_follow_up_reruns_affected_steps()
+    test_bulk_diagnoses_bounded_and_ordered()
+    test_batch_resume()
+    print("\n✅ Workflow tests passed!")